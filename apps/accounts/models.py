@@ -654,7 +654,7 @@ class AuditLog(Document):
             'organization',
             'action',
             'resource_type',
-            'created_at',
+            {'fields': ['created_at', 'id']},  # Keyset pagination
             'severity',
         ],
     }
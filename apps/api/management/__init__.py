@@ -0,0 +1 @@
+# Empty __init__ file
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""
+Convert legacy numeric values to native Decimal128 / double storage
+Usage: python manage.py migrate_numeric_fields [--collection credit_batches ...] [--batch-size 1000]
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.api.numeric import DEFAULT_CONVERT_BATCH_SIZE, convert_numeric_fields, get_numeric_fields
+
+
+class Command(BaseCommand):
+    help = 'Rewrite credit, price, emission and reading fields still stored as strings or legacy number types'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--collection', action='append', default=[],
+            help='Only convert this collection (repeatable; default all)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_CONVERT_BATCH_SIZE, help='Documents per batch'
+        )
+
+    def handle(self, *args, **options):
+        documents = {document._get_collection_name(): document for document, _, _ in get_numeric_fields()}
+        unknown = [name for name in options['collection'] if name not in documents]
+        if unknown:
+            raise CommandError(f"Unknown collection(s): {', '.join(unknown)}; choose from {', '.join(documents)}")
+        selected = [documents[name] for name in options['collection']]
+
+        converted = {}
+        try:
+            for name, count in convert_numeric_fields(selected, options['batch_size']):
+                converted[name] = converted.get(name, 0) + count
+                self.stdout.write(f'  {name}: {converted[name]} documents converted')
+        except Exception as e:
+            raise CommandError(f'Error converting numeric fields: {str(e)}')
+
+        total = sum(converted.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Converted {total} documents across {len(converted)} collection(s)'
+        ))
@@ -0,0 +1,163 @@
+"""
+Numeric storage - native Decimal128 / double fields and online conversion
+
+mongoengine's DecimalField quantizes to two places and stores a double (or
+a string with force_string), so MongoDB cannot $sum credits or prices
+exactly and every total is re-added in Python. Quantities and money are
+stored as Decimal128 (DecimalAmountField); sensor readings, which the
+NumPy pipeline handles as float64 anyway, are plain doubles.
+
+get_numeric_fields() lists every converted field; convert_numeric_fields()
+rewrites legacy values in place in _id batches so it can run while the
+application keeps writing, and is safe to re-run.
+"""
+
+import decimal
+
+from bson.decimal128 import Decimal128
+from mongoengine.fields import Decimal128Field
+
+
+DEFAULT_CONVERT_BATCH_SIZE = 1000
+
+DECIMAL = 'decimal'
+DOUBLE = 'double'
+
+# BSON types a converted field may still hold, per target type
+LEGACY_TYPES = {
+    DECIMAL: ['double', 'int', 'long', 'string'],
+    DOUBLE: ['decimal', 'int', 'long', 'string'],
+}
+
+CONVERTERS = {
+    DECIMAL: '$toDecimal',
+    DOUBLE: '$toDouble',
+}
+
+
+class DecimalAmountField(Decimal128Field):
+    """
+    Decimal128Field that reads legacy doubles as the shortest decimal that
+    round-trips (0.1, not 0.1000000000000000055511151231257827) and accepts
+    int and float defaults.
+    """
+
+    def to_mongo(self, value):
+        if value is None or isinstance(value, Decimal128):
+            return value
+        if not isinstance(value, decimal.Decimal):
+            with decimal.localcontext(self.DECIMAL_CONTEXT) as ctx:
+                value = ctx.create_decimal(repr(value) if isinstance(value, float) else str(value))
+        return super().to_mongo(value)
+
+    def validate(self, value):
+        try:
+            value = self.to_mongo(value)
+        except (TypeError, ValueError, decimal.InvalidOperation) as exc:
+            self.error(f'Could not convert value to Decimal128: {exc}')
+        if not value.to_decimal().is_finite():
+            self.error('Decimal value must be finite')
+        super().validate(value)
+
+
+def to_decimal(value):
+    """Decimal from a stored or aggregated number (Decimal128, double, int) or None"""
+    if value is None:
+        return None
+    if isinstance(value, Decimal128):
+        return value.to_decimal()
+    if isinstance(value, float):
+        return decimal.Decimal(repr(value))
+    return decimal.Decimal(value)
+
+
+def get_numeric_fields():
+    """[(document, target type, [field paths])] of every field stored natively"""
+    # Imported lazily: the models import DecimalAmountField from here
+    from apps.data_intake.models import DataAggregation, DataPoint
+    from apps.esg.models import EmissionInventory
+    from apps.marketplace.models import Listing, Order, TradeHistory
+    from apps.registry.models import CreditBatch, CreditTransaction
+
+    return [
+        (CreditBatch, DECIMAL, ['total_credits', 'available_credits', 'retired_credits']),
+        (CreditTransaction, DECIMAL, ['quantity']),
+        (Listing, DECIMAL, ['quantity', 'quantity_sold', 'quantity_remaining', 'unit_price']),
+        (Order, DECIMAL, ['quantity', 'unit_price', 'total_price']),
+        (TradeHistory, DECIMAL, ['quantity', 'price_per_credit', 'total_price']),
+        (EmissionInventory, DECIMAL, [
+            'scope1_emissions', 'scope2_emissions', 'scope3_emissions',
+            'total_emissions', 'net_emissions', 'baseline_emissions',
+            'emission_sources.emissions_value',
+        ]),
+        (DataPoint, DOUBLE, ['value']),
+        (DataAggregation, DOUBLE, ['sum_value', 'avg_value', 'min_value', 'max_value', 'stddev_value']),
+    ]
+
+
+def legacy_filter(target, fields):
+    """Query matching documents where any of fields still holds a legacy type"""
+    return {'$or': [{field: {'$type': LEGACY_TYPES[target]}} for field in fields]}
+
+
+def conversion_pipeline(target, field):
+    """Update pipeline converting one field in place"""
+    return [{'$set': {field: {CONVERTERS[target]: f'${field}'}}}]
+
+
+def convert_collection(document, target, fields, batch_size=DEFAULT_CONVERT_BATCH_SIZE):
+    """
+    Convert legacy values of fields on one collection in _id order.
+    Yields the number of documents converted per batch.
+    """
+    collection = document._get_collection()
+    query = legacy_filter(target, fields)
+    last_id = None
+    while True:
+        # Walk _id order so each batch resumes where the last one stopped and
+        # documents written meanwhile by the application are never revisited
+        batch_query = dict(query, _id={'$gt': last_id}) if last_id is not None else query
+        ids = [row['_id'] for row in collection.find(batch_query, {'_id': 1}).sort('_id', 1).limit(batch_size)]
+        if not ids:
+            return
+        last_id = ids[-1]
+        for field in fields:
+            # One update per field so missing (or embedded) fields are never created
+            collection.update_many(
+                {'_id': {'$in': ids}, field: {'$type': LEGACY_TYPES[target]}},
+                conversion_pipeline(target, field),
+            )
+        yield len(ids)
+
+
+def convert_numeric_fields(documents=None, batch_size=DEFAULT_CONVERT_BATCH_SIZE):
+    """
+    Convert every collection of get_numeric_fields() (or only those of documents).
+    Yields (collection name, documents converted in the batch).
+    """
+    for document, target, fields in get_numeric_fields():
+        if documents and document not in documents:
+            continue
+        name = document._get_collection_name()
+        for converted in convert_collection(document, target, fields, batch_size):
+            yield name, converted
+
+
+def sum_fields(document, fields, match=None, group_by=None):
+    """
+    Server-side $sum of fields over the matching documents.
+
+    Returns {group key: {field: Decimal}}, keyed by None without group_by.
+    Decimal128 fields sum exactly; legacy doubles are included as they are.
+    """
+    group = {'_id': f'${group_by}' if group_by else None, 'count': {'$sum': 1}}
+    for field in fields:
+        group[field.replace('.', '__')] = {'$sum': f'${field}'}
+    pipeline = ([{'$match': match}] if match else []) + [{'$group': group}]
+    totals = {}
+    for row in document._get_collection().aggregate(pipeline):
+        key = row.pop('_id')
+        count = row.pop('count')
+        totals[key] = {field: to_decimal(row[field.replace('.', '__')]) for field in fields}
+        totals[key]['count'] = count
+    return totals
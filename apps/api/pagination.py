@@ -0,0 +1,103 @@
+"""
+Keyset (cursor) pagination for mongoengine querysets
+
+PageNumberPagination runs a count() and a skip() per page, so deep pages of
+append-heavy collections scan everything before them. KeysetPagination
+orders by (keyset field, _id) and resumes after the last row of the
+previous page with a range query, so every page costs one index seek. There
+is no total count; clients follow the opaque `next` cursor.
+
+Views set `keyset_field` (default created_at); the collection should have a
+compound (field, _id) index, prefixed by any equality filters the view applies.
+"""
+
+import base64
+
+from bson import json_util
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Newest-first keyset pagination over (keyset_field, _id)"""
+
+    page_size = api_settings.PAGE_SIZE or 20
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    keyset_field = 'created_at'
+    descending = True
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.field = getattr(view, 'keyset_field', self.keyset_field)
+        self.descending = getattr(view, 'keyset_descending', self.descending)
+        page_size = self.get_page_size(request)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(__raw__=self.after(queryset, *position))
+
+        order = '-' if self.descending else '+'
+        rows = list(queryset.order_by(f'{order}{self.field}', f'{order}id').limit(page_size + 1))
+        page = rows[:page_size]
+        self.next_position = None
+        if len(rows) > page_size:
+            last = page[-1]
+            self.next_position = (getattr(last, self.field), last.pk)
+        return page
+
+    def after(self, queryset, value, last_id):
+        """Raw filter for rows strictly after (value, last_id) in page order"""
+        db_field = queryset._document._fields[self.field].db_field
+        operator = '$lt' if self.descending else '$gt'
+        return {'$or': [
+            {db_field: {operator: value}},
+            {db_field: value, '_id': {operator: last_id}},
+        ]}
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, position):
+        value, last_id = position
+        raw = json_util.dumps({'v': value, 'i': last_id}).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            position = json_util.loads(raw.decode('utf-8'))
+            return position['v'], position['i']
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,36 @@
+"""
+Batched reference loading for list endpoints
+
+Reading a ReferenceField attribute fetches the referenced document with a
+query of its own, so serializing a page that shows one field of a related
+document costs a round trip per row. List views collect the referenced ids
+of the page instead and load each referenced collection once, projected to
+the fields they show; serializers read ids from the stored values and look
+the related rows up in the maps passed through their context.
+"""
+
+def reference_id(value):
+    """Return the id behind a reference field value without dereferencing it"""
+    if value is None:
+        return None
+    return getattr(value, 'pk', None) or getattr(value, 'id', None) or value
+
+
+def stored_reference(document, field):
+    """Id stored in a ReferenceField, read without dereferencing it"""
+    return reference_id(document._data.get(field))
+
+
+def reference_ids(documents, field):
+    """Distinct ids a page of documents references through field"""
+    ids = {stored_reference(document, field) for document in documents}
+    ids.discard(None)
+    return ids
+
+
+def load_references(document, ids, fields):
+    """{id: raw document} of the referenced documents in one query, projected to fields"""
+    if not ids:
+        return {}
+    cursor = document._get_collection().find({'_id': {'$in': list(ids)}}, dict.fromkeys(fields, 1))
+    return {row['_id']: row for row in cursor}
@@ -0,0 +1,144 @@
+"""
+Data Intake source activity - write-behind DataSource.last_data_received
+
+Ingest only records the newest stored timestamp per source in memory. The
+pending maxima are flushed with one $max update per source once per flush
+interval, so hot devices never turn a reading into a second write and
+concurrent flushes can only move the field forward. A daemon timer started
+by the first pending reading flushes the interval even if no further batch
+arrives, so a stored reading reaches last_data_received within one flush
+interval while its process is alive; pending maxima are also flushed at
+process exit.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from apps.api.references import reference_id
+from apps.data_intake.models import DataSource
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_FLUSH_SECONDS = 30
+DEFAULT_STALE_MINUTES = 60
+
+
+def get_flush_seconds():
+    """Seconds between last_data_received flushes; 0 flushes after every batch"""
+    return getattr(settings, 'DATA_INTAKE_SOURCE_ACTIVITY_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS)
+
+
+class SourceActivity:
+    """Coalesces the latest reading timestamp per data source between flushes"""
+
+    def __init__(self, flush_seconds=None):
+        self.flush_seconds = get_flush_seconds() if flush_seconds is None else flush_seconds
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._timer = None
+
+    def record(self, docs):
+        """Track the max timestamp per source of stored docs; flush when the interval is up"""
+        latest = {}
+        for doc in docs:
+            source_id = doc['data_source']
+            if source_id not in latest or doc['timestamp'] > latest[source_id]:
+                latest[source_id] = doc['timestamp']
+
+        with self._lock:
+            self._merge(latest)
+            due = time.monotonic() - self._last_flush >= self.flush_seconds
+            if not due:
+                self._schedule()
+        if due:
+            self.flush()
+
+    def _merge(self, latest):
+        for source_id, timestamp in latest.items():
+            if source_id not in self._pending or timestamp > self._pending[source_id]:
+                self._pending[source_id] = timestamp
+
+    def _schedule(self):
+        # Caller holds the lock; one timer covers everything pending until it fires
+        if self._timer is None and self._pending and self.flush_seconds > 0:
+            self._timer = threading.Timer(self.flush_seconds, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Write pending maxima with one $max update per source. Returns sources updated."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+
+        operations = [
+            UpdateOne({'_id': source_id}, {'$max': {'last_data_received': timestamp}})
+            for source_id, timestamp in pending.items()
+        ]
+        try:
+            DataSource._get_collection().bulk_write(operations, ordered=False)
+        except PyMongoError as e:
+            # Keep the maxima for the next flush; the readings themselves are stored
+            logger.error(f"Failed to update last_data_received for {len(operations)} sources: {e}")
+            with self._lock:
+                self._merge(pending)
+                self._schedule()
+            return 0
+        return len(operations)
+
+
+_activity = None
+_activity_lock = threading.Lock()
+
+
+def get_source_activity():
+    """Process-wide SourceActivity, flushed at exit"""
+    global _activity
+    with _activity_lock:
+        if _activity is None:
+            _activity = SourceActivity()
+            atexit.register(_activity.flush)
+    return _activity
+
+
+def record_activity(docs):
+    """Note newly stored readings for the next last_data_received flush"""
+    if docs:
+        get_source_activity().record(docs)
+
+
+def stale_sources(minutes=DEFAULT_STALE_MINUTES, project=None, source_type=None, now=None):
+    """
+    Active sources with no reading in the last `minutes` (or none at all),
+    most silent first. Served by the (is_active, last_data_received) index.
+    This process's pending maxima are flushed first; readings other processes
+    stored within their last flush interval may not be reflected yet.
+    """
+    get_source_activity().flush()
+    cutoff = (now or datetime.utcnow()) - timedelta(minutes=minutes)
+    query = {
+        'is_active': True,
+        '$or': [{'last_data_received': {'$lt': cutoff}}, {'last_data_received': None}],
+    }
+    if project is not None:
+        query['project'] = reference_id(project)
+    if source_type is not None:
+        query['type'] = source_type
+
+    return list(DataSource._get_collection().find(
+        query, {'name': 1, 'project': 1, 'type': 1, 'last_data_received': 1}
+    ).sort('last_data_received', 1))
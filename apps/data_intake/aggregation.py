@@ -0,0 +1,215 @@
+"""
+Data Intake aggregation - DataAggregation rollups maintained on ingest
+
+Rollups are updated after the readings are stored. When that update fails
+the readings stay stored and the buckets it missed are recorded in
+data_aggregation_dirty, so rebuild_aggregations --dirty can recompute the
+affected projects from raw readings.
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from apps.api.references import reference_id
+from apps.data_intake.models import DataAggregation, AggregationPeriodChoices, DirtyAggregation
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_ROLLUP_PERIODS = [
+    AggregationPeriodChoices.HOURLY,
+    AggregationPeriodChoices.DAILY,
+    AggregationPeriodChoices.WEEKLY,
+    AggregationPeriodChoices.MONTHLY,
+]
+
+
+def get_rollup_periods():
+    """Periods updated on ingest; an empty list disables rollups"""
+    return getattr(settings, 'DATA_INTAKE_ROLLUP_PERIODS', DEFAULT_ROLLUP_PERIODS)
+
+
+def period_bounds(period, timestamp):
+    """Return the [start, end) window of the period containing timestamp"""
+    if period == AggregationPeriodChoices.HOURLY:
+        hour = datetime(timestamp.year, timestamp.month, timestamp.day, timestamp.hour)
+        return hour, hour + timedelta(hours=1)
+    day = datetime(timestamp.year, timestamp.month, timestamp.day)
+    if period == AggregationPeriodChoices.DAILY:
+        return day, day + timedelta(days=1)
+    if period == AggregationPeriodChoices.WEEKLY:
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=7)
+    if period == AggregationPeriodChoices.MONTHLY:
+        start = day.replace(day=1)
+        if start.month == 12:
+            return start, start.replace(year=start.year + 1, month=1)
+        return start, start.replace(month=start.month + 1)
+    raise ValueError(f'Unknown aggregation period: {period}')
+
+
+def summarize(docs, periods):
+    """
+    Pre-aggregate a batch in memory so each period bucket gets one upsert.
+
+    Returns {(project, data_source, metric_type, period, period_start): summary}.
+    """
+    summaries = {}
+    for doc in docs:
+        value = doc['value']
+        for period in periods:
+            start, end = period_bounds(period, doc['timestamp'])
+            key = (doc['project'], doc['data_source'], doc['metric_type'], period, start)
+            summary = summaries.get(key)
+            if summary is None:
+                summaries[key] = {
+                    'count': 1, 'sum': value, 'min': value, 'max': value,
+                    'period_end': end, 'unit': doc.get('unit'),
+                }
+            else:
+                summary['count'] += 1
+                summary['sum'] += value
+                summary['min'] = min(summary['min'], value)
+                summary['max'] = max(summary['max'], value)
+    return summaries
+
+
+def rollup_update(summary, now):
+    """
+    Pipeline update merging a batch summary into a period bucket.
+
+    Counters are combined server side so concurrent and late-arriving
+    batches commute; avg_value is recomputed from the merged sum and count
+    in the same atomic update. Legacy string counts are converted on the fly.
+    """
+    return [
+        {'$set': {
+            'count': {'$add': [{'$toLong': {'$ifNull': ['$count', 0]}}, summary['count']]},
+            'sum_value': {'$add': [{'$ifNull': ['$sum_value', 0]}, summary['sum']]},
+            'min_value': {'$min': ['$min_value', summary['min']]},
+            'max_value': {'$max': ['$max_value', summary['max']]},
+            'period_end': summary['period_end'],
+            'unit': {'$ifNull': ['$unit', summary['unit']]},
+            'created_at': {'$ifNull': ['$created_at', now]},
+            'updated_at': now,
+        }},
+        {'$set': {'avg_value': {'$divide': ['$sum_value', '$count']}}},
+    ]
+
+
+def apply_rollups(docs, periods=None):
+    """Fold stored data point documents into their DataAggregation buckets"""
+    periods = get_rollup_periods() if periods is None else periods
+    if not docs or not periods:
+        return 0
+
+    now = datetime.utcnow()
+    summaries = summarize(docs, periods)
+    keys = list(summaries)
+    operations = [UpdateOne(_bucket_filter(key), rollup_update(summaries[key], now), upsert=True) for key in keys]
+    try:
+        DataAggregation._get_collection().bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        logger.error(f"Failed to update {len(errors)} data aggregations: {errors[0].get('errmsg') if errors else e}")
+        mark_dirty([keys[error['index']] for error in errors], str(e), now)
+    except PyMongoError as e:
+        # Unknown which buckets were updated; mark them all
+        logger.error(f"Failed to update data aggregations: {e}")
+        mark_dirty(keys, str(e), now)
+    return len(operations)
+
+
+def _bucket_filter(key):
+    project, data_source, metric_type, period, start = key
+    return {
+        'project': project,
+        'data_source': data_source,
+        'metric_type': metric_type,
+        'period': period,
+        'period_start': start,
+    }
+
+
+def mark_dirty(keys, error, now=None):
+    """
+    Record (project, data_source, metric_type, period, period_start) buckets
+    a rollup update missed. Returns markers written.
+    """
+    if not keys:
+        return 0
+    now = now or datetime.utcnow()
+    operations = [
+        UpdateOne(_bucket_filter(key), {'$set': {'error': error[:500], 'marked_at': now}}, upsert=True)
+        for key in keys
+    ]
+    try:
+        DirtyAggregation._get_collection().bulk_write(operations, ordered=False)
+    except PyMongoError as e:
+        projects = ', '.join(sorted({str(key[0]) for key in keys}))
+        logger.error(
+            f"Failed to mark {len(keys)} data aggregations for rebuild ({e}); "
+            f"run rebuild_aggregations --project for: {projects}"
+        )
+        return 0
+    return len(operations)
+
+
+def dirty_projects():
+    """Ids of projects with rollup buckets marked dirty"""
+    return DirtyAggregation._get_collection().distinct('project')
+
+
+def clear_dirty(project, periods, before):
+    """Drop a project's markers of periods recorded before a rebuild of them started. Returns markers removed."""
+    return DirtyAggregation._get_collection().delete_many({
+        'project': reference_id(project),
+        'period': {'$in': list(periods)},
+        'marked_at': {'$lt': before},
+    }).deleted_count
+
+
+def project_rollups(project, metric_type, period, start=None, end=None):
+    """
+    Combine per-source buckets into project totals for each period.
+
+    Reads O(periods x sources) aggregation documents instead of raw readings.
+    """
+    match = {'project': reference_id(project), 'metric_type': metric_type, 'period': period}
+    if start is not None or end is not None:
+        match['period_start'] = {}
+        if start is not None:
+            match['period_start']['$gte'] = start
+        if end is not None:
+            match['period_start']['$lt'] = end
+
+    pipeline = [
+        {'$match': match},
+        {'$group': {
+            '_id': '$period_start',
+            'period_end': {'$first': '$period_end'},
+            'count': {'$sum': {'$toLong': '$count'}},
+            'sum_value': {'$sum': '$sum_value'},
+            'min_value': {'$min': '$min_value'},
+            'max_value': {'$max': '$max_value'},
+            'unit': {'$first': '$unit'},
+        }},
+        {'$sort': {'_id': 1}},
+    ]
+    for row in DataAggregation._get_collection().aggregate(pipeline):
+        count = row['count']
+        yield {
+            'period': period,
+            'period_start': row['_id'],
+            'period_end': row['period_end'],
+            'count': count,
+            'sum_value': row['sum_value'],
+            'avg_value': row['sum_value'] / count if count else None,
+            'min_value': row['min_value'],
+            'max_value': row['max_value'],
+            'unit': row['unit'],
+        }
@@ -0,0 +1,337 @@
+"""
+Data Intake anomaly detection - online detector feeding MRV Anomaly records
+
+Every stored batch is run through a per-(data_source, metric_type) detector
+whose state lives in one small anomaly_detector_states document:
+
+- baseline: EWMA mean plus an hour-of-day seasonal offset, with an EWMA
+  variance of the residuals; updates use winsorised residuals so a spike
+  barely moves the baseline
+- SPIKE / DROP: standardised residual beyond +/- threshold, raised once per
+  excursion
+- DRIFT: two-sided CUSUM of the standardised residuals crossing its limit,
+  i.e. a sustained shift the EWMA has not caught up with yet
+
+Nothing is flagged before `warmup` readings. Readings older than the last
+one seen are skipped; the detector only moves forward in time. State is
+written back with an optimistic version check and the batch is replayed on
+a lost race. Raised anomalies are pushed onto the project's open
+MRVRequests whose reporting period covers the reading.
+"""
+
+import logging
+import math
+from collections import defaultdict
+from datetime import datetime
+
+from bson import ObjectId
+from django.conf import settings
+from kombu.exceptions import OperationalError
+from pymongo import UpdateMany
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from apps.data_intake.models import AnomalyDetectorState
+from apps.data_intake.storage import to_epoch_ms, from_epoch_ms
+from apps.data_intake.validation import get_inline_max_points
+from apps.mrv.models import (
+    Anomaly, AnomalySeverityChoices, AnomalyTypeChoices, MRVRequest, OPEN_MRV_STATUSES
+)
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_DETECTOR_PARAMS = {
+    'alpha': 0.02,             # EWMA weight of a new reading (mean and variance)
+    'seasonal_alpha': 0.05,    # EWMA weight of a new reading in its hour-of-day offset
+    'warmup': 48,              # Readings before anything is flagged
+    'threshold': 4.0,          # |z| of a spike or drop
+    'cusum_slack': 0.5,        # CUSUM allowance per reading, in standard deviations
+    'cusum_limit': 12.0,       # CUSUM decision interval
+    'min_std_fraction': 1e-3,  # Std floor relative to |mean|, keeps flat series finite
+}
+
+MAX_STATE_WRITE_ATTEMPTS = 5
+MAX_REQUEST_ANOMALIES = 500
+SEASONAL_SLOTS = 24
+MS_PER_HOUR = 3600000
+
+RECOMMENDED_ACTIONS = {
+    AnomalyTypeChoices.SPIKE: 'Check the device and the reading against a reference measurement',
+    AnomalyTypeChoices.DROP: 'Check for sensor failure, power loss or an operational stop',
+    AnomalyTypeChoices.DRIFT: 'Recalibrate the sensor or document the operational change',
+}
+
+
+def get_detector_params(metric_type):
+    """Default parameters merged with DATA_INTAKE_ANOMALY_PARAMS overrides for the metric"""
+    params = dict(DEFAULT_DETECTOR_PARAMS)
+    params.update(getattr(settings, 'DATA_INTAKE_ANOMALY_PARAMS', {}).get(metric_type, {}))
+    return params
+
+
+def severity_for(kind, score, threshold):
+    """LOW / MEDIUM / HIGH from how far past the threshold a reading went"""
+    if kind == AnomalyTypeChoices.DRIFT:
+        return AnomalySeverityChoices.MEDIUM
+    if abs(score) >= 2 * threshold:
+        return AnomalySeverityChoices.HIGH
+    if abs(score) >= 1.5 * threshold:
+        return AnomalySeverityChoices.MEDIUM
+    return AnomalySeverityChoices.LOW
+
+
+class SeriesDetector:
+    """EWMA + hour-of-day baseline + CUSUM detector of one series"""
+
+    def __init__(self, params, state=None):
+        state = state or {}
+        self.params = params
+        self.count = state.get('count', 0)
+        self.mean = state.get('mean', 0.0)
+        self.var = state.get('var', 0.0)
+        self.seasonal = list(state.get('seasonal') or [0.0] * SEASONAL_SLOTS)
+        self.cusum_pos = state.get('cusum_pos', 0.0)
+        self.cusum_neg = state.get('cusum_neg', 0.0)
+        self.alarm = state.get('alarm')
+        last = state.get('last_timestamp')
+        self.last_ms = to_epoch_ms(last) if last is not None else None
+
+    def state(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'var': self.var,
+            'seasonal': self.seasonal,
+            'cusum_pos': self.cusum_pos,
+            'cusum_neg': self.cusum_neg,
+            'alarm': self.alarm,
+            'last_timestamp': from_epoch_ms(self.last_ms) if self.last_ms is not None else None,
+        }
+
+    def update(self, t_ms, value):
+        """Fold one reading in; returns (type, expected, score) when it raises an anomaly"""
+        if self.last_ms is not None and t_ms <= self.last_ms:
+            return None
+        self.last_ms = t_ms
+        slot = (t_ms // MS_PER_HOUR) % SEASONAL_SLOTS
+        if self.count == 0:
+            self.count, self.mean = 1, value
+            return None
+
+        p = self.params
+        expected = self.mean + self.seasonal[slot]
+        std = max(math.sqrt(self.var), p['min_std_fraction'] * max(abs(self.mean), 1.0))
+        z = (value - expected) / std
+        residual = value - expected
+        event = None
+
+        if self.count >= p['warmup']:
+            threshold = p['threshold']
+            kind = None
+            if z > threshold:
+                kind = AnomalyTypeChoices.SPIKE
+            elif z < -threshold:
+                kind = AnomalyTypeChoices.DROP
+            if kind is not None and kind != self.alarm:
+                event = (kind, expected, z)
+            self.alarm = kind
+
+            bounded = min(max(z, -threshold), threshold)
+            self.cusum_pos = max(0.0, self.cusum_pos + bounded - p['cusum_slack'])
+            self.cusum_neg = max(0.0, self.cusum_neg - bounded - p['cusum_slack'])
+            if self.cusum_pos > p['cusum_limit'] or self.cusum_neg > p['cusum_limit']:
+                if event is None:
+                    event = (AnomalyTypeChoices.DRIFT, expected, z)
+                # Re-anchor the level on the new regime instead of raising the same drift again
+                self.cusum_pos = self.cusum_neg = 0.0
+                self.mean += residual
+                residual = 0.0
+            # Winsorise so an outlier barely moves the baseline
+            residual = min(max(residual, -threshold * std), threshold * std)
+
+        # Converge like running means until the EWMA windows are filled; each
+        # hour-of-day slot has seen about count / SEASONAL_SLOTS readings
+        alpha = max(p['alpha'], 1.0 / (self.count + 1))
+        seasonal_alpha = max(p['seasonal_alpha'], SEASONAL_SLOTS / (self.count + SEASONAL_SLOTS))
+        self.mean += alpha * residual
+        self.var = (1 - alpha) * (self.var + alpha * residual * residual)
+        self.seasonal[slot] += seasonal_alpha * (expected + residual - self.mean - self.seasonal[slot])
+        self.count += 1
+        return event
+
+
+def _load_states(keys):
+    source_ids = list({source_id for source_id, _ in keys})
+    rows = AnomalyDetectorState._get_collection().find({'data_source': {'$in': source_ids}})
+    states = {}
+    for row in rows:
+        key = (row['data_source'], row['metric_type'])
+        if key in keys:
+            states[key] = row
+    return states
+
+
+def _run_series(source_id, metric_type, members, state):
+    params = get_detector_params(metric_type)
+    detector = SeriesDetector(params, state)
+    events = []
+    for doc in members:
+        result = detector.update(to_epoch_ms(doc['timestamp']), float(doc['value']))
+        if result is None:
+            continue
+        kind, expected, score = result
+        unit = f" {doc['unit']}" if doc.get('unit') else ''
+        events.append(Anomaly(
+            type=kind,
+            severity=severity_for(kind, score, params['threshold']),
+            description=(
+                f'{metric_type} {kind.lower()}: {float(doc["value"]):g}{unit} '
+                f'against an expected {expected:g}{unit} ({score:+.1f} sd)'
+            ),
+            recommended_action=RECOMMENDED_ACTIONS[kind],
+            data_source=source_id,
+            metric_type=metric_type,
+            observed_at=doc['timestamp'],
+            value=float(doc['value']),
+            expected=expected,
+            score=score,
+        ))
+    return detector, events
+
+
+def _save_state(project_id, source_id, metric_type, detector, state):
+    """Write detector state if nobody else did since it was read; False on a lost race"""
+    collection = AnomalyDetectorState._get_collection()
+    update = dict(detector.state(), updated_at=datetime.utcnow())
+    if state is None:
+        try:
+            collection.insert_one(dict(
+                update, data_source=source_id, project=project_id, metric_type=metric_type, version=1
+            ))
+            return True
+        except DuplicateKeyError:
+            return False
+    result = collection.update_one(
+        {'_id': state['_id'], 'version': state.get('version', 0)},
+        {'$set': update, '$inc': {'version': 1}},
+    )
+    return result.modified_count == 1
+
+
+def attach_anomalies(project_id, anomalies):
+    """Push anomalies onto the project's open MRV requests covering each reading"""
+    if not anomalies:
+        return
+    now = datetime.utcnow()
+    operations = []
+    for anomaly in anomalies:
+        observed = anomaly.observed_at
+        operations.append(UpdateMany(
+            {
+                'project': project_id,
+                'status': {'$in': list(OPEN_MRV_STATUSES)},
+                'reporting_period_start': {'$not': {'$gt': observed}},
+                'reporting_period_end': {'$not': {'$lt': observed}},
+            },
+            {
+                '$push': {'anomalies': {'$each': [anomaly.to_mongo().to_dict()], '$slice': -MAX_REQUEST_ANOMALIES}},
+                '$set': {'updated_at': now},
+            },
+        ))
+    MRVRequest._get_collection().bulk_write(operations, ordered=False)
+
+
+def detect_anomalies(docs):
+    """
+    Run stored readings through their series detectors and attach what they
+    raise to open MRV requests. Returns the anomalies raised.
+    """
+    series = defaultdict(list)
+    for doc in docs:
+        series[(doc['project'], doc['data_source'], doc['metric_type'])].append(doc)
+    for members in series.values():
+        members.sort(key=lambda doc: doc['timestamp'])
+
+    pending = set(series)
+    raised = defaultdict(list)
+    for _ in range(MAX_STATE_WRITE_ATTEMPTS):
+        if not pending:
+            break
+        states = _load_states({(source_id, metric_type) for _, source_id, metric_type in pending})
+        lost = set()
+        for key in pending:
+            project_id, source_id, metric_type = key
+            state = states.get((source_id, metric_type))
+            detector, events = _run_series(source_id, metric_type, series[key], state)
+            if _save_state(project_id, source_id, metric_type, detector, state):
+                raised[project_id].extend(events)
+            else:
+                lost.add(key)
+        pending = lost
+    if pending:
+        logger.warning(f"Anomaly detector state of {len(pending)} series kept changing; batch skipped for them")
+
+    for project_id, anomalies in raised.items():
+        attach_anomalies(project_id, anomalies)
+    return [anomaly for anomalies in raised.values() for anomaly in anomalies]
+
+
+def _detect_safely(docs):
+    try:
+        return detect_anomalies(docs)
+    except PyMongoError as e:
+        logger.error(f"Anomaly detection failed for {len(docs)} data points: {e}")
+        return None
+
+
+def _object_id(value):
+    return str(value) if value is not None else None
+
+
+def detect_queued(rows):
+    """Run readings serialised by schedule_detection through detection (queue worker side)"""
+    return _detect_safely([
+        dict(
+            row,
+            project=ObjectId(row['project']) if row['project'] else None,
+            data_source=ObjectId(row['data_source']) if row['data_source'] else None,
+            timestamp=from_epoch_ms(row['timestamp']),
+        )
+        for row in rows
+    ])
+
+
+def schedule_detection(docs, inline=False):
+    """
+    Run freshly stored readings through anomaly detection: inline for small
+    batches (or when inline), else on the detect_data_point_anomalies Celery
+    task. The readings go in the message, so every storage layout works.
+    """
+    if not docs or not getattr(settings, 'DATA_INTAKE_ANOMALY_DETECTION_ENABLED', True):
+        return
+    columns = [
+        {key: doc.get(key) for key in ('project', 'data_source', 'metric_type', 'value', 'unit', 'timestamp')}
+        for doc in docs
+    ]
+    if inline or len(columns) <= get_inline_max_points():
+        _detect_safely(columns)
+        return
+
+    # Imported here: the tasks module builds on this one
+    from apps.data_intake.tasks import detect_data_point_anomalies
+    rows = [
+        dict(
+            column,
+            project=_object_id(column['project']),
+            data_source=_object_id(column['data_source']),
+            value=float(column['value']),
+            timestamp=to_epoch_ms(column['timestamp']),
+        )
+        for column in columns
+    ]
+    try:
+        detect_data_point_anomalies.delay(rows)
+    except OperationalError as e:
+        # Detector state only moves forward, so nothing could catch these up later
+        logger.warning(f"Could not queue anomaly detection of {len(rows)} data points, running inline: {e}")
+        _detect_safely(columns)
@@ -0,0 +1,433 @@
+"""
+Data Intake archive - cold-storage tiering of aged data_points into columnar files
+
+Closed months older than DATA_INTAKE_ARCHIVE_AFTER_MONTHS are exported per
+project into one compressed NumPy .npz file per month (local disk or GCS),
+recorded in a DataPointArchive manifest, then deleted from data_points.
+Each (data_source, metric_type) series gets its own members so a read only
+decompresses the series it needs:
+
+    <key>_t    int64 epoch milliseconds, ascending
+    <key>_v    float64 values
+    <key>_id   uint8 (rows, 12) original ObjectIds
+    <key>_doc  uint8 Extended JSON lines with the remaining fields
+
+TieredPointStore wraps the hot store so iter_columns streams archived
+months back merged with any hot rows of the same month, which keeps charts,
+validation context and aggregation rebuilds working over archived ranges.
+A manifest is marked ARCHIVED before its rows are deleted; merged reads drop
+readings seen twice, so a run interrupted mid-delete never double counts.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+from bson import ObjectId, json_util
+from bson.decimal128 import Decimal128
+from django.conf import settings
+
+from apps.api.references import reference_id
+from apps.data_intake.aggregation import period_bounds
+from apps.data_intake.payloads import attach_raw_payloads, delete_raw_payloads
+from apps.data_intake.models import (
+    DataPoint, DataPointArchive, AggregationPeriodChoices, ArchiveStatusChoices,
+    StorageLayoutChoices
+)
+from apps.data_intake.storage import (
+    DEFAULT_COLUMN_CHUNK_SIZE, get_point_store, naive_utc, to_epoch_ms, from_epoch_ms
+)
+
+
+DEFAULT_ARCHIVE_AFTER_MONTHS = 12
+DEFAULT_DELETE_BATCH_SIZE = 10000
+DEFAULT_PAYLOAD_BATCH_SIZE = 1000
+ARCHIVED_FIELDS = ('is_validated', 'validation_status', 'validation_notes', 'raw_payload', 'created_at')
+
+
+def get_archive_uri():
+    """Archive location (file:///path or gs://bucket/prefix); empty disables tiering"""
+    return getattr(settings, 'DATA_INTAKE_ARCHIVE_URI', '')
+
+
+def get_archive_after_months():
+    """Months a closed period stays in data_points before it is archived"""
+    return getattr(settings, 'DATA_INTAKE_ARCHIVE_AFTER_MONTHS', DEFAULT_ARCHIVE_AFTER_MONTHS)
+
+
+class LocalArchiveBackend:
+    """Archive files under a local directory"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def put(self, local_path, name):
+        target = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(local_path, target)
+        return f'file://{target}'
+
+    def open(self, uri):
+        return open(uri[len('file://'):], 'rb')
+
+
+@lru_cache(maxsize=None)
+def _gcs_bucket(name):
+    # google-cloud-storage is only needed when archiving to GCS
+    from google.cloud import storage
+    return storage.Client().bucket(name)
+
+
+class GCSArchiveBackend:
+    """Archive files in a Google Cloud Storage bucket"""
+
+    def __init__(self, bucket, prefix=''):
+        self.bucket = _gcs_bucket(bucket)
+        self.prefix = prefix.strip('/')
+
+    def _blob_name(self, uri):
+        return uri.split('/', 3)[3]
+
+    def put(self, local_path, name):
+        blob_name = f'{self.prefix}/{name}' if self.prefix else name
+        self.bucket.blob(blob_name).upload_from_filename(local_path)
+        return f'gs://{self.bucket.name}/{blob_name}'
+
+    def open(self, uri):
+        # np.load needs a seekable file; spool the object locally
+        local = tempfile.TemporaryFile()
+        self.bucket.blob(self._blob_name(uri)).download_to_file(local)
+        local.seek(0)
+        return local
+
+
+def get_archive_backend(uri=None):
+    """Backend for an archive location or a stored archive file URI"""
+    uri = uri or get_archive_uri()
+    if uri.startswith('gs://'):
+        bucket, _, prefix = uri[len('gs://'):].partition('/')
+        return GCSArchiveBackend(bucket, prefix)
+    if uri.startswith('file://'):
+        return LocalArchiveBackend(uri[len('file://'):])
+    raise ValueError(f'Unsupported archive location: {uri!r}')
+
+
+def _float(value):
+    return float(value.to_decimal()) if isinstance(value, Decimal128) else float(value)
+
+
+class _SeriesColumns:
+    """Columns of one series collected while streaming a month's readings"""
+
+    def __init__(self, data_source, metric_type, unit):
+        self.data_source = data_source
+        self.metric_type = metric_type
+        self.unit = unit
+        self.t, self.v, self.ids, self.docs = [], [], [], []
+
+    def add(self, doc):
+        self.t.append(to_epoch_ms(doc['timestamp']))
+        self.v.append(_float(doc['value']))
+        self.ids.append(doc['_id'].binary)
+        extra = {field: doc[field] for field in ARCHIVED_FIELDS if doc.get(field) not in (None, {})}
+        if doc.get('unit') != self.unit:
+            extra['unit'] = doc.get('unit')
+        self.docs.append(json_util.dumps(extra))
+
+    def members(self, key):
+        return {
+            f'{key}_t': np.array(self.t, dtype=np.int64),
+            f'{key}_v': np.array(self.v, dtype=np.float64),
+            f'{key}_id': np.frombuffer(b''.join(self.ids), dtype=np.uint8).reshape(-1, 12),
+            f'{key}_doc': np.frombuffer('\n'.join(self.docs).encode('utf-8'), dtype=np.uint8),
+        }
+
+
+def closed_periods(project_id, cutoff):
+    """Month starts of a project's readings in months that ended before cutoff"""
+    pipeline = [
+        {'$match': {'project': project_id, 'timestamp': {'$lt': cutoff}}},
+        {'$group': {'_id': {'$dateTrunc': {'date': '$timestamp', 'unit': 'month'}}}},
+        {'$sort': {'_id': 1}},
+    ]
+    starts = [naive_utc(row['_id']) for row in DataPoint._get_collection().aggregate(pipeline)]
+    return [start for start in starts if period_bounds(AggregationPeriodChoices.MONTHLY, start)[1] <= cutoff]
+
+
+def archive_cutoff(now=None, months=None):
+    """Start of the month `months` months before now; earlier months are archivable"""
+    now = now or datetime.utcnow()
+    months = get_archive_after_months() if months is None else months
+    index = now.year * 12 + now.month - 1 - months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _delete_ids(ids, batch_size=DEFAULT_DELETE_BATCH_SIZE):
+    collection = DataPoint._get_collection()
+    deleted = 0
+    for i in range(0, len(ids), batch_size):
+        batch = ids[i:i + batch_size]
+        deleted += collection.delete_many({'_id': {'$in': batch}}).deleted_count
+        delete_raw_payloads(batch)
+    return deleted
+
+
+def _archived_ids(archive):
+    with get_archive_backend(archive.uri).open(archive.uri) as handle:
+        with np.load(handle) as data:
+            return [
+                ObjectId(raw.tobytes()) for series in archive.series
+                for raw in data[f"{series['key']}_id"]
+            ]
+
+
+def _with_raw_payloads(cursor, batch_size=DEFAULT_PAYLOAD_BATCH_SIZE):
+    # Offloaded raw payloads travel into the archive with their readings
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield from attach_raw_payloads(batch)
+            batch = []
+    yield from attach_raw_payloads(batch)
+
+
+def purge_archive(archive):
+    """Delete an archive part's rows from data_points (idempotent) and mark it PURGED"""
+    deleted = _delete_ids(_archived_ids(archive))
+    archive.status = ArchiveStatusChoices.PURGED
+    archive.purged_at = datetime.utcnow()
+    archive.save()
+    return deleted
+
+
+def archive_period(project_id, period_start, backend=None):
+    """
+    Export one closed month of a project's readings to a new archive part,
+    then delete them from data_points. Returns a summary dict, or None when
+    the month has no hot rows left.
+    """
+    if get_point_store().layout != StorageLayoutChoices.DOCUMENTS:
+        raise ValueError('Archiving requires the DOCUMENTS storage layout')
+    backend = backend or get_archive_backend()
+    project_id = reference_id(project_id)
+    period_start, period_end = period_bounds(AggregationPeriodChoices.MONTHLY, period_start)
+
+    # Finish parts an earlier run archived but did not purge, so their rows are not exported twice
+    existing = list(DataPointArchive.objects(project=project_id, period_start=period_start))
+    for archive in existing:
+        if archive.status == ArchiveStatusChoices.ARCHIVED:
+            purge_archive(archive)
+
+    cursor = DataPoint._get_collection().find(
+        {'project': project_id, 'timestamp': {'$gte': period_start, '$lt': period_end}},
+        {'metric_type': 1, 'data_source': 1, 'timestamp': 1, 'value': 1, 'unit': 1,
+         **{field: 1 for field in ARCHIVED_FIELDS}},
+    ).sort([('data_source', 1), ('metric_type', 1), ('timestamp', 1)])
+
+    series, current = [], None
+    for doc in _with_raw_payloads(cursor):
+        if current is None or (doc['data_source'], doc['metric_type']) != (current.data_source, current.metric_type):
+            current = _SeriesColumns(doc['data_source'], doc['metric_type'], doc.get('unit'))
+            series.append(current)
+        current.add(doc)
+    if not series:
+        return None
+
+    part = max((archive.part for archive in existing), default=-1) + 1
+    members, manifest_series, ids = {}, [], []
+    for index, columns in enumerate(series):
+        key = f's{index}'
+        members.update(columns.members(key))
+        ids.extend(ObjectId(raw) for raw in columns.ids)
+        manifest_series.append({
+            'data_source': columns.data_source,
+            'metric_type': columns.metric_type,
+            'unit': columns.unit,
+            'key': key,
+            'rows': len(columns.t),
+        })
+
+    name = f'{project_id}/{period_start:%Y-%m}-part{part}.npz'
+    with tempfile.NamedTemporaryFile(suffix='.npz') as local:
+        np.savez_compressed(local, **members)
+        local.flush()
+        size = local.tell()
+        local.seek(0)
+        digest = hashlib.sha256()
+        for block in iter(lambda: local.read(1024 * 1024), b''):
+            digest.update(block)
+        uri = backend.put(local.name, name)
+
+    archive = DataPointArchive(
+        project=project_id,
+        period_start=period_start,
+        period_end=period_end,
+        part=part,
+        uri=uri,
+        rows=len(ids),
+        size_bytes=size,
+        sha256=digest.hexdigest(),
+        series=manifest_series,
+    )
+    archive.save()
+    deleted = _delete_ids(ids)
+    archive.status = ArchiveStatusChoices.PURGED
+    archive.purged_at = datetime.utcnow()
+    archive.save()
+
+    return {
+        'project_id': str(project_id),
+        'period_start': period_start,
+        'part': part,
+        'rows': len(ids),
+        'deleted': deleted,
+        'size_bytes': size,
+        'uri': uri,
+    }
+
+
+def archive_project(project_id, cutoff=None, backend=None):
+    """Archive every closed month of a project before cutoff; yields one summary per part"""
+    project_id = reference_id(project_id)
+    cutoff = cutoff or archive_cutoff()
+    backend = backend or get_archive_backend()
+    for period_start in closed_periods(project_id, cutoff):
+        summary = archive_period(project_id, period_start, backend)
+        if summary:
+            yield summary
+
+
+def archived_parts(data_source, metric_type, start=None, end=None):
+    """Archive parts holding a series, optionally overlapping [start, end), oldest first"""
+    query = {
+        'series': {'$elemMatch': {'data_source': reference_id(data_source), 'metric_type': metric_type}},
+    }
+    if start is not None:
+        query['period_end'] = {'$gt': naive_utc(start)}
+    if end is not None:
+        query['period_start'] = {'$lt': naive_utc(end)}
+    return list(DataPointArchive.objects(__raw__=query).order_by('period_start', 'part'))
+
+
+def archived_series(data_source):
+    """(metric_type, unit) pairs of a source found only in archives"""
+    pairs = {}
+    rows = DataPointArchive._get_collection().find(
+        {'series.data_source': reference_id(data_source)}, {'series': 1}
+    )
+    for row in rows:
+        for series in row['series']:
+            if series['data_source'] == reference_id(data_source):
+                pairs.setdefault(series['metric_type'], series.get('unit'))
+    return list(pairs.items())
+
+
+def _series_entry(archive, data_source, metric_type):
+    for series in archive.series:
+        if series['data_source'] == data_source and series['metric_type'] == metric_type:
+            return series
+    return None
+
+
+def read_archived_columns(archive, data_source, metric_type):
+    """(timestamps_ms, values) of one series from one archive part"""
+    series = _series_entry(archive, reference_id(data_source), metric_type)
+    if series is None:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    with get_archive_backend(archive.uri).open(archive.uri) as handle:
+        with np.load(handle) as data:
+            return data[f"{series['key']}_t"], data[f"{series['key']}_v"]
+
+
+def iter_archived_rows(data_source, metric_type, start=None, end=None):
+    """
+    Yield full archived readings (as data_points-shaped dicts) of a series in
+    [start, end), e.g. for an MRV re-audit export.
+    """
+    source_id = reference_id(data_source)
+    start_ms = to_epoch_ms(start) if start is not None else None
+    end_ms = to_epoch_ms(end) if end is not None else None
+    for archive in archived_parts(source_id, metric_type, start, end):
+        series = _series_entry(archive, source_id, metric_type)
+        with get_archive_backend(archive.uri).open(archive.uri) as handle:
+            with np.load(handle) as data:
+                t = data[f"{series['key']}_t"]
+                v = data[f"{series['key']}_v"]
+                ids = data[f"{series['key']}_id"]
+                docs = data[f"{series['key']}_doc"].tobytes().decode('utf-8').split('\n')
+        for i in range(len(t)):
+            if (start_ms is not None and t[i] < start_ms) or (end_ms is not None and t[i] >= end_ms):
+                continue
+            row = {
+                '_id': ObjectId(ids[i].tobytes()),
+                'project': reference_id(archive._data.get('project')),
+                'data_source': source_id,
+                'metric_type': metric_type,
+                'value': float(v[i]),
+                'unit': series.get('unit'),
+                'timestamp': from_epoch_ms(t[i]),
+            }
+            row.update(json_util.loads(docs[i]) if docs[i] else {})
+            yield row
+
+
+class TieredPointStore:
+    """
+    Hot store plus archive parts. iter_columns is transparent over archived
+    months; everything else (writes, dedup, queries) goes to the hot store.
+    """
+
+    def __init__(self, hot):
+        self.hot = hot
+
+    def __getattr__(self, name):
+        return getattr(self.hot, name)
+
+    def iter_columns(self, data_source, metric_type, start=None, end=None, chunk_size=DEFAULT_COLUMN_CHUNK_SIZE):
+        """Yield (timestamps_ms, values) NumPy chunks for readings in [start, end) in timestamp order"""
+        parts = archived_parts(data_source, metric_type, start, end)
+        if not parts:
+            yield from self.hot.iter_columns(data_source, metric_type, start, end, chunk_size)
+            return
+
+        cursor = start
+        months = {}
+        for archive in parts:
+            months.setdefault(naive_utc(archive.period_start), []).append(archive)
+        for period_start, archives in sorted(months.items()):
+            period_end = naive_utc(archives[0].period_end)
+            if cursor is None or naive_utc(cursor) < period_start:
+                yield from self.hot.iter_columns(data_source, metric_type, cursor, period_start, chunk_size)
+
+            low = max(naive_utc(start), period_start) if start is not None else period_start
+            high = min(naive_utc(end), period_end) if end is not None else period_end
+            t, v = self._merged_month(data_source, metric_type, archives, low, high, chunk_size)
+            for i in range(0, len(t), chunk_size):
+                yield t[i:i + chunk_size], v[i:i + chunk_size]
+            cursor = period_end
+
+        if end is None or naive_utc(cursor) < naive_utc(end):
+            yield from self.hot.iter_columns(data_source, metric_type, cursor, end, chunk_size)
+
+    def _merged_month(self, data_source, metric_type, archives, low, high, chunk_size):
+        t_parts, v_parts = [], []
+        for archive in archives:
+            t, v = read_archived_columns(archive, data_source, metric_type)
+            t_parts.append(t)
+            v_parts.append(v)
+        # Late arrivals, or rows whose deletion was interrupted, may still be hot
+        for t, v in self.hot.iter_columns(data_source, metric_type, low, high, chunk_size):
+            t_parts.append(t)
+            v_parts.append(v)
+
+        t, v = np.concatenate(t_parts), np.concatenate(v_parts)
+        mask = (t >= to_epoch_ms(low)) & (t < to_epoch_ms(high))
+        t, v = t[mask], v[mask]
+        # Readings are unique per timestamp within a series; keep one copy
+        t, first = np.unique(t, return_index=True)
+        return t, v[first]
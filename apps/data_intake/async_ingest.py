@@ -0,0 +1,275 @@
+"""
+Data Intake async ingest - asynchronous DataPoint writes on Celery workers
+
+With DATA_INTAKE_ASYNC_INGEST the bulk and stream endpoints only validate
+readings and charge quotas; the prepared documents are saved as
+IngestBatchChunk documents of DATA_INTAKE_ASYNC_CHUNK_SIZE points and one
+Celery task per chunk stores them through ingestion.write_points (bulk
+insert, rollups, validation and anomaly detection). The request returns 202
+with the IngestBatch id, which reports progress until every chunk is done.
+
+Chunks travel through MongoDB rather than the broker, so messages stay
+small and a chunk survives a broker restart. A chunk whose task could not
+be sent (broker down) or was lost is sent again by requeue_stale_chunks,
+which Celery beat runs every DATA_INTAKE_ASYNC_REQUEUE_MINUTES. Counters are folded into the
+batch once per chunk (guarded by done_chunks), so a redelivered task never
+counts a chunk twice; its already stored readings come back as duplicates
+of the first attempt and are not written again.
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+from celery import current_app
+from django.conf import settings
+from kombu.exceptions import OperationalError
+
+from apps.data_intake.ingestion import (
+    IngestResult, get_stream_chunk_size, get_stream_max_line_bytes, iter_ndjson_chunks, prepare_points,
+    write_points
+)
+from apps.data_intake.models import IngestBatch, IngestBatchChunk, IngestBatchStatusChoices
+from apps.data_intake.quotas import QuotaExceeded, charge_quotas
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_ASYNC_CHUNK_SIZE = 5000
+DEFAULT_REQUEUE_MINUTES = 30
+MAX_BATCH_ERRORS = 1000
+
+INGEST_CHUNK_TASK = 'apps.data_intake.tasks.ingest_batch_chunk'
+
+
+def get_async_ingest_enabled():
+    """Whether bulk and stream ingestion are handed to Celery workers"""
+    return getattr(settings, 'DATA_INTAKE_ASYNC_INGEST', False)
+
+
+def get_async_chunk_size():
+    """Points stored per queued task"""
+    return getattr(settings, 'DATA_INTAKE_ASYNC_CHUNK_SIZE', DEFAULT_ASYNC_CHUNK_SIZE)
+
+
+def get_requeue_minutes():
+    """Minutes after which a chunk still waiting for its task is sent again"""
+    return getattr(settings, 'DATA_INTAKE_ASYNC_REQUEUE_MINUTES', DEFAULT_REQUEUE_MINUTES)
+
+
+def _send_chunks(chunk_ids):
+    """Send one task per chunk; stops at the first broker error and returns how many were sent"""
+    for sent, chunk_id in enumerate(chunk_ids):
+        try:
+            current_app.send_task(INGEST_CHUNK_TASK, args=[str(chunk_id)])
+        except OperationalError as e:
+            # The chunks are stored; requeue_stale_chunks sends them once the broker is back
+            logger.warning(f"Could not queue {len(chunk_ids) - sent} ingest chunks: {e}")
+            return sent
+    return len(chunk_ids)
+
+
+def _error_records(errors, offset=0):
+    return [{'index': offset + row, 'error': message} for row, message in sorted(errors.items())]
+
+
+def create_batch(kind):
+    """New, unsealed IngestBatch"""
+    batch = IngestBatch(kind=kind)
+    batch.save()
+    return batch
+
+
+def add_points(batch_id, docs, rows, errors, received, offset=0):
+    """
+    Queue prepared documents (rows are request indexes relative to offset)
+    and record rows rejected during validation. Returns chunks queued.
+    """
+    chunk_size = get_async_chunk_size()
+    chunks = [(docs[i:i + chunk_size], [offset + row for row in rows[i:i + chunk_size]])
+              for i in range(0, len(docs), chunk_size)]
+    # Reserve chunk numbers first so a fast worker never sees more chunks done than queued
+    batch = IngestBatch._get_collection().find_one_and_update(
+        {'_id': batch_id},
+        {
+            '$inc': {'received': received, 'queued': len(docs), 'failed': len(errors), 'chunks': len(chunks)},
+            '$push': {'errors': {'$each': _error_records(errors, offset), '$slice': MAX_BATCH_ERRORS}},
+        },
+        projection={'chunks': 1},
+    )
+    first_seq = batch['chunks']
+    collection = IngestBatchChunk._get_collection()
+    now = datetime.utcnow()
+    chunk_ids = [
+        collection.insert_one({
+            'batch': batch_id, 'seq': seq, 'points': points, 'rows': chunk_rows, 'created_at': now, 'queued_at': now,
+        }).inserted_id
+        for seq, (points, chunk_rows) in enumerate(chunks, start=first_seq)
+    ]
+    _send_chunks(chunk_ids)
+    return len(chunks)
+
+
+def requeue_stale_chunks(minutes=None, now=None):
+    """
+    Send chunks again whose task was never sent or has not stored them within
+    `minutes`. A chunk stored meanwhile is skipped by its second task.
+    Returns chunks sent.
+    """
+    now = now or datetime.utcnow()
+    minutes = get_requeue_minutes() if minutes is None else minutes
+    collection = IngestBatchChunk._get_collection()
+    stale = [
+        chunk['_id'] for chunk in
+        collection.find({'queued_at': {'$not': {'$gte': now - timedelta(minutes=minutes)}}}, {'_id': 1})
+    ]
+    sent = _send_chunks(stale)
+    if sent:
+        collection.update_many({'_id': {'$in': stale[:sent]}}, {'$set': {'queued_at': now}})
+    return sent
+
+
+def seal_batch(batch_id, error=None):
+    """Mark that no more chunks will be added, completing the batch if they are all done"""
+    update = {'sealed': True}
+    if error:
+        update['error'] = error
+    IngestBatch._get_collection().update_one({'_id': batch_id}, {'$set': update})
+    finish_batch(batch_id)
+
+
+def finish_batch(batch_id):
+    """COMPLETED (FAILED when a chunk failed) once sealed and every chunk is done"""
+    IngestBatch._get_collection().update_one(
+        {
+            '_id': batch_id,
+            'sealed': True,
+            'status': {'$in': [IngestBatchStatusChoices.QUEUED, IngestBatchStatusChoices.PROCESSING]},
+            '$expr': {'$eq': [{'$size': '$done_chunks'}, '$chunks']},
+        },
+        [{'$set': {
+            'status': {'$cond': [
+                {'$gt': ['$failed_chunks', 0]}, IngestBatchStatusChoices.FAILED, IngestBatchStatusChoices.COMPLETED
+            ]},
+            'completed_at': datetime.utcnow(),
+        }}],
+    )
+
+
+def enqueue_points(payloads, enforce_quotas=False):
+    """
+    Validate payloads, charge quotas and queue the valid ones as a BULK
+    batch. QuotaExceeded is raised before anything is queued.
+    """
+    docs, rows, errors = prepare_points(payloads)
+    if enforce_quotas:
+        charge_quotas(docs)
+    batch = create_batch('BULK')
+    try:
+        add_points(batch.pk, docs, rows, errors, len(payloads))
+    finally:
+        seal_batch(batch.pk)
+    batch.reload()
+    return batch
+
+
+def enqueue_stream(stream, enforce_quotas=False, chunk_size=None, max_line_bytes=None):
+    """
+    Validate an NDJSON stream chunk by chunk and queue it as one STREAM
+    batch. A chunk refused by a quota ends the stream; what came before it
+    stays queued. Returns (batch, QuotaExceeded or None, resume offset).
+    """
+    chunk_size = chunk_size or get_stream_chunk_size()
+    max_line_bytes = max_line_bytes or get_stream_max_line_bytes()
+    batch = create_batch('STREAM')
+    records = 0
+    throttled = None
+    try:
+        for payloads, rejected in iter_ndjson_chunks(stream, chunk_size, max_line_bytes):
+            docs, rows, errors = prepare_points(payloads)
+            if enforce_quotas:
+                try:
+                    charge_quotas(docs)
+                except QuotaExceeded as e:
+                    throttled = e
+                    break
+            errors.update(rejected)
+            add_points(batch.pk, docs, rows, errors, len(payloads), offset=records)
+            records += len(payloads)
+    finally:
+        seal_batch(batch.pk, error=str(throttled) if throttled else None)
+    batch.reload()
+    return batch, throttled, records
+
+
+def process_chunk(chunk_id):
+    """
+    Store one queued chunk and fold its outcome into the batch. A chunk that
+    is gone or already counted is skipped. Returns the IngestResult, or None
+    when skipped.
+    """
+    chunk = IngestBatchChunk._get_collection().find_one({'_id': chunk_id})
+    if chunk is None:
+        return None
+    batches = IngestBatch._get_collection()
+    batch_id, seq = chunk['batch'], chunk['seq']
+    batches.update_one(
+        {'_id': batch_id, 'status': IngestBatchStatusChoices.QUEUED},
+        {'$set': {'status': IngestBatchStatusChoices.PROCESSING, 'started_at': datetime.utcnow()}},
+    )
+
+    rows = chunk['rows']
+    result = IngestResult(max(rows) + 1 if rows else 0)
+    write_points(chunk['points'], rows, result, inline=True)
+    batches.update_one(
+        {'_id': batch_id, 'done_chunks': {'$ne': seq}},
+        {
+            '$inc': {'inserted': result.inserted, 'duplicates': result.duplicates, 'failed': result.failed},
+            '$push': {
+                'done_chunks': seq,
+                'errors': {'$each': _error_records(result.errors), '$slice': MAX_BATCH_ERRORS},
+            },
+        },
+    )
+    IngestBatchChunk._get_collection().delete_one({'_id': chunk_id})
+    finish_batch(batch_id)
+    return result
+
+
+def fail_chunk(chunk_id, error):
+    """Give up on a chunk after its last retry: count its rows as failed"""
+    chunk = IngestBatchChunk._get_collection().find_one({'_id': chunk_id}, {'batch': 1, 'seq': 1, 'rows': 1})
+    if chunk is None:
+        return
+    batch_id, seq = chunk['batch'], chunk['seq']
+    logger.error(f"Ingest batch {batch_id} chunk {seq} failed: {error}")
+    IngestBatch._get_collection().update_one(
+        {'_id': batch_id, 'done_chunks': {'$ne': seq}},
+        {
+            '$inc': {'failed': len(chunk['rows']), 'failed_chunks': 1},
+            '$push': {'done_chunks': seq},
+            '$set': {'error': f'chunk {seq}: {error}'},
+        },
+    )
+    IngestBatchChunk._get_collection().delete_one({'_id': chunk_id})
+    finish_batch(batch_id)
+
+
+def batch_summary(batch):
+    """API representation of an IngestBatch"""
+    return {
+        'batch_id': str(batch.pk),
+        'kind': batch.kind,
+        'status': batch.status,
+        'received': batch.received,
+        'queued': batch.queued,
+        'inserted': batch.inserted,
+        'duplicates': batch.duplicates,
+        'failed': batch.failed,
+        'chunks': batch.chunks,
+        'chunks_done': len(batch.done_chunks or []),
+        'errors': batch.errors,
+        'error': batch.error,
+        'created_at': batch.created_at,
+        'started_at': batch.started_at,
+        'completed_at': batch.completed_at,
+    }
@@ -0,0 +1,264 @@
+"""
+Data Intake backfill - vectorized DataAggregation recomputation from raw readings
+
+Readings are streamed per (data_source, metric_type) in timestamp order as
+columnar NumPy chunks. Because the stream is sorted, every period except the
+last one in a chunk is complete, so statistics are computed with contiguous
+group reductions and only the open period is carried to the next chunk.
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+from pymongo import UpdateOne
+
+from apps.api.references import reference_id
+from apps.data_intake.aggregation import DEFAULT_ROLLUP_PERIODS
+from apps.data_intake.archive import TieredPointStore, archived_series
+from apps.data_intake.models import (
+    DataSource, DataAggregation, AggregationPeriodChoices
+)
+from apps.data_intake.storage import get_point_store, DEFAULT_COLUMN_CHUNK_SIZE, EPOCH
+
+DEFAULT_CHUNK_SIZE = DEFAULT_COLUMN_CHUNK_SIZE
+PERCENTILES = (5, 50, 95)
+
+MS_PER_HOUR = 3600000
+MS_PER_DAY = 86400000
+
+
+def period_keys(period, timestamps_ms):
+    """Vectorized period index for epoch-millisecond timestamps"""
+    if period == AggregationPeriodChoices.HOURLY:
+        return timestamps_ms // MS_PER_HOUR
+    days = timestamps_ms // MS_PER_DAY
+    if period == AggregationPeriodChoices.DAILY:
+        return days
+    if period == AggregationPeriodChoices.WEEKLY:
+        # 1970-01-01 was a Thursday; shift so weeks start on Monday
+        return (days + 3) // 7
+    if period == AggregationPeriodChoices.MONTHLY:
+        return timestamps_ms.astype('datetime64[ms]').astype('datetime64[M]').astype(np.int64)
+    raise ValueError(f'Unknown aggregation period: {period}')
+
+
+def period_window(period, key):
+    """Return the [start, end) datetimes of a period index"""
+    key = int(key)
+    if period == AggregationPeriodChoices.HOURLY:
+        start = EPOCH + timedelta(hours=key)
+        return start, start + timedelta(hours=1)
+    if period == AggregationPeriodChoices.DAILY:
+        start = EPOCH + timedelta(days=key)
+        return start, start + timedelta(days=1)
+    if period == AggregationPeriodChoices.WEEKLY:
+        start = EPOCH + timedelta(days=key * 7 - 3)
+        return start, start + timedelta(days=7)
+    if period == AggregationPeriodChoices.MONTHLY:
+        year, month = divmod(key, 12)
+        start = datetime(1970 + year, month + 1, 1)
+        end = datetime(start.year + 1, 1, 1) if month == 11 else datetime(start.year, month + 2, 1)
+        return start, end
+    raise ValueError(f'Unknown aggregation period: {period}')
+
+
+def group_stats(keys, values):
+    """
+    Statistics for each run of equal keys in a sorted key array.
+
+    Returns a list of (key, stats) in key order.
+    """
+    if not len(keys):
+        return []
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    ends = np.append(starts[1:], len(keys))
+    counts = ends - starts
+    sums = np.add.reduceat(values, starts)
+    mins = np.minimum.reduceat(values, starts)
+    maxs = np.maximum.reduceat(values, starts)
+
+    groups = []
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        group = values[start:end]
+        p = np.percentile(group, PERCENTILES)
+        groups.append((keys[start], {
+            'count': int(counts[i]),
+            'sum': float(sums[i]),
+            'avg': float(sums[i] / counts[i]),
+            'min': float(mins[i]),
+            'max': float(maxs[i]),
+            'stddev': float(group.std(ddof=1)) if counts[i] > 1 else 0.0,
+            'percentiles': {f'p{q}': float(v) for q, v in zip(PERCENTILES, p)},
+        }))
+    return groups
+
+
+class PeriodAccumulator:
+    """Turns sorted columnar chunks into completed period statistics for one period type"""
+
+    def __init__(self, period):
+        self.period = period
+        self.pending_key = None
+        self.pending = []
+
+    def _close_pending(self):
+        if self.pending_key is None:
+            return []
+        values = np.concatenate(self.pending)
+        stats = group_stats(np.full(len(values), self.pending_key), values)
+        self.pending_key, self.pending = None, []
+        return stats
+
+    def feed(self, timestamps_ms, values):
+        """Consume a sorted chunk; return stats for periods that are now complete"""
+        if not len(values):
+            return []
+        keys = period_keys(self.period, timestamps_ms)
+        completed = []
+
+        if self.pending_key is not None:
+            split = int(np.searchsorted(keys, self.pending_key, side='right'))
+            self.pending.append(values[:split])
+            if split == len(keys):
+                return completed
+            completed.extend(self._close_pending())
+            keys, values = keys[split:], values[split:]
+
+        # Everything before the last key is complete; the last period may continue
+        last = keys[-1]
+        split = int(np.searchsorted(keys, last, side='left'))
+        completed.extend(group_stats(keys[:split], values[:split]))
+        self.pending_key = last
+        self.pending = [values[split:]]
+        return completed
+
+    def flush(self):
+        return self._close_pending()
+
+
+def _aggregation_update(project_id, source_id, metric_type, unit, period, key, stats, rebuilt_at):
+    start, end = period_window(period, key)
+    return UpdateOne(
+        {
+            'project': project_id,
+            'data_source': source_id,
+            'metric_type': metric_type,
+            'period': period,
+            'period_start': start,
+        },
+        {
+            '$set': {
+                'period_end': end,
+                'count': stats['count'],
+                'sum_value': stats['sum'],
+                'avg_value': stats['avg'],
+                'min_value': stats['min'],
+                'max_value': stats['max'],
+                'stddev_value': stats['stddev'],
+                'percentiles': stats['percentiles'],
+                'unit': unit,
+                'updated_at': rebuilt_at,
+            },
+            '$setOnInsert': {'created_at': rebuilt_at},
+        },
+        upsert=True
+    )
+
+
+def _series(source_id, store):
+    """Return (metric_type, unit) pairs stored for a data source, archived months included"""
+    pipeline = [
+        {'$match': {'data_source': source_id}},
+        {'$group': {'_id': '$metric_type', 'unit': {'$first': '$unit'}}},
+    ]
+    series = {row['_id']: row['unit'] for row in store.document._get_collection().aggregate(pipeline)}
+    if isinstance(store, TieredPointStore):
+        for metric_type, unit in archived_series(source_id):
+            series.setdefault(metric_type, unit)
+    return list(series.items())
+
+
+def rebuild_project_aggregations(project, periods=None, chunk_size=DEFAULT_CHUNK_SIZE, layout=None):
+    """
+    Recompute every DataAggregation bucket of a project from its raw readings.
+
+    Buckets are bulk-upserted as each period completes; buckets the rebuild
+    did not touch (e.g. after purging bad sensor data) are removed at the end.
+    Incremental rollups keep count/sum/min/max current afterwards, while
+    stddev and percentiles reflect the latest rebuild.
+    """
+    periods = periods or DEFAULT_ROLLUP_PERIODS
+    project_id = reference_id(project)
+    rebuilt_at = datetime.utcnow()
+    started = time.monotonic()
+    collection = DataAggregation._get_collection()
+    store = get_point_store(layout)
+
+    points = written = 0
+    for source in DataSource._get_collection().find({'project': project_id}, {'_id': 1}):
+        source_id = source['_id']
+        for metric_type, unit in _series(source_id, store):
+            accumulators = [PeriodAccumulator(period) for period in periods]
+            for timestamps_ms, values in store.iter_columns(source_id, metric_type, chunk_size=chunk_size):
+                points += len(values)
+                operations = [
+                    _aggregation_update(project_id, source_id, metric_type, unit,
+                                        acc.period, key, stats, rebuilt_at)
+                    for acc in accumulators
+                    for key, stats in acc.feed(timestamps_ms, values)
+                ]
+                if operations:
+                    collection.bulk_write(operations, ordered=False)
+                    written += len(operations)
+
+            operations = [
+                _aggregation_update(project_id, source_id, metric_type, unit,
+                                    acc.period, key, stats, rebuilt_at)
+                for acc in accumulators
+                for key, stats in acc.flush()
+            ]
+            if operations:
+                collection.bulk_write(operations, ordered=False)
+                written += len(operations)
+
+    removed = collection.delete_many({
+        'project': project_id,
+        'period': {'$in': list(periods)},
+        'updated_at': {'$lt': rebuilt_at},
+    }).deleted_count
+
+    return {
+        'project_id': str(project_id),
+        'points': points,
+        'aggregations': written,
+        'removed': removed,
+        'seconds': round(time.monotonic() - started, 3),
+    }
+
+
+def _init_worker():
+    # Connections must not be shared across processes; open a fresh one per worker
+    from mongoengine import disconnect
+    from config.settings import init_mongodb_connection
+    disconnect()
+    init_mongodb_connection()
+
+
+def _rebuild_in_worker(args):
+    project_id, periods, chunk_size = args
+    return rebuild_project_aggregations(project_id, periods, chunk_size)
+
+
+def rebuild_aggregations(project_ids, periods=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+    """Rebuild several projects, one project per process when workers > 1"""
+    jobs = [(reference_id(project_id), periods, chunk_size) for project_id in project_ids]
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield _rebuild_in_worker(job)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        for summary in executor.map(_rebuild_in_worker, jobs):
+            yield summary
@@ -0,0 +1,368 @@
+"""
+Data Intake benchmark - ingestion throughput of the DataPoint write path
+
+Creates a synthetic fleet of DataSources, drives the single, bulk and
+streaming ingest paths with generated readings from `concurrency` threads
+and reports per scenario:
+
+- points/sec: readings stored over wall-clock time
+- latency: p50 / p90 / p99 / max of one ingest call (one reading, one bulk
+  batch or one NDJSON stream) in milliseconds
+- bytes written and index growth: data and index size deltas of the
+  collections ingest writes to (from collStats, so run against an otherwise
+  idle mongod)
+
+Results are plain JSON so runs can be kept and compared with
+compare_results(). Everything the benchmark writes is tagged with its
+run id and removed by cleanup_fleet() unless asked to keep it.
+"""
+
+import io
+import json
+import os
+import platform
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pymongo
+from bson import ObjectId
+from django.conf import settings
+from pymongo.errors import OperationFailure
+
+from apps.data_intake.aggregation import get_rollup_periods
+from apps.data_intake.ingestion import IngestResult, ingest_points, prepare_points, stream_ingest, write_points
+from apps.data_intake.models import (
+    AnomalyDetectorState, DataAggregation, DataPoint, DataPointBucket, DataPointPayload, DataSource,
+    DataSourceTypeChoices, MetricTypeChoices, StorageLayoutChoices
+)
+from apps.data_intake.payloads import get_retention
+from apps.data_intake.quotas import charge_quotas
+from apps.data_intake.storage import get_point_store
+
+
+class BenchmarkModeChoices:
+    """Ingest paths the benchmark can drive"""
+    SINGLE = 'SINGLE'
+    BULK = 'BULK'
+    STREAM = 'STREAM'
+
+    CHOICES = [
+        (SINGLE, 'One reading per call (POST data-points/)'),
+        (BULK, 'One batch per call (POST data-points/bulk/)'),
+        (STREAM, 'One NDJSON stream per call (POST data-points/stream/)'),
+    ]
+
+
+RESULT_FORMAT_VERSION = 1
+LATENCY_PERCENTILES = (50, 90, 99)
+
+# Collections the write path touches; their growth is reported per scenario
+STORAGE_DOCUMENTS = (DataPoint, DataPointBucket, DataPointPayload, DataAggregation)
+
+# Metric type: (unit, typical value, spread)
+SYNTHETIC_METRICS = {
+    MetricTypeChoices.CO2_CONCENTRATION: ('ppm', 415.0, 25.0),
+    MetricTypeChoices.ENERGY_CONSUMPTION: ('kWh', 120.0, 40.0),
+    MetricTypeChoices.TEMPERATURE: ('C', 22.0, 6.0),
+    MetricTypeChoices.SOIL_MOISTURE: ('%', 30.0, 8.0),
+}
+
+
+def create_fleet(run_id, sources, project_id=None):
+    """Insert `sources` synthetic IOT DataSources tagged with run_id; returns their ids"""
+    project_id = project_id or ObjectId()
+    now = datetime.utcnow()
+    docs = [
+        {
+            '_id': ObjectId(),
+            'project': project_id,
+            'name': f'benchmark-{run_id}-{i}',
+            'type': DataSourceTypeChoices.IOT,
+            'metadata': {'benchmark_run': run_id},
+            'is_active': True,
+            'created_at': now,
+            'updated_at': now,
+        }
+        for i in range(sources)
+    ]
+    DataSource._get_collection().insert_many(docs, ordered=False)
+    return [doc['_id'] for doc in docs]
+
+
+def cleanup_fleet(run_id):
+    """Remove the synthetic sources of a run and everything ingested for them"""
+    sources = DataSource._get_collection()
+    source_ids = [row['_id'] for row in sources.find({'metadata.benchmark_run': run_id}, {'_id': 1})]
+    if not source_ids:
+        return 0
+    for document in STORAGE_DOCUMENTS + (AnomalyDetectorState,):
+        document._get_collection().delete_many({'data_source': {'$in': source_ids}})
+    return sources.delete_many({'_id': {'$in': source_ids}}).deleted_count
+
+
+class ReadingGenerator:
+    """
+    Synthetic readings for one worker. Timestamps interleave across workers
+    (worker + k * workers seconds after start) so no two readings collide
+    and nothing is dropped as a duplicate.
+    """
+
+    def __init__(self, source_ids, worker, workers, start, seed=None):
+        self.source_ids = [str(source_id) for source_id in source_ids]
+        self.metrics = list(SYNTHETIC_METRICS)
+        self.worker = worker
+        self.workers = workers
+        self.start = start
+        self.seq = 0
+        self.rng = np.random.default_rng(seed)
+
+    def batch(self, size):
+        """`size` reading payloads as the API receives them"""
+        noise = self.rng.standard_normal(size)
+        payloads = []
+        for i in range(size):
+            seq = self.seq + i
+            source_id = self.source_ids[seq % len(self.source_ids)]
+            metric = self.metrics[(seq // len(self.source_ids)) % len(self.metrics)]
+            unit, typical, spread = SYNTHETIC_METRICS[metric]
+            timestamp = self.start + timedelta(seconds=seq * self.workers + self.worker)
+            payloads.append({
+                'data_source_id': source_id,
+                'metric_type': metric,
+                'value': round(typical + spread * float(noise[i]), 3),
+                'unit': unit,
+                'timestamp': timestamp.isoformat() + 'Z',
+                'raw_payload': {'seq': seq, 'worker': self.worker, 'rssi': -60 - seq % 30},
+            })
+        self.seq += size
+        return payloads
+
+
+def ingest_single(payloads, enforce_quotas=False):
+    """The POST data-points/ path, one reading per call"""
+    store = get_point_store()
+    inserted = duplicates = failed = 0
+    for payload in payloads:
+        docs, rows, errors = prepare_points([payload])
+        if errors:
+            failed += 1
+            continue
+        if enforce_quotas:
+            charge_quotas(docs)
+        result = write_points(docs, rows, IngestResult(1), store=store)
+        inserted += result.inserted
+        duplicates += result.duplicates
+        failed += result.failed
+    return inserted, duplicates, failed
+
+
+def ingest_bulk(payloads, enforce_quotas=False):
+    """The POST data-points/bulk/ path"""
+    result = ingest_points(payloads, enforce_quotas=enforce_quotas)
+    return result.inserted, result.duplicates, result.failed
+
+
+def ingest_stream(payloads, enforce_quotas=False, chunk_size=None):
+    """The POST data-points/stream/ path over an in-memory NDJSON body"""
+    body = io.BytesIO(b''.join(json.dumps(payload).encode() + b'\n' for payload in payloads))
+    summary = None
+    for summary in stream_ingest(body, chunk_size=chunk_size, enforce_quotas=enforce_quotas):
+        pass
+    return summary['inserted'], summary['duplicates'], summary['failed']
+
+
+def collection_sizes():
+    """{collection: (data bytes, index bytes)} of the collections ingest writes to"""
+    db = DataPoint._get_db()
+    sizes = {}
+    for document in STORAGE_DOCUMENTS:
+        name = document._get_collection_name()
+        try:
+            stats = db.command('collStats', name)
+        except OperationFailure:
+            # Not created yet
+            stats = {}
+        sizes[name] = (int(stats.get('size', 0)), int(stats.get('totalIndexSize', 0)))
+    return sizes
+
+
+def size_growth(before, after):
+    """{'bytes_written', 'index_growth_bytes', 'collections'} between two collection_sizes()"""
+    collections = {}
+    for name, (size, index_size) in after.items():
+        size_before, index_before = before.get(name, (0, 0))
+        if size != size_before or index_size != index_before:
+            collections[name] = {'bytes': size - size_before, 'index_bytes': index_size - index_before}
+    return {
+        'bytes_written': sum(entry['bytes'] for entry in collections.values()),
+        'index_growth_bytes': sum(entry['index_bytes'] for entry in collections.values()),
+        'collections': collections,
+    }
+
+
+def latency_summary(latencies):
+    """Percentiles of call latencies (seconds) in milliseconds"""
+    if not latencies:
+        return {}
+    millis = np.asarray(latencies, dtype=np.float64) * 1000.0
+    summary = {f'p{p}': round(float(np.percentile(millis, p)), 3) for p in LATENCY_PERCENTILES}
+    summary['mean'] = round(float(millis.mean()), 3)
+    summary['max'] = round(float(millis.max()), 3)
+    return summary
+
+
+INGEST_CALLS = {
+    BenchmarkModeChoices.SINGLE: ingest_single,
+    BenchmarkModeChoices.BULK: ingest_bulk,
+    BenchmarkModeChoices.STREAM: ingest_stream,
+}
+
+
+def run_scenario(mode, source_ids, points, concurrency=1, batch_size=1000, enforce_quotas=False, seed=None):
+    """
+    Ingest `points` readings through one path from `concurrency` threads.
+    SINGLE times every reading; BULK and STREAM time each call of batch_size
+    readings. Returns the scenario's result record.
+    """
+    ingest = INGEST_CALLS[mode]
+    per_call = 1 if mode == BenchmarkModeChoices.SINGLE else batch_size
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(seconds=points)
+    calls = -(-points // per_call)
+    lock = threading.Lock()
+    latencies = []
+    totals = {'inserted': 0, 'duplicates': 0, 'failed': 0}
+
+    def worker(index):
+        generator = ReadingGenerator(source_ids, index, concurrency, start, None if seed is None else seed + index)
+        own_latencies, counts = [], [0, 0, 0]
+        for call in range(index, calls, concurrency):
+            payloads = generator.batch(min(per_call, points - call * per_call))
+            began = time.perf_counter()
+            inserted, duplicates, failed = ingest(payloads, enforce_quotas)
+            own_latencies.append(time.perf_counter() - began)
+            counts = [counts[0] + inserted, counts[1] + duplicates, counts[2] + failed]
+        with lock:
+            latencies.extend(own_latencies)
+            totals['inserted'] += counts[0]
+            totals['duplicates'] += counts[1]
+            totals['failed'] += counts[2]
+
+    before = collection_sizes()
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='ingest-benchmark') as executor:
+        # list() re-raises the first worker error
+        list(executor.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - began
+    growth = size_growth(before, collection_sizes())
+
+    return dict(
+        {
+            'mode': mode,
+            'concurrency': concurrency,
+            'batch_size': per_call,
+            'points': points,
+            'calls': calls,
+            'elapsed_seconds': round(elapsed, 3),
+            'points_per_second': round(totals['inserted'] / elapsed, 1) if elapsed else None,
+            'latency_ms': latency_summary(latencies),
+            'bytes_per_point': round(growth['bytes_written'] / totals['inserted'], 1) if totals['inserted'] else None,
+        },
+        **totals,
+        **growth,
+    )
+
+
+def environment():
+    """What a result depends on besides the code: versions and ingest settings"""
+    try:
+        server_version = DataPoint._get_db().client.server_info().get('version')
+    except Exception:
+        server_version = None
+    return {
+        'python': platform.python_version(),
+        'pymongo': pymongo.version,
+        'mongodb': server_version,
+        'host': platform.node(),
+        'cpus': os.cpu_count(),
+        'storage_layout': getattr(settings, 'DATA_INTAKE_STORAGE_LAYOUT', StorageLayoutChoices.DOCUMENTS),
+        'raw_payload_retention': get_retention(),
+        'rollup_periods': list(get_rollup_periods()),
+        'anomaly_detection': getattr(settings, 'DATA_INTAKE_ANOMALY_DETECTION_ENABLED', True),
+    }
+
+
+def run_benchmark(modes, points, sources=100, concurrency=(1,), batch_size=1000,
+                  enforce_quotas=False, seed=None, keep_data=False, progress=None):
+    """
+    Run every (mode, concurrency) scenario against a fresh synthetic fleet.
+    progress, when given, is called with each scenario result as it
+    completes. Returns the JSON-ready run record.
+    """
+    run_id = uuid.uuid4().hex[:12]
+    record = {
+        'format_version': RESULT_FORMAT_VERSION,
+        'run_id': run_id,
+        'started_at': datetime.utcnow().isoformat() + 'Z',
+        'config': {
+            'modes': list(modes),
+            'points': points,
+            'sources': sources,
+            'concurrency': list(concurrency),
+            'batch_size': batch_size,
+            'enforce_quotas': enforce_quotas,
+            'seed': seed,
+        },
+        'environment': environment(),
+        'scenarios': [],
+    }
+    try:
+        for mode in modes:
+            for workers in concurrency:
+                # Each scenario gets a fresh fleet so earlier readings and
+                # detector state do not skew later ones
+                cleanup_fleet(run_id)
+                source_ids = create_fleet(run_id, sources)
+                result = run_scenario(mode, source_ids, points, workers, batch_size, enforce_quotas, seed)
+                record['scenarios'].append(result)
+                if progress:
+                    progress(result)
+    finally:
+        if not keep_data:
+            cleanup_fleet(run_id)
+    record['finished_at'] = datetime.utcnow().isoformat() + 'Z'
+    return record
+
+
+def scenario_key(scenario):
+    return scenario['mode'], scenario['concurrency'], scenario['batch_size']
+
+
+def compare_results(baseline, current):
+    """
+    Per scenario present in both runs: throughput and latency of current
+    relative to baseline (1.10 = 10% higher).
+    """
+    previous = {scenario_key(scenario): scenario for scenario in baseline.get('scenarios', [])}
+    comparison = []
+    for scenario in current.get('scenarios', []):
+        before = previous.get(scenario_key(scenario))
+        if before is None:
+            continue
+        entry = {'mode': scenario['mode'], 'concurrency': scenario['concurrency'], 'batch_size': scenario['batch_size']}
+        for name, old, new in (
+            ('points_per_second', before.get('points_per_second'), scenario.get('points_per_second')),
+            ('p50_ms', before.get('latency_ms', {}).get('p50'), scenario.get('latency_ms', {}).get('p50')),
+            ('p99_ms', before.get('latency_ms', {}).get('p99'), scenario.get('latency_ms', {}).get('p99')),
+            ('bytes_per_point', before.get('bytes_per_point'), scenario.get('bytes_per_point')),
+        ):
+            entry[name] = {
+                'baseline': old,
+                'current': new,
+                'ratio': round(new / old, 3) if old and new is not None else None,
+            }
+        comparison.append(entry)
+    return comparison
@@ -0,0 +1,220 @@
+"""
+Data Intake downsampling - chart-sized series from raw readings and rollups
+
+Readings are folded into a fixed number of time buckets in a single
+streaming pass (per-bucket min/max/sum/count), so memory is O(target points)
+whatever the range. MINMAX returns those buckets directly; LTTB runs
+Largest-Triangle-Three-Buckets over a few-times-oversampled min/max series.
+Where a DataAggregation period is no wider than one bucket, the fully covered
+periods are read from rollups and only the partial edges are scanned raw.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+
+from apps.api.references import reference_id
+from apps.data_intake.aggregation import get_rollup_periods, period_bounds
+from apps.data_intake.models import DataAggregation, AggregationPeriodChoices
+from apps.data_intake.storage import get_point_store, to_epoch_ms, from_epoch_ms
+
+
+class DownsampleMethodChoices:
+    """Downsampling method constants"""
+    LTTB = 'LTTB'
+    MINMAX = 'MINMAX'
+
+    CHOICES = [
+        (LTTB, 'Largest Triangle Three Buckets'),
+        (MINMAX, 'Min/max per bucket'),
+    ]
+
+
+MAX_TARGET_POINTS = 10000
+LTTB_OVERSAMPLING = 4
+
+# Longest possible length of each rollup period, finest first
+PERIOD_WIDTHS = [
+    (AggregationPeriodChoices.HOURLY, timedelta(hours=1)),
+    (AggregationPeriodChoices.DAILY, timedelta(days=1)),
+    (AggregationPeriodChoices.WEEKLY, timedelta(days=7)),
+    (AggregationPeriodChoices.MONTHLY, timedelta(days=31)),
+]
+
+
+class MinMaxBuckets:
+    """Streaming per-bucket min/max/sum/count over a fixed time range"""
+
+    def __init__(self, start_ms, end_ms, buckets):
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.buckets = buckets
+        self.width = max(1, -(-(end_ms - start_ms) // buckets))
+        self.count = np.zeros(buckets, dtype=np.int64)
+        self.sum = np.zeros(buckets)
+        self.min = np.full(buckets, np.inf)
+        self.max = np.full(buckets, -np.inf)
+        self.min_t = np.zeros(buckets, dtype=np.int64)
+        self.max_t = np.zeros(buckets, dtype=np.int64)
+
+    def _bucket(self, timestamps_ms):
+        return np.clip((timestamps_ms - self.start_ms) // self.width, 0, self.buckets - 1)
+
+    def add(self, timestamps_ms, values, counts=None, sums=None, maxima=None, maxima_t=None):
+        """
+        Fold a chunk into the buckets. Raw readings pass only timestamps and
+        values; pre-aggregated rows also pass counts, sums and maxima (values
+        are then the minima).
+        """
+        if not len(timestamps_ms):
+            return
+        counts = np.ones(len(values), dtype=np.int64) if counts is None else counts
+        sums = values if sums is None else sums
+        maxima = values if maxima is None else maxima
+        maxima_t = timestamps_ms if maxima_t is None else maxima_t
+
+        idx = self._bucket(timestamps_ms)
+        np.add.at(self.count, idx, counts)
+        np.add.at(self.sum, idx, sums)
+
+        # Order by (bucket, value) so the first row of each bucket is its minimum
+        order = np.lexsort((values, idx))
+        first = np.concatenate(([True], idx[order][1:] != idx[order][:-1]))
+        rows = order[first]
+        better = values[rows] < self.min[idx[rows]]
+        self.min[idx[rows[better]]] = values[rows[better]]
+        self.min_t[idx[rows[better]]] = timestamps_ms[rows[better]]
+
+        order = np.lexsort((-maxima, idx))
+        first = np.concatenate(([True], idx[order][1:] != idx[order][:-1]))
+        rows = order[first]
+        better = maxima[rows] > self.max[idx[rows]]
+        self.max[idx[rows[better]]] = maxima[rows[better]]
+        self.max_t[idx[rows[better]]] = maxima_t[rows[better]]
+
+    def rows(self):
+        """[bucket_start, min, max, avg, count] for non-empty buckets"""
+        filled = np.flatnonzero(self.count)
+        return [
+            [
+                from_epoch_ms(self.start_ms + int(i) * self.width),
+                float(self.min[i]), float(self.max[i]),
+                float(self.sum[i] / self.count[i]), int(self.count[i]),
+            ]
+            for i in filled
+        ]
+
+    def points(self):
+        """Time-ordered (timestamps_ms, values) of every bucket's min and max"""
+        filled = np.flatnonzero(self.count)
+        t = np.concatenate((self.min_t[filled], self.max_t[filled]))
+        v = np.concatenate((self.min[filled], self.max[filled]))
+        order = np.lexsort((v, t))
+        t, v = t[order], v[order]
+        keep = np.concatenate(([True], (t[1:] != t[:-1]) | (v[1:] != v[:-1])))
+        return t[keep], v[keep]
+
+
+def lttb(timestamps_ms, values, target):
+    """Largest-Triangle-Three-Buckets selection of target points from a sorted series"""
+    size = len(values)
+    if target >= size or target < 3:
+        return timestamps_ms, values
+
+    t = timestamps_ms.astype(np.float64)
+    edges = np.linspace(1, size - 1, target - 1).astype(np.int64)
+    selected = np.empty(target, dtype=np.int64)
+    selected[0], selected[-1] = 0, size - 1
+
+    anchor = 0
+    for i in range(target - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        if i == target - 3:
+            next_t, next_v = t[-1], values[-1]
+        else:
+            next_hi = max(edges[i + 2], hi + 1)
+            next_t, next_v = t[hi:next_hi].mean(), values[hi:next_hi].mean()
+        area = np.abs(
+            (t[anchor] - next_t) * (values[lo:hi] - values[anchor])
+            - (t[anchor] - t[lo:hi]) * (next_v - values[anchor])
+        )
+        anchor = lo + int(np.argmax(area))
+        selected[i + 1] = anchor
+    return timestamps_ms[selected], values[selected]
+
+
+def _rollup_period(bucket_width):
+    """Coarsest maintained rollup period that still fits inside one bucket"""
+    maintained = set(get_rollup_periods())
+    chosen = None
+    for period, width in PERIOD_WIDTHS:
+        if period in maintained and width <= bucket_width:
+            chosen = period
+    return chosen
+
+
+def _fold_rollups(state, data_source, metric_type, period, start, end):
+    rows = list(DataAggregation._get_collection().find(
+        {
+            'data_source': reference_id(data_source),
+            'metric_type': metric_type,
+            'period': period,
+            'period_start': {'$gte': start, '$lt': end},
+        },
+        {'period_start': 1, 'count': 1, 'sum_value': 1, 'min_value': 1, 'max_value': 1},
+    ))
+    if not rows:
+        return
+    starts = np.array([to_epoch_ms(row['period_start']) for row in rows], dtype=np.int64)
+    state.add(
+        starts,
+        np.array([row['min_value'] for row in rows], dtype=np.float64),
+        counts=np.array([int(row['count']) for row in rows], dtype=np.int64),
+        sums=np.array([row['sum_value'] for row in rows], dtype=np.float64),
+        maxima=np.array([row['max_value'] for row in rows], dtype=np.float64),
+    )
+
+
+def downsample_series(data_source, metric_type, start, end, target, method=DownsampleMethodChoices.LTTB):
+    """
+    Downsample one source/metric series over [start, end) to about target points.
+
+    Returns {'method', 'source', 'bucket_seconds', 'points'} where points are
+    [timestamp, value] pairs for LTTB and [bucket_start, min, max, avg, count]
+    rows for MINMAX.
+    """
+    start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+    buckets = target if method == DownsampleMethodChoices.MINMAX else target * LTTB_OVERSAMPLING
+    state = MinMaxBuckets(start_ms, end_ms, buckets)
+    store = get_point_store()
+
+    raw_ranges = [(start, end)]
+    source = 'raw'
+    period = _rollup_period(timedelta(milliseconds=int(state.width)))
+    if period is not None:
+        first_start, first_end = period_bounds(period, start)
+        full_start = start if first_start == start else first_end
+        full_end = period_bounds(period, end)[0]
+        if full_start < full_end:
+            _fold_rollups(state, data_source, metric_type, period, full_start, full_end)
+            raw_ranges = [(start, full_start), (full_end, end)]
+            source = f'aggregations:{period}'
+
+    for range_start, range_end in raw_ranges:
+        if range_start >= range_end:
+            continue
+        for timestamps_ms, values in store.iter_columns(data_source, metric_type, range_start, range_end):
+            state.add(timestamps_ms, values)
+
+    if method == DownsampleMethodChoices.MINMAX:
+        points = state.rows()
+    else:
+        t, v = lttb(*state.points(), target)
+        points = [[from_epoch_ms(ts), float(value)] for ts, value in zip(t, v)]
+
+    return {
+        'method': method,
+        'source': source,
+        'bucket_seconds': state.width / 1000,
+        'points': points,
+    }
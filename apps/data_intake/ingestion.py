@@ -0,0 +1,392 @@
+"""
+Data Intake ingestion pipeline - validation and bulk writes for DataPoint
+
+Ingestion is idempotent: a reading whose (data_source, metric_type,
+timestamp) is already stored, or repeated within a batch, is accepted as a
+duplicate without being written or rolled up again.
+"""
+
+import base64
+import json
+import math
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from apps.data_intake.activity import record_activity
+from apps.data_intake.anomalies import schedule_detection
+from apps.data_intake.aggregation import apply_rollups
+from apps.data_intake.models import (
+    DataSource, DataPoint, MetricTypeChoices, RawPayloadRetentionChoices, StorageLayoutChoices
+)
+from apps.data_intake.payloads import detach_raw_payloads, get_retention, store_raw_payloads
+from apps.data_intake.quotas import QuotaExceeded, charge_quotas
+from apps.data_intake.storage import get_point_store, dedup_key, truncate_to_millis
+from apps.data_intake.validation import schedule_validation
+
+
+METRIC_TYPES = frozenset(code for code, _ in MetricTypeChoices.CHOICES)
+
+DEFAULT_BULK_MAX_POINTS = 50000
+DEFAULT_STREAM_CHUNK_SIZE = 5000
+DEFAULT_STREAM_MAX_LINE_BYTES = 64 * 1024
+
+
+def get_bulk_max_points():
+    """Largest number of points accepted in a single bulk request"""
+    return getattr(settings, 'DATA_INTAKE_BULK_MAX_POINTS', DEFAULT_BULK_MAX_POINTS)
+
+
+def get_stream_chunk_size():
+    """Number of NDJSON records written per bulk insert while streaming"""
+    return getattr(settings, 'DATA_INTAKE_STREAM_CHUNK_SIZE', DEFAULT_STREAM_CHUNK_SIZE)
+
+
+def get_stream_max_line_bytes():
+    """Longest NDJSON line accepted; longer lines are rejected without being buffered"""
+    return getattr(settings, 'DATA_INTAKE_STREAM_MAX_LINE_BYTES', DEFAULT_STREAM_MAX_LINE_BYTES)
+
+
+class IngestResult:
+    """
+    Outcome of an ingestion batch.
+
+    Row status is kept as a bitmap (bit i set = row i accepted, either
+    stored or already present) so that a response for tens of thousands of
+    rows stays a few kilobytes; only failed rows carry an error message.
+    """
+
+    def __init__(self, total, offset=0):
+        self.total = total
+        self.offset = offset
+        self.inserted = 0
+        self.duplicates = 0
+        self.errors = {}
+        self._bitmap = bytearray((total + 7) // 8)
+
+    def mark_ok(self, row):
+        self._bitmap[row >> 3] |= 1 << (row & 7)
+        self.inserted += 1
+
+    def mark_duplicate(self, row):
+        self._bitmap[row >> 3] |= 1 << (row & 7)
+        self.duplicates += 1
+
+    def mark_failed(self, row, message):
+        self.errors[row] = message
+
+    @property
+    def failed(self):
+        return len(self.errors)
+
+    @property
+    def bitmap(self):
+        """Base64 encoded row bitmap, least significant bit first"""
+        return base64.b64encode(bytes(self._bitmap)).decode('ascii')
+
+    def to_dict(self):
+        return {
+            'received': self.total,
+            'inserted': self.inserted,
+            'duplicates': self.duplicates,
+            'failed': self.failed,
+            'bitmap': self.bitmap,
+            'errors': [
+                {'index': self.offset + row, 'error': message}
+                for row, message in sorted(self.errors.items())
+            ],
+        }
+
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 string or epoch seconds into a naive UTC datetime"""
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.fromtimestamp(value, tz=timezone.utc).replace(tzinfo=None)
+        except (OverflowError, OSError):
+            raise ValueError('timestamp out of range')
+    elif isinstance(value, str):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError('timestamp is not a valid ISO 8601 datetime')
+    else:
+        raise ValueError('timestamp is required')
+
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_value(value):
+    """Parse a numeric reading, rejecting booleans, NaN and infinities"""
+    if isinstance(value, bool) or value is None:
+        raise ValueError('value must be a number')
+    try:
+        number = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        raise ValueError('value must be a number')
+    if not number.is_finite():
+        raise ValueError('value must be finite')
+    # Readings are stored as doubles; a finite Decimal can still overflow one
+    if not math.isfinite(float(number)):
+        raise ValueError('value out of range')
+    return number
+
+
+def _object_id(value):
+    try:
+        return ObjectId(str(value))
+    except (InvalidId, TypeError):
+        return None
+
+
+def load_sources(source_ids):
+    """Fetch project and status for the referenced data sources in one query"""
+    if not source_ids:
+        return {}
+    rows = DataSource.objects(id__in=list(source_ids)).only('project', 'is_active').as_pymongo()
+    return {row['_id']: row for row in rows}
+
+
+def prepare_points(payloads):
+    """
+    Validate raw payloads in a single pass and convert them to data_points documents.
+
+    Returns (docs, rows, errors) where rows[i] is the payload index of docs[i]
+    and errors maps payload index to a message.
+    """
+    value_field = DataPoint._fields['value']
+    source_ids = set()
+    for payload in payloads:
+        if isinstance(payload, dict):
+            source_id = _object_id(payload.get('data_source_id'))
+            if source_id is not None:
+                source_ids.add(source_id)
+    sources = load_sources(source_ids)
+
+    now = datetime.utcnow()
+    docs, rows, errors = [], [], {}
+    for row, payload in enumerate(payloads):
+        try:
+            if not isinstance(payload, dict):
+                raise ValueError('data point must be an object')
+
+            source = sources.get(_object_id(payload.get('data_source_id')))
+            if source is None:
+                raise ValueError('unknown data_source_id')
+            if not source.get('is_active', True):
+                raise ValueError('data source is inactive')
+
+            project_id = payload.get('project_id')
+            if project_id is not None and _object_id(project_id) != source['project']:
+                raise ValueError('project_id does not match data source project')
+
+            metric_type = payload.get('metric_type')
+            if metric_type not in METRIC_TYPES:
+                raise ValueError(f'invalid metric_type: {metric_type}')
+
+            unit = payload.get('unit')
+            if not isinstance(unit, str) or not unit:
+                raise ValueError('unit is required')
+
+            value = value_field.to_mongo(parse_value(payload.get('value')))
+            timestamp = truncate_to_millis(parse_timestamp(payload.get('timestamp')))
+        except ValueError as e:
+            errors[row] = str(e)
+            continue
+
+        doc = {
+            '_id': ObjectId(),
+            'data_source': source['_id'],
+            'project': source['project'],
+            'metric_type': metric_type,
+            'value': value,
+            'unit': unit,
+            'is_validated': False,
+            'timestamp': timestamp,
+            'created_at': now,
+        }
+        raw_payload = payload.get('raw_payload')
+        if isinstance(raw_payload, dict) and raw_payload:
+            doc['raw_payload'] = raw_payload
+        docs.append(doc)
+        rows.append(row)
+
+    return docs, rows, errors
+
+
+def write_points(docs, rows, result, store=None, inline=False):
+    """
+    Write prepared documents to the configured storage layout in one unordered
+    bulk write, then fold the newly stored rows into their DataAggregation
+    rollups, the validation stage, anomaly detection and the source activity
+    tracker (which coalesces DataSource.last_data_received). Raw payloads are detached first
+    and kept per the retention mode (see apps.data_intake.payloads) for newly
+    stored readings only. Repeats within the batch are dropped
+    before the write; readings the store already holds come back as
+    duplicates. Neither is rolled up or validated again. Validation is
+    queued for a Celery worker unless inline; with inline, validation and
+    anomaly detection run before returning whatever the batch size (queue
+    workers already run off the request path).
+    """
+    if not docs:
+        return result
+
+    unique_docs, unique_rows, seen = [], [], set()
+    for doc, row in zip(docs, rows):
+        key = dedup_key(doc)
+        if key in seen:
+            result.mark_duplicate(row)
+            continue
+        seen.add(key)
+        unique_docs.append(doc)
+        unique_rows.append(row)
+
+    store = store or get_point_store()
+    retention = get_retention()
+    if store.layout == StorageLayoutChoices.BUCKETS and retention == RawPayloadRetentionChoices.INLINE:
+        # A bucket has nowhere to keep a payload inline
+        retention = RawPayloadRetentionChoices.COMPRESSED
+    payloads = detach_raw_payloads(unique_docs, retention)
+    failed, duplicates = store.write(unique_docs)
+
+    stored = []
+    for position, row in enumerate(unique_rows):
+        if position in failed:
+            result.mark_failed(row, failed[position])
+        elif position in duplicates:
+            result.mark_duplicate(row)
+        else:
+            result.mark_ok(row)
+            stored.append(unique_docs[position])
+
+    store_raw_payloads(stored, payloads)
+    apply_rollups(stored)
+    schedule_validation(stored, inline=inline)
+    schedule_detection(stored, inline=inline)
+    record_activity(stored)
+    return result
+
+
+def ingest_points(payloads, offset=0, rejected=None, enforce_quotas=False):
+    """
+    Validate and store a batch of data point payloads.
+
+    rejected maps row index to an error found before validation (e.g. a
+    line that was not valid JSON); such rows are passed as None placeholders
+    and reported with that message. With enforce_quotas the valid rows are
+    charged against their source and project ingest quotas first, and
+    QuotaExceeded is raised before anything is written.
+    """
+    result = IngestResult(len(payloads), offset=offset)
+    docs, rows, errors = prepare_points(payloads)
+    if enforce_quotas:
+        charge_quotas(docs)
+    if rejected:
+        errors.update(rejected)
+    for row, message in errors.items():
+        result.mark_failed(row, message)
+    return write_points(docs, rows, result)
+
+
+def iter_ndjson_chunks(stream, chunk_size, max_line_bytes):
+    """
+    Read an NDJSON stream line by line and yield (payloads, rejected) chunks.
+
+    Only one chunk and one line are held in memory at a time. Blank lines
+    are skipped; undecodable or oversized lines become None placeholders
+    with a message in rejected so record indexes stay stable.
+    """
+    payloads, rejected = [], {}
+    while True:
+        line = stream.readline(max_line_bytes + 1)
+        if not line:
+            break
+
+        if len(line) > max_line_bytes and not line.endswith(b'\n'):
+            # Drain the rest of the oversized line without buffering it
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(max_line_bytes + 1)
+            rejected[len(payloads)] = f'line exceeds {max_line_bytes} bytes'
+            payloads.append(None)
+        else:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                payloads.append(json.loads(line))
+            except ValueError:
+                rejected[len(payloads)] = 'invalid JSON'
+                payloads.append(None)
+
+        if len(payloads) >= chunk_size:
+            yield payloads, rejected
+            payloads, rejected = [], {}
+
+    if payloads:
+        yield payloads, rejected
+
+
+def stream_ingest(stream, chunk_size=None, max_line_bytes=None, enforce_quotas=False):
+    """
+    Ingest an NDJSON stream in fixed-size chunks.
+
+    Yields one progress record per chunk (with that chunk's bitmap and
+    errors) followed by a final summary, so callers can relay progress
+    while memory stays bounded by the chunk size. A chunk refused by an
+    ingest quota is reported as failed and ends the stream; the summary
+    carries retry_after and the offset to resume from.
+    """
+    chunk_size = chunk_size or get_stream_chunk_size()
+    max_line_bytes = max_line_bytes or get_stream_max_line_bytes()
+
+    records = inserted = duplicates = failed = chunks = 0
+    throttled = resume_offset = None
+    for payloads, rejected in iter_ndjson_chunks(stream, chunk_size, max_line_bytes):
+        try:
+            result = ingest_points(payloads, offset=records, rejected=rejected, enforce_quotas=enforce_quotas)
+        except QuotaExceeded as e:
+            throttled, resume_offset = e, records
+            result = IngestResult(len(payloads), offset=records)
+            for row in range(len(payloads)):
+                result.mark_failed(row, str(e))
+        chunks += 1
+        records += result.total
+        inserted += result.inserted
+        duplicates += result.duplicates
+        failed += result.failed
+
+        progress = result.to_dict()
+        progress.update({
+            'chunk': chunks,
+            'offset': result.offset,
+            'records_processed': records,
+            'total_inserted': inserted,
+            'total_duplicates': duplicates,
+            'total_failed': failed,
+        })
+        yield progress
+        if throttled is not None:
+            break
+
+    summary = {
+        'done': True,
+        'chunks': chunks,
+        'received': records,
+        'inserted': inserted,
+        'duplicates': duplicates,
+        'failed': failed,
+    }
+    if throttled is not None:
+        summary.update({
+            'throttled': True,
+            'retry_after': throttled.retry_after_seconds,
+            'resume_offset': resume_offset,
+        })
+    yield summary
@@ -0,0 +1,48 @@
+"""
+Move closed months of data points to columnar cold storage
+Usage: python manage.py archive_data_points --project <id> [--project <id> ...] [--months 12]
+       python manage.py archive_data_points --all
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.data_intake.archive import archive_cutoff, archive_project, get_archive_uri
+from apps.data_intake.models import DataSource
+
+
+class Command(BaseCommand):
+    help = 'Export aged data points to compressed .npz archives (local or GCS) and delete them from data_points'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', action='append', default=[], help='Project id (repeatable)')
+        parser.add_argument('--all', action='store_true', help='Archive every project with data sources')
+        parser.add_argument(
+            '--months', type=int,
+            help='Keep this many months hot (default DATA_INTAKE_ARCHIVE_AFTER_MONTHS)'
+        )
+
+    def handle(self, *args, **options):
+        if not get_archive_uri():
+            raise CommandError('Set DATA_INTAKE_ARCHIVE_URI to enable archiving')
+        project_ids = options['project']
+        if options['all']:
+            project_ids = DataSource._get_collection().distinct('project')
+        if not project_ids:
+            raise CommandError('Pass --project <id> or --all')
+
+        cutoff = archive_cutoff(months=options['months'])
+        self.stdout.write(f'Archiving months before {cutoff:%Y-%m} for {len(project_ids)} project(s)...')
+
+        total_rows = 0
+        try:
+            for project_id in project_ids:
+                for summary in archive_project(project_id, cutoff):
+                    total_rows += summary['rows']
+                    self.stdout.write(
+                        f"  {summary['project_id']} {summary['period_start']:%Y-%m} part {summary['part']}: "
+                        f"{summary['rows']} rows -> {summary['size_bytes']} bytes ({summary['uri']})"
+                    )
+        except Exception as e:
+            raise CommandError(f'Error archiving data points: {str(e)}')
+
+        self.stdout.write(self.style.SUCCESS(f'Archived {total_rows} data points'))
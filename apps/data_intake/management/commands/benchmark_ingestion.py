@@ -0,0 +1,111 @@
+"""
+Measure ingestion throughput and latency against the configured MongoDB
+Usage: python manage.py benchmark_ingestion [--mode BULK --mode STREAM] [--points 100000]
+           [--sources 100] [--concurrency 1 --concurrency 8] [--batch-size 1000]
+           [--output results.json] [--compare previous.json]
+"""
+
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.data_intake.benchmark import BenchmarkModeChoices, compare_results, run_benchmark
+
+
+# Refuse to write synthetic fleets into a database that does not look disposable
+SAFE_DATABASE_MARKERS = ('bench', 'test', 'local', 'dev')
+
+
+class Command(BaseCommand):
+    help = 'Drive single, bulk and streaming ingestion with synthetic readings and report throughput as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mode', action='append', choices=[code for code, _ in BenchmarkModeChoices.CHOICES],
+            help='Ingest path to drive (repeatable; default all)'
+        )
+        parser.add_argument('--points', type=int, default=100000, help='Readings per scenario')
+        parser.add_argument('--sources', type=int, default=100, help='Synthetic data sources')
+        parser.add_argument(
+            '--concurrency', type=int, action='append',
+            help='Concurrent ingest threads (repeatable; default 1)'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Readings per bulk call or stream')
+        parser.add_argument('--quotas', action='store_true', help='Charge ingest quotas like the API does')
+        parser.add_argument('--seed', type=int, help='Seed of the synthetic values')
+        parser.add_argument('--output', help='Write the run record as JSON to this file')
+        parser.add_argument('--compare', help='Previous run record (JSON) to compare against')
+        parser.add_argument('--keep-data', action='store_true', help='Keep the synthetic sources and readings')
+        parser.add_argument(
+            '--force', action='store_true',
+            help=f"Run even if the database name contains none of: {', '.join(SAFE_DATABASE_MARKERS)}"
+        )
+
+    def handle(self, *args, **options):
+        database = getattr(settings, 'MONGODB_DB_NAME', '')
+        if not options['force'] and not any(marker in database.lower() for marker in SAFE_DATABASE_MARKERS):
+            raise CommandError(
+                f'Refusing to benchmark against database {database!r}; point MONGODB_DB_NAME at a '
+                f'disposable database or pass --force'
+            )
+        if options['points'] < 1 or options['sources'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--points, --sources and --batch-size must be positive')
+        concurrency = options['concurrency'] or [1]
+        if min(concurrency) < 1:
+            raise CommandError('--concurrency must be positive')
+
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Cannot read {options["compare"]}: {e}')
+
+        modes = options['mode'] or [code for code, _ in BenchmarkModeChoices.CHOICES]
+        self.stdout.write(
+            f"Benchmarking {', '.join(modes)} with {options['points']} readings from "
+            f"{options['sources']} sources at concurrency {', '.join(map(str, concurrency))}..."
+        )
+        try:
+            record = run_benchmark(
+                modes, options['points'],
+                sources=options['sources'],
+                concurrency=concurrency,
+                batch_size=options['batch_size'],
+                enforce_quotas=options['quotas'],
+                seed=options['seed'],
+                keep_data=options['keep_data'],
+                progress=self.report,
+            )
+        except Exception as e:
+            raise CommandError(f'Benchmark failed: {str(e)}')
+
+        if baseline is not None:
+            record['comparison'] = {
+                'baseline_run_id': baseline.get('run_id'),
+                'scenarios': compare_results(baseline, record),
+            }
+            for entry in record['comparison']['scenarios']:
+                ratio = entry['points_per_second']['ratio']
+                self.stdout.write(
+                    f"  {entry['mode']} x{entry['concurrency']}: "
+                    f"{'n/a' if ratio is None else f'{ratio:.2f}x'} points/sec of run {baseline.get('run_id')}"
+                )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(record, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Run {record['run_id']} written to {options['output']}"))
+        else:
+            self.stdout.write(json.dumps(record, indent=2))
+
+    def report(self, result):
+        latency = result['latency_ms']
+        self.stdout.write(
+            f"  {result['mode']} x{result['concurrency']} (batch {result['batch_size']}): "
+            f"{result['points_per_second']} points/sec, p50 {latency.get('p50')} ms, "
+            f"p99 {latency.get('p99')} ms, {result['bytes_written']} bytes, "
+            f"+{result['index_growth_bytes']} index bytes, {result['failed']} failed"
+        )
@@ -0,0 +1,46 @@
+"""
+Remove duplicate readings and build the (data_source, metric_type, timestamp) dedup index
+Usage: python manage.py dedupe_data_points [--rebuild] [--workers 4]
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.data_intake.backfill import rebuild_aggregations
+from apps.data_intake.storage import get_point_store
+
+
+class Command(BaseCommand):
+    help = 'Delete duplicate data points so the unique dedup index can be built'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Rebuild aggregations of projects that had duplicates'
+        )
+        parser.add_argument('--workers', type=int, default=1, help='Parallel worker processes for --rebuild')
+
+    def handle(self, *args, **options):
+        store = get_point_store()
+        self.stdout.write(f'Removing duplicate readings ({store.layout} layout)...')
+
+        try:
+            removed, project_ids = store.remove_duplicates()
+            store.document.ensure_indexes()
+        except Exception as e:
+            raise CommandError(f'Error removing duplicates: {str(e)}')
+
+        self.stdout.write(f'  Removed {removed} duplicate(s) across {len(project_ids)} project(s)')
+
+        if project_ids and options['rebuild']:
+            try:
+                for summary in rebuild_aggregations(project_ids, workers=options['workers']):
+                    self.stdout.write(f"  {summary['project_id']}: rebuilt {summary['aggregations']} aggregations")
+            except Exception as e:
+                raise CommandError(f'Error rebuilding aggregations: {str(e)}')
+        elif project_ids:
+            self.stdout.write(
+                'Aggregations of affected projects still include duplicates; '
+                'run rebuild_aggregations for them or re-run with --rebuild'
+            )
+
+        self.stdout.write(self.style.SUCCESS('Dedup index is in place'))
@@ -0,0 +1,39 @@
+"""
+Move raw payloads stored inline on existing data points to the compressed payload store
+Usage: python manage.py offload_raw_payloads [--retention COMPRESSED|SAMPLED|NONE] [--batch-size 1000]
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.data_intake.models import RawPayloadRetentionChoices
+from apps.data_intake.payloads import get_retention, offload_inline_payloads
+
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Compress (or drop) raw_payload fields stored inline on data points'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention',
+            choices=[code for code, _ in RawPayloadRetentionChoices.CHOICES if code != RawPayloadRetentionChoices.INLINE],
+            help='Retention to apply (default DATA_INTAKE_RAW_PAYLOAD_RETENTION)'
+        )
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Data points per batch')
+
+    def handle(self, *args, **options):
+        retention = options['retention'] or get_retention()
+        if retention == RawPayloadRetentionChoices.INLINE:
+            raise CommandError('Retention is INLINE; pass --retention to offload payloads')
+
+        processed = 0
+        try:
+            for count in offload_inline_payloads(options['batch_size'], retention):
+                processed += count
+                self.stdout.write(f'  {processed} data points processed')
+        except Exception as e:
+            raise CommandError(f'Error offloading raw payloads: {str(e)}')
+
+        self.stdout.write(self.style.SUCCESS(f'Applied {retention} retention to {processed} data points'))
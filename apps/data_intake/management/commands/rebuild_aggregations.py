@@ -0,0 +1,68 @@
+"""
+Rebuild DataAggregation rollups from raw readings
+Usage: python manage.py rebuild_aggregations --project <id> [--project <id> ...] [--workers 4]
+       python manage.py rebuild_aggregations --all --workers 8
+       python manage.py rebuild_aggregations --dirty
+"""
+
+from datetime import datetime
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.data_intake.aggregation import DEFAULT_ROLLUP_PERIODS, clear_dirty, dirty_projects
+from apps.data_intake.backfill import DEFAULT_CHUNK_SIZE, rebuild_aggregations
+from apps.data_intake.models import DataSource, AggregationPeriodChoices
+
+
+class Command(BaseCommand):
+    help = 'Recompute DataAggregation buckets (incl. stddev and percentiles) from raw data points'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', action='append', default=[], help='Project id (repeatable)')
+        parser.add_argument('--all', action='store_true', help='Rebuild every project with data sources')
+        parser.add_argument(
+            '--dirty', action='store_true',
+            help='Rebuild projects whose rollups an ingest failed to update'
+        )
+        parser.add_argument(
+            '--period', action='append', default=[],
+            choices=[code for code, _ in AggregationPeriodChoices.CHOICES],
+            help='Period to rebuild (repeatable, default: all rollup periods)'
+        )
+        parser.add_argument('--workers', type=int, default=1, help='Parallel worker processes')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Readings per NumPy chunk')
+
+    def handle(self, *args, **options):
+        project_ids = options['project']
+        if options['all']:
+            project_ids = DataSource._get_collection().distinct('project')
+        elif options['dirty']:
+            project_ids = project_ids + dirty_projects()
+            if not project_ids:
+                self.stdout.write(self.style.SUCCESS('No dirty aggregations'))
+                return
+        if not project_ids:
+            raise CommandError('Pass --project <id>, --all or --dirty')
+
+        periods = options['period'] or DEFAULT_ROLLUP_PERIODS
+        self.stdout.write(f'Rebuilding aggregations for {len(project_ids)} project(s)...')
+
+        total_points = 0
+        started = datetime.utcnow()
+        try:
+            for summary in rebuild_aggregations(
+                project_ids, periods, options['chunk_size'], options['workers']
+            ):
+                total_points += summary['points']
+                # Failures marked after the rebuild started may not be covered by it
+                clear_dirty(ObjectId(summary['project_id']), periods, started)
+                self.stdout.write(
+                    f"  {summary['project_id']}: {summary['points']} points -> "
+                    f"{summary['aggregations']} aggregations ({summary['removed']} stale removed) "
+                    f"in {summary['seconds']}s"
+                )
+        except Exception as e:
+            raise CommandError(f'Error rebuilding aggregations: {str(e)}')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt aggregations from {total_points} data points'))
@@ -0,0 +1,40 @@
+"""
+Validate stored readings that the ingest-time validation stage has not covered
+Usage: python manage.py validate_data_points [--project <id> ...] [--revalidate] [--batch-size 20000]
+"""
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.data_intake.models import StorageLayoutChoices
+from apps.data_intake.storage import get_point_store
+from apps.data_intake.validation import DEFAULT_SWEEP_BATCH_SIZE, validate_pending
+
+
+class Command(BaseCommand):
+    help = 'Set validation_status on data points that have not been validated yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', action='append', default=[], help='Project id (repeatable)')
+        parser.add_argument(
+            '--revalidate', action='store_true',
+            help='Re-check readings that already have a status (e.g. after changing rules)'
+        )
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_SWEEP_BATCH_SIZE, help='Readings per batch')
+
+    def handle(self, *args, **options):
+        if get_point_store().layout != StorageLayoutChoices.DOCUMENTS:
+            raise CommandError('Validation status is only stored for the DOCUMENTS layout')
+
+        project_ids = [ObjectId(project_id) for project_id in options['project']]
+        totals = {}
+        try:
+            for counts in validate_pending(project_ids, options['revalidate'], batch_size=options['batch_size']):
+                for status, count in counts.items():
+                    totals[status] = totals.get(status, 0) + count
+                summary = ', '.join(f'{status}: {count}' for status, count in sorted(totals.items()))
+                self.stdout.write(f'  {sum(totals.values())} validated ({summary})')
+        except Exception as e:
+            raise CommandError(f'Error validating data points: {str(e)}')
+
+        self.stdout.write(self.style.SUCCESS(f'Validated {sum(totals.values())} data points'))
@@ -3,11 +3,14 @@ Data Intake app models - IoT, Satellite, Manual data ingestion
 """
 
 from mongoengine import (
-    Document, StringField, DecimalField, DateTimeField,
-    ReferenceField, DictField, BooleanField
+    Document, StringField, DateTimeField,
+    ReferenceField, DictField, BooleanField, ListField, FloatField, IntField, FileField,
+    ObjectIdField, BinaryField
 )
 from datetime import datetime
 
+from apps.api.references import reference_id
+
 
 class DataSourceTypeChoices:
     """Data source type constants"""
@@ -45,6 +48,112 @@ class MetricTypeChoices:
     ]
 
 
+class AggregationPeriodChoices:
+    """Aggregation period constants"""
+    HOURLY = 'HOURLY'
+    DAILY = 'DAILY'
+    WEEKLY = 'WEEKLY'
+    MONTHLY = 'MONTHLY'
+    
+    CHOICES = [
+        (HOURLY, 'Hourly'),
+        (DAILY, 'Daily'),
+        (WEEKLY, 'Weekly'),
+        (MONTHLY, 'Monthly'),
+    ]
+
+
+class ValidationStatusChoices:
+    """DataPoint validation status constants"""
+    PASS = 'PASS'
+    FAIL = 'FAIL'
+    REQUIRES_REVIEW = 'REQUIRES_REVIEW'
+    
+    CHOICES = [
+        (PASS, 'Pass'),
+        (FAIL, 'Fail'),
+        (REQUIRES_REVIEW, 'Requires Review'),
+    ]
+
+
+class StorageLayoutChoices:
+    """DataPoint storage layout constants"""
+    DOCUMENTS = 'DOCUMENTS'  # One document per reading in data_points
+    BUCKETS = 'BUCKETS'      # One document per source/metric/time bucket in data_point_buckets
+    
+    CHOICES = [
+        (DOCUMENTS, 'Document per reading'),
+        (BUCKETS, 'Time-bucketed'),
+    ]
+
+
+class UploadFormatChoices:
+    """Manual upload file format constants"""
+    CSV = 'CSV'
+    XLSX = 'XLSX'
+    
+    CHOICES = [
+        (CSV, 'CSV'),
+        (XLSX, 'Excel (XLSX)'),
+    ]
+
+
+class UploadStatusChoices:
+    """Manual upload status constants"""
+    QUEUED = 'QUEUED'
+    PROCESSING = 'PROCESSING'
+    COMPLETED = 'COMPLETED'
+    FAILED = 'FAILED'
+    
+    CHOICES = [
+        (QUEUED, 'Queued'),
+        (PROCESSING, 'Processing'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    ]
+
+
+class IngestBatchStatusChoices:
+    """Asynchronous ingest batch status constants"""
+    QUEUED = 'QUEUED'
+    PROCESSING = 'PROCESSING'
+    COMPLETED = 'COMPLETED'
+    FAILED = 'FAILED'
+    
+    CHOICES = [
+        (QUEUED, 'Queued'),
+        (PROCESSING, 'Processing'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    ]
+
+
+class ArchiveStatusChoices:
+    """DataPoint archive part status constants"""
+    ARCHIVED = 'ARCHIVED'  # File written and readable; hot rows may still be pending deletion
+    PURGED = 'PURGED'      # Archived rows deleted from data_points
+    
+    CHOICES = [
+        (ARCHIVED, 'Archived'),
+        (PURGED, 'Purged from hot storage'),
+    ]
+
+
+class RawPayloadRetentionChoices:
+    """What ingest keeps of each reading's original gateway message"""
+    NONE = 'NONE'              # Dropped
+    SAMPLED = 'SAMPLED'        # Compressed in data_point_payloads for a sampled fraction of readings
+    COMPRESSED = 'COMPRESSED'  # Compressed in data_point_payloads for every reading
+    INLINE = 'INLINE'          # Stored on the DataPoint document itself
+    
+    CHOICES = [
+        (NONE, 'Not retained'),
+        (SAMPLED, 'Sampled, compressed'),
+        (COMPRESSED, 'Compressed'),
+        (INLINE, 'Inline'),
+    ]
+
+
 class DataSource(Document):
     """Data source configuration"""
     
@@ -54,6 +163,8 @@ class DataSource(Document):
             'project',
             'type',
             'created_at',
+            # Staleness scans: active sources ordered by last reading
+            {'fields': ['is_active', 'last_data_received']},
         ],
     }
     
@@ -71,7 +182,7 @@ class DataSource(Document):
     
     # Status & tracking
     is_active = BooleanField(default=True)
-    last_data_received = DateTimeField()
+    last_data_received = DateTimeField()  # Maintained write-behind by apps.data_intake.activity
     
     created_at = DateTimeField(default=datetime.utcnow)
     updated_at = DateTimeField(default=datetime.utcnow)
@@ -86,11 +197,16 @@ class DataPoint(Document):
     meta = {
         'collection': 'data_points',
         'indexes': [
-            {'fields': ['data_source', 'timestamp']},
-            'project',
+            # Dedup key: a retried reading is rejected by the index instead of stored twice
+            {'fields': ['data_source', 'metric_type', 'timestamp'], 'unique': True},
+            # Keyset pagination: (timestamp, _id) behind each equality filter
+            {'fields': ['project', 'timestamp', 'id']},
+            {'fields': ['data_source', 'timestamp', 'id']},
+            {'fields': ['timestamp', 'id']},
             'metric_type',
-            'timestamp',
             'created_at',
+            # Backlog of readings still waiting for the validation stage
+            {'fields': ['is_validated', 'created_at'], 'partialFilterExpression': {'is_validated': False}},
         ],
     }
     
@@ -103,54 +219,336 @@ class DataPoint(Document):
     )
     
     # Data
-    value = DecimalField(required=True)
+    value = FloatField(required=True)  # Stored as a native double
     unit = StringField(required=True)  # e.g., 'ppm', 'kWh', 'tons', '%'
     
     # Raw data
-    raw_payload = DictField()  # Original data from source
+    raw_payload = DictField()  # Original data from source when kept INLINE; see DataPointPayload
     
     # Quality & validation
     is_validated = BooleanField(default=False)
-    validation_status = StringField()  # PASS, FAIL, REQUIRES_REVIEW
+    validation_status = StringField(choices=ValidationStatusChoices.CHOICES)
     validation_notes = StringField()
     
     # Timestamps
     timestamp = DateTimeField(required=True)  # When data was collected
     created_at = DateTimeField(default=datetime.utcnow)
     
+    @property
+    def data_source_id(self):
+        return reference_id(self._data.get('data_source'))
+    
+    @property
+    def project_id(self):
+        return reference_id(self._data.get('project'))
+    
     def __str__(self):
         return f"{self.project.name} - {self.metric_type}: {self.value} {self.unit}"
 
 
+class DataPointPayload(Document):
+    """
+    Compressed original gateway message of a reading, keyed by the DataPoint id.
+    Bucketed readings have no DataPoint; theirs are found by source, metric and timestamp.
+    """
+    
+    meta = {
+        'collection': 'data_point_payloads',
+        'indexes': [
+            {'fields': ['data_source', 'metric_type', 'timestamp']},
+        ],
+    }
+    
+    id = ObjectIdField(primary_key=True)  # Same _id as the DataPoint
+    data_source = ReferenceField(DataSource)
+    metric_type = StringField()
+    timestamp = DateTimeField()
+    codec = StringField(required=True)  # zstd or zlib
+    size = IntField()  # Uncompressed BSON bytes
+    data = BinaryField(required=True)
+    created_at = DateTimeField(default=datetime.utcnow)
+    
+    def __str__(self):
+        return f"payload {self.id} ({len(self.data)}/{self.size} bytes, {self.codec})"
+
+
+class DataPointBucket(Document):
+    """
+    Time bucket of readings for one source and metric (bucketed storage layout).
+    Timestamps and values are parallel arrays in arrival order. A bucket holds
+    at most DATA_INTAKE_BUCKET_MAX_READINGS readings; once full it is sealed
+    and the time bucket continues in an overflow bucket with the next seq.
+    """
+    
+    meta = {
+        'collection': 'data_point_buckets',
+        'indexes': [
+            {'fields': ['data_source', 'metric_type', 'bucket_start', 'seq'], 'unique': True},
+            {'fields': ['project', 'metric_type', 'bucket_start']},
+        ],
+    }
+    
+    data_source = ReferenceField(DataSource, required=True)
+    project = ReferenceField('apps.projects.Project', required=True)
+    metric_type = StringField(
+        choices=MetricTypeChoices.CHOICES,
+        required=True
+    )
+    unit = StringField()
+    
+    bucket_start = DateTimeField(required=True)
+    seq = IntField(default=0)  # 0, then one more per overflow bucket of the same time bucket
+    sealed = BooleanField(default=False)  # Full; no more readings are appended
+    floor = DateTimeField()  # Latest timestamp held by the sealed buckets before this one
+    
+    # Readings
+    timestamps = ListField(DateTimeField())
+    values = ListField(FloatField())
+    count = IntField(default=0)
+    min_value = FloatField()
+    max_value = FloatField()
+    
+    created_at = DateTimeField(default=datetime.utcnow)
+    updated_at = DateTimeField(default=datetime.utcnow)
+    
+    def __str__(self):
+        return f"{self.metric_type} bucket {self.bucket_start} ({self.count} readings)"
+
+
+class AnomalyDetectorState(Document):
+    """
+    Online anomaly detector state of one (data_source, metric_type) series,
+    updated with every stored batch (see apps.data_intake.anomalies)
+    """
+    
+    meta = {
+        'collection': 'anomaly_detector_states',
+        'indexes': [
+            {'fields': ['data_source', 'metric_type'], 'unique': True},
+        ],
+    }
+    
+    data_source = ReferenceField(DataSource, required=True)
+    project = ReferenceField('apps.projects.Project', required=True)
+    metric_type = StringField(choices=MetricTypeChoices.CHOICES, required=True)
+    
+    # EWMA baseline: value ~ mean + seasonal[hour of day], residual variance var
+    count = IntField(default=0)
+    mean = FloatField(default=0.0)
+    var = FloatField(default=0.0)
+    seasonal = ListField(FloatField())
+    # Two-sided CUSUM of standardised residuals, for drift
+    cusum_pos = FloatField(default=0.0)
+    cusum_neg = FloatField(default=0.0)
+    alarm = StringField()  # SPIKE or DROP while an excursion is ongoing
+    last_timestamp = DateTimeField()
+    
+    version = IntField(default=0)  # Optimistic concurrency between writers
+    updated_at = DateTimeField(default=datetime.utcnow)
+    
+    def __str__(self):
+        return f"{self.metric_type} detector ({self.count} readings)"
+
+
 class DataAggregation(Document):
-    """Aggregated data for reporting"""
+    """
+    Aggregated data for reporting - one document per source, metric and period.
+    Maintained incrementally on ingest; avg_value is derived from sum_value / count.
+    """
     
     meta = {
         'collection': 'data_aggregations',
         'indexes': [
-            'project',
-            'metric_type',
-            'period',
+            {
+                'fields': ['project', 'metric_type', 'period', 'period_start', 'data_source'],
+                'unique': True,
+            },
+            {'fields': ['data_source', 'metric_type', 'period', 'period_start']},
         ],
     }
     
     project = ReferenceField('apps.projects.Project', required=True)
+    data_source = ReferenceField(DataSource)
     metric_type = StringField(required=True)
     
-    period = StringField(required=True)  # DAILY, WEEKLY, MONTHLY
+    period = StringField(choices=AggregationPeriodChoices.CHOICES, required=True)  # HOURLY, DAILY, WEEKLY, MONTHLY
     period_start = DateTimeField(required=True)
-    period_end = DateTimeField(required=True)
+    period_end = DateTimeField(required=True)  # Exclusive
     
     # Aggregated values
-    count = StringField()
-    sum_value = DecimalField()
-    avg_value = DecimalField()
-    min_value = DecimalField()
-    max_value = DecimalField()
+    count = IntField(default=0)
+    sum_value = FloatField()
+    avg_value = FloatField()
+    min_value = FloatField()
+    max_value = FloatField()
+    
+    # Dispersion - recomputed by full rebuilds, not by incremental rollups
+    stddev_value = FloatField()
+    percentiles = DictField()  # e.g. {'p5': ..., 'p50': ..., 'p95': ...}
     
     unit = StringField()
     
     created_at = DateTimeField(default=datetime.utcnow)
+    updated_at = DateTimeField(default=datetime.utcnow)
+    
+    @property
+    def data_source_id(self):
+        return reference_id(self._data.get('data_source'))
+    
+    @property
+    def project_id(self):
+        return reference_id(self._data.get('project'))
     
     def __str__(self):
         return f"{self.project.name} - {self.metric_type} ({self.period})"
+
+
+class DirtyAggregation(Document):
+    """
+    DataAggregation bucket an ingest stored readings for but failed to update.
+    rebuild_aggregations --dirty recomputes the projects these name.
+    """
+    
+    meta = {
+        'collection': 'data_aggregation_dirty',
+        'indexes': [
+            {'fields': ['project', 'data_source', 'metric_type', 'period', 'period_start'], 'unique': True},
+        ],
+    }
+    
+    project = ReferenceField('apps.projects.Project', required=True)
+    data_source = ReferenceField(DataSource)
+    metric_type = StringField(required=True)
+    period = StringField(choices=AggregationPeriodChoices.CHOICES, required=True)
+    period_start = DateTimeField(required=True)
+    error = StringField()
+    marked_at = DateTimeField(default=datetime.utcnow)  # Last failure; rebuilds started later clear it
+    
+    def __str__(self):
+        return f"Dirty {self.metric_type} {self.period} rollup from {self.period_start}"
+
+
+class ManualUpload(Document):
+    """Spreadsheet of readings uploaded for a MANUAL data source, with its per-row error report"""
+    
+    meta = {
+        'collection': 'manual_uploads',
+        'indexes': [
+            {'fields': ['data_source', '-created_at']},
+        ],
+    }
+    
+    data_source = ReferenceField(DataSource, required=True)
+    project = ReferenceField('apps.projects.Project', required=True)
+    uploaded_by_email = StringField()
+    
+    filename = StringField()
+    format = StringField(choices=UploadFormatChoices.CHOICES, required=True)
+    column_mapping = DictField()
+    source_file = FileField(collection_name='manual_upload_files')  # Queued spreadsheet; removed once processed
+    
+    status = StringField(choices=UploadStatusChoices.CHOICES, default=UploadStatusChoices.PROCESSING)
+    rows = IntField(default=0)
+    inserted = IntField(default=0)
+    duplicates = IntField(default=0)
+    failed = IntField(default=0)
+    error = StringField()  # Why the whole upload failed, if it did
+    error_report = FileField(collection_name='manual_upload_reports')  # CSV of rejected rows
+    
+    created_at = DateTimeField(default=datetime.utcnow)
+    completed_at = DateTimeField()
+    
+    def __str__(self):
+        return f"{self.filename} ({self.status}: {self.inserted}/{self.rows})"
+
+
+class IngestBatch(Document):
+    """
+    Readings accepted by the API and queued for Celery workers to store.
+    Progress counters are folded in once per chunk; see apps.data_intake.async_ingest.
+    """
+    
+    meta = {
+        'collection': 'ingest_batches',
+        'indexes': [
+            # Status records are only useful while clients poll them
+            {'fields': ['created_at'], 'expireAfterSeconds': 7 * 24 * 3600},
+        ],
+    }
+    
+    kind = StringField(required=True)  # BULK or STREAM
+    status = StringField(choices=IngestBatchStatusChoices.CHOICES, default=IngestBatchStatusChoices.QUEUED)
+    
+    received = IntField(default=0)  # Rows in the request, including rejected ones
+    queued = IntField(default=0)  # Valid rows handed to workers
+    inserted = IntField(default=0)
+    duplicates = IntField(default=0)
+    failed = IntField(default=0)
+    errors = ListField(DictField())  # First rejected rows: {'index': ..., 'error': ...}
+    
+    chunks = IntField(default=0)
+    done_chunks = ListField(IntField())  # Chunk numbers already folded into the counters
+    failed_chunks = IntField(default=0)
+    sealed = BooleanField(default=False)  # No more chunks will be added
+    error = StringField()
+    
+    created_at = DateTimeField(default=datetime.utcnow)
+    started_at = DateTimeField()
+    completed_at = DateTimeField()
+    
+    def __str__(self):
+        return f"{self.kind} batch {self.pk} ({self.status}: {self.inserted}/{self.received})"
+
+
+class IngestBatchChunk(Document):
+    """Prepared data_points documents of one queued chunk, removed once stored"""
+    
+    meta = {
+        'collection': 'ingest_batch_chunks',
+        'indexes': [
+            {'fields': ['batch', 'seq'], 'unique': True},
+            {'fields': ['created_at'], 'expireAfterSeconds': 7 * 24 * 3600},
+            {'fields': ['queued_at']},
+        ],
+    }
+    
+    batch = ObjectIdField(required=True)
+    seq = IntField(required=True)
+    points = ListField(DictField())  # As produced by ingestion.prepare_points
+    rows = ListField(IntField())  # Request row index of each point
+    created_at = DateTimeField(default=datetime.utcnow)
+    queued_at = DateTimeField()  # Last time its task was sent; see async_ingest.requeue_stale_chunks
+
+
+class DataPointArchive(Document):
+    """
+    Manifest of one columnar archive file holding a project's readings for a
+    closed month. A month archived more than once (late arrivals) has several parts.
+    """
+    
+    meta = {
+        'collection': 'data_point_archives',
+        'indexes': [
+            {'fields': ['project', 'period_start', 'part'], 'unique': True},
+            {'fields': ['series.data_source', 'series.metric_type', 'period_start']},
+        ],
+    }
+    
+    project = ReferenceField('apps.projects.Project', required=True)
+    period_start = DateTimeField(required=True)
+    period_end = DateTimeField(required=True)  # Exclusive
+    part = IntField(default=0)
+    
+    uri = StringField(required=True)  # file:// or gs:// location of the .npz
+    rows = IntField(default=0)
+    size_bytes = IntField(default=0)
+    sha256 = StringField()
+    # One entry per (data_source, metric_type): {'data_source', 'metric_type', 'unit', 'key', 'rows'}
+    series = ListField(DictField())
+    
+    status = StringField(choices=ArchiveStatusChoices.CHOICES, default=ArchiveStatusChoices.ARCHIVED)
+    created_at = DateTimeField(default=datetime.utcnow)
+    purged_at = DateTimeField()
+    
+    def __str__(self):
+        return f"{self.period_start:%Y-%m} part {self.part} ({self.rows} rows, {self.status})"
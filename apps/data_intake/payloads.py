@@ -0,0 +1,227 @@
+"""
+Data Intake raw payloads - retention of each reading's original gateway message
+
+Keeping the whole message inline on every DataPoint roughly triples document
+size and working set for a field that is almost never read.
+DATA_INTAKE_RAW_PAYLOAD_RETENTION picks what ingest keeps:
+
+    NONE        payloads are dropped
+    SAMPLED     a deterministic DATA_INTAKE_RAW_PAYLOAD_SAMPLE_RATE fraction is kept compressed
+    COMPRESSED  every payload is kept compressed
+    INLINE      payloads stay on the DataPoint (previous behaviour; COMPRESSED
+                under the BUCKETS layout, which has no per-reading document)
+
+Compressed payloads are BSON-encoded, zstd-compressed (zlib when zstandard is
+not installed; the codec is stored per payload) and written to
+data_point_payloads under the DataPoint's _id. They are only loaded when a
+detail view or an audit export asks for them.
+"""
+
+import logging
+import threading
+import zlib
+
+import bson
+from django.conf import settings
+from pymongo.errors import BulkWriteError
+
+from apps.data_intake.models import DataPoint, DataPointPayload, RawPayloadRetentionChoices
+
+try:
+    import zstandard
+except ImportError:  # Payloads fall back to zlib
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_RETENTION = RawPayloadRetentionChoices.COMPRESSED
+DEFAULT_SAMPLE_RATE = 0.01
+DEFAULT_LOAD_BATCH_SIZE = 1000
+
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
+DUPLICATE_KEY_ERROR = 11000
+
+
+def get_retention():
+    """Raw payload retention mode (RawPayloadRetentionChoices)"""
+    return getattr(settings, 'DATA_INTAKE_RAW_PAYLOAD_RETENTION', DEFAULT_RETENTION)
+
+
+def get_sample_rate():
+    """Fraction of readings whose payload is kept under SAMPLED retention"""
+    return getattr(settings, 'DATA_INTAKE_RAW_PAYLOAD_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+
+
+_codecs = threading.local()
+
+
+def compress_payload(payload):
+    """(codec, compressed bytes, uncompressed size) for a payload dict"""
+    raw = bson.encode(payload)
+    if zstandard is not None:
+        # Compressor contexts are not thread safe; keep one per thread
+        compressor = getattr(_codecs, 'compressor', None)
+        if compressor is None:
+            compressor = _codecs.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        return 'zstd', compressor.compress(raw), len(raw)
+    return 'zlib', zlib.compress(raw, ZLIB_LEVEL), len(raw)
+
+
+def decompress_payload(codec, data):
+    """Payload dict from compressed bytes"""
+    data = bytes(data)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstandard is required to read zstd-compressed payloads')
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    elif codec == 'zlib':
+        raw = zlib.decompress(data)
+    else:
+        raise ValueError(f'Unknown payload codec: {codec!r}')
+    return bson.decode(raw)
+
+
+def is_sampled(point_id, rate):
+    """Deterministic per-reading sampling decision, stable across retries and processes"""
+    return zlib.crc32(point_id.binary) < rate * 0x100000000
+
+
+def detach_raw_payloads(docs, retention=None, sample_rate=None):
+    """
+    Apply the retention mode to prepared documents before they are written.
+    Payloads are popped from the documents unless INLINE; returns
+    {point id: payload} of those to store compressed once the points are in.
+    """
+    retention = retention or get_retention()
+    if retention == RawPayloadRetentionChoices.INLINE:
+        return {}
+    sample_rate = get_sample_rate() if sample_rate is None else sample_rate
+
+    pending = {}
+    for doc in docs:
+        payload = doc.pop('raw_payload', None)
+        if not payload or retention == RawPayloadRetentionChoices.NONE:
+            continue
+        if retention == RawPayloadRetentionChoices.SAMPLED and not is_sampled(doc['_id'], sample_rate):
+            continue
+        pending[doc['_id']] = payload
+    return pending
+
+
+def store_raw_payloads(docs, pending, strict=False):
+    """
+    Compress and insert the pending payloads of stored documents. A payload
+    already stored by a retried write is left alone; other failures are
+    logged, or raised when strict. Returns payloads written.
+    """
+    operations = []
+    for doc in docs:
+        payload = pending.get(doc['_id'])
+        if payload is None:
+            continue
+        codec, data, size = compress_payload(payload)
+        operations.append({
+            '_id': doc['_id'],
+            'data_source': doc['data_source'],
+            'metric_type': doc.get('metric_type'),
+            'timestamp': doc.get('timestamp'),
+            'codec': codec,
+            'size': size,
+            'data': bson.Binary(data),
+            'created_at': doc.get('created_at'),
+        })
+    if not operations:
+        return 0
+
+    try:
+        return len(DataPointPayload._get_collection().insert_many(operations, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        unexpected = [error for error in errors if error.get('code') != DUPLICATE_KEY_ERROR]
+        if unexpected and strict:
+            raise
+        if unexpected:
+            # The readings are stored; only their raw payloads are lost
+            logger.error(f"Failed to store {len(unexpected)} raw payloads: {unexpected[0].get('errmsg')}")
+        return e.details.get('nInserted', 0)
+
+
+def load_raw_payloads(point_ids, batch_size=DEFAULT_LOAD_BATCH_SIZE):
+    """{point id: payload dict} of the offloaded payloads stored for point_ids"""
+    point_ids = list(point_ids)
+    collection = DataPointPayload._get_collection()
+    payloads = {}
+    for i in range(0, len(point_ids), batch_size):
+        for row in collection.find({'_id': {'$in': point_ids[i:i + batch_size]}}):
+            payloads[row['_id']] = decompress_payload(row['codec'], row['data'])
+    return payloads
+
+
+def attach_raw_payloads(docs):
+    """Fill raw_payload on raw data_points documents that do not carry it inline"""
+    missing = [doc['_id'] for doc in docs if not doc.get('raw_payload')]
+    if not missing:
+        return docs
+    payloads = load_raw_payloads(missing)
+    for doc in docs:
+        if doc['_id'] in payloads:
+            doc['raw_payload'] = payloads[doc['_id']]
+    return docs
+
+
+def load_raw_payload(point):
+    """
+    Original payload of a DataPoint: inline if present, else from
+    data_point_payloads (by source, metric and timestamp for bucketed readings,
+    which have no id)
+    """
+    if point.raw_payload:
+        return point.raw_payload
+    if point.pk is None:
+        row = DataPointPayload._get_collection().find_one({
+            'data_source': point.data_source_id,
+            'metric_type': point.metric_type,
+            'timestamp': point.timestamp,
+        })
+        return decompress_payload(row['codec'], row['data']) if row else {}
+    return load_raw_payloads([point.pk]).get(point.pk, {})
+
+
+def delete_raw_payloads(point_ids, batch_size=DEFAULT_LOAD_BATCH_SIZE * 10):
+    """Remove offloaded payloads of deleted readings. Returns payloads deleted."""
+    point_ids = list(point_ids)
+    collection = DataPointPayload._get_collection()
+    deleted = 0
+    for i in range(0, len(point_ids), batch_size):
+        deleted += collection.delete_many({'_id': {'$in': point_ids[i:i + batch_size]}}).deleted_count
+    return deleted
+
+
+def offload_inline_payloads(batch_size=DEFAULT_LOAD_BATCH_SIZE, retention=None, sample_rate=None):
+    """
+    Move payloads stored inline on existing data_points into
+    data_point_payloads (or drop them) under the configured retention.
+    Yields the number of documents processed per batch.
+    """
+    retention = retention or get_retention()
+    if retention == RawPayloadRetentionChoices.INLINE:
+        return
+    points = DataPoint._get_collection()
+    projection = {'data_source': 1, 'metric_type': 1, 'timestamp': 1, 'raw_payload': 1, 'created_at': 1}
+    last_id = None
+    while True:
+        # Walk _id order so each batch resumes where the last one stopped
+        query = {'raw_payload': {'$exists': True}}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        docs = list(points.find(query, projection).sort('_id', 1).limit(batch_size))
+        if not docs:
+            return
+        ids = [doc['_id'] for doc in docs]
+        last_id = ids[-1]
+        store_raw_payloads(docs, detach_raw_payloads(docs, retention, sample_rate), strict=True)
+        # Unset only after the payloads are safely stored
+        points.update_many({'_id': {'$in': ids}}, {'$unset': {'raw_payload': ''}})
+        yield len(docs)
@@ -0,0 +1,239 @@
+"""
+Data Intake ingest quotas - token-bucket rate limits per data source and project
+
+Each data source and each project has a bucket of `burst` readings that
+refills at `rate` readings per second. Limits come from
+metadata['ingest_quota'] = {'rate': ..., 'burst': ...} on the DataSource or
+Project, falling back to the DATA_INTAKE_*_QUOTA_* settings; a rate of 0
+means unlimited. Both scopes are unlimited by default, so operators opt in
+per source or project through metadata, or fleet-wide through settings.
+
+A batch is charged against every bucket it touches in one atomic step and
+is admitted only if all of them can pay, so a throttled request never
+spends another scope's tokens. A batch larger than a bucket's burst is
+admitted when that bucket is full and leaves it in debt, so oversized
+batches are delayed instead of rejected forever.
+
+Buckets live in Redis (DATA_INTAKE_QUOTA_REDIS_URL) so every worker shares
+them; without it each process keeps its own in-memory buckets.
+"""
+
+import math
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from apps.data_intake.models import DataSource
+from apps.projects.models import Project
+
+
+DEFAULT_SOURCE_RATE = 0.0
+DEFAULT_SOURCE_BURST = 50000
+DEFAULT_PROJECT_RATE = 0.0
+DEFAULT_PROJECT_BURST = 500000
+DEFAULT_CONFIG_TTL_SECONDS = 60
+
+QUOTA_KEY_PREFIX = 'ingest_quota'
+
+
+def get_redis_url():
+    """Redis URL of the shared bucket store; empty keeps buckets in process"""
+    return getattr(settings, 'DATA_INTAKE_QUOTA_REDIS_URL', '')
+
+
+def get_default_quota(scope):
+    """(rate, burst) applied to a 'source' or 'project' without its own ingest_quota"""
+    if scope == 'project':
+        return (
+            getattr(settings, 'DATA_INTAKE_PROJECT_QUOTA_RATE', DEFAULT_PROJECT_RATE),
+            getattr(settings, 'DATA_INTAKE_PROJECT_QUOTA_BURST', DEFAULT_PROJECT_BURST),
+        )
+    return (
+        getattr(settings, 'DATA_INTAKE_SOURCE_QUOTA_RATE', DEFAULT_SOURCE_RATE),
+        getattr(settings, 'DATA_INTAKE_SOURCE_QUOTA_BURST', DEFAULT_SOURCE_BURST),
+    )
+
+
+class QuotaExceeded(Exception):
+    """Batch refused by an ingest quota; retry_after is in seconds"""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f'Ingest quota exceeded; retry after {retry_after} seconds')
+
+    @property
+    def retry_after_seconds(self):
+        """Whole seconds for a Retry-After header"""
+        return max(1, math.ceil(self.retry_after))
+
+
+def quota_from_metadata(metadata, scope):
+    """(rate, burst) from a document's metadata, else the scope default"""
+    default_rate, default_burst = get_default_quota(scope)
+    quota = (metadata or {}).get('ingest_quota')
+    if not isinstance(quota, dict):
+        return default_rate, default_burst
+    try:
+        rate = float(quota.get('rate', default_rate))
+        burst = int(quota.get('burst', default_burst))
+    except (TypeError, ValueError):
+        return default_rate, default_burst
+    return rate, burst
+
+
+class MemoryQuotaStore:
+    """Token buckets in process memory"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, charges):
+        """
+        Charge [(key, cost, rate, burst)] atomically. Returns 0 when admitted,
+        otherwise the seconds until every bucket could pay.
+        """
+        with self._lock:
+            now = self.clock()
+            wait, balances = 0.0, []
+            for key, cost, rate, burst in charges:
+                tokens, updated = self._buckets.get(key, (burst, now))
+                tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+                need = min(cost, burst)
+                if tokens < need:
+                    wait = max(wait, (need - tokens) / rate)
+                balances.append(tokens)
+            if wait > 0:
+                return wait
+            for (key, cost, rate, burst), tokens in zip(charges, balances):
+                self._buckets[key] = (tokens - cost, now)
+            return 0.0
+
+
+# KEYS: bucket keys; ARGV: cost, rate, burst per key. Uses the server clock so
+# workers with skewed clocks share one timeline.
+TAKE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local wait = 0
+local balances = {}
+for i, key in ipairs(KEYS) do
+    local cost = tonumber(ARGV[i * 3 - 2])
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local burst = tonumber(ARGV[i * 3])
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or burst
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    local need = math.min(cost, burst)
+    if tokens < need then
+        wait = math.max(wait, (need - tokens) / rate)
+    end
+    balances[i] = tokens
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local cost = tonumber(ARGV[i * 3 - 2])
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local burst = tonumber(ARGV[i * 3])
+    redis.call('HSET', key, 'tokens', tostring(balances[i] - cost), 'updated', tostring(now))
+    -- A bucket idle long enough to refill completely is the same as no bucket
+    redis.call('EXPIRE', key, math.ceil((burst + math.max(0, cost - balances[i])) / rate) + 1)
+end
+return '0'
+"""
+
+
+class RedisQuotaStore:
+    """Token buckets shared by every worker through Redis"""
+
+    def __init__(self, url):
+        # redis is only needed when quotas are shared
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(TAKE_SCRIPT)
+
+    def take(self, charges):
+        keys, args = [], []
+        for key, cost, rate, burst in charges:
+            keys.append(f'{QUOTA_KEY_PREFIX}:{key}')
+            args.extend((cost, rate, burst))
+        return float(self.script(keys=keys, args=args))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_quota_store():
+    """Process-wide quota store (Redis when configured)"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            url = get_redis_url()
+            _store = RedisQuotaStore(url) if url else MemoryQuotaStore()
+    return _store
+
+
+class QuotaConfigCache:
+    """Per-process cache of (rate, burst) by document id, refreshed every ttl seconds"""
+
+    def __init__(self, document, scope, ttl=DEFAULT_CONFIG_TTL_SECONDS, clock=time.monotonic):
+        self.document = document
+        self.scope = scope
+        self.ttl = ttl
+        self.clock = clock
+        self._quotas = {}
+        self._lock = threading.Lock()
+
+    def get(self, ids):
+        """{id: (rate, burst)} for ids, loading expired or unknown ones in one query"""
+        now = self.clock()
+        with self._lock:
+            quotas = {i: self._quotas[i] for i in ids if i in self._quotas and self._quotas[i][1] > now}
+        missing = [i for i in ids if i not in quotas]
+        if missing:
+            rows = self.document._get_collection().find(
+                {'_id': {'$in': missing}}, {'metadata.ingest_quota': 1}
+            )
+            loaded = {row['_id']: quota_from_metadata(row.get('metadata'), self.scope) for row in rows}
+            for i in missing:
+                quotas[i] = (loaded.get(i, get_default_quota(self.scope)), now + self.ttl)
+            with self._lock:
+                self._quotas.update({i: quotas[i] for i in missing})
+        return {i: quota for i, (quota, _) in quotas.items()}
+
+
+_source_quotas = QuotaConfigCache(DataSource, 'source')
+_project_quotas = QuotaConfigCache(Project, 'project')
+
+
+def batch_charges(docs):
+    """[(key, cost, rate, burst)] for prepared documents; unlimited scopes are left out"""
+    sources = Counter(doc['data_source'] for doc in docs)
+    projects = Counter(doc['project'] for doc in docs)
+    charges = []
+    for scope, counts, cache in (('source', sources, _source_quotas), ('project', projects, _project_quotas)):
+        if not counts:
+            continue
+        quotas = cache.get(list(counts))
+        for object_id, cost in counts.items():
+            rate, burst = quotas[object_id]
+            if rate > 0:
+                charges.append((f'{scope}:{object_id}', cost, rate, max(1, burst)))
+    return charges
+
+
+def charge_quotas(docs, store=None):
+    """Spend quota for a batch of prepared documents, or raise QuotaExceeded"""
+    charges = batch_charges(docs)
+    if not charges:
+        return
+    wait = (store or get_quota_store()).take(charges)
+    if wait > 0:
+        raise QuotaExceeded(wait)
@@ -0,0 +1,296 @@
+"""
+Data Intake resampling - irregular readings aligned to a regular time grid
+
+A grid is `step` wide cells from start to end. Readings of each series are
+folded into cells in one streaming pass (count/sum/min/max/last per cell),
+reading fully covered DataAggregation rollups instead of raw points when the
+step is exactly one hourly or daily period. Cells with no reading are gaps;
+gaps of up to max_gap cells are filled by interpolation (LINEAR between the
+neighbouring observed cells, PREVIOUS carries the last observed cell
+forward), longer ones are left empty. Every cell is flagged as observed,
+filled or missing so MRV calculations can tell measured data from estimates.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+
+from apps.api.references import reference_id
+from apps.data_intake.aggregation import get_rollup_periods
+from apps.data_intake.models import DataAggregation, AggregationPeriodChoices
+from apps.data_intake.storage import get_point_store, to_epoch_ms, from_epoch_ms
+
+
+class InterpolationChoices:
+    """Gap filling method constants"""
+    LINEAR = 'LINEAR'
+    PREVIOUS = 'PREVIOUS'
+    NONE = 'NONE'
+
+    CHOICES = [
+        (LINEAR, 'Linear between neighbouring cells'),
+        (PREVIOUS, 'Carry previous cell forward'),
+        (NONE, 'Leave gaps empty'),
+    ]
+
+
+class ResampleAggregateChoices:
+    """How readings within one grid cell are combined"""
+    MEAN = 'MEAN'
+    SUM = 'SUM'
+    MIN = 'MIN'
+    MAX = 'MAX'
+    LAST = 'LAST'
+
+    CHOICES = [
+        (MEAN, 'Mean'),
+        (SUM, 'Sum'),
+        (MIN, 'Minimum'),
+        (MAX, 'Maximum'),
+        (LAST, 'Last reading'),
+    ]
+
+
+class CellStatus:
+    """Per-cell flags of a resampled series"""
+    OBSERVED = 0
+    FILLED = 1
+    MISSING = 2
+
+    LABELS = ['OBSERVED', 'FILLED', 'MISSING']
+
+
+MAX_GRID_CELLS = 200000
+
+# Rollup periods of fixed width that can stand in for a grid cell
+FIXED_PERIODS = [
+    (AggregationPeriodChoices.HOURLY, timedelta(hours=1)),
+    (AggregationPeriodChoices.DAILY, timedelta(days=1)),
+]
+
+
+class GridAccumulator:
+    """Streaming count/sum/min/max/last per grid cell for one series"""
+
+    def __init__(self, start_ms, step_ms, cells):
+        self.start_ms = start_ms
+        self.step_ms = step_ms
+        self.cells = cells
+        self.count = np.zeros(cells, dtype=np.int64)
+        self.sum = np.zeros(cells)
+        self.min = np.full(cells, np.inf)
+        self.max = np.full(cells, -np.inf)
+        self.last = np.full(cells, np.nan)
+        self.last_t = np.full(cells, np.iinfo(np.int64).min, dtype=np.int64)
+
+    def _cells(self, timestamps_ms):
+        idx = (timestamps_ms - self.start_ms) // self.step_ms
+        inside = (idx >= 0) & (idx < self.cells)
+        return idx[inside], inside
+
+    def add(self, timestamps_ms, values):
+        """Fold a chunk of raw readings into their cells"""
+        if not len(timestamps_ms):
+            return
+        idx, inside = self._cells(timestamps_ms)
+        t, v = timestamps_ms[inside], values[inside]
+        self.count += np.bincount(idx, minlength=self.cells)
+        self.sum += np.bincount(idx, weights=v, minlength=self.cells)
+        np.minimum.at(self.min, idx, v)
+        np.maximum.at(self.max, idx, v)
+        self._update_last(idx, t, v)
+
+    def add_rollups(self, starts_ms, counts, sums, minima, maxima):
+        """Fold DataAggregation rows whose period is exactly one cell"""
+        if not len(starts_ms):
+            return
+        idx, inside = self._cells(starts_ms)
+        self.count[idx] += counts[inside]
+        self.sum[idx] += sums[inside]
+        self.min[idx] = np.minimum(self.min[idx], minima[inside])
+        self.max[idx] = np.maximum(self.max[idx], maxima[inside])
+
+    def _update_last(self, idx, t, v):
+        np.maximum.at(self.last_t, idx, t)
+        latest = t == self.last_t[idx]
+        self.last[idx[latest]] = v[latest]
+
+    def values(self, aggregate):
+        """Per-cell value (NaN where the cell is empty)"""
+        observed = self.count > 0
+        out = np.full(self.cells, np.nan)
+        if aggregate == ResampleAggregateChoices.SUM:
+            out[observed] = self.sum[observed]
+        elif aggregate == ResampleAggregateChoices.MIN:
+            out[observed] = self.min[observed]
+        elif aggregate == ResampleAggregateChoices.MAX:
+            out[observed] = self.max[observed]
+        elif aggregate == ResampleAggregateChoices.LAST:
+            out[observed] = self.last[observed]
+        else:
+            out[observed] = self.sum[observed] / self.count[observed]
+        return out
+
+
+def gap_runs(missing):
+    """[(first, last_exclusive)] index runs where missing is True"""
+    edges = np.diff(np.concatenate(([0], missing.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def fill_gaps(values, interpolation=InterpolationChoices.LINEAR, max_gap=None):
+    """
+    Fill NaN cells of a gridded series. Returns (filled values, status flags).
+    Only gaps of at most max_gap cells (any length when None) are filled;
+    LINEAR needs an observed cell on both sides, PREVIOUS one before.
+    """
+    values = np.array(values, dtype=np.float64)
+    missing = np.isnan(values)
+    status = np.where(missing, CellStatus.MISSING, CellStatus.OBSERVED).astype(np.int8)
+    if interpolation == InterpolationChoices.NONE or not missing.any() or missing.all():
+        return values, status
+
+    fillable = np.zeros(len(values), dtype=bool)
+    for first, last in gap_runs(missing):
+        if max_gap is not None and last - first > max_gap:
+            continue
+        if first == 0:
+            continue
+        if interpolation == InterpolationChoices.LINEAR and last == len(values):
+            continue
+        fillable[first:last] = True
+    if not fillable.any():
+        return values, status
+
+    observed = np.flatnonzero(~missing)
+    targets = np.flatnonzero(fillable)
+    if interpolation == InterpolationChoices.PREVIOUS:
+        previous = observed[np.searchsorted(observed, targets) - 1]
+        values[targets] = values[previous]
+    else:
+        values[targets] = np.interp(targets, observed, values[observed])
+    status[targets] = CellStatus.FILLED
+    return values, status
+
+
+def _rollup_period(step, start, end):
+    """Maintained fixed-width rollup period equal to step whose boundaries the grid follows"""
+    maintained = set(get_rollup_periods())
+    for period, width in FIXED_PERIODS:
+        width_ms = int(width.total_seconds() * 1000)
+        if period in maintained and width == step \
+                and to_epoch_ms(start) % width_ms == 0 and to_epoch_ms(end) % width_ms == 0:
+            return period
+    return None
+
+
+def _fold_rollups(state, data_source, metric_type, period, start, end):
+    rows = list(DataAggregation._get_collection().find(
+        {
+            'data_source': reference_id(data_source),
+            'metric_type': metric_type,
+            'period': period,
+            'period_start': {'$gte': start, '$lt': end},
+        },
+        {'period_start': 1, 'count': 1, 'sum_value': 1, 'min_value': 1, 'max_value': 1},
+    ))
+    if not rows:
+        return
+    state.add_rollups(
+        np.array([to_epoch_ms(row['period_start']) for row in rows], dtype=np.int64),
+        np.array([int(row['count']) for row in rows], dtype=np.int64),
+        np.array([row['sum_value'] for row in rows], dtype=np.float64),
+        np.array([row['min_value'] for row in rows], dtype=np.float64),
+        np.array([row['max_value'] for row in rows], dtype=np.float64),
+    )
+
+
+def grid_cells(start, end, step):
+    """Number of step-wide cells covering [start, end)"""
+    step_ms = int(step.total_seconds() * 1000)
+    return -(-(to_epoch_ms(end) - to_epoch_ms(start)) // step_ms)
+
+
+def accumulate_series(data_source, metric_type, start, end, step, aggregate=ResampleAggregateChoices.MEAN, store=None):
+    """GridAccumulator of one series over [start, end) and where it was read from"""
+    step_ms = int(step.total_seconds() * 1000)
+    state = GridAccumulator(to_epoch_ms(start), step_ms, grid_cells(start, end, step))
+
+    period = None
+    if aggregate != ResampleAggregateChoices.LAST:
+        # Rollups keep count/sum/min/max but not the last reading
+        period = _rollup_period(step, start, end)
+    if period is not None:
+        _fold_rollups(state, data_source, metric_type, period, start, end)
+        return state, f'aggregations:{period}'
+
+    store = store or get_point_store()
+    for timestamps_ms, values in store.iter_columns(data_source, metric_type, start, end):
+        state.add(timestamps_ms, values)
+    return state, 'raw'
+
+
+def resample_series(data_source, metric_type, start, end, step, aggregate=ResampleAggregateChoices.MEAN,
+                    interpolation=InterpolationChoices.LINEAR, max_gap=None, store=None):
+    """
+    One series on the grid. Returns a dict of NumPy arrays for internal
+    callers: values (NaN where still missing), status (CellStatus), counts
+    (readings per cell), plus the source it was read from.
+    """
+    state, source = accumulate_series(data_source, metric_type, start, end, step, aggregate, store)
+    values, cell_status = fill_gaps(state.values(aggregate), interpolation, max_gap)
+    return {'values': values, 'status': cell_status, 'counts': state.count, 'source': source}
+
+
+def resample(series, start, end, step, aggregate=ResampleAggregateChoices.MEAN,
+             interpolation=InterpolationChoices.LINEAR, max_gap=None):
+    """
+    Align several (data_source, metric_type) series to one grid over [start, end).
+
+    Returns {'timestamps_ms', 'series'} where timestamps_ms are the cell
+    starts and series holds one resample_series result per input, in order.
+    """
+    cells = grid_cells(start, end, step)
+    if cells * max(1, len(series)) > MAX_GRID_CELLS:
+        raise ValueError(f'Grid too large: {cells} cells x {len(series)} series (max {MAX_GRID_CELLS})')
+
+    store = get_point_store()
+    step_ms = int(step.total_seconds() * 1000)
+    timestamps_ms = to_epoch_ms(start) + step_ms * np.arange(cells, dtype=np.int64)
+    return {
+        'timestamps_ms': timestamps_ms,
+        'series': [
+            resample_series(data_source, metric_type, start, end, step, aggregate, interpolation, max_gap, store)
+            for data_source, metric_type in series
+        ],
+    }
+
+
+def resampled_to_dict(result, series, step):
+    """JSON-ready form of a resample() result for the API"""
+    timestamps = [from_epoch_ms(ts) for ts in result['timestamps_ms']]
+    step_ms = int(step.total_seconds() * 1000)
+    payload = []
+    for (data_source, metric_type), resampled in zip(series, result['series']):
+        values, cell_status = resampled['values'], resampled['status']
+        missing = cell_status == CellStatus.MISSING
+        unobserved = cell_status != CellStatus.OBSERVED
+        payload.append({
+            'data_source_id': str(reference_id(data_source)),
+            'metric_type': metric_type,
+            'source': resampled['source'],
+            'values': [None if flag else float(value) for value, flag in zip(values, missing)],
+            'status': [CellStatus.LABELS[flag] for flag in cell_status],
+            'observed': int((cell_status == CellStatus.OBSERVED).sum()),
+            'filled': int((cell_status == CellStatus.FILLED).sum()),
+            'missing': int(missing.sum()),
+            'gaps': [
+                [timestamps[first], from_epoch_ms(result['timestamps_ms'][last - 1] + step_ms)]
+                for first, last in gap_runs(unobserved)
+            ],
+        })
+    return {
+        'step_seconds': step.total_seconds(),
+        'timestamps': timestamps,
+        'series': payload,
+    }
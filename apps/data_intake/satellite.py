@@ -0,0 +1,577 @@
+"""
+Data Intake satellite rasters - per-project NDVI and biomass points from scene files
+
+Scenes are local GeoTIFF (uncompressed, stripped) or NPY files in geographic
+(lon/lat) coordinates. Pixel data is memory mapped, so only the windows that
+cover a project footprint are ever paged in. Each footprint window is split
+into tiles that are reduced to small, mergeable statistics on a process pool.
+
+A footprint is the project's GeoJSON boundary (Project.metadata['boundary'])
+or, without one, a circular buffer around ProjectLocation. Every active
+SATELLITE data source yields one VEGETATION_INDEX point (mean NDVI) and, for
+categories with a biomass model, one BIOMASS_INDEX point (area-weighted
+above-ground biomass in t/ha) per scene, ingested like any other reading.
+"""
+
+import json
+import math
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from bson import ObjectId
+from django.conf import settings
+
+from apps.data_intake.ingestion import ingest_points, parse_timestamp
+from apps.data_intake.models import DataSource, DataSourceTypeChoices, MetricTypeChoices
+from apps.projects.models import Project, CarbonCategory, CarbonCategoryChoices
+
+
+DEFAULT_TILE_SIZE = 1024
+DEFAULT_BUFFER_METERS = 1000
+BUFFER_VERTICES = 64
+NDVI_BINS = 200
+NDVI_PERCENTILES = (10, 50, 90)
+
+METERS_PER_DEGREE_LAT = 110574.0
+METERS_PER_DEGREE_LON = 111320.0
+SQ_METERS_PER_HECTARE = 10000.0
+
+# Exponential NDVI -> above-ground biomass fits in t/ha: a * exp(b * ndvi) for
+# pixels at or above min_ndvi (0 below), capped at max. Calibrate per
+# methodology with DATA_INTAKE_BIOMASS_MODELS or a source's 'biomass_model'.
+DEFAULT_BIOMASS_MODELS = {
+    CarbonCategoryChoices.GREEN: {'a': 2.6, 'b': 5.6, 'min_ndvi': 0.2, 'max': 600},
+    CarbonCategoryChoices.BLUE: {'a': 3.2, 'b': 4.9, 'min_ndvi': 0.15, 'max': 500},
+}
+
+DEFAULT_BANDS = {'red': 0, 'nir': 1}
+
+# TIFF field type -> (struct format, size in bytes)
+TIFF_TYPES = {
+    1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8), 6: ('b', 1), 7: ('B', 1),
+    8: ('h', 2), 9: ('i', 4), 10: ('ii', 8), 11: ('f', 4), 12: ('d', 8), 16: ('Q', 8), 17: ('q', 8),
+}
+TIFF_SAMPLE_FORMATS = {1: 'u', 2: 'i', 3: 'f'}
+TAG_WIDTH, TAG_HEIGHT, TAG_BITS, TAG_COMPRESSION = 256, 257, 258, 259
+TAG_STRIP_OFFSETS, TAG_SAMPLES, TAG_STRIP_BYTES = 273, 277, 279
+TAG_PLANAR, TAG_DATETIME, TAG_TILE_WIDTH, TAG_SAMPLE_FORMAT = 284, 306, 322, 339
+TAG_PIXEL_SCALE, TAG_TIEPOINT, TAG_TRANSFORMATION = 33550, 33922, 34264
+TAG_GEO_KEYS, TAG_NODATA = 34735, 42113
+GEOKEY_MODEL_TYPE, MODEL_TYPE_GEOGRAPHIC = 1024, 2
+
+
+def get_tile_size():
+    """Edge length in pixels of the tiles processed in parallel"""
+    return getattr(settings, 'DATA_INTAKE_SATELLITE_TILE_SIZE', DEFAULT_TILE_SIZE)
+
+
+def get_biomass_model(category, overrides=None):
+    """Biomass model for a carbon category (None disables BIOMASS_INDEX points)"""
+    models = dict(DEFAULT_BIOMASS_MODELS)
+    models.update(getattr(settings, 'DATA_INTAKE_BIOMASS_MODELS', {}))
+    model = models.get(category)
+    if overrides:
+        model = dict(model or {}, **overrides)
+    return model
+
+
+class RasterScene:
+    """
+    Memory-mapped bands of a north-up geographic raster.
+
+    transform is (x0, dx, y0, dy): the lon/lat of the top-left corner and the
+    pixel size in degrees (dy is negative for north-up rasters).
+    """
+
+    def __init__(self, path, bands, transform, nodata=None, acquired_at=None, band_names=None):
+        self.path = path
+        self.bands = bands
+        self.transform = tuple(float(value) for value in transform)
+        self.nodata = nodata
+        self.acquired_at = acquired_at
+        self.band_names = dict(DEFAULT_BANDS, **(band_names or {}))
+
+    @property
+    def height(self):
+        return self.bands[0].shape[0]
+
+    @property
+    def width(self):
+        return self.bands[0].shape[1]
+
+    def window(self, bounds):
+        """Pixel window (row0, row1, col0, col1) covering lon/lat bounds, or None outside the scene"""
+        min_x, min_y, max_x, max_y = bounds
+        x0, dx, y0, dy = self.transform
+        cols = sorted(((min_x - x0) / dx, (max_x - x0) / dx))
+        rows = sorted(((max_y - y0) / dy, (min_y - y0) / dy))
+        col0, col1 = max(int(math.floor(cols[0])), 0), min(int(math.ceil(cols[1])), self.width)
+        row0, row1 = max(int(math.floor(rows[0])), 0), min(int(math.ceil(rows[1])), self.height)
+        if col0 >= col1 or row0 >= row1:
+            return None
+        return row0, row1, col0, col1
+
+    def pixel_centers(self, window):
+        """Longitudes of the window's columns and latitudes of its rows"""
+        row0, row1, col0, col1 = window
+        x0, dx, y0, dy = self.transform
+        lons = x0 + (np.arange(col0, col1) + 0.5) * dx
+        lats = y0 + (np.arange(row0, row1) + 0.5) * dy
+        return lons, lats
+
+    def pixel_area_ha(self, lats):
+        """Area in hectares of one pixel at each latitude"""
+        _, dx, _, dy = self.transform
+        width_m = abs(dx) * METERS_PER_DEGREE_LON * np.cos(np.radians(lats))
+        return width_m * abs(dy) * METERS_PER_DEGREE_LAT / SQ_METERS_PER_HECTARE
+
+
+def _read_tiff_tags(handle):
+    order = handle.read(2)
+    if order not in (b'II', b'MM'):
+        raise ValueError('not a TIFF file')
+    endian = '<' if order == b'II' else '>'
+    magic, = struct.unpack(endian + 'H', handle.read(2))
+    if magic == 42:
+        big, offset_format = False, 'I'
+    elif magic == 43:
+        big, offset_format = True, 'Q'
+        handle.read(4)
+    else:
+        raise ValueError('not a TIFF file')
+    offset, = struct.unpack(endian + offset_format, handle.read(struct.calcsize(offset_format)))
+
+    handle.seek(offset)
+    entry_size, inline_size = (20, 8) if big else (12, 4)
+    count, = struct.unpack(endian + ('Q' if big else 'H'), handle.read(8 if big else 2))
+    entries = handle.read(count * entry_size)
+
+    tags = {}
+    for i in range(count):
+        entry = entries[i * entry_size:(i + 1) * entry_size]
+        tag, field_type = struct.unpack(endian + 'HH', entry[:4])
+        if field_type not in TIFF_TYPES:
+            continue
+        number, = struct.unpack(endian + offset_format, entry[4:4 + inline_size])
+        field_format, size = TIFF_TYPES[field_type]
+        field = entry[4 + inline_size:]
+        if number * size <= inline_size:
+            data = field[:number * size]
+        else:
+            handle.seek(struct.unpack(endian + offset_format, field)[0])
+            data = handle.read(number * size)
+
+        if field_type == 2:
+            tags[tag] = data.rstrip(b'\0').decode('ascii', 'replace')
+        else:
+            values = struct.unpack(endian + field_format * number, data)
+            if field_type in (5, 10):
+                values = tuple(values[j] / values[j + 1] if values[j + 1] else 0.0 for j in range(0, len(values), 2))
+            tags[tag] = values
+    return endian, tags
+
+
+def _geotiff_transform(tags):
+    if TAG_TRANSFORMATION in tags:
+        matrix = tags[TAG_TRANSFORMATION]
+        if matrix[1] or matrix[4]:
+            raise ValueError('rotated GeoTIFFs are not supported')
+        return matrix[3], matrix[0], matrix[7], matrix[5]
+    if TAG_PIXEL_SCALE in tags and TAG_TIEPOINT in tags:
+        scale_x, scale_y = tags[TAG_PIXEL_SCALE][:2]
+        col, row, _, x, y = tags[TAG_TIEPOINT][:5]
+        return x - col * scale_x, scale_x, y + row * scale_y, -scale_y
+    raise ValueError('GeoTIFF has no georeferencing')
+
+
+def _is_geographic(tags):
+    keys = tags.get(TAG_GEO_KEYS)
+    if not keys:
+        return True
+    for i in range(4, 4 + 4 * keys[3], 4):
+        if keys[i] == GEOKEY_MODEL_TYPE:
+            return keys[i + 3] == MODEL_TYPE_GEOGRAPHIC
+    return True
+
+
+def _contiguous(offsets, counts):
+    return all(offsets[i] + counts[i] == offsets[i + 1] for i in range(len(offsets) - 1))
+
+
+def read_geotiff(path):
+    """
+    Memory map an uncompressed, stripped GeoTIFF (classic or BigTIFF).
+    Compressed or tiled files must be converted first, e.g. with
+    gdal_translate -co COMPRESS=NONE -co TILED=NO.
+    """
+    with open(path, 'rb') as handle:
+        endian, tags = _read_tiff_tags(handle)
+
+    if tags.get(TAG_COMPRESSION, (1,))[0] != 1 or TAG_TILE_WIDTH in tags:
+        raise ValueError('only uncompressed, stripped GeoTIFFs can be memory mapped')
+    if not _is_geographic(tags):
+        raise ValueError('only geographic (lon/lat) GeoTIFFs are supported')
+
+    width, height = tags[TAG_WIDTH][0], tags[TAG_HEIGHT][0]
+    samples = tags.get(TAG_SAMPLES, (1,))[0]
+    bits, formats = set(tags.get(TAG_BITS, (8,))), set(tags.get(TAG_SAMPLE_FORMAT, (1,)))
+    if len(bits) != 1 or len(formats) != 1:
+        raise ValueError('bands with mixed sample types are not supported')
+    bits, sample_format = bits.pop(), formats.pop()
+    if bits % 8 or sample_format not in TIFF_SAMPLE_FORMATS:
+        raise ValueError(f'unsupported sample type: {bits} bit format {sample_format}')
+    dtype = np.dtype(f'{endian}{TIFF_SAMPLE_FORMATS[sample_format]}{bits // 8}')
+
+    offsets, counts = tags[TAG_STRIP_OFFSETS], tags[TAG_STRIP_BYTES]
+    if tags.get(TAG_PLANAR, (1,))[0] == 1:
+        if not _contiguous(offsets, counts) or sum(counts) < width * height * samples * dtype.itemsize:
+            raise ValueError('GeoTIFF strips are not contiguous')
+        pixels = np.memmap(path, dtype=dtype, mode='r', offset=offsets[0], shape=(height, width, samples))
+        bands = [pixels[:, :, band] for band in range(samples)]
+    else:
+        per_band = len(offsets) // samples
+        bands = []
+        for band in range(samples):
+            band_offsets = offsets[band * per_band:(band + 1) * per_band]
+            band_counts = counts[band * per_band:(band + 1) * per_band]
+            if not _contiguous(band_offsets, band_counts) or sum(band_counts) < width * height * dtype.itemsize:
+                raise ValueError('GeoTIFF strips are not contiguous')
+            bands.append(np.memmap(path, dtype=dtype, mode='r', offset=band_offsets[0], shape=(height, width)))
+
+    nodata = tags.get(TAG_NODATA)
+    acquired_at = tags.get(TAG_DATETIME)
+    return RasterScene(
+        path, bands, _geotiff_transform(tags),
+        nodata=float(nodata) if nodata not in (None, '') else None,
+        acquired_at=datetime.strptime(acquired_at, '%Y:%m:%d %H:%M:%S') if acquired_at else None,
+    )
+
+
+def read_npy(path):
+    """
+    Memory map a (bands, rows, cols) NPY array. Georeferencing comes from a
+    JSON sidecar next to it (scene.npy -> scene.json) with "transform"
+    [x0, dx, y0, dy] and optional "nodata", "acquired_at" and "bands"
+    ({"red": 2, "nir": 3}).
+    """
+    sidecar_path = os.path.splitext(path)[0] + '.json'
+    if not os.path.exists(sidecar_path):
+        raise ValueError(f'missing georeferencing sidecar {sidecar_path}')
+    with open(sidecar_path) as handle:
+        sidecar = json.load(handle)
+
+    pixels = np.load(path, mmap_mode='r')
+    if pixels.ndim != 3:
+        raise ValueError('NPY scenes must be shaped (bands, rows, cols)')
+    acquired_at = sidecar.get('acquired_at')
+    return RasterScene(
+        path, [pixels[band] for band in range(pixels.shape[0])], sidecar['transform'],
+        nodata=sidecar.get('nodata'),
+        acquired_at=parse_timestamp(acquired_at) if acquired_at else None,
+        band_names=sidecar.get('bands'),
+    )
+
+
+def open_raster(path):
+    """Open a scene by extension (.tif/.tiff or .npy)"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.tif', '.tiff'):
+        return read_geotiff(path)
+    if extension == '.npy':
+        return read_npy(path)
+    raise ValueError(f'unsupported raster format: {extension}')
+
+
+_scenes = {}
+
+
+def _cached_scene(path):
+    # One memory map per scene per worker process
+    if path not in _scenes:
+        _scenes[path] = open_raster(path)
+    return _scenes[path]
+
+
+def buffer_ring(longitude, latitude, meters, vertices=BUFFER_VERTICES):
+    """Closed lon/lat ring approximating a circle of radius meters"""
+    angles = np.linspace(0, 2 * np.pi, vertices + 1)
+    d_lat = meters / METERS_PER_DEGREE_LAT
+    d_lon = meters / (METERS_PER_DEGREE_LON * max(math.cos(math.radians(latitude)), 1e-6))
+    return np.column_stack((longitude + d_lon * np.cos(angles), latitude + d_lat * np.sin(angles)))
+
+
+def geojson_rings(geometry):
+    """Rings of a GeoJSON Polygon/MultiPolygon (or Feature) as (N, 2) lon/lat arrays"""
+    if geometry.get('type') == 'Feature':
+        geometry = geometry.get('geometry') or {}
+    if geometry.get('type') == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry.get('type') == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        raise ValueError(f"unsupported boundary geometry: {geometry.get('type')}")
+    return [np.asarray(ring, dtype=np.float64)[:, :2] for polygon in polygons for ring in polygon]
+
+
+def footprint_rings(project, source_metadata=None):
+    """Project boundary rings, or a buffer around its location when it has none"""
+    source_metadata = source_metadata or {}
+    boundary = (project.get('metadata') or {}).get('boundary')
+    if boundary:
+        return geojson_rings(boundary)
+
+    location = project.get('location') or {}
+    if location.get('latitude') is None or location.get('longitude') is None:
+        return []
+    meters = source_metadata.get('buffer_m') or getattr(
+        settings, 'DATA_INTAKE_SATELLITE_BUFFER_METERS', DEFAULT_BUFFER_METERS
+    )
+    return [buffer_ring(float(location['longitude']), float(location['latitude']), float(meters))]
+
+
+def rings_bounds(rings):
+    """(min_lon, min_lat, max_lon, max_lat) of a set of rings"""
+    points = np.concatenate(rings)
+    return points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max()
+
+
+def polygon_mask(rings, lons, lats):
+    """
+    Even-odd inside mask for pixel centers (rows = lats, cols = lons), so
+    holes and multipolygons need no special casing. Each row is a scanline:
+    edge crossings are computed for all rows at once and counted per row.
+    """
+    edges = np.concatenate([np.column_stack((ring[:-1], ring[1:])) for ring in rings if len(ring) > 1])
+    x0, y0, x1, y1 = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+    y = lats[:, None]
+    crosses = (y0 <= y) != (y1 <= y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xs = np.where(crosses, x0 + (y - y0) * (x1 - x0) / (y1 - y0), np.inf)
+    xs.sort(axis=1)
+
+    mask = np.empty((len(lats), len(lons)), dtype=bool)
+    for row in range(len(lats)):
+        mask[row] = np.searchsorted(xs[row], lons) % 2 == 1
+    return mask
+
+
+def iter_tiles(window, tile_size):
+    """Split a pixel window into tile windows of at most tile_size x tile_size"""
+    row0, row1, col0, col1 = window
+    for row in range(row0, row1, tile_size):
+        for col in range(col0, col1, tile_size):
+            yield row, min(row + tile_size, row1), col, min(col + tile_size, col1)
+
+
+def empty_stats():
+    return {
+        'pixels': 0, 'ndvi_sum': 0.0, 'ndvi_sumsq': 0.0, 'ndvi_min': np.inf, 'ndvi_max': -np.inf,
+        'ndvi_hist': np.zeros(NDVI_BINS, dtype=np.int64), 'area_ha': 0.0, 'vegetated_ha': 0.0, 'biomass_t': 0.0,
+    }
+
+
+def merge_stats(total, part):
+    """Fold one tile's statistics into a running total"""
+    total['pixels'] += part['pixels']
+    total['ndvi_sum'] += part['ndvi_sum']
+    total['ndvi_sumsq'] += part['ndvi_sumsq']
+    total['ndvi_min'] = min(total['ndvi_min'], part['ndvi_min'])
+    total['ndvi_max'] = max(total['ndvi_max'], part['ndvi_max'])
+    total['ndvi_hist'] += part['ndvi_hist']
+    total['area_ha'] += part['area_ha']
+    total['vegetated_ha'] += part['vegetated_ha']
+    total['biomass_t'] += part['biomass_t']
+    return total
+
+
+def biomass_density(ndvi, model):
+    """Per-pixel above-ground biomass in t/ha"""
+    density = np.minimum(model['a'] * np.exp(model['b'] * ndvi), model.get('max', np.inf))
+    return np.where(ndvi >= model.get('min_ndvi', -1.0), density, 0.0)
+
+
+def tile_stats(job):
+    """Reduce one tile of one footprint to mergeable NDVI/biomass statistics"""
+    path, window, red_band, nir_band, rings, model, offset = job
+    scene = _cached_scene(path)
+    row0, row1, col0, col1 = window
+    red = np.array(scene.bands[red_band][row0:row1, col0:col1], dtype=np.float64)
+    nir = np.array(scene.bands[nir_band][row0:row1, col0:col1], dtype=np.float64)
+    lons, lats = scene.pixel_centers(window)
+
+    valid = polygon_mask(rings, lons, lats)
+    if scene.nodata is not None:
+        valid &= (red != scene.nodata) & (nir != scene.nodata)
+    red += offset
+    nir += offset
+    total = red + nir
+    valid &= np.isfinite(total) & (total > 0)
+
+    stats = empty_stats()
+    if not valid.any():
+        return stats
+    ndvi = np.clip((nir[valid] - red[valid]) / total[valid], -1.0, 1.0)
+    area = np.broadcast_to(scene.pixel_area_ha(lats)[:, None], valid.shape)[valid]
+
+    stats.update({
+        'pixels': int(ndvi.size),
+        'ndvi_sum': float(ndvi.sum()),
+        'ndvi_sumsq': float(np.dot(ndvi, ndvi)),
+        'ndvi_min': float(ndvi.min()),
+        'ndvi_max': float(ndvi.max()),
+        'ndvi_hist': np.bincount(
+            np.minimum(((ndvi + 1.0) / 2.0 * NDVI_BINS).astype(np.int64), NDVI_BINS - 1), minlength=NDVI_BINS
+        ),
+        'area_ha': float(area.sum()),
+    })
+    if model:
+        stats['vegetated_ha'] = float(area[ndvi >= model.get('min_ndvi', -1.0)].sum())
+        stats['biomass_t'] = float(np.dot(biomass_density(ndvi, model), area))
+    return stats
+
+
+def histogram_percentile(hist, q):
+    """Approximate percentile (bin center) from an NDVI histogram"""
+    position = np.searchsorted(np.cumsum(hist), q / 100.0 * hist.sum())
+    return -1.0 + (min(position, NDVI_BINS - 1) + 0.5) * 2.0 / NDVI_BINS
+
+
+def scene_statistics(path, footprints, tile_size=None, workers=1):
+    """
+    Statistics per footprint for one scene. footprints is a list of
+    (window, red_band, nir_band, rings, model, offset); tiles of all
+    footprints are spread over a process pool when workers > 1.
+    """
+    tile_size = tile_size or get_tile_size()
+    owners, jobs = [], []
+    for index, (window, red_band, nir_band, rings, model, offset) in enumerate(footprints):
+        for tile in iter_tiles(window, tile_size):
+            owners.append(index)
+            jobs.append((path, tile, red_band, nir_band, rings, model, offset))
+
+    if workers <= 1 or len(jobs) <= 1:
+        try:
+            return _merge_by_owner(owners, map(tile_stats, jobs), len(footprints))
+        finally:
+            _scenes.pop(path, None)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return _merge_by_owner(owners, executor.map(tile_stats, jobs), len(footprints))
+
+
+def _merge_by_owner(owners, results, count):
+    totals = [empty_stats() for _ in range(count)]
+    for index, stats in zip(owners, results):
+        merge_stats(totals[index], stats)
+    return totals
+
+
+def stats_payloads(source_id, stats, timestamp, scene_name, model):
+    """VEGETATION_INDEX (and BIOMASS_INDEX when modelled) payloads for one footprint"""
+    if not stats['pixels']:
+        return []
+    mean = stats['ndvi_sum'] / stats['pixels']
+    variance = max(stats['ndvi_sumsq'] / stats['pixels'] - mean * mean, 0.0)
+    common = {'scene': scene_name, 'pixels': stats['pixels'], 'area_ha': round(stats['area_ha'], 4)}
+
+    ndvi_payload = dict(common, **{
+        'std': round(math.sqrt(variance), 6),
+        'min': round(stats['ndvi_min'], 6),
+        'max': round(stats['ndvi_max'], 6),
+    })
+    for q in NDVI_PERCENTILES:
+        ndvi_payload[f'p{q}'] = round(histogram_percentile(stats['ndvi_hist'], q), 4)
+    payloads = [{
+        'data_source_id': str(source_id),
+        'metric_type': MetricTypeChoices.VEGETATION_INDEX,
+        'value': round(mean, 6),
+        'unit': 'NDVI',
+        'timestamp': timestamp,
+        'raw_payload': ndvi_payload,
+    }]
+
+    if model and stats['area_ha'] > 0:
+        payloads.append({
+            'data_source_id': str(source_id),
+            'metric_type': MetricTypeChoices.BIOMASS_INDEX,
+            'value': round(stats['biomass_t'] / stats['area_ha'], 4),
+            'unit': 't/ha',
+            'timestamp': timestamp,
+            'raw_payload': dict(common, **{
+                'total_biomass_t': round(stats['biomass_t'], 2),
+                'vegetated_ha': round(stats['vegetated_ha'], 4),
+                'model': model,
+            }),
+        })
+    return payloads
+
+
+def load_satellite_sources(source_ids=None):
+    """Active SATELLITE sources with their project's footprint fields and carbon category code"""
+    query = {'type': DataSourceTypeChoices.SATELLITE, 'is_active': True}
+    if source_ids:
+        query['_id'] = {'$in': [ObjectId(str(source_id)) for source_id in source_ids]}
+    sources = list(DataSource._get_collection().find(query, {'project': 1, 'metadata': 1}))
+
+    projects = {
+        row['_id']: row for row in Project._get_collection().find(
+            {'_id': {'$in': list({source['project'] for source in sources})}},
+            {'location': 1, 'metadata': 1, 'carbon_category': 1},
+        )
+    }
+    categories = {
+        row['_id']: row.get('code') for row in CarbonCategory._get_collection().find(
+            {'_id': {'$in': list({project.get('carbon_category') for project in projects.values()})}},
+            {'code': 1},
+        )
+    }
+    for source in sources:
+        project = projects.get(source['project'], {})
+        source['project_doc'] = project
+        source['category'] = categories.get(project.get('carbon_category'))
+    return sources
+
+
+def ingest_scene(path, source_ids=None, acquired_at=None, tile_size=None, workers=1):
+    """
+    Compute and ingest per-project points for one scene.
+
+    Returns (summaries, IngestResult): one summary per satellite source
+    whose footprint overlaps the scene.
+    """
+    scene = open_raster(path)
+    timestamp = acquired_at or scene.acquired_at
+    if timestamp is None:
+        raise ValueError('scene acquisition time is unknown; pass acquired_at')
+
+    covered, footprints = [], []
+    for source in load_satellite_sources(source_ids):
+        metadata = source.get('metadata') or {}
+        rings = footprint_rings(source['project_doc'], metadata)
+        window = scene.window(rings_bounds(rings)) if rings else None
+        if window is None:
+            continue
+        red_band = int(metadata.get('red_band', scene.band_names['red']))
+        nir_band = int(metadata.get('nir_band', scene.band_names['nir']))
+        if max(red_band, nir_band) >= len(scene.bands):
+            raise ValueError(f"source {source['_id']} expects band {max(red_band, nir_band)}, scene has {len(scene.bands)}")
+        model = get_biomass_model(source['category'], metadata.get('biomass_model'))
+        covered.append((source, model))
+        footprints.append((window, red_band, nir_band, rings, model, float(metadata.get('reflectance_offset', 0))))
+
+    totals = scene_statistics(path, footprints, tile_size, workers)
+
+    scene_name = os.path.basename(path)
+    summaries, payloads = [], []
+    for (source, model), stats in zip(covered, totals):
+        source_payloads = stats_payloads(source['_id'], stats, timestamp, scene_name, model)
+        payloads.extend(source_payloads)
+        summaries.append({
+            'data_source_id': str(source['_id']),
+            'project_id': str(source['project']),
+            'pixels': stats['pixels'],
+            'points': len(source_payloads),
+        })
+    return summaries, ingest_points(payloads)
@@ -2,8 +2,15 @@
 Data Intake app serializers
 """
 
+from bson import ObjectId
 from rest_framework import serializers
-from apps.data_intake.models import DataSource, DataPoint, DataAggregation, DataSourceTypeChoices, MetricTypeChoices
+from apps.data_intake.activity import DEFAULT_STALE_MINUTES
+from apps.data_intake.downsampling import DownsampleMethodChoices, MAX_TARGET_POINTS
+from apps.data_intake.resampling import InterpolationChoices, ResampleAggregateChoices
+from apps.data_intake.models import (
+    DataSource, DataPoint, DataAggregation, DataSourceTypeChoices, MetricTypeChoices,
+    AggregationPeriodChoices
+)
 
 
 class DataSourceSerializer(serializers.Serializer):
@@ -43,8 +50,9 @@ class DataAggregationSerializer(serializers.Serializer):
     
     id = serializers.CharField(read_only=True)
     project_id = serializers.CharField()
+    data_source_id = serializers.CharField(required=False)
     metric_type = serializers.CharField()
-    period = serializers.CharField()
+    period = serializers.ChoiceField(choices=AggregationPeriodChoices.CHOICES)
     period_start = serializers.DateTimeField()
     period_end = serializers.DateTimeField()
     count = serializers.IntegerField()
@@ -52,5 +60,66 @@ class DataAggregationSerializer(serializers.Serializer):
     avg_value = serializers.DecimalField(max_digits=20, decimal_places=6)
     min_value = serializers.DecimalField(max_digits=20, decimal_places=6)
     max_value = serializers.DecimalField(max_digits=20, decimal_places=6)
+    stddev_value = serializers.DecimalField(max_digits=20, decimal_places=6, required=False)
+    percentiles = serializers.DictField(required=False)
     unit = serializers.CharField()
     created_at = serializers.DateTimeField(read_only=True)
+    updated_at = serializers.DateTimeField(read_only=True)
+
+
+class DataPointSeriesQuerySerializer(serializers.Serializer):
+    """Query parameters for downsampled time-series reads"""
+    
+    data_source_id = serializers.CharField()
+    metric_type = serializers.ChoiceField(choices=MetricTypeChoices.CHOICES)
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+    points = serializers.IntegerField(min_value=3, max_value=MAX_TARGET_POINTS, default=1000)
+    method = serializers.ChoiceField(choices=DownsampleMethodChoices.CHOICES, default=DownsampleMethodChoices.LTTB)
+    
+    def validate_data_source_id(self, value):
+        if not ObjectId.is_valid(value):
+            raise serializers.ValidationError('Invalid data source id')
+        return value
+    
+    def validate(self, attrs):
+        if attrs['start'] >= attrs['end']:
+            raise serializers.ValidationError('start must be before end')
+        return attrs
+
+
+class StaleDataSourceQuerySerializer(serializers.Serializer):
+    """Query parameters for listing silent data sources"""
+    
+    minutes = serializers.IntegerField(min_value=1, default=DEFAULT_STALE_MINUTES)
+    project_id = serializers.CharField(required=False)
+    type = serializers.ChoiceField(choices=DataSourceTypeChoices.CHOICES, required=False)
+    
+    def validate_project_id(self, value):
+        if not ObjectId.is_valid(value):
+            raise serializers.ValidationError('Invalid project id')
+        return value
+
+
+class ResampleQuerySerializer(serializers.Serializer):
+    """Query parameters for aligning sources to a regular grid"""
+    
+    data_source_id = serializers.ListField(child=serializers.CharField(), min_length=1, max_length=50)
+    metric_type = serializers.ChoiceField(choices=MetricTypeChoices.CHOICES)
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+    step = serializers.IntegerField(min_value=1, default=3600)  # Seconds
+    aggregate = serializers.ChoiceField(choices=ResampleAggregateChoices.CHOICES, default=ResampleAggregateChoices.MEAN)
+    interpolation = serializers.ChoiceField(choices=InterpolationChoices.CHOICES, default=InterpolationChoices.LINEAR)
+    max_gap = serializers.IntegerField(min_value=0, required=False)  # Longest gap filled, in cells
+    
+    def validate_data_source_id(self, value):
+        for source_id in value:
+            if not ObjectId.is_valid(source_id):
+                raise serializers.ValidationError(f'Invalid data source id: {source_id}')
+        return value
+    
+    def validate(self, attrs):
+        if attrs['start'] >= attrs['end']:
+            raise serializers.ValidationError('start must be before end')
+        return attrs
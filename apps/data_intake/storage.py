@@ -0,0 +1,566 @@
+"""
+Data Intake storage layouts - where DataPoint readings are written and read from
+
+DOCUMENTS stores one data_points document per reading. BUCKETS stores one
+data_point_buckets document per (data_source, metric_type, time bucket) with
+parallel timestamp/value arrays, which keeps index size and write
+amplification proportional to buckets instead of readings; a busy series
+continues in overflow buckets once DATA_INTAKE_BUCKET_MAX_READINGS is
+reached. Both layouts share the write and series read interface (write,
+iter_values, iter_columns), so ingestion, rollups, charts and validation do
+not care which is active. Individual readings only exist under DOCUMENTS:
+bucketed ones have no id, so listing or fetching single readings needs that
+layout.
+
+Readings are deduplicated on (data_source, metric_type, timestamp): writing a
+reading that is already stored is a no-op reported as a duplicate, so device
+retries never inflate sums.
+"""
+
+from collections import defaultdict
+from itertools import groupby
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from bson.codec_options import CodecOptions
+from django.conf import settings
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from apps.api.references import reference_id
+from apps.data_intake.models import (
+    DataPoint, DataPointBucket, StorageLayoutChoices
+)
+
+
+DEFAULT_BUCKET_SECONDS = 3600
+DEFAULT_BUCKET_MAX_READINGS = 10000  # ~300 KB of arrays, far below the 16 MB document limit
+DEFAULT_COLUMN_CHUNK_SIZE = 500000
+DEFAULT_DEDUPE_BATCH_SIZE = 10000
+
+DUPLICATE_KEY_ERROR = 11000
+# Optimistic bucket appends retried after losing a race with another writer
+MAX_BUCKET_WRITE_ATTEMPTS = 5
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def bucket_start(timestamp, bucket_seconds=DEFAULT_BUCKET_SECONDS):
+    """Floor a naive UTC datetime to the start of its bucket"""
+    epoch_seconds = int((timestamp - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=epoch_seconds - epoch_seconds % bucket_seconds)
+
+
+def naive_utc(timestamp):
+    """Drop tzinfo after converting to UTC (tz_aware connections return aware datetimes)"""
+    if timestamp is not None and timestamp.tzinfo is not None:
+        return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def to_epoch_ms(timestamp):
+    """Milliseconds since the epoch for a (naive or aware) UTC datetime"""
+    return int((naive_utc(timestamp) - EPOCH).total_seconds() * 1000)
+
+
+def from_epoch_ms(value):
+    """Naive UTC datetime for milliseconds since the epoch"""
+    return EPOCH + timedelta(milliseconds=int(value))
+
+
+def truncate_to_millis(timestamp):
+    """BSON dates keep milliseconds; truncate so in-memory keys match stored ones"""
+    return timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+
+
+def dedup_key(doc):
+    """(data_source, metric_type, timestamp) identity of a prepared reading"""
+    return doc['data_source'], doc['metric_type'], truncate_to_millis(doc['timestamp'])
+
+
+def _raw_collection(document):
+    # Columnar reads decode timestamps as epoch ms server side; skip tz conversion
+    return document._get_collection().with_options(codec_options=CodecOptions(tz_aware=False))
+
+
+def _merged_readings(buckets):
+    """(timestamp, value, bucket) of buckets covering the same time bucket, in timestamp order"""
+    readings = [
+        (naive_utc(timestamp), value, bucket)
+        for bucket in buckets
+        for timestamp, value in zip(bucket['timestamps'], bucket['values'])
+    ]
+    readings.sort(key=lambda reading: reading[0])
+    return readings
+
+
+def _range_filter(field, start, end):
+    bounds = {}
+    if start is not None:
+        bounds['$gte'] = start
+    if end is not None:
+        bounds['$lte'] = end
+    return {field: bounds} if bounds else {}
+
+
+def _half_open_filter(field, start, end):
+    bounds = {}
+    if start is not None:
+        bounds['$gte'] = start
+    if end is not None:
+        bounds['$lt'] = end
+    return {field: bounds} if bounds else {}
+
+
+def _base_filter(data_source=None, project=None, metric_type=None):
+    query = {}
+    if data_source is not None:
+        query['data_source'] = reference_id(data_source)
+    if project is not None:
+        query['project'] = reference_id(project)
+    if metric_type is not None:
+        query['metric_type'] = metric_type
+    return query
+
+
+class DocumentPointStore:
+    """One data_points document per reading"""
+
+    layout = StorageLayoutChoices.DOCUMENTS
+    document = DataPoint
+
+    def write(self, docs):
+        """
+        Insert documents unordered. Returns (failed, duplicates): a
+        {position: error message} dict and the set of positions rejected by
+        the unique dedup index because the reading is already stored.
+        """
+        failed, duplicates = {}, set()
+        try:
+            DataPoint._get_collection().insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                if error.get('code') == DUPLICATE_KEY_ERROR:
+                    duplicates.add(error['index'])
+                else:
+                    failed[error['index']] = error.get('errmsg', 'write failed')
+        return failed, duplicates
+
+    def iter_values(self, data_source=None, project=None, metric_type=None, start=None, end=None):
+        """Yield (timestamp, value) pairs in timestamp order"""
+        query = _base_filter(data_source, project, metric_type)
+        query.update(_range_filter('timestamp', start, end))
+        cursor = DataPoint._get_collection().find(
+            query, {'_id': 0, 'timestamp': 1, 'value': 1}
+        ).sort('timestamp', 1)
+        for row in cursor:
+            yield naive_utc(row['timestamp']), row['value']
+
+    def query(self, data_source=None, project=None, metric_type=None, start=None, end=None):
+        """Yield DataPoint documents in timestamp order"""
+        filters = {}
+        if data_source is not None:
+            filters['data_source'] = reference_id(data_source)
+        if project is not None:
+            filters['project'] = reference_id(project)
+        if metric_type is not None:
+            filters['metric_type'] = metric_type
+        if start is not None:
+            filters['timestamp__gte'] = start
+        if end is not None:
+            filters['timestamp__lte'] = end
+        return DataPoint.objects(**filters).order_by('timestamp')
+
+    def iter_columns(self, data_source, metric_type, start=None, end=None, chunk_size=DEFAULT_COLUMN_CHUNK_SIZE):
+        """Yield (timestamps_ms, values) NumPy chunks for readings in [start, end) in timestamp order"""
+        match = _base_filter(data_source, None, metric_type)
+        match.update(_half_open_filter('timestamp', naive_utc(start), naive_utc(end)))
+        pipeline = [
+            {'$match': match},
+            {'$sort': {'timestamp': 1}},
+            {'$project': {'_id': 0, 't': {'$toLong': '$timestamp'}, 'v': '$value'}},
+        ]
+        cursor = _raw_collection(DataPoint).aggregate(pipeline, allowDiskUse=True, batchSize=10000)
+        t_chunk = np.empty(chunk_size, dtype=np.int64)
+        v_chunk = np.empty(chunk_size, dtype=np.float64)
+        size = 0
+        for row in cursor:
+            t_chunk[size] = row['t']
+            v_chunk[size] = row['v']
+            size += 1
+            if size == chunk_size:
+                yield t_chunk.copy(), v_chunk.copy()
+                size = 0
+        if size:
+            yield t_chunk[:size].copy(), v_chunk[:size].copy()
+
+    def remove_duplicates(self, batch_size=DEFAULT_DEDUPE_BATCH_SIZE):
+        """
+        Delete all but the first-inserted copy of each duplicated reading so the
+        unique dedup index can be built. Returns (removed, affected project ids).
+        """
+        pipeline = [
+            {'$group': {
+                '_id': {'s': '$data_source', 'm': '$metric_type', 't': '$timestamp'},
+                'ids': {'$push': '$_id'},
+                'project': {'$first': '$project'},
+                'n': {'$sum': 1},
+            }},
+            {'$match': {'n': {'$gt': 1}}},
+        ]
+        collection = DataPoint._get_collection()
+        removed, projects, batch = 0, set(), []
+        for group in collection.aggregate(pipeline, allowDiskUse=True):
+            projects.add(group['project'])
+            batch.extend(sorted(group['ids'])[1:])
+            if len(batch) >= batch_size:
+                removed += collection.delete_many({'_id': {'$in': batch}}).deleted_count
+                batch = []
+        if batch:
+            removed += collection.delete_many({'_id': {'$in': batch}}).deleted_count
+        return removed, projects
+
+
+class BucketPointStore:
+    """
+    One data_point_buckets document per source, metric and time bucket, plus
+    overflow buckets once a bucket holds max_readings readings.
+
+    Readings are read back as series only (iter_values, iter_columns): they
+    have no id of their own, so the per-reading list and detail endpoints
+    need the DOCUMENTS layout. query() rebuilds unsaved DataPoint documents
+    for code that wants model instances.
+    """
+
+    layout = StorageLayoutChoices.BUCKETS
+    document = DataPointBucket
+
+    def __init__(self, bucket_seconds=None, max_readings=None):
+        self.bucket_seconds = bucket_seconds or getattr(
+            settings, 'DATA_INTAKE_BUCKET_SECONDS', DEFAULT_BUCKET_SECONDS
+        )
+        self.max_readings = max_readings or getattr(
+            settings, 'DATA_INTAKE_BUCKET_MAX_READINGS', DEFAULT_BUCKET_MAX_READINGS
+        )
+
+    def write(self, docs):
+        """
+        Append docs to their buckets with one unordered bulk upsert.
+        Returns (failed, duplicates) like DocumentPointStore.write.
+
+        Each append goes to the open (unsealed) bucket of its time bucket and
+        only matches when that bucket has room and holds none of its
+        timestamps, and when the readings are newer than its floor (so none
+        can sit in a sealed bucket). Otherwise the upsert collides with the
+        unique bucket index, and only those readings take the checked path:
+        every bucket of the time bucket is searched for them, and the rest go
+        to the open bucket or, when it is full, to new overflow buckets.
+        """
+        groups, seen, duplicates = defaultdict(list), set(), set()
+        for position, doc in enumerate(docs):
+            key = dedup_key(doc)
+            if key in seen:
+                duplicates.add(position)
+                continue
+            seen.add(key)
+            source_id, metric_type, timestamp = key
+            groups[(source_id, metric_type, bucket_start(timestamp, self.bucket_seconds))].append(position)
+
+        failed = {}
+        targets, conflicts = [], defaultdict(list)
+        for key, positions in groups.items():
+            if len(positions) <= self.max_readings:
+                targets.append((key, None, positions, None, False))
+            else:
+                conflicts[key] = positions
+        for _ in range(MAX_BUCKET_WRITE_ATTEMPTS):
+            if conflicts:
+                targets += self._place(conflicts, docs, duplicates)
+            if not targets:
+                break
+            conflicts = self._write_targets(targets, docs, failed)
+            targets = []
+
+        for positions in conflicts.values():
+            for position in positions:
+                failed[position] = 'bucket write conflict, retry later'
+        return failed, duplicates
+
+    def _write_targets(self, targets, docs, failed):
+        """Append each (key, seq, positions, floor, sealed) target; returns {key: positions} that collided"""
+        now = datetime.utcnow()
+        operations = [self._append(*target, docs, now) for target in targets]
+        conflicts = defaultdict(list)
+        try:
+            DataPointBucket._get_collection().bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                key, _, positions, _, _ = targets[error['index']]
+                if error.get('code') == DUPLICATE_KEY_ERROR:
+                    conflicts[key].extend(positions)
+                else:
+                    for position in positions:
+                        failed[position] = error.get('errmsg', 'write failed')
+        return conflicts
+
+    def _append(self, key, seq, positions, floor, sealed, docs, now):
+        source_id, metric_type, start = key
+        timestamps = [truncate_to_millis(docs[p]['timestamp']) for p in positions]
+        values = [docs[p]['value'] for p in positions]
+        first = docs[positions[0]]
+        query = {
+            'data_source': source_id,
+            'metric_type': metric_type,
+            'bucket_start': start,
+            'sealed': {'$ne': True},
+            'count': {'$lte': self.max_readings - len(positions)},
+            'timestamps': {'$nin': timestamps},
+        }
+        update = {
+            '$push': {
+                'timestamps': {'$each': timestamps},
+                'values': {'$each': values},
+            },
+            '$inc': {'count': len(positions)},
+            '$min': {'min_value': min(values)},
+            '$max': {'max_value': max(values)},
+            '$set': {'updated_at': now},
+            '$setOnInsert': {
+                'project': first['project'],
+                'unit': first['unit'],
+                'created_at': now,
+            },
+        }
+        if seq is None:
+            # Whichever bucket is open; readings at or before its floor may be in a sealed one
+            query['floor'] = {'$not': {'$gte': min(timestamps)}}
+            update['$setOnInsert']['seq'] = 0
+        else:
+            query['seq'] = seq
+            if floor is not None:
+                update['$setOnInsert']['floor'] = floor
+        if sealed:
+            update['$set']['sealed'] = True
+        return UpdateOne(query, update, upsert=True)
+
+    def _place(self, conflicts, docs, duplicates):
+        """
+        Targets for readings whose optimistic append collided: readings any
+        bucket of their time bucket already holds become duplicates, the rest
+        fill the open bucket or new overflow buckets
+        """
+        stored = self._stored_buckets(conflicts, docs)
+        targets, seals = [], []
+        for key, positions in conflicts.items():
+            buckets = stored.get(key, [])
+            held = set().union(*(bucket['hits'] for bucket in buckets))
+            remaining = []
+            for position in positions:
+                if truncate_to_millis(docs[position]['timestamp']) in held:
+                    duplicates.add(position)
+                else:
+                    remaining.append(position)
+            if not remaining:
+                continue
+
+            last = buckets[-1] if buckets else None
+            if last is not None and not last.get('sealed') and last['count'] + len(remaining) <= self.max_readings:
+                targets.append((key, last['seq'], remaining, None, False))
+                continue
+
+            if last is not None and not last.get('sealed'):
+                seals.append(UpdateOne({'_id': last['_id']}, {'$set': {'sealed': True}}))
+            seq = last['seq'] + 1 if last is not None else 0
+            floor = max((bucket['last'] for bucket in buckets if bucket.get('last')), default=None)
+            # Fill overflow buckets in timestamp order so each one's floor bounds the ones before it
+            remaining.sort(key=lambda position: docs[position]['timestamp'])
+            for i in range(0, len(remaining), self.max_readings):
+                chunk = remaining[i:i + self.max_readings]
+                targets.append((key, seq, chunk, floor, i + self.max_readings < len(remaining)))
+                floor = truncate_to_millis(docs[chunk[-1]]['timestamp'])
+                seq += 1
+
+        if seals:
+            # Sealed before the overflow buckets exist, so at most one bucket is ever open
+            DataPointBucket._get_collection().bulk_write(seals, ordered=False)
+        return targets
+
+    def _stored_buckets(self, conflicts, docs):
+        """
+        {(source, metric, bucket_start): buckets in seq order} with count,
+        sealed flag, latest timestamp and which of the conflicting
+        timestamps each holds
+        """
+        candidates = list({
+            truncate_to_millis(docs[position]['timestamp'])
+            for positions in conflicts.values() for position in positions
+        })
+        pipeline = [
+            {'$match': {'$or': [
+                {'data_source': source_id, 'metric_type': metric_type, 'bucket_start': start}
+                for source_id, metric_type, start in conflicts
+            ]}},
+            {'$project': {
+                'data_source': 1, 'metric_type': 1, 'bucket_start': 1, 'count': 1, 'sealed': 1,
+                'seq': {'$ifNull': ['$seq', 0]},
+                'last': {'$max': '$timestamps'},
+                'hits': {'$setIntersection': ['$timestamps', candidates]},
+            }},
+            {'$sort': {'seq': 1}},
+        ]
+        stored = defaultdict(list)
+        for bucket in _raw_collection(DataPointBucket).aggregate(pipeline):
+            bucket['hits'] = set(bucket['hits'])
+            stored[(bucket['data_source'], bucket['metric_type'], bucket['bucket_start'])].append(bucket)
+        return stored
+
+    def _iter_readings(self, data_source, project, metric_type, start, end, fields):
+        """Yield (bucket, timestamp, value) for readings inside [start, end] in timestamp order"""
+        start, end = naive_utc(start), naive_utc(end)
+        query = _base_filter(data_source, project, metric_type)
+        query.update(_range_filter(
+            'bucket_start',
+            bucket_start(start, self.bucket_seconds) if start is not None else None,
+            end
+        ))
+        cursor = DataPointBucket._get_collection().find(query, dict(fields, bucket_start=1)).sort('bucket_start', 1)
+        # Buckets sharing a bucket_start (other sources, overflow) overlap in time; later ones do not
+        for _, group in groupby(cursor, key=lambda bucket: bucket['bucket_start']):
+            for timestamp, value, bucket in _merged_readings(group):
+                if (start is None or timestamp >= start) and (end is None or timestamp <= end):
+                    yield bucket, timestamp, value
+
+    def iter_values(self, data_source=None, project=None, metric_type=None, start=None, end=None):
+        """Yield (timestamp, value) pairs in timestamp order"""
+        fields = {'_id': 0, 'timestamps': 1, 'values': 1}
+        for _, timestamp, value in self._iter_readings(data_source, project, metric_type, start, end, fields):
+            yield timestamp, value
+
+    def query(self, data_source=None, project=None, metric_type=None, start=None, end=None):
+        """
+        Yield unsaved DataPoint documents rebuilt from buckets in timestamp
+        order. This is a generator, not a QuerySet: it cannot be filtered,
+        ordered or paginated further, and the documents have no id or
+        validation fields (load_raw_payload still finds their payloads).
+        """
+        fields = {
+            'timestamps': 1, 'values': 1, 'data_source': 1, 'project': 1,
+            'metric_type': 1, 'unit': 1, 'created_at': 1,
+        }
+        for bucket, timestamp, value in self._iter_readings(data_source, project, metric_type, start, end, fields):
+            yield DataPoint._from_son({
+                'data_source': bucket['data_source'],
+                'project': bucket['project'],
+                'metric_type': bucket['metric_type'],
+                'value': value,
+                'unit': bucket.get('unit'),
+                'is_validated': False,
+                'timestamp': timestamp,
+                'created_at': bucket.get('created_at'),
+            })
+
+    def iter_columns(self, data_source, metric_type, start=None, end=None, chunk_size=DEFAULT_COLUMN_CHUNK_SIZE):
+        """Yield (timestamps_ms, values) NumPy chunks for readings in [start, end) in timestamp order"""
+        start, end = naive_utc(start), naive_utc(end)
+        match = _base_filter(data_source, None, metric_type)
+        match.update(_half_open_filter(
+            'bucket_start',
+            bucket_start(start, self.bucket_seconds) if start is not None else None,
+            end
+        ))
+        pipeline = [
+            {'$match': match},
+            {'$sort': {'bucket_start': 1}},
+            {'$project': {
+                '_id': 0,
+                's': '$bucket_start',
+                't': {'$map': {'input': '$timestamps', 'in': {'$toLong': '$$this'}}},
+                'v': '$values',
+            }},
+        ]
+        start_ms = to_epoch_ms(start) if start is not None else None
+        end_ms = to_epoch_ms(end) if end is not None else None
+
+        t_parts, v_parts, size, last_start = [], [], 0, None
+        for bucket in _raw_collection(DataPointBucket).aggregate(pipeline, allowDiskUse=True):
+            # Chunks end between time buckets, never between overflow buckets of one
+            if size >= chunk_size and bucket['s'] != last_start:
+                yield _sorted_columns(t_parts, v_parts, start_ms, end_ms)
+                t_parts, v_parts, size = [], [], 0
+            t_parts.append(np.asarray(bucket['t'], dtype=np.int64))
+            v_parts.append(np.asarray(bucket['v'], dtype=np.float64))
+            size += len(bucket['t'])
+            last_start = bucket['s']
+        if size:
+            yield _sorted_columns(t_parts, v_parts, start_ms, end_ms)
+
+    def remove_duplicates(self, batch_size=DEFAULT_DEDUPE_BATCH_SIZE):
+        """
+        Rewrite buckets holding the same timestamp more than once, keeping the
+        first copy. Returns (removed, affected project ids).
+        """
+        query = {'$expr': {'$ne': [
+            {'$size': {'$setUnion': ['$timestamps', []]}},
+            {'$size': '$timestamps'},
+        ]}}
+        collection = _raw_collection(DataPointBucket)
+        removed, projects, operations = 0, set(), []
+        for bucket in collection.find(query, {'project': 1, 'timestamps': 1, 'values': 1}):
+            seen, timestamps, values = set(), [], []
+            for timestamp, value in zip(bucket['timestamps'], bucket['values']):
+                if timestamp not in seen:
+                    seen.add(timestamp)
+                    timestamps.append(timestamp)
+                    values.append(value)
+            removed += len(bucket['timestamps']) - len(timestamps)
+            projects.add(bucket['project'])
+            operations.append(UpdateOne({'_id': bucket['_id']}, {'$set': {
+                'timestamps': timestamps,
+                'values': values,
+                'count': len(timestamps),
+                'min_value': min(values),
+                'max_value': max(values),
+                'updated_at': datetime.utcnow(),
+            }}))
+            if len(operations) >= batch_size:
+                collection.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+        return removed, projects
+
+
+def _sorted_columns(t_parts, v_parts, start_ms, end_ms):
+    # Buckets are disjoint in time but readings inside one arrive in any order
+    t = np.concatenate(t_parts)
+    v = np.concatenate(v_parts)
+    order = np.argsort(t, kind='stable')
+    t, v = t[order], v[order]
+    if start_ms is not None or end_ms is not None:
+        mask = np.ones(len(t), dtype=bool)
+        if start_ms is not None:
+            mask &= t >= start_ms
+        if end_ms is not None:
+            mask &= t < end_ms
+        t, v = t[mask], v[mask]
+    return t, v
+
+
+def get_point_store(layout=None):
+    """
+    Return the store for the configured DATA_INTAKE_STORAGE_LAYOUT, with
+    reads tiered over archived months when DATA_INTAKE_ARCHIVE_URI is set
+    """
+    layout = layout or getattr(settings, 'DATA_INTAKE_STORAGE_LAYOUT', StorageLayoutChoices.DOCUMENTS)
+    if layout == StorageLayoutChoices.BUCKETS:
+        store = BucketPointStore()
+    elif layout == StorageLayoutChoices.DOCUMENTS:
+        store = DocumentPointStore()
+    else:
+        raise ValueError(f'Unknown data point storage layout: {layout}')
+
+    if getattr(settings, 'DATA_INTAKE_ARCHIVE_URI', ''):
+        # Imported here: the archive module builds on this one
+        from apps.data_intake.archive import TieredPointStore
+        return TieredPointStore(store)
+    return store
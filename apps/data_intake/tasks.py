@@ -0,0 +1,72 @@
+"""
+Data Intake Celery tasks
+"""
+
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from celery import shared_task
+from pymongo.errors import PyMongoError
+
+from apps.data_intake.anomalies import detect_queued
+from apps.data_intake.async_ingest import fail_chunk, process_chunk, requeue_stale_chunks
+from apps.data_intake.uploads import fail_upload, process_queued_upload
+from apps.data_intake.validation import get_sweep_minutes, validate_ids, validate_pending
+
+
+MAX_CHUNK_RETRIES = 5
+MAX_UPLOAD_RETRIES = 5
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True, max_retries=MAX_CHUNK_RETRIES)
+def ingest_batch_chunk(self, chunk_id):
+    """Store one queued IngestBatchChunk; MongoDB errors are retried with backoff"""
+    try:
+        result = process_chunk(ObjectId(chunk_id))
+    except PyMongoError as e:
+        if self.request.retries >= self.max_retries:
+            fail_chunk(ObjectId(chunk_id), str(e))
+            return None
+        raise self.retry(exc=e, countdown=2 ** self.request.retries)
+    if result is None:
+        return None
+    return {'inserted': result.inserted, 'duplicates': result.duplicates, 'failed': result.failed}
+
+
+@shared_task(ignore_result=True)
+def requeue_ingest_chunks():
+    """Send queued ingest chunks again whose task was never sent or was lost (run by Celery beat)"""
+    return requeue_stale_chunks()
+
+@shared_task(bind=True, ignore_result=True, acks_late=True, reject_on_worker_lost=True, max_retries=MAX_UPLOAD_RETRIES)
+def process_manual_upload(self, upload_id):
+    """Process a queued ManualUpload; MongoDB errors are retried with backoff"""
+    try:
+        process_queued_upload(ObjectId(upload_id))
+    except PyMongoError as e:
+        if self.request.retries >= self.max_retries:
+            fail_upload(ObjectId(upload_id), str(e))
+            return
+        raise self.retry(exc=e, countdown=2 ** self.request.retries)
+
+
+@shared_task(ignore_result=True, acks_late=True)
+def validate_data_points(point_ids):
+    """Validate readings an API request stored (queued by schedule_validation)"""
+    return validate_ids([ObjectId(point_id) for point_id in point_ids])
+
+
+@shared_task(ignore_result=True, acks_late=True)
+def detect_data_point_anomalies(rows):
+    """Run readings an API request stored through anomaly detection (queued by schedule_detection)"""
+    detect_queued(rows)
+
+
+@shared_task(ignore_result=True)
+def validate_pending_points():
+    """
+    Validate readings whose validation task was never queued or was lost (run
+    by Celery beat). Readings younger than one sweep interval are left to their task.
+    """
+    created_before = datetime.utcnow() - timedelta(minutes=get_sweep_minutes())
+    return sum(sum(counts.values()) for counts in validate_pending(created_before=created_before))
@@ -0,0 +1,1174 @@
+"""
+Tests for the data intake ingestion pipeline
+"""
+
+import base64
+import io
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import zipfile
+from decimal import Decimal
+from datetime import datetime, timezone
+from unittest import mock
+
+from bson import ObjectId
+from django.test import SimpleTestCase
+from kombu.exceptions import OperationalError
+from pymongo.errors import AutoReconnect, BulkWriteError
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+import numpy as np
+
+from apps.api.numeric import DecimalAmountField, conversion_pipeline, legacy_filter, to_decimal
+from apps.api.pagination import KeysetPagination
+from apps.data_intake.activity import SourceActivity
+from apps.data_intake.async_ingest import add_points, enqueue_points, process_chunk, requeue_stale_chunks
+from apps.data_intake.anomalies import DEFAULT_DETECTOR_PARAMS, SeriesDetector, detect_queued, schedule_detection
+from apps.data_intake.archive import LocalArchiveBackend, TieredPointStore, archive_cutoff, archive_period, iter_archived_rows
+from apps.data_intake.downsampling import MinMaxBuckets, lttb
+from apps.data_intake.benchmark import ReadingGenerator, compare_results, latency_summary, size_growth
+from apps.data_intake.backfill import PeriodAccumulator, period_keys, period_window
+from apps.data_intake.aggregation import apply_rollups, period_bounds, summarize
+from apps.data_intake.models import (
+    ArchiveStatusChoices, DataAggregation, DataPoint, DataPointArchive, DataPointBucket, DataSourceTypeChoices,
+    DirtyAggregation, ManualUpload, RawPayloadRetentionChoices, StorageLayoutChoices, UploadFormatChoices,
+    UploadStatusChoices
+)
+from apps.data_intake.payloads import compress_payload, decompress_payload, detach_raw_payloads
+from apps.data_intake.quotas import MemoryQuotaStore, quota_from_metadata
+from apps.data_intake.resampling import (
+    CellStatus, GridAccumulator, InterpolationChoices, ResampleAggregateChoices, fill_gaps, gap_runs
+)
+from apps.data_intake.storage import BucketPointStore, bucket_start, naive_utc
+from apps.data_intake.satellite import (
+    buffer_ring, polygon_mask, read_npy, scene_statistics, stats_payloads, DEFAULT_BIOMASS_MODELS
+)
+from apps.data_intake.uploads import (
+    ColumnMapping, count_rows, iter_csv_rows, iter_xlsx_rows, normalize_unit, process_queued_upload, process_upload
+)
+from apps.data_intake.views import DataPointViewSet, DataSourceViewSet
+from apps.data_intake.validation import check_series, schedule_validation, stuck_runs, rate_violations, cross_source_violations
+from apps.data_intake.ingestion import (
+    IngestResult, parse_timestamp, parse_value, prepare_points, write_points, iter_ndjson_chunks
+)
+
+
+class IngestResultTests(SimpleTestCase):
+    """Test the compact per-row result bitmap"""
+
+    def test_bitmap_marks_stored_rows(self):
+        result = IngestResult(10)
+        for row in (0, 3, 9):
+            result.mark_ok(row)
+        result.mark_failed(1, 'invalid metric_type: X')
+
+        bitmap = base64.b64decode(result.bitmap)
+        self.assertEqual(bitmap, bytes([0b00001001, 0b00000010]))
+        self.assertEqual(result.inserted, 3)
+        self.assertEqual(result.failed, 1)
+
+    def test_error_indexes_include_offset(self):
+        result = IngestResult(2, offset=1000)
+        result.mark_failed(1, 'unit is required')
+        self.assertEqual(result.to_dict()['errors'], [{'index': 1001, 'error': 'unit is required'}])
+
+
+class ParsingTests(SimpleTestCase):
+    """Test payload field parsing"""
+
+    def test_parse_timestamp_normalises_to_naive_utc(self):
+        self.assertEqual(
+            parse_timestamp('2024-03-01T05:30:00+05:30'),
+            datetime(2024, 3, 1, 0, 0)
+        )
+        self.assertEqual(parse_timestamp(0), datetime(1970, 1, 1))
+
+    def test_parse_timestamp_rejects_garbage(self):
+        with self.assertRaises(ValueError):
+            parse_timestamp('yesterday')
+        with self.assertRaises(ValueError):
+            parse_timestamp(None)
+
+    def test_parse_value_rejects_non_numbers(self):
+        for value in (True, None, 'abc', 'NaN', 'Infinity'):
+            with self.assertRaises(ValueError):
+                parse_value(value)
+        self.assertEqual(parse_value('412.5'), parse_value(412.5))
+
+
+class PreparePointsTests(SimpleTestCase):
+    """Test single-pass validation of bulk payloads"""
+
+    def setUp(self):
+        self.source_id = ObjectId()
+        self.project_id = ObjectId()
+        patcher = mock.patch(
+            'apps.data_intake.ingestion.load_sources',
+            return_value={
+                self.source_id: {'_id': self.source_id, 'project': self.project_id, 'is_active': True},
+            }
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def point(self, **overrides):
+        payload = {
+            'data_source_id': str(self.source_id),
+            'metric_type': 'CO2_CONCENTRATION',
+            'value': 412.5,
+            'unit': 'ppm',
+            'timestamp': '2024-03-01T00:00:00Z',
+        }
+        payload.update(overrides)
+        return payload
+
+    def test_valid_points_become_documents(self):
+        docs, rows, errors = prepare_points([self.point(), self.point(value='7')])
+        self.assertEqual(errors, {})
+        self.assertEqual(rows, [0, 1])
+        self.assertEqual(docs[0]['project'], self.project_id)
+        self.assertEqual(docs[0]['data_source'], self.source_id)
+        self.assertEqual(docs[1]['value'], 7.0)
+
+    def test_out_of_range_rows_are_row_errors(self):
+        docs, rows, errors = prepare_points([
+            self.point(timestamp=1e20), self.point(timestamp=float('inf')), self.point(value='1e400'), self.point(),
+        ])
+        self.assertEqual(rows, [3])
+        self.assertEqual(errors, {
+            0: 'timestamp out of range', 1: 'timestamp out of range', 2: 'value out of range',
+        })
+
+    def test_values_keep_full_precision(self):
+        docs, _, _ = prepare_points([self.point(value='412.123456')])
+        self.assertIsInstance(docs[0]['value'], float)
+        self.assertEqual(docs[0]['value'], 412.123456)
+
+    def test_invalid_rows_are_reported_by_index(self):
+        docs, rows, errors = prepare_points([
+            self.point(),
+            self.point(metric_type='HUMIDITY'),
+            self.point(data_source_id=str(ObjectId())),
+            self.point(project_id=str(ObjectId())),
+            'not-an-object',
+        ])
+        self.assertEqual(rows, [0])
+        self.assertEqual(sorted(errors), [1, 2, 3, 4])
+        self.assertIn('metric_type', errors[1])
+
+
+class DedupTests(SimpleTestCase):
+    """Test that repeated readings are accepted as no-ops and never rolled up twice"""
+
+    def doc(self, source, minute, value=1.0):
+        return {
+            '_id': ObjectId(), 'data_source': source, 'project': ObjectId(),
+            'metric_type': 'RAINFALL', 'value': value, 'unit': 'mm',
+            'timestamp': datetime(2024, 1, 1, 0, minute, 0, 250),
+        }
+
+    def test_batch_and_stored_duplicates_are_not_rolled_up(self):
+        source = ObjectId()
+        docs = [self.doc(source, 0), self.doc(source, 1), self.doc(source, 0, value=9.0), self.doc(source, 2)]
+        store = mock.Mock()
+        # Position 1 of the deduplicated batch (minute 1) is already stored
+        store.write.return_value = ({}, {1})
+
+        with mock.patch('apps.data_intake.ingestion.apply_rollups') as apply_rollups, \
+                mock.patch('apps.data_intake.ingestion.schedule_validation'), \
+                mock.patch('apps.data_intake.ingestion.schedule_detection'), \
+                mock.patch('apps.data_intake.ingestion.record_activity'):
+            result = write_points(docs, [0, 1, 2, 3], IngestResult(4), store=store)
+
+        self.assertEqual(len(store.write.call_args[0][0]), 3)
+        self.assertEqual((result.inserted, result.duplicates, result.failed), (2, 2, 0))
+        self.assertEqual(base64.b64decode(result.bitmap), bytes([0b00001111]))
+        rolled_up = apply_rollups.call_args[0][0]
+        self.assertEqual([doc['timestamp'].minute for doc in rolled_up], [0, 2])
+        self.assertEqual(rolled_up[0]['value'], 1.0)
+
+
+class BulkIngestViewTests(SimpleTestCase):
+    """Test request body shapes of the bulk ingestion endpoint"""
+
+    def post(self, body):
+        request = APIRequestFactory().post('/data-points/bulk/', json.dumps(body), content_type='application/json')
+        force_authenticate(request, user=mock.Mock(is_authenticated=True))
+        return DataPointViewSet.as_view({'post': 'bulk'})(request)
+
+    def test_bodies_without_a_points_array_are_rejected(self):
+        for body in ('x', 5, True, None, [], {'points': 'x'}, {}):
+            with self.subTest(body=body):
+                response = self.post(body)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data['error'], 'Expected a non-empty array of data points')
+
+
+class ManualUploadViewTests(SimpleTestCase):
+    """Test how the upload endpoint handles bad mappings and spreadsheets too large for the request"""
+
+    def post(self, rows, mapping=None):
+        body = io.BytesIO(b'timestamp,value\n' + b'2024-01-01,1\n' * rows)
+        body.name = 'readings.csv'
+        data = {'file': body}
+        if mapping is not None:
+            data['mapping'] = json.dumps(mapping)
+        request = APIRequestFactory().post('/data-sources/x/upload/', data, format='multipart')
+        force_authenticate(request, user=mock.Mock(is_authenticated=True))
+        return DataSourceViewSet.as_view({'post': 'upload'})(request, pk=str(ObjectId()))
+
+    def setUp(self):
+        source = mock.Mock(type=DataSourceTypeChoices.MANUAL, _data={'project': ObjectId()})
+        sources = mock.Mock()
+        sources.return_value.only.return_value.first.return_value = source
+        for target, value in (
+            ('apps.data_intake.views.DataSource.objects', sources),
+            ('apps.data_intake.views.ManualUpload', mock.Mock()),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_oversized_file_is_refused_without_async_ingest(self):
+        with self.settings(DATA_INTAKE_ASYNC_INGEST=False, DATA_INTAKE_UPLOAD_MAX_ROWS=3), \
+                mock.patch('apps.data_intake.views.process_upload') as process:
+            self.assertEqual(self.post(4).status_code, 413)
+        process.assert_not_called()
+
+    def test_malformed_mapping_is_refused_before_anything_is_saved(self):
+        for mapping in ({'metrics': {'Trees': 5}}, {'metrics': ['Trees']}, {'defaults': 'mm'}, {'value': 3}):
+            with self.subTest(mapping=mapping), mock.patch('apps.data_intake.views.process_upload') as process:
+                response = self.post(1, mapping)
+                self.assertEqual(response.status_code, 400)
+                process.assert_not_called()
+
+    def test_file_is_queued_with_async_ingest(self):
+        with self.settings(DATA_INTAKE_ASYNC_INGEST=True, DATA_INTAKE_UPLOAD_MAX_ROWS=3), \
+                mock.patch('apps.data_intake.views.upload_summary', return_value={}), \
+                mock.patch('apps.data_intake.views.queue_upload') as queue, \
+                mock.patch('apps.data_intake.views.process_upload') as process:
+            self.assertEqual(self.post(4).status_code, 202)
+        queue.assert_called_once()
+        process.assert_not_called()
+
+
+class NDJSONChunkTests(SimpleTestCase):
+    """Test line-by-line NDJSON chunking"""
+
+    def test_chunks_are_fixed_size_and_skip_blank_lines(self):
+        body = io.BytesIO(b'{"a": 1}\n\n{"a": 2}\n{"a": 3}\n{"a": 4}\n{"a": 5}')
+        chunks = list(iter_ndjson_chunks(body, chunk_size=2, max_line_bytes=1024))
+        self.assertEqual([len(payloads) for payloads, _ in chunks], [2, 2, 1])
+        self.assertEqual(chunks[2][0], [{'a': 5}])
+
+    def test_bad_lines_keep_their_record_index(self):
+        long_line = b'{"a": "' + b'x' * 100 + b'"}\n'
+        body = io.BytesIO(b'{"a": 1}\nnot json\n' + long_line + b'{"a": 4}\n')
+        [(payloads, rejected)] = list(iter_ndjson_chunks(body, chunk_size=10, max_line_bytes=32))
+        self.assertEqual(payloads, [{'a': 1}, None, None, {'a': 4}])
+        self.assertEqual(rejected, {1: 'invalid JSON', 2: 'line exceeds 32 bytes'})
+
+
+class BucketLayoutTests(SimpleTestCase):
+    """Test time bucket boundaries for the bucketed storage layout"""
+
+    def test_bucket_start_floors_to_bucket(self):
+        self.assertEqual(bucket_start(datetime(2024, 3, 1, 13, 59, 59)), datetime(2024, 3, 1, 13))
+        self.assertEqual(bucket_start(datetime(2024, 3, 1, 13, 59), 900), datetime(2024, 3, 1, 13, 45))
+
+    def test_naive_utc_converts_aware_datetimes(self):
+        aware = parse_timestamp('2024-03-01T00:00:00Z').replace(tzinfo=timezone.utc)
+        self.assertEqual(naive_utc(aware), datetime(2024, 3, 1))
+
+    def bucket_store(self, max_readings):
+        collection = mock.Mock()
+        collection.with_options.return_value = collection
+        patcher = mock.patch.object(DataPointBucket, '_get_collection', return_value=collection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return BucketPointStore(3600, max_readings), collection
+
+    def readings(self, source_id, minutes):
+        return [
+            {'data_source': source_id, 'project': ObjectId(), 'metric_type': 'CO2_CONCENTRATION', 'unit': 'ppm',
+             'timestamp': datetime(2024, 3, 1, 13, minute), 'value': float(minute)}
+            for minute in minutes
+        ]
+
+    def test_full_bucket_overflows_and_dedups_across_buckets(self):
+        store, collection = self.bucket_store(max_readings=3)
+        source_id, start = ObjectId(), datetime(2024, 3, 1, 13)
+        docs = self.readings(source_id, [5, 20, 21])
+        conflict = BulkWriteError({'writeErrors': [{'index': 0, 'code': 11000, 'errmsg': 'E11000'}]})
+        collection.bulk_write.side_effect = [conflict, None, None]
+        collection.aggregate.return_value = [
+            {'_id': ObjectId(), 'data_source': source_id, 'metric_type': 'CO2_CONCENTRATION', 'bucket_start': start,
+             'seq': 0, 'count': 3, 'sealed': True, 'last': datetime(2024, 3, 1, 13, 9), 'hits': [docs[0]['timestamp']]},
+            {'_id': ObjectId(), 'data_source': source_id, 'metric_type': 'CO2_CONCENTRATION', 'bucket_start': start,
+             'seq': 1, 'count': 2, 'sealed': False, 'last': datetime(2024, 3, 1, 13, 15), 'hits': []},
+        ]
+
+        failed, duplicates = store.write(docs)
+
+        self.assertEqual((failed, duplicates), ({}, {0}))
+        first = collection.bulk_write.call_args_list[0][0][0][0]
+        self.assertEqual(first._filter['floor'], {'$not': {'$gte': docs[0]['timestamp']}})
+        seal = collection.bulk_write.call_args_list[1][0][0][0]
+        self.assertEqual(seal._doc, {'$set': {'sealed': True}})
+        overflow = collection.bulk_write.call_args_list[2][0][0][0]
+        self.assertEqual(overflow._filter['seq'], 2)
+        self.assertEqual(overflow._doc['$push']['timestamps']['$each'], [docs[1]['timestamp'], docs[2]['timestamp']])
+        self.assertEqual(overflow._doc['$setOnInsert']['floor'], datetime(2024, 3, 1, 13, 15))
+
+    def test_oversized_batch_fills_sealed_overflow_buckets_in_order(self):
+        store, collection = self.bucket_store(max_readings=2)
+        docs = self.readings(ObjectId(), [30, 10, 20, 40, 50])
+        collection.aggregate.return_value = []
+
+        self.assertEqual(store.write(docs), ({}, set()))
+        collection.bulk_write.assert_called_once()
+        targets = collection.bulk_write.call_args[0][0]
+        self.assertEqual([op._filter['seq'] for op in targets], [0, 1, 2])
+        self.assertEqual(
+            [[t.minute for t in op._doc['$push']['timestamps']['$each']] for op in targets],
+            [[10, 20], [30, 40], [50]]
+        )
+        self.assertEqual([op._doc['$set'].get('sealed') for op in targets], [True, True, None])
+        self.assertEqual(targets[2]._doc['$setOnInsert']['floor'], datetime(2024, 3, 1, 13, 40))
+
+    def test_reads_merge_buckets_of_one_time_bucket(self):
+        store, collection = self.bucket_store(max_readings=2)
+        start = datetime(2024, 3, 1, 13)
+        collection.find.return_value.sort.return_value = [
+            {'bucket_start': start, 'timestamps': [start.replace(minute=40), start.replace(minute=10)], 'values': [4, 1]},
+            {'bucket_start': start, 'timestamps': [start.replace(minute=20)], 'values': [2]},
+            {'bucket_start': start.replace(hour=14), 'timestamps': [start.replace(hour=14)], 'values': [5]},
+        ]
+        self.assertEqual([value for _, value in store.iter_values(project=ObjectId())], [1, 2, 4, 5])
+
+
+class RollupTests(SimpleTestCase):
+    """Test period bucketing and in-batch pre-aggregation for rollups"""
+
+    def test_period_bounds(self):
+        ts = datetime(2024, 12, 18, 15, 30)  # A Wednesday
+        self.assertEqual(period_bounds('DAILY', ts), (datetime(2024, 12, 18), datetime(2024, 12, 19)))
+        self.assertEqual(period_bounds('WEEKLY', ts), (datetime(2024, 12, 16), datetime(2024, 12, 23)))
+        self.assertEqual(period_bounds('MONTHLY', ts), (datetime(2024, 12, 1), datetime(2025, 1, 1)))
+
+    def test_summarize_groups_by_source_metric_and_period(self):
+        project, source = ObjectId(), ObjectId()
+        docs = [
+            {'project': project, 'data_source': source, 'metric_type': 'RAINFALL',
+             'value': value, 'unit': 'mm', 'timestamp': ts}
+            for value, ts in [
+                (4.0, datetime(2024, 1, 1, 1)),
+                (1.0, datetime(2024, 1, 1, 23)),
+                (7.0, datetime(2024, 1, 2, 0)),
+            ]
+        ]
+        summaries = summarize(docs, ['DAILY', 'MONTHLY'])
+        first_day = summaries[(project, source, 'RAINFALL', 'DAILY', datetime(2024, 1, 1))]
+        month = summaries[(project, source, 'RAINFALL', 'MONTHLY', datetime(2024, 1, 1))]
+        self.assertEqual((first_day['count'], first_day['sum'], first_day['min'], first_day['max']), (2, 5.0, 1.0, 4.0))
+        self.assertEqual((month['count'], month['sum'], month['max']), (3, 12.0, 7.0))
+        self.assertEqual(len(summaries), 3)
+
+    def test_failed_rollups_are_marked_dirty(self):
+        project, source = ObjectId(), ObjectId()
+        docs = [{'project': project, 'data_source': source, 'metric_type': 'RAINFALL', 'value': 1.0, 'unit': 'mm',
+                 'timestamp': datetime(2024, 1, 1, 1)}]
+        aggregations, dirty = mock.Mock(), mock.Mock()
+        aggregations.bulk_write.side_effect = BulkWriteError({'writeErrors': [{'index': 1, 'code': 2, 'errmsg': 'x'}]})
+        with mock.patch.object(DataAggregation, '_get_collection', return_value=aggregations), \
+                mock.patch.object(DirtyAggregation, '_get_collection', return_value=dirty):
+            self.assertEqual(apply_rollups(docs, ['HOURLY', 'DAILY']), 2)
+            markers = dirty.bulk_write.call_args[0][0]
+            self.assertEqual([marker._filter['period'] for marker in markers], ['DAILY'])
+            self.assertEqual(markers[0]._filter['period_start'], datetime(2024, 1, 1))
+
+            aggregations.bulk_write.side_effect = AutoReconnect('primary stepped down')
+            apply_rollups(docs, ['HOURLY', 'DAILY'])
+            self.assertEqual(len(dirty.bulk_write.call_args[0][0]), 2)
+
+
+class BackfillTests(SimpleTestCase):
+    """Test vectorized period statistics used by aggregation rebuilds"""
+
+    def test_vectorized_periods_match_rollup_periods(self):
+        timestamps = [datetime(2023, 12, 31, 23, 59), datetime(2024, 1, 1), datetime(2024, 2, 29, 12)]
+        ms = np.array([int((ts - datetime(1970, 1, 1)).total_seconds() * 1000) for ts in timestamps])
+        for period in ('DAILY', 'WEEKLY', 'MONTHLY'):
+            for ts, key in zip(timestamps, period_keys(period, ms)):
+                self.assertEqual(period_window(period, key), period_bounds(period, ts))
+
+    def test_accumulator_is_independent_of_chunking(self):
+        day_ms = 86400000
+        timestamps = np.arange(0, 10 * day_ms, day_ms // 24, dtype=np.int64)
+        values = np.arange(len(timestamps), dtype=np.float64)
+
+        def run(chunk):
+            acc = PeriodAccumulator('DAILY')
+            stats = []
+            for i in range(0, len(values), chunk):
+                stats.extend(acc.feed(timestamps[i:i + chunk], values[i:i + chunk]))
+            return stats + acc.flush()
+
+        whole, chunked = run(len(values)), run(7)
+        self.assertEqual(len(whole), 10)
+        self.assertEqual([key for key, _ in whole], [key for key, _ in chunked])
+        self.assertEqual([s['sum'] for _, s in whole], [s['sum'] for _, s in chunked])
+        self.assertEqual(whole[0][1]['count'], 24)
+        self.assertEqual(whole[0][1]['percentiles']['p50'], 11.5)
+
+
+class DownsamplingTests(SimpleTestCase):
+    """Test streaming min/max buckets and LTTB selection"""
+
+    def test_minmax_buckets_match_whole_series(self):
+        t = np.arange(1000, dtype=np.int64) * 1000
+        v = np.sin(np.arange(1000) / 10.0)
+        v[123] = 50.0
+        state = MinMaxBuckets(0, 1000 * 1000, 10)
+        for i in range(0, 1000, 333):
+            state.add(t[i:i + 333], v[i:i + 333])
+
+        rows = state.rows()
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(sum(row[4] for row in rows), 1000)
+        self.assertEqual(rows[1][2], 50.0)
+        self.assertAlmostEqual(rows[0][1], v[:100].min())
+
+    def test_lttb_keeps_endpoints_and_spikes(self):
+        t = np.arange(5000, dtype=np.int64)
+        v = np.zeros(5000)
+        v[2500] = 100.0
+        sampled_t, sampled_v = lttb(t, v, 50)
+        self.assertEqual(len(sampled_t), 50)
+        self.assertEqual((sampled_t[0], sampled_t[-1]), (0, 4999))
+        self.assertIn(100.0, sampled_v)
+        self.assertTrue(np.all(np.diff(sampled_t) > 0))
+
+
+class ValidationTests(SimpleTestCase):
+    """Test the vectorized validation checks"""
+
+    rules = {
+        'ranges': {'%': (0, 100)},
+        'max_rate_per_hour': {'%': 30},
+        'stuck_readings': 4,
+        'cross_source_tolerance': 0.5,
+    }
+
+    def test_stuck_runs_mark_whole_run(self):
+        mask = stuck_runs(np.array([1.0, 2.0, 2.0, 2.0, 2.0, 3.0, 3.0]), 4)
+        self.assertEqual(mask.tolist(), [False, True, True, True, True, False, False])
+
+    def test_rate_uses_elapsed_hours(self):
+        t = np.array([0, 3600000, 3600000 * 3], dtype=np.int64)
+        v = np.array([10.0, 50.0, 90.0])
+        self.assertEqual(rate_violations(t, v, 30).tolist(), [False, True, False])
+
+    def test_cross_source_compares_to_hour_median(self):
+        t = np.array([0, 60000, 3600000], dtype=np.int64)
+        v = np.array([10.0, 30.0, 30.0])
+        hours = np.array([0], dtype=np.int64)
+        mask = cross_source_violations(t, v, hours, np.array([12.0]), 0.5)
+        # The third reading's hour has no peers and is not checked
+        self.assertEqual(mask.tolist(), [False, True, False])
+
+    def test_statuses_and_notes(self):
+        t = np.arange(6, dtype=np.int64) * 60000
+        v = np.array([20.0, 120.0, 20.0, 20.0, 20.0, 20.0])
+        units = np.array(['%', '%', '%', '%', '%', 'm3/m3'], dtype=object)
+        status, notes = check_series(t, v, units, t, v, self.rules)
+
+        self.assertEqual(status.tolist(), [
+            'PASS', 'FAIL', 'REQUIRES_REVIEW', 'REQUIRES_REVIEW', 'REQUIRES_REVIEW', 'REQUIRES_REVIEW'
+        ])
+        self.assertEqual(notes[0], '')
+        self.assertEqual(notes[1], 'range, rate')
+        self.assertEqual(notes[2], 'rate, stuck')
+        self.assertEqual(notes[5], 'unit, stuck')
+
+    def test_context_readings_are_not_reported(self):
+        context_t = np.arange(5, dtype=np.int64) * 60000
+        context_v = np.full(5, 20.0)
+        status, notes = check_series(
+            context_t[-1:], context_v[-1:], np.array(['%'], dtype=object), context_t, context_v, self.rules
+        )
+        self.assertEqual(status.tolist(), ['REQUIRES_REVIEW'])
+        self.assertEqual(notes.tolist(), ['stuck'])
+
+    def test_request_batches_are_queued_instead_of_validated(self):
+        docs = [
+            {'_id': ObjectId(), 'project': ObjectId(), 'data_source': ObjectId(), 'metric_type': 'SOIL_MOISTURE',
+             'value': 20.0, 'unit': '%', 'timestamp': datetime(2024, 1, 1)}
+            for _ in range(3)
+        ]
+        with mock.patch('apps.data_intake.tasks.validate_data_points') as task, \
+                mock.patch('apps.data_intake.validation.validate_points') as validate_points, \
+                mock.patch('apps.data_intake.validation.TASK_BATCH_SIZE', 2):
+            schedule_validation(docs)
+            validate_points.assert_not_called()
+            self.assertEqual([call[0][0] for call in task.delay.call_args_list], [
+                [str(docs[0]['_id']), str(docs[1]['_id'])], [str(docs[2]['_id'])]
+            ])
+
+            schedule_validation(docs, inline=True)
+            self.assertEqual(len(validate_points.call_args[0][0]), 3)
+
+            task.delay.side_effect = OperationalError('broker unavailable')
+            schedule_validation(docs)
+
+
+class SatelliteTests(SimpleTestCase):
+    """Test raster footprint masking and tiled NDVI statistics"""
+
+    def write_scene(self, directory, red, nir):
+        path = os.path.join(directory, 'scene.npy')
+        np.save(path, np.stack([red, nir]))
+        with open(os.path.join(directory, 'scene.json'), 'w') as handle:
+            json.dump({'transform': [10.0, 0.01, 1.0, -0.01], 'nodata': 0, 'acquired_at': '2024-06-01T10:00:00Z'}, handle)
+        return path
+
+    def test_polygon_mask_handles_holes(self):
+        outer = np.array([[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]], dtype=float)
+        hole = np.array([[4, 4], [6, 4], [6, 6], [4, 6], [4, 4]], dtype=float)
+        centers = np.arange(12) - 0.5
+        mask = polygon_mask([outer, hole], centers, centers)
+        self.assertTrue(mask[2, 2])
+        self.assertFalse(mask[5, 5])
+        self.assertFalse(mask[0, 5])
+        self.assertEqual(mask.sum(), 100 - 4)
+
+    def test_tiled_statistics_match_single_tile(self):
+        rng = np.random.default_rng(0)
+        red = rng.uniform(100, 500, (100, 100)).astype(np.float32)
+        nir = rng.uniform(500, 3000, (100, 100)).astype(np.float32)
+        red[10, 10] = 0  # nodata
+        ring = buffer_ring(10.5, 0.5, 3000)
+        model = DEFAULT_BIOMASS_MODELS['GREEN']
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write_scene(directory, red, nir)
+            scene = read_npy(path)
+            self.assertIsInstance(scene.bands[0], np.memmap)
+            window = scene.window((10.0, 0.0, 11.0, 1.0))
+            footprint = (window, 0, 1, [ring], model, 0.0)
+            single = scene_statistics(path, [footprint], tile_size=100)[0]
+            tiled = scene_statistics(path, [footprint], tile_size=7)[0]
+
+        self.assertEqual(single['pixels'], tiled['pixels'])
+        self.assertGreater(single['pixels'], 0)
+        self.assertAlmostEqual(single['ndvi_sum'], tiled['ndvi_sum'])
+        self.assertAlmostEqual(single['biomass_t'], tiled['biomass_t'], places=4)
+        self.assertTrue((single['ndvi_hist'] == tiled['ndvi_hist']).all())
+
+        payloads = stats_payloads(ObjectId(), tiled, scene.acquired_at, 'scene.npy', model)
+        self.assertEqual([p['metric_type'] for p in payloads], ['VEGETATION_INDEX', 'BIOMASS_INDEX'])
+        self.assertTrue(-1 <= payloads[0]['value'] <= 1)
+        self.assertEqual(payloads[1]['unit'], 't/ha')
+
+
+class SourceActivityTests(SimpleTestCase):
+    """Test write-behind coalescing of last_data_received"""
+
+    def test_batches_coalesce_into_one_max_update_per_source(self):
+        hot, quiet = ObjectId(), ObjectId()
+        activity = SourceActivity(flush_seconds=3600)
+        with mock.patch('apps.data_intake.activity.DataSource') as data_source:
+            collection = data_source._get_collection.return_value
+            activity.record([
+                {'data_source': hot, 'timestamp': datetime(2024, 1, 1, 0, 5)},
+                {'data_source': hot, 'timestamp': datetime(2024, 1, 1, 0, 1)},
+            ])
+            activity.record([
+                {'data_source': hot, 'timestamp': datetime(2024, 1, 1, 0, 3)},
+                {'data_source': quiet, 'timestamp': datetime(2024, 1, 1, 0, 0)},
+            ])
+            collection.bulk_write.assert_not_called()
+
+            self.assertEqual(activity.flush(), 2)
+            self.assertEqual(activity.flush(), 0)
+
+        operations = collection.bulk_write.call_args[0][0]
+        updates = {op._filter['_id']: op._doc['$max']['last_data_received'] for op in operations}
+        self.assertEqual(updates, {hot: datetime(2024, 1, 1, 0, 5), quiet: datetime(2024, 1, 1, 0, 0)})
+
+    def test_pending_readings_flush_without_another_batch(self):
+        flushed = threading.Event()
+        activity = SourceActivity(flush_seconds=0.05)
+        with mock.patch('apps.data_intake.activity.DataSource') as data_source:
+            data_source._get_collection.return_value.bulk_write.side_effect = lambda *args, **kwargs: flushed.set()
+            activity.record([{'data_source': ObjectId(), 'timestamp': datetime(2024, 1, 1)}])
+            self.assertTrue(flushed.wait(5))
+        self.assertEqual(activity._pending, {})
+
+
+class KeysetPaginationTests(SimpleTestCase):
+    """Test opaque cursors and the resume filter used for data_points listings"""
+
+    def test_cursor_round_trip(self):
+        paginator = KeysetPagination()
+        position = (datetime(2024, 5, 1, 12, 0, 0, 123000), ObjectId())
+        request = mock.Mock(query_params={'cursor': paginator.encode_cursor(position)})
+        value, last_id = paginator.decode_cursor(request)
+        self.assertEqual(naive_utc(value), position[0])
+        self.assertEqual(last_id, position[1])
+
+    def test_resume_filter_breaks_timestamp_ties_on_id(self):
+        paginator = KeysetPagination()
+        paginator.field = 'timestamp'
+        last_id = ObjectId()
+        stamp = datetime(2024, 5, 1)
+        self.assertEqual(paginator.after(mock.Mock(_document=DataPoint), stamp, last_id), {'$or': [
+            {'timestamp': {'$lt': stamp}},
+            {'timestamp': stamp, '_id': {'$lt': last_id}},
+        ]})
+
+
+class ManualUploadTests(SimpleTestCase):
+    """Test streaming spreadsheet parsing, column mapping and unit normalization"""
+
+    def xlsx(self, rows):
+        ns = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+        cells = []
+        for number, row in enumerate(rows, start=1):
+            xml = ''.join(
+                f'<c r="{column}{number}" t="inlineStr"><is><t>{value}</t></is></c>' if isinstance(value, str)
+                # (type, raw) writes a cell as is, e.g. a shared string index
+                else f'<c r="{column}{number}" t="{value[0]}"><v>{value[1]}</v></c>' if isinstance(value, tuple)
+                else f'<c r="{column}{number}"><v>{value}</v></c>'
+                for column, value in row
+            )
+            cells.append(f'<row r="{number}">{xml}</row>')
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('xl/workbook.xml', (
+                f'<workbook xmlns="{ns}" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                '<sheets><sheet name="Data" sheetId="1" r:id="rId1"/></sheets></workbook>'
+            ))
+            archive.writestr('xl/_rels/workbook.xml.rels', (
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                '<Relationship Id="rId1" Target="worksheets/sheet1.xml"/></Relationships>'
+            ))
+            archive.writestr('xl/worksheets/sheet1.xml', (
+                f'<worksheet xmlns="{ns}"><sheetData>{"".join(cells)}</sheetData></worksheet>'
+            ))
+        buffer.seek(0)
+        return buffer
+
+    def test_xlsx_rows_keep_column_positions(self):
+        rows = list(iter_xlsx_rows(self.xlsx([
+            [('A', 'Date'), ('B', 'Rain (in)'), ('C', 'Trees')],
+            [('A', 45292), ('C', 12)],
+        ])))
+        self.assertEqual(rows[0], (1, ['Date', 'Rain (in)', 'Trees']))
+        self.assertEqual(rows[1], (2, [45292.0, '', 12.0]))
+
+    def test_wide_mapping_skips_blank_cells_and_reads_excel_dates(self):
+        mapping = ColumnMapping(
+            {'timestamp': 'Date', 'metrics': {'Rain (in)': {'metric_type': 'RAINFALL', 'unit': 'in'}, 'Trees': 'TREE_COUNT'}},
+            ['Date', 'Rain (in)', 'Trees'],
+        )
+        readings = list(mapping.readings([45292.0, '', 12.0]))
+        self.assertEqual(readings, [('Trees', 'TREE_COUNT', 12.0, '', datetime(2024, 1, 1))])
+
+    def test_long_mapping_from_csv(self):
+        data = io.BytesIO('\ufefftimestamp,Metric,value,unit\n2024-03-01,RAINFALL,0.5,inches\n,RAINFALL,1,mm\n'.encode('utf-8'))
+        rows = iter_csv_rows(data)
+        mapping = ColumnMapping({'metric_type': 'Metric'}, next(rows)[1])
+        number, values = next(rows)
+        self.assertEqual(number, 2)
+        (column, metric_type, value, unit, timestamp), = mapping.readings(values)
+        self.assertEqual((metric_type, timestamp), ('RAINFALL', datetime(2024, 3, 1)))
+        self.assertEqual(normalize_unit(metric_type, Decimal(value), unit), (Decimal('12.70'), 'mm'))
+        with self.assertRaises(ValueError):
+            list(mapping.readings(next(rows)[1]))
+
+    def test_missing_column_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ColumnMapping({'timestamp': 'When'}, ['Date', 'value', 'metric_type', 'unit'])
+
+    def upload(self, mapping):
+        return mock.Mock(
+            pk=ObjectId(), format=UploadFormatChoices.XLSX, column_mapping=mapping,
+            rows=0, inserted=0, duplicates=0, failed=0, error=None, error_report=mock.Mock(),
+        )
+
+    def test_unreadable_cells_and_dates_reject_only_their_row(self):
+        data = self.xlsx([
+            [('A', 'Date'), ('B', 'Trees')],
+            [('A', 1e10), ('B', 1)],
+            [('A', 45292), ('B', 2)],
+            [('A', 45293), ('B', ('s', 7))],
+        ])
+        upload = self.upload({'timestamp': 'Date', 'metrics': {'Trees': 'TREE_COUNT'}, 'defaults': {'unit': 'trees'}})
+        result = mock.Mock(inserted=1, duplicates=0, errors={})
+        reports = []
+        upload.error_report.put.side_effect = lambda report, **kwargs: reports.append(report.read())
+        with mock.patch('apps.data_intake.uploads.ingest_points', return_value=result) as ingest:
+            process_upload(upload, data)
+
+        self.assertEqual(upload.status, UploadStatusChoices.COMPLETED)
+        self.assertEqual((upload.rows, upload.inserted, upload.failed), (3, 1, 2))
+        [payload] = ingest.call_args[0][0]
+        self.assertEqual(payload['timestamp'], datetime(2024, 1, 1))
+        report = reports[0].decode('utf-8').splitlines()
+        self.assertEqual([line.split(',')[0] for line in report[1:]], ['2', '4'])
+        self.assertIn('timestamp out of range', report[1])
+
+    def test_unexpected_errors_fail_the_upload(self):
+        upload = self.upload({'metrics': {'Trees': 'TREE_COUNT'}})
+        data = self.xlsx([[('A', 'timestamp'), ('B', 'Trees')], [('A', 45292), ('B', 1)]])
+        with mock.patch('apps.data_intake.uploads.ingest_points', side_effect=RuntimeError('disk full')):
+            process_upload(upload, data)
+        self.assertEqual(upload.status, UploadStatusChoices.FAILED)
+        self.assertEqual(upload.error, 'upload could not be processed: disk full')
+        upload.save.assert_called_once_with()
+
+    def test_row_count_stops_past_the_limit_and_rewinds(self):
+        data = io.BytesIO(b'timestamp,value\n' + b'2024-01-01,1\n,\n' * 5)
+        self.assertEqual(count_rows(data, UploadFormatChoices.CSV, 3), 4)
+        self.assertEqual(data.tell(), 0)
+        self.assertEqual(count_rows(data, UploadFormatChoices.CSV, 10), 5)
+        self.assertEqual(count_rows(io.BytesIO(b'not a zip'), UploadFormatChoices.XLSX, 10), 0)
+
+    def test_queued_upload_starts_over_with_fresh_counts(self):
+        upload = mock.Mock(rows=7, inserted=5, duplicates=0, failed=2, error='worker lost')
+        with mock.patch.object(ManualUpload, 'objects') as objects, \
+                mock.patch('apps.data_intake.uploads.process_upload') as process:
+            objects.return_value.first.return_value = upload
+            self.assertIs(process_queued_upload(ObjectId()), upload)
+
+        upload.error_report.delete.assert_called_once_with()
+        process.assert_called_once_with(upload, upload.source_file.get.return_value)
+        self.assertEqual((upload.rows, upload.inserted, upload.failed, upload.error), (0, 0, 0, None))
+        upload.source_file.delete.assert_called_once_with()
+
+
+class ArchiveTests(SimpleTestCase):
+    """Test archive cutoffs and tiered reads over archived months"""
+
+    def test_cutoff_keeps_whole_months_hot(self):
+        self.assertEqual(archive_cutoff(datetime(2024, 3, 15), months=12), datetime(2023, 3, 1))
+        self.assertEqual(archive_cutoff(datetime(2024, 1, 1), months=1), datetime(2023, 12, 1))
+
+    def test_tiered_reads_merge_archive_with_late_hot_rows(self):
+        day_ms = 86400000
+        jan, feb = datetime(2024, 1, 1), datetime(2024, 2, 1)
+        jan_ms = int((jan - datetime(1970, 1, 1)).total_seconds() * 1000)
+        archive = mock.Mock(period_start=jan, period_end=feb)
+
+        def hot_columns(source, metric, start, end, chunk_size):
+            if start == jan:
+                # A late arrival plus a row whose purge was interrupted
+                yield np.array([jan_ms + 2 * day_ms, jan_ms + day_ms]), np.array([9.0, 1.0])
+            elif start == feb:
+                yield np.array([jan_ms + 40 * day_ms]), np.array([5.0])
+
+        hot = mock.Mock()
+        hot.iter_columns.side_effect = hot_columns
+        archived = (np.array([jan_ms, jan_ms + day_ms]), np.array([0.0, 1.0]))
+        with mock.patch('apps.data_intake.archive.archived_parts', return_value=[archive]), \
+                mock.patch('apps.data_intake.archive.read_archived_columns', return_value=archived):
+            chunks = list(TieredPointStore(hot).iter_columns(ObjectId(), 'RAINFALL', jan, None))
+
+        t = np.concatenate([chunk[0] for chunk in chunks])
+        v = np.concatenate([chunk[1] for chunk in chunks])
+        self.assertEqual(((t - jan_ms) // day_ms).tolist(), [0, 1, 2, 40])
+        self.assertEqual(v.tolist(), [0.0, 1.0, 9.0, 5.0])
+
+
+    def test_archive_period_exports_series_then_deletes_rows(self):
+        project, source = ObjectId(), ObjectId()
+        docs = [
+            {'_id': ObjectId(), 'data_source': source, 'metric_type': metric, 'unit': 'mm',
+             'timestamp': datetime(2024, 1, day), 'value': float(day), 'is_validated': True}
+            for metric in ('RAINFALL', 'TEMPERATURE') for day in (1, 2, 3)
+        ]
+        docs[4]['unit'] = 'C'
+        collection = mock.Mock()
+        collection.find.return_value.sort.return_value = iter(docs)
+        collection.delete_many.return_value.deleted_count = len(docs)
+        statuses = []
+
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch('apps.data_intake.archive.get_point_store',
+                           return_value=mock.Mock(layout=StorageLayoutChoices.DOCUMENTS)), \
+                mock.patch.object(DataPoint, '_get_collection', return_value=collection), \
+                mock.patch.object(DataPointArchive, 'objects', return_value=[]), \
+                mock.patch.object(DataPointArchive, 'save', autospec=True,
+                                  side_effect=lambda archive: statuses.append(archive.status)) as save, \
+                mock.patch('apps.data_intake.archive.attach_raw_payloads', side_effect=lambda batch: batch), \
+                mock.patch('apps.data_intake.archive.delete_raw_payloads') as delete_payloads:
+            summary = archive_period(project, datetime(2024, 1, 15), LocalArchiveBackend(directory))
+            archive = save.call_args[0][0]
+            with mock.patch('apps.data_intake.archive.archived_parts', return_value=[archive]):
+                rows = list(iter_archived_rows(source, 'TEMPERATURE', datetime(2024, 1, 2)))
+            self.assertTrue(os.path.exists(summary['uri'][len('file://'):]))
+
+        self.assertEqual(summary['period_start'], datetime(2024, 1, 1))
+        self.assertEqual((summary['part'], summary['rows'], summary['deleted']), (0, 6, 6))
+        self.assertEqual([series['metric_type'] for series in archive.series], ['RAINFALL', 'TEMPERATURE'])
+        # The manifest is saved as ARCHIVED before any row is deleted
+        self.assertEqual(statuses, [ArchiveStatusChoices.ARCHIVED, ArchiveStatusChoices.PURGED])
+        deleted_ids = collection.delete_many.call_args[0][0]['_id']['$in']
+        self.assertEqual(sorted(deleted_ids), sorted(doc['_id'] for doc in docs))
+        delete_payloads.assert_called_once_with(deleted_ids)
+
+        self.assertEqual([row['_id'] for row in rows], [docs[4]['_id'], docs[5]['_id']])
+        self.assertEqual([row['value'] for row in rows], [2.0, 3.0])
+        self.assertEqual([row['unit'] for row in rows], ['C', 'mm'])
+        self.assertTrue(all(row['is_validated'] and row['project'] == project for row in rows))
+
+class RawPayloadTests(SimpleTestCase):
+    """Test raw payload retention modes and compression"""
+
+    def docs(self, count):
+        return [
+            {'_id': ObjectId(), 'data_source': ObjectId(), 'raw_payload': {'device': f'gw-{i}', 'rssi': -70 - i}}
+            for i in range(count)
+        ]
+
+    def test_payload_round_trip_with_either_codec(self):
+        payload = {'device': 'gw-1', 'readings': [1.5, 2.5], 'at': datetime(2024, 1, 1, 12, 0)}
+        codec, data, size = compress_payload(payload)
+        self.assertEqual(decompress_payload(codec, data), payload)
+        with mock.patch('apps.data_intake.payloads.zstandard', None):
+            codec, data, _ = compress_payload(payload)
+            self.assertEqual(codec, 'zlib')
+            self.assertEqual(decompress_payload(codec, data), payload)
+
+    def test_retention_modes(self):
+        docs = self.docs(3)
+        self.assertEqual(detach_raw_payloads(docs, RawPayloadRetentionChoices.INLINE), {})
+        self.assertTrue(all('raw_payload' in doc for doc in docs))
+
+        pending = detach_raw_payloads(docs, RawPayloadRetentionChoices.COMPRESSED)
+        self.assertEqual(set(pending), {doc['_id'] for doc in docs})
+        self.assertFalse(any('raw_payload' in doc for doc in docs))
+
+        docs = self.docs(3)
+        self.assertEqual(detach_raw_payloads(docs, RawPayloadRetentionChoices.NONE), {})
+        self.assertFalse(any('raw_payload' in doc for doc in docs))
+
+    def test_sampling_is_deterministic(self):
+        docs = self.docs(2000)
+        sampled = detach_raw_payloads([dict(doc) for doc in docs], RawPayloadRetentionChoices.SAMPLED, 0.25)
+        again = detach_raw_payloads([dict(doc) for doc in docs], RawPayloadRetentionChoices.SAMPLED, 0.25)
+        self.assertEqual(set(sampled), set(again))
+        self.assertTrue(350 < len(sampled) < 650)
+
+
+class IngestQuotaTests(SimpleTestCase):
+    """Test token-bucket ingest quotas"""
+
+    def setUp(self):
+        self.now = 0.0
+        self.store = MemoryQuotaStore(clock=lambda: self.now)
+
+    def test_bucket_refills_at_rate(self):
+        self.assertEqual(self.store.take([('source:a', 10, 2.0, 10)]), 0)
+        self.assertAlmostEqual(self.store.take([('source:a', 4, 2.0, 10)]), 2.0)
+        self.now = 2.0
+        self.assertEqual(self.store.take([('source:a', 4, 2.0, 10)]), 0)
+
+    def test_refused_batch_spends_no_tokens(self):
+        self.store.take([('project:p', 5, 1.0, 5)])
+        wait = self.store.take([('source:a', 3, 1.0, 5), ('project:p', 3, 1.0, 5)])
+        self.assertAlmostEqual(wait, 3.0)
+        # The source bucket was not charged for the refused batch
+        self.assertEqual(self.store.take([('source:a', 5, 1.0, 5)]), 0)
+
+    def test_oversized_batch_runs_into_debt(self):
+        self.assertEqual(self.store.take([('source:a', 25, 1.0, 10)]), 0)
+        self.assertAlmostEqual(self.store.take([('source:a', 1, 1.0, 10)]), 16.0)
+
+    def test_metadata_quota_overrides_default(self):
+        self.assertEqual(quota_from_metadata({'ingest_quota': {'rate': 0.5, 'burst': 30}}, 'source'), (0.5, 30))
+        with self.settings(DATA_INTAKE_SOURCE_QUOTA_RATE=3.0, DATA_INTAKE_SOURCE_QUOTA_BURST=9):
+            self.assertEqual(quota_from_metadata({'ingest_quota': 'fast'}, 'source'), (3.0, 9))
+
+    def test_sources_are_unlimited_by_default(self):
+        self.assertEqual(quota_from_metadata({}, 'source')[0], 0)
+        self.assertEqual(quota_from_metadata({}, 'project')[0], 0)
+
+
+class ResamplingTests(SimpleTestCase):
+    """Test grid alignment and gap filling"""
+
+    def test_readings_fold_into_cells(self):
+        state = GridAccumulator(0, 10, 3)
+        state.add(np.array([1, 5, 12], dtype=np.int64), np.array([1.0, 3.0, 5.0]))
+        state.add(np.array([25, 40], dtype=np.int64), np.array([7.0, 9.0]))
+        self.assertEqual(state.count.tolist(), [2, 1, 1])
+        self.assertEqual(state.values(ResampleAggregateChoices.MEAN).tolist(), [2.0, 5.0, 7.0])
+        self.assertEqual(state.values(ResampleAggregateChoices.LAST).tolist(), [3.0, 5.0, 7.0])
+        self.assertEqual(state.values(ResampleAggregateChoices.SUM).tolist(), [4.0, 5.0, 7.0])
+
+    def test_linear_fills_interior_gaps_only(self):
+        values, status = fill_gaps([1.0, np.nan, np.nan, 4.0, np.nan], InterpolationChoices.LINEAR)
+        self.assertEqual(values[:4].tolist(), [1.0, 2.0, 3.0, 4.0])
+        self.assertTrue(np.isnan(values[4]))
+        self.assertEqual(status.tolist(), [
+            CellStatus.OBSERVED, CellStatus.FILLED, CellStatus.FILLED, CellStatus.OBSERVED, CellStatus.MISSING
+        ])
+
+    def test_previous_and_max_gap(self):
+        values, _ = fill_gaps([np.nan, 1.0, np.nan, np.nan, 4.0, np.nan], InterpolationChoices.PREVIOUS)
+        self.assertEqual(values[1:].tolist(), [1.0, 1.0, 1.0, 4.0, 4.0])
+        self.assertTrue(np.isnan(values[0]))
+
+        values, status = fill_gaps([1.0, np.nan, np.nan, 4.0], InterpolationChoices.LINEAR, max_gap=1)
+        self.assertEqual((status == CellStatus.MISSING).sum(), 2)
+
+    def test_gap_runs(self):
+        runs = gap_runs(np.array([True, False, True, True, False, True]))
+        self.assertEqual([(int(a), int(b)) for a, b in runs], [(0, 1), (2, 4), (5, 6)])
+
+
+class AnomalyDetectorTests(SimpleTestCase):
+    """Test the online spike/drop/drift detector"""
+
+    def run_series(self, spike_at=None, shift_from=None, readings=600):
+        rng = random.Random(1)
+        detector = SeriesDetector(DEFAULT_DETECTOR_PARAMS)
+        events = []
+        for i in range(readings):
+            # Hourly readings with a daily cycle
+            value = 10 + 3 * math.sin(2 * math.pi * (i % 24) / 24) + rng.gauss(0, 0.3)
+            if i == spike_at:
+                value += 5
+            if shift_from is not None and i >= shift_from:
+                value += 1
+            event = detector.update(i * 3600000, value)
+            if event:
+                events.append((i, event[0]))
+        return detector, events
+
+    def test_seasonal_series_raises_nothing(self):
+        _, events = self.run_series(readings=3000)
+        self.assertEqual(events, [])
+
+    def test_spike_and_drift(self):
+        _, events = self.run_series(spike_at=300, shift_from=400)
+        self.assertEqual(events[0], (300, 'SPIKE'))
+        drifts = [i for i, kind in events if kind == 'DRIFT']
+        self.assertEqual(len(drifts), 1)
+        self.assertTrue(400 <= drifts[0] < 440)
+
+    def test_state_round_trip_and_late_readings_are_skipped(self):
+        detector, _ = self.run_series(readings=100)
+        restored = SeriesDetector(DEFAULT_DETECTOR_PARAMS, detector.state())
+        self.assertEqual(restored.count, 100)
+        self.assertIsNone(restored.update(50 * 3600000, 1000.0))
+        self.assertEqual(restored.count, 100)
+
+    def scheduled_docs(self):
+        project, source = ObjectId(), ObjectId()
+        return [
+            {'project': project, 'data_source': source, 'metric_type': 'FLOW', 'value': Decimal('1.5'),
+             'unit': 'm3', 'timestamp': datetime(2024, 1, 1, hour)}
+            for hour in range(3)
+        ]
+
+    def test_large_batches_are_queued_and_restored_on_the_worker(self):
+        docs = self.scheduled_docs()
+        with mock.patch('apps.data_intake.anomalies.get_inline_max_points', return_value=1), \
+                mock.patch('apps.data_intake.tasks.detect_data_point_anomalies.delay') as delay, \
+                mock.patch('apps.data_intake.anomalies.detect_anomalies') as detect:
+            schedule_detection(docs)
+            detect.assert_not_called()
+            # The message survives JSON serialisation
+            detect_queued(json.loads(json.dumps(delay.call_args[0][0])))
+
+        restored = detect.call_args[0][0]
+        self.assertEqual([row['timestamp'] for row in restored], [doc['timestamp'] for doc in docs])
+        self.assertEqual(restored[0]['project'], docs[0]['project'])
+        self.assertEqual(restored[0]['data_source'], docs[0]['data_source'])
+        self.assertEqual(restored[0]['value'], 1.5)
+
+    def test_broker_outage_runs_detection_inline(self):
+        with mock.patch('apps.data_intake.anomalies.get_inline_max_points', return_value=1), \
+                mock.patch('apps.data_intake.tasks.detect_data_point_anomalies.delay',
+                           side_effect=OperationalError('connection refused')), \
+                mock.patch('apps.data_intake.anomalies.detect_anomalies') as detect:
+            schedule_detection(self.scheduled_docs())
+        self.assertEqual(len(detect.call_args[0][0]), 3)
+
+
+class NumericStorageTests(SimpleTestCase):
+    """Test Decimal128 amount fields and the legacy value conversion"""
+
+    def test_amount_field_stores_exact_decimal128(self):
+        field = DecimalAmountField()
+        self.assertEqual(field.to_mongo(Decimal('1234.5678')).to_decimal(), Decimal('1234.5678'))
+        self.assertEqual(field.to_mongo(0).to_decimal(), Decimal('0'))
+
+    def test_legacy_doubles_read_as_shortest_decimal(self):
+        field = DecimalAmountField()
+        self.assertEqual(field.to_python(0.1), Decimal('0.1'))
+        self.assertEqual(to_decimal(field.to_mongo(2.675)), Decimal('2.675'))
+        self.assertEqual(to_decimal(12.5), Decimal('12.5'))
+        self.assertIsNone(to_decimal(None))
+
+    def test_invalid_amounts_fail_validation(self):
+        field = DecimalAmountField()
+        field.name = 'quantity'
+        with self.assertRaises(Exception):
+            field.validate('not-a-number')
+        with self.assertRaises(Exception):
+            field.validate(Decimal('Infinity'))
+
+    def test_conversion_only_targets_legacy_types(self):
+        self.assertEqual(
+            legacy_filter('decimal', ['quantity', 'unit_price']),
+            {'$or': [
+                {'quantity': {'$type': ['double', 'int', 'long', 'string']}},
+                {'unit_price': {'$type': ['double', 'int', 'long', 'string']}},
+            ]}
+        )
+        self.assertEqual(conversion_pipeline('double', 'value'), [{'$set': {'value': {'$toDouble': '$value'}}}])
+
+
+class IngestBenchmarkTests(SimpleTestCase):
+    """Test synthetic load generation and result reporting of the ingest benchmark"""
+
+    def test_workers_never_generate_duplicate_readings(self):
+        sources = [ObjectId() for _ in range(3)]
+        start = datetime(2024, 1, 1)
+        keys = set()
+        for worker in range(4):
+            generator = ReadingGenerator(sources, worker, 4, start, seed=worker)
+            for payload in generator.batch(50) + generator.batch(50):
+                keys.add((payload['data_source_id'], payload['metric_type'], payload['timestamp']))
+        self.assertEqual(len(keys), 400)
+
+    def test_latency_summary_in_milliseconds(self):
+        summary = latency_summary([0.001] * 98 + [0.5, 1.0])
+        self.assertEqual(summary['p50'], 1.0)
+        self.assertEqual(summary['max'], 1000.0)
+        self.assertGreater(summary['p99'], 400)
+        self.assertEqual(latency_summary([]), {})
+
+    def test_size_growth_reports_changed_collections(self):
+        growth = size_growth(
+            {'data_points': (1000, 400), 'data_aggregations': (50, 10)},
+            {'data_points': (5000, 900), 'data_aggregations': (50, 10), 'data_point_payloads': (700, 100)},
+        )
+        self.assertEqual(growth['bytes_written'], 4700)
+        self.assertEqual(growth['index_growth_bytes'], 600)
+        self.assertEqual(sorted(growth['collections']), ['data_point_payloads', 'data_points'])
+
+    def test_compare_matches_scenarios(self):
+        scenario = {'mode': 'BULK', 'concurrency': 4, 'batch_size': 1000, 'bytes_per_point': 200.0}
+        baseline = {'scenarios': [dict(scenario, points_per_second=1000.0, latency_ms={'p50': 10.0, 'p99': 40.0})]}
+        current = {'scenarios': [
+            dict(scenario, points_per_second=1250.0, latency_ms={'p50': 8.0, 'p99': 40.0}),
+            dict(scenario, mode='STREAM', points_per_second=900.0, latency_ms={}),
+        ]}
+        comparison = compare_results(baseline, current)
+        self.assertEqual(len(comparison), 1)
+        self.assertEqual(comparison[0]['points_per_second']['ratio'], 1.25)
+        self.assertEqual(comparison[0]['p50_ms']['ratio'], 0.8)
+
+
+class AsyncIngestTests(SimpleTestCase):
+    """Test queueing of prepared batches and per-chunk progress accounting"""
+
+    def setUp(self):
+        self.batches = mock.Mock()
+        self.chunks = mock.Mock()
+        for target, collection in (
+            ('apps.data_intake.async_ingest.IngestBatch._get_collection', self.batches),
+            ('apps.data_intake.async_ingest.IngestBatchChunk._get_collection', self.chunks),
+        ):
+            patcher = mock.patch(target, return_value=collection)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_points_are_queued_in_numbered_chunks(self):
+        batch_id = ObjectId()
+        self.batches.find_one_and_update.return_value = {'_id': batch_id, 'chunks': 2}
+        self.chunks.insert_one.side_effect = lambda doc: mock.Mock(inserted_id=ObjectId())
+        docs = [{'_id': ObjectId()} for _ in range(5)]
+
+        with self.settings(DATA_INTAKE_ASYNC_CHUNK_SIZE=2), \
+                mock.patch('apps.data_intake.async_ingest.current_app') as app:
+            queued = add_points(batch_id, docs, [0, 1, 3, 4, 5], {2: 'unit is required'}, 6, offset=100)
+
+        self.assertEqual(queued, 3)
+        update = self.batches.find_one_and_update.call_args[0][1]
+        self.assertEqual(update['$inc'], {'received': 6, 'queued': 5, 'failed': 1, 'chunks': 3})
+        self.assertEqual(update['$push']['errors']['$each'], [{'index': 102, 'error': 'unit is required'}])
+        chunks = [call[0][0] for call in self.chunks.insert_one.call_args_list]
+        self.assertEqual([chunk['seq'] for chunk in chunks], [2, 3, 4])
+        self.assertEqual(chunks[1]['rows'], [103, 104])
+        self.assertEqual(app.send_task.call_count, 3)
+
+    def test_broker_outage_leaves_chunks_for_the_sweep(self):
+        self.batches.find_one_and_update.return_value = {'_id': ObjectId(), 'chunks': 0}
+        self.chunks.insert_one.side_effect = lambda doc: mock.Mock(inserted_id=ObjectId())
+        payloads = [{'value': 1}] * 3
+        docs = [{'_id': ObjectId()} for _ in payloads]
+
+        with self.settings(DATA_INTAKE_ASYNC_CHUNK_SIZE=1), \
+                mock.patch('apps.data_intake.async_ingest.prepare_points', return_value=(docs, [0, 1, 2], {})), \
+                mock.patch('apps.data_intake.async_ingest.IngestBatch') as batch_model, \
+                mock.patch('apps.data_intake.async_ingest.current_app') as app:
+            batch_model._get_collection.return_value = self.batches
+            app.send_task.side_effect = OperationalError('connection refused')
+            enqueue_points(payloads)
+
+        # Stored and sealed; the first failed send stops the rest
+        self.assertEqual(self.chunks.insert_one.call_count, 3)
+        self.assertEqual(app.send_task.call_count, 1)
+        self.assertEqual(self.batches.update_one.call_args_list[0][0][1], {'$set': {'sealed': True}})
+
+    def test_stale_chunks_are_sent_again(self):
+        now = datetime(2024, 1, 1, 12, 0)
+        stale = [{'_id': ObjectId()}, {'_id': ObjectId()}]
+        self.chunks.find.return_value = stale
+        with mock.patch('apps.data_intake.async_ingest.current_app') as app:
+            self.assertEqual(requeue_stale_chunks(minutes=30, now=now), 2)
+
+        query = self.chunks.find.call_args[0][0]
+        self.assertEqual(query, {'queued_at': {'$not': {'$gte': datetime(2024, 1, 1, 11, 30)}}})
+        self.assertEqual([call[1]['args'] for call in app.send_task.call_args_list], [[str(c['_id'])] for c in stale])
+        self.chunks.update_many.assert_called_once_with(
+            {'_id': {'$in': [c['_id'] for c in stale]}}, {'$set': {'queued_at': now}}
+        )
+
+    def test_chunk_is_counted_once(self):
+        batch_id, chunk_id = ObjectId(), ObjectId()
+        self.chunks.find_one.return_value = {
+            '_id': chunk_id, 'batch': batch_id, 'seq': 3, 'points': [{}, {}], 'rows': [7, 8],
+        }
+
+        def write(docs, rows, result, store=None, inline=False):
+            result.mark_ok(7)
+            result.mark_failed(8, 'boom')
+            return result
+
+        with mock.patch('apps.data_intake.async_ingest.write_points', side_effect=write) as write_points:
+            result = process_chunk(chunk_id)
+
+        self.assertTrue(write_points.call_args[1]['inline'])
+        self.assertEqual((result.inserted, result.failed), (1, 1))
+        fold = self.batches.update_one.call_args_list[1][0]
+        self.assertEqual(fold[0], {'_id': batch_id, 'done_chunks': {'$ne': 3}})
+        self.assertEqual(fold[1]['$inc'], {'inserted': 1, 'duplicates': 0, 'failed': 1})
+        self.assertEqual(fold[1]['$push']['errors']['$each'], [{'index': 8, 'error': 'boom'}])
+        self.chunks.delete_one.assert_called_once_with({'_id': chunk_id})
+
+    def test_missing_chunk_is_skipped(self):
+        self.chunks.find_one.return_value = None
+        with mock.patch('apps.data_intake.async_ingest.write_points') as write_points:
+            self.assertIsNone(process_chunk(ObjectId()))
+        write_points.assert_not_called()
@@ -0,0 +1,484 @@
+"""
+Data Intake manual uploads - CSV/XLSX spreadsheets of readings for MANUAL sources
+
+Files are parsed row by row (CSV with the csv module, XLSX by streaming the
+first worksheet's XML out of the zip), mapped to data point payloads and
+written through ingest_points in fixed-size chunks, so memory stays bounded
+by the chunk size whatever the row count. Rejected rows are streamed to a CSV
+error report stored in GridFS with the ManualUpload record.
+
+With DATA_INTAKE_ASYNC_INGEST the file is stored in GridFS and processed by
+a Celery worker; the request returns the QUEUED ManualUpload to poll.
+Otherwise it is processed inside the request, which only accepts files of
+up to DATA_INTAKE_UPLOAD_MAX_ROWS data rows.
+
+Column mapping (all keys optional, header names match case-insensitively):
+
+    {
+        "timestamp": "Date",                # default column "timestamp"
+        "timestamp_format": "%d/%m/%Y",     # strptime format, default ISO 8601
+        "value": "Reading",                 # long format: one reading per row
+        "metric_type": "Metric",
+        "unit": "Unit",
+        "defaults": {"metric_type": "RAINFALL", "unit": "mm"},
+        "metrics": {                        # wide format: one column per metric
+            "Rain (in)": {"metric_type": "RAINFALL", "unit": "in"},
+            "Trees": "TREE_COUNT"
+        }
+    }
+
+Units are normalized per metric (e.g. inches -> mm, fraction -> %).
+"""
+
+import csv
+import io
+import logging
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from xml.etree.ElementTree import ParseError, iterparse
+
+from celery import current_app
+from django.conf import settings
+from django.utils.dateparse import parse_date
+from pymongo.errors import PyMongoError
+
+from apps.data_intake.ingestion import ingest_points, parse_timestamp, parse_value, get_stream_chunk_size
+from apps.data_intake.models import ManualUpload, MetricTypeChoices, UploadFormatChoices, UploadStatusChoices
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_UPLOAD_MAX_ROWS = 100000
+PROCESS_UPLOAD_TASK = 'apps.data_intake.tasks.process_manual_upload'
+PARSE_ERRORS = (ValueError, KeyError, csv.Error, zipfile.BadZipFile, ParseError)
+
+REPORT_SPOOL_BYTES = 1024 * 1024
+REPORT_HEADER = ['row', 'column', 'error']
+
+EXCEL_EPOCH = datetime(1899, 12, 30)
+XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+XLSX_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+XLSX_PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# Per metric: unit alias (lower case) -> (canonical unit, factor to canonical)
+UNIT_ALIASES = {
+    MetricTypeChoices.RAINFALL: {
+        'mm': ('mm', Decimal(1)), 'millimeter': ('mm', Decimal(1)), 'millimeters': ('mm', Decimal(1)),
+        'cm': ('mm', Decimal(10)), 'in': ('mm', Decimal('25.4')), 'inch': ('mm', Decimal('25.4')),
+        'inches': ('mm', Decimal('25.4')),
+    },
+    MetricTypeChoices.SOIL_MOISTURE: {
+        '%': ('%', Decimal(1)), 'percent': ('%', Decimal(1)), 'pct': ('%', Decimal(1)),
+        'vwc': ('%', Decimal(1)), 'fraction': ('%', Decimal(100)), 'm3/m3': ('%', Decimal(100)),
+    },
+    MetricTypeChoices.TREE_COUNT: {
+        'count': ('count', Decimal(1)), 'trees': ('count', Decimal(1)), 'tree': ('count', Decimal(1)),
+        '#': ('count', Decimal(1)), 'no.': ('count', Decimal(1)),
+    },
+}
+
+
+def normalize_unit(metric_type, value, unit):
+    """Convert a Decimal value to the metric's canonical unit; unknown units pass through"""
+    alias = UNIT_ALIASES.get(metric_type, {}).get(unit.strip().lower())
+    if alias is None:
+        return value, unit.strip()
+    canonical, factor = alias
+    return value * factor, canonical
+
+
+def get_upload_max_rows():
+    """Data rows a file may hold when it is processed inside the request; 0 is unlimited"""
+    return getattr(settings, 'DATA_INTAKE_UPLOAD_MAX_ROWS', DEFAULT_UPLOAD_MAX_ROWS)
+
+
+def detect_format(filename):
+    """Upload format from a file name, or None when unsupported"""
+    name = (filename or '').lower()
+    if name.endswith('.csv'):
+        return UploadFormatChoices.CSV
+    if name.endswith('.xlsx'):
+        return UploadFormatChoices.XLSX
+    return None
+
+
+def iter_csv_rows(fileobj):
+    """Yield (row_number, values) from a binary CSV file, header included as row 1"""
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    try:
+        for number, values in enumerate(csv.reader(text), start=1):
+            yield number, values
+    finally:
+        text.detach()
+
+
+def _column_index(reference):
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index - 1
+
+
+def _first_sheet_path(archive):
+    workbook = archive.read('xl/workbook.xml')
+    rels = archive.read('xl/_rels/workbook.xml.rels')
+    sheet_id = None
+    for _, element in iterparse(io.BytesIO(workbook)):
+        if element.tag == f'{XLSX_NS}sheet':
+            sheet_id = element.get(f'{XLSX_REL_NS}id')
+            break
+    for _, element in iterparse(io.BytesIO(rels)):
+        if element.tag == f'{XLSX_PACKAGE_REL_NS}Relationship' and element.get('Id') == sheet_id:
+            target = element.get('Target')
+            return target.lstrip('/') if target.startswith('/') else f'xl/{target}'
+    raise ValueError('workbook has no worksheet')
+
+
+def _shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as handle:
+        for _, element in iterparse(handle):
+            if element.tag == f'{XLSX_NS}si':
+                strings.append(''.join(text.text or '' for text in element.iter(f'{XLSX_NS}t')))
+                element.clear()
+    return strings
+
+
+def iter_xlsx_rows(fileobj):
+    """
+    Yield (row_number, values) from the first worksheet of an XLSX file.
+    Numeric cells come back as floats, everything else as strings. Only the
+    shared string table is held in memory; rows are parsed and discarded
+    one at a time.
+    """
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise ValueError('not a valid XLSX file')
+    with archive:
+        strings = _shared_strings(archive)
+        with archive.open(_first_sheet_path(archive)) as handle:
+            sheet_data = None
+            for event, element in iterparse(handle, events=('start', 'end')):
+                if event == 'start':
+                    if element.tag == f'{XLSX_NS}sheetData':
+                        sheet_data = element
+                    continue
+                if element.tag != f'{XLSX_NS}row':
+                    continue
+                values = []
+                for cell in element.iter(f'{XLSX_NS}c'):
+                    position = _column_index(cell.get('r', '')) if cell.get('r') else len(values)
+                    values.extend([''] * (position - len(values)))
+                    values.append(_cell_value(cell, strings))
+                yield int(element.get('r', 0)), values
+                # Drop parsed rows from the tree so memory does not grow with the sheet
+                sheet_data.clear()
+
+
+class InvalidCell:
+    """XLSX cell that could not be read; rejects its row once the mapping reads it"""
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return ''
+
+
+def _cell_value(cell, strings):
+    cell_type = cell.get('t', 'n')
+    if cell_type == 'inlineStr':
+        return ''.join(text.text or '' for text in cell.iter(f'{XLSX_NS}t'))
+    raw = cell.findtext(f'{XLSX_NS}v')
+    if raw is None:
+        return ''
+    try:
+        if cell_type == 's':
+            return strings[int(raw)]
+        if cell_type == 'n':
+            return float(raw)
+    except (IndexError, ValueError):
+        return InvalidCell(f"cell {cell.get('r', '')} cannot be read: {raw!r}")
+    return raw
+
+
+def iter_rows(fileobj, upload_format):
+    if upload_format == UploadFormatChoices.XLSX:
+        return iter_xlsx_rows(fileobj)
+    return iter_csv_rows(fileobj)
+
+
+def count_rows(fileobj, upload_format, limit):
+    """
+    Non-blank data rows of a file, counting no further than limit + 1, then
+    rewind it. A file that does not parse counts as empty; process_upload
+    reports why.
+    """
+    count = 0
+    rows = iter_rows(fileobj, upload_format)
+    try:
+        next(rows, None)
+        for _, values in rows:
+            if any(value != '' for value in values):
+                count += 1
+                if count > limit:
+                    break
+    except PARSE_ERRORS:
+        count = 0
+    finally:
+        rows.close()
+    fileobj.seek(0)
+    return count
+
+
+def validate_mapping(mapping):
+    """Raise ValueError unless mapping has the shape described in the module docstring"""
+    if not isinstance(mapping, dict):
+        raise ValueError('mapping must be a JSON object')
+    for field in ('timestamp', 'timestamp_format', 'value', 'metric_type', 'unit'):
+        if field in mapping and not isinstance(mapping[field], str):
+            raise ValueError(f'mapping {field} must be a string')
+    if not isinstance(mapping.get('defaults') or {}, dict):
+        raise ValueError('mapping defaults must be an object')
+    metrics = mapping.get('metrics') or {}
+    if not isinstance(metrics, dict):
+        raise ValueError('mapping metrics must be an object of column: metric')
+    for column, metric in metrics.items():
+        if not isinstance(metric, (str, dict)):
+            raise ValueError(f'metric for column {column} must be a metric type or an object')
+
+
+class ColumnMapping:
+    """Resolves a mapping against a header row and turns data rows into payloads"""
+
+    def __init__(self, mapping, header):
+        validate_mapping(mapping or {})
+        self.mapping = mapping or {}
+        self.columns = {str(name).strip().lower(): index for index, name in enumerate(header)}
+        self.defaults = self.mapping.get('defaults') or {}
+        self.timestamp_format = self.mapping.get('timestamp_format')
+
+        self.timestamp = self._column('timestamp', required=True)
+        self.metrics = []
+        for column, metric in (self.mapping.get('metrics') or {}).items():
+            if isinstance(metric, str):
+                metric = {'metric_type': metric}
+            if metric.get('metric_type') not in dict(MetricTypeChoices.CHOICES):
+                raise ValueError(f"invalid metric_type for column {column}: {metric.get('metric_type')}")
+            self.metrics.append((column, self._index(column), metric))
+
+        if not self.metrics:
+            self.value = self._column('value', required=True)
+            self.metric_type = self._column('metric_type', required='metric_type' not in self.defaults)
+            self.unit = self._column('unit', required='unit' not in self.defaults)
+
+    def _index(self, name):
+        index = self.columns.get(str(name).strip().lower())
+        if index is None:
+            raise ValueError(f'column not found: {name}')
+        return index
+
+    def _column(self, field, required=False):
+        name = self.mapping.get(field, field)
+        if not required and str(name).strip().lower() not in self.columns:
+            return None
+        return self._index(name)
+
+    def parse_timestamp(self, value):
+        if isinstance(value, float):
+            # XLSX dates are serial days since the Excel epoch
+            try:
+                return EXCEL_EPOCH + timedelta(days=value)
+            except (OverflowError, ValueError):
+                raise ValueError('timestamp out of range')
+        value = str(value).strip()
+        if self.timestamp_format:
+            try:
+                return datetime.strptime(value, self.timestamp_format)
+            except ValueError:
+                raise ValueError(f'timestamp does not match {self.timestamp_format}')
+        date = parse_date(value) if len(value) == 10 else None
+        if date is not None:
+            return datetime(date.year, date.month, date.day)
+        return parse_timestamp(value)
+
+    @staticmethod
+    def _cell(values, index):
+        if index is None or index >= len(values):
+            return ''
+        value = values[index]
+        if isinstance(value, InvalidCell):
+            raise ValueError(value.message)
+        return value.strip() if isinstance(value, str) else value
+
+    def readings(self, values):
+        """
+        Yield (column, metric_type, value, unit, timestamp) for a data row.
+        Raises ValueError for a row that cannot be read at all.
+        """
+        timestamp = self._cell(values, self.timestamp)
+        if timestamp == '':
+            raise ValueError('timestamp is required')
+        timestamp = self.parse_timestamp(timestamp)
+
+        if self.metrics:
+            for column, index, metric in self.metrics:
+                value = self._cell(values, index)
+                if value == '':
+                    continue
+                yield column, metric['metric_type'], value, metric.get('unit') or self.defaults.get('unit', ''), timestamp
+            return
+
+        metric_type = self._cell(values, self.metric_type) or self.defaults.get('metric_type')
+        unit = self._cell(values, self.unit) or self.defaults.get('unit')
+        yield self.mapping.get('value', 'value'), metric_type, self._cell(values, self.value), unit, timestamp
+
+
+class UploadReport:
+    """Rejected rows written to a spooled CSV so a million-row upload never buffers its errors"""
+
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_BYTES, mode='w+b')
+        self.text = io.TextIOWrapper(self.file, encoding='utf-8', newline='')
+        self.writer = csv.writer(self.text)
+        self.writer.writerow(REPORT_HEADER)
+        self.count = 0
+
+    def add(self, row, column, message):
+        self.writer.writerow([row, column or '', message])
+        self.count += 1
+
+    def detach(self):
+        """Flush and return the binary report positioned at its start"""
+        self.text.flush()
+        self.text.detach()
+        self.file.seek(0)
+        return self.file
+
+
+def _flush(payloads, refs, rejected, upload, report):
+    result = ingest_points(payloads, rejected=rejected)
+    upload.inserted += result.inserted
+    upload.duplicates += result.duplicates
+    for index, message in result.errors.items():
+        row, column = refs[index]
+        report.add(row, column, message)
+
+
+def process_upload(upload, fileobj, chunk_size=None):
+    """
+    Parse, map and ingest an uploaded file for upload.data_source. Updates
+    and saves the ManualUpload with counts, status and the error report.
+    """
+    chunk_size = chunk_size or get_stream_chunk_size()
+    source_id = str(upload.data_source.pk)
+    report = UploadReport()
+    payloads, refs, rejected = [], [], {}
+
+    try:
+        rows = iter_rows(fileobj, upload.format)
+        header = next(rows, None)
+        if header is None:
+            raise ValueError('file is empty')
+        mapping = ColumnMapping(upload.column_mapping, header[1])
+
+        for number, values in rows:
+            if not any(value != '' for value in values):
+                continue
+            upload.rows += 1
+            try:
+                readings = list(mapping.readings(values))
+            except ValueError as e:
+                report.add(number, None, str(e))
+                continue
+
+            for column, metric_type, value, unit, timestamp in readings:
+                try:
+                    value, unit = normalize_unit(metric_type or '', parse_value(value), unit or '')
+                except ValueError as e:
+                    rejected[len(payloads)] = str(e)
+                    value = None
+                refs.append((number, column))
+                payloads.append({
+                    'data_source_id': source_id,
+                    'metric_type': metric_type,
+                    'value': value,
+                    'unit': unit,
+                    'timestamp': timestamp,
+                    'raw_payload': {'upload_id': str(upload.pk), 'row': number},
+                } if value is not None else None)
+
+            if len(payloads) >= chunk_size:
+                _flush(payloads, refs, rejected, upload, report)
+                payloads, refs, rejected = [], [], {}
+
+        if payloads:
+            _flush(payloads, refs, rejected, upload, report)
+        upload.status = UploadStatusChoices.COMPLETED
+    except PARSE_ERRORS as e:
+        upload.status = UploadStatusChoices.FAILED
+        upload.error = str(e)
+    except PyMongoError:
+        # Left to the caller: a queued upload is retried, see tasks.process_manual_upload
+        raise
+    except Exception as e:
+        logger.exception(f"Upload {upload.pk} could not be processed")
+        upload.status = UploadStatusChoices.FAILED
+        upload.error = f'upload could not be processed: {e}'
+
+    upload.failed = report.count
+    report_file = report.detach()
+    if report.count:
+        upload.error_report.put(report_file, content_type='text/csv', filename=f'{upload.pk}-errors.csv')
+    report_file.close()
+    upload.completed_at = datetime.utcnow()
+    upload.save()
+    return upload
+
+
+def queue_upload(upload, fileobj):
+    """Store the file with a saved ManualUpload and queue it for a Celery worker"""
+    upload.source_file.put(fileobj, content_type='application/octet-stream', filename=upload.filename)
+    upload.status = UploadStatusChoices.QUEUED
+    upload.save()
+    current_app.send_task(PROCESS_UPLOAD_TASK, args=[str(upload.pk)])
+    return upload
+
+
+def process_queued_upload(upload_id):
+    """
+    Process a queued upload's stored file, then drop the file. A redelivered
+    task starts the file over with fresh counts; readings stored by the first
+    attempt come back as duplicates. Returns the ManualUpload, or None when it
+    is gone or already finished.
+    """
+    upload = ManualUpload.objects(
+        id=upload_id, status__in=[UploadStatusChoices.QUEUED, UploadStatusChoices.PROCESSING]
+    ).first()
+    if upload is None or not upload.source_file:
+        return None
+    if upload.error_report:
+        upload.error_report.delete()
+    upload.status = UploadStatusChoices.PROCESSING
+    upload.rows = upload.inserted = upload.duplicates = upload.failed = 0
+    upload.error = None
+    upload.save()
+
+    process_upload(upload, upload.source_file.get())
+    upload.source_file.delete()
+    upload.save()
+    return upload
+
+
+def fail_upload(upload_id, error):
+    """Give up on a queued upload after its last retry"""
+    ManualUpload.objects(
+        id=upload_id, status__in=[UploadStatusChoices.QUEUED, UploadStatusChoices.PROCESSING]
+    ).update(set__status=UploadStatusChoices.FAILED, set__error=error, set__completed_at=datetime.utcnow())
@@ -0,0 +1,369 @@
+"""
+Data Intake validation - vectorized quality checks that set DataPoint.validation_status
+
+Stored readings are grouped per (data_source, metric_type) and checked as
+NumPy columns together with the preceding readings of the same series:
+
+- range: value outside the bounds configured for its unit -> FAIL
+- unit: a unit with no configured bounds for the metric -> REQUIRES_REVIEW
+- rate: change per hour against the previous reading above the limit -> REQUIRES_REVIEW
+- stuck: a run of identical values at least stuck_readings long -> REQUIRES_REVIEW
+- cross_source: far from the median hourly average of the project's other
+  sources for the same metric -> REQUIRES_REVIEW
+
+Results are written with one update_many per (status, notes) group.
+
+The checks read up to DATA_INTAKE_VALIDATION_CONTEXT_HOURS of each series,
+so readings stored by an API request are validated by the
+validate_data_points Celery task (apps.data_intake.tasks) and no request
+waits on that read; Celery workers that store readings (async ingest)
+validate inline. Readings whose task could not be queued, or was lost,
+stay is_validated=False until validate_pending() reaches them: every
+DATA_INTAKE_VALIDATION_SWEEP_MINUTES from Celery beat, or on demand with the
+validate_data_points command.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from kombu.exceptions import OperationalError
+from pymongo.errors import PyMongoError
+
+from apps.data_intake.aggregation import get_rollup_periods
+from apps.data_intake.models import (
+    DataPoint, DataAggregation, MetricTypeChoices, AggregationPeriodChoices,
+    StorageLayoutChoices, ValidationStatusChoices
+)
+from apps.data_intake.storage import get_point_store, to_epoch_ms, from_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_INLINE_MAX_POINTS = 2000
+DEFAULT_CONTEXT_HOURS = 24
+DEFAULT_UPDATE_BATCH_SIZE = 10000
+DEFAULT_SWEEP_BATCH_SIZE = 20000
+DEFAULT_SWEEP_MINUTES = 10
+TASK_BATCH_SIZE = 5000  # Reading ids per validation task message
+MS_PER_HOUR = 3600000
+
+# data_points fields the checks read
+VALIDATION_FIELDS = ('_id', 'project', 'data_source', 'metric_type', 'value', 'unit', 'timestamp')
+
+# Per metric: bounds by unit, max change per hour by unit, identical readings
+# that make a sensor "stuck", and the allowed relative deviation from the
+# other sources of the project (None disables a check)
+DEFAULT_VALIDATION_RULES = {
+    MetricTypeChoices.CO2_CONCENTRATION: {
+        'ranges': {'ppm': (250, 5000)},
+        'max_rate_per_hour': {'ppm': 1000},
+        'stuck_readings': 12,
+        'cross_source_tolerance': 0.5,
+    },
+    MetricTypeChoices.ENERGY_CONSUMPTION: {
+        'ranges': {'Wh': (0, 1e10), 'kWh': (0, 1e7), 'MWh': (0, 1e4)},
+        'max_rate_per_hour': {},
+        'stuck_readings': None,
+        'cross_source_tolerance': None,
+    },
+    MetricTypeChoices.BIOMASS_INDEX: {
+        'ranges': {'t/ha': (0, 1000), 'index': (0, 1)},
+        'max_rate_per_hour': {},
+        'stuck_readings': None,
+        'cross_source_tolerance': 0.5,
+    },
+    MetricTypeChoices.TEMPERATURE: {
+        'ranges': {'C': (-60, 60), '°C': (-60, 60), 'F': (-76, 140), '°F': (-76, 140), 'K': (213, 333)},
+        'max_rate_per_hour': {'C': 10, '°C': 10, 'F': 18, '°F': 18, 'K': 10},
+        'stuck_readings': 24,
+        'cross_source_tolerance': 0.5,
+    },
+    MetricTypeChoices.RAINFALL: {
+        'ranges': {'mm': (0, 500), 'in': (0, 20)},
+        'max_rate_per_hour': {},
+        'stuck_readings': None,
+        'cross_source_tolerance': None,
+    },
+    MetricTypeChoices.SOIL_MOISTURE: {
+        'ranges': {'%': (0, 100)},
+        'max_rate_per_hour': {'%': 30},
+        'stuck_readings': 48,
+        'cross_source_tolerance': 0.5,
+    },
+    MetricTypeChoices.TREE_COUNT: {
+        'ranges': {'count': (0, 1e7), 'trees': (0, 1e7)},
+        'max_rate_per_hour': {},
+        'stuck_readings': None,
+        'cross_source_tolerance': None,
+    },
+    MetricTypeChoices.VEGETATION_INDEX: {
+        'ranges': {'NDVI': (-1, 1), 'index': (-1, 1)},
+        'max_rate_per_hour': {},
+        'stuck_readings': None,
+        'cross_source_tolerance': 0.5,
+    },
+}
+
+CROSS_SOURCE_MIN_SOURCES = 2
+
+
+def get_validation_rules(metric_type):
+    """Default rules for a metric merged with DATA_INTAKE_VALIDATION_RULES overrides"""
+    rules = dict(DEFAULT_VALIDATION_RULES.get(metric_type, {}))
+    rules.update(getattr(settings, 'DATA_INTAKE_VALIDATION_RULES', {}).get(metric_type, {}))
+    return rules
+
+
+def get_inline_max_points():
+    """Largest stored batch anomaly detection checks inline; larger batches go to its worker"""
+    return getattr(settings, 'DATA_INTAKE_VALIDATION_INLINE_MAX_POINTS', DEFAULT_INLINE_MAX_POINTS)
+
+
+def range_violations(values, low, high):
+    """Mask of values outside [low, high]"""
+    return (values < low) | (values > high)
+
+
+def rate_violations(timestamps_ms, values, max_per_hour):
+    """Mask of readings whose change from the previous reading exceeds max_per_hour"""
+    mask = np.zeros(len(values), dtype=bool)
+    if len(values) < 2:
+        return mask
+    hours = np.diff(timestamps_ms) / MS_PER_HOUR
+    change = np.abs(np.diff(values))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.where(hours > 0, change / hours, 0.0)
+    mask[1:] = rate > max_per_hour
+    return mask
+
+
+def stuck_runs(values, min_run):
+    """Mask of readings inside a run of at least min_run identical consecutive values"""
+    if not len(values):
+        return np.zeros(0, dtype=bool)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(values) != 0) + 1))
+    lengths = np.diff(np.append(starts, len(values)))
+    return np.repeat(lengths >= min_run, lengths)
+
+
+def cross_source_violations(timestamps_ms, values, hour_ms, medians, tolerance):
+    """
+    Mask of readings deviating from their hour's peer median by more than
+    tolerance (relative). hour_ms/medians must be sorted by hour.
+    """
+    mask = np.zeros(len(values), dtype=bool)
+    if not len(hour_ms):
+        return mask
+    hours = timestamps_ms - timestamps_ms % MS_PER_HOUR
+    idx = np.clip(np.searchsorted(hour_ms, hours), 0, len(hour_ms) - 1)
+    known = hour_ms[idx] == hours
+    peer = medians[idx]
+    scale = np.maximum(np.abs(peer), 1e-9)
+    mask[known] = (np.abs(values[known] - peer[known]) / scale[known]) > tolerance
+    return mask
+
+
+def _peer_medians(project_id, source_id, metric_type, start, end):
+    """Per-hour median of the other sources' HOURLY averages (hours with enough peers only)"""
+    rows = DataAggregation._get_collection().find(
+        {
+            'project': project_id,
+            'metric_type': metric_type,
+            'period': AggregationPeriodChoices.HOURLY,
+            'data_source': {'$ne': source_id},
+            'period_start': {'$gte': start - timedelta(hours=1), '$lte': end},
+        },
+        {'period_start': 1, 'avg_value': 1},
+    )
+    by_hour = defaultdict(list)
+    for row in rows:
+        if row.get('avg_value') is not None:
+            by_hour[to_epoch_ms(row['period_start'])].append(float(row['avg_value']))
+
+    hours = sorted(hour for hour, peers in by_hour.items() if len(peers) >= CROSS_SOURCE_MIN_SOURCES)
+    return (
+        np.array(hours, dtype=np.int64),
+        np.array([np.median(by_hour[hour]) for hour in hours], dtype=np.float64),
+    )
+
+
+def check_series(batch_t, batch_v, batch_units, context_t, context_v, rules, peers=None):
+    """
+    Run every configured check for one series.
+
+    batch_* are the readings being validated; context_* the sorted series
+    around them (including the batch). Returns (status, notes) arrays aligned
+    with the batch.
+    """
+    size = len(batch_v)
+    fail = np.zeros(size, dtype=bool)
+    notes = {name: np.zeros(size, dtype=bool) for name in ('range', 'unit', 'rate', 'stuck', 'cross_source')}
+
+    ranges = rules.get('ranges') or {}
+    rate_limits = rules.get('max_rate_per_hour') or {}
+    position = np.clip(np.searchsorted(context_t, batch_t), 0, max(len(context_t) - 1, 0))
+
+    for unit in np.unique(batch_units):
+        in_unit = batch_units == unit
+        if ranges:
+            if unit in ranges:
+                low, high = ranges[unit]
+                notes['range'][in_unit] = range_violations(batch_v[in_unit], low, high)
+            else:
+                notes['unit'][in_unit] = True
+        if unit in rate_limits and len(context_t):
+            rate = rate_violations(context_t, context_v, rate_limits[unit])
+            notes['rate'][in_unit] = rate[position[in_unit]]
+
+    if rules.get('stuck_readings') and len(context_t):
+        notes['stuck'] = stuck_runs(context_v, rules['stuck_readings'])[position]
+
+    if rules.get('cross_source_tolerance') and peers is not None:
+        notes['cross_source'] = cross_source_violations(
+            batch_t, batch_v, peers[0], peers[1], rules['cross_source_tolerance']
+        )
+
+    fail |= notes['range']
+    review = np.zeros(size, dtype=bool)
+    for name in ('unit', 'rate', 'stuck', 'cross_source'):
+        review |= notes[name]
+
+    status = np.full(size, ValidationStatusChoices.PASS, dtype=object)
+    status[review] = ValidationStatusChoices.REQUIRES_REVIEW
+    status[fail] = ValidationStatusChoices.FAIL
+
+    labels = np.full(size, '', dtype=object)
+    for name in ('range', 'unit', 'rate', 'stuck', 'cross_source'):
+        flagged = notes[name]
+        labels[flagged] = np.where(labels[flagged] == '', name, labels[flagged] + ', ' + name)
+    return status, labels
+
+
+def validate_points(docs, store=None):
+    """
+    Validate stored data_points documents and write their status in grouped
+    bulk updates. Returns {status: count}.
+    """
+    store = store or get_point_store()
+    context = timedelta(hours=getattr(settings, 'DATA_INTAKE_VALIDATION_CONTEXT_HOURS', DEFAULT_CONTEXT_HOURS))
+    cross_source = AggregationPeriodChoices.HOURLY in get_rollup_periods()
+
+    series = defaultdict(list)
+    for doc in docs:
+        series[(doc['project'], doc['data_source'], doc['metric_type'])].append(doc)
+
+    groups = defaultdict(list)
+    for (project_id, source_id, metric_type), members in series.items():
+        rules = get_validation_rules(metric_type)
+        members.sort(key=lambda doc: doc['timestamp'])
+        batch_t = np.array([to_epoch_ms(doc['timestamp']) for doc in members], dtype=np.int64)
+        batch_v = np.array([float(doc['value']) for doc in members], dtype=np.float64)
+        batch_units = np.array([doc.get('unit') or '' for doc in members], dtype=object)
+
+        start, end = from_epoch_ms(batch_t[0]), from_epoch_ms(batch_t[-1])
+        chunks = list(store.iter_columns(source_id, metric_type, start - context, end + timedelta(milliseconds=1)))
+        context_t = np.concatenate([t for t, _ in chunks]) if chunks else batch_t
+        context_v = np.concatenate([v for _, v in chunks]) if chunks else batch_v
+
+        peers = None
+        if cross_source and rules.get('cross_source_tolerance'):
+            peers = _peer_medians(project_id, source_id, metric_type, start, end)
+
+        status, labels = check_series(batch_t, batch_v, batch_units, context_t, context_v, rules, peers)
+        for doc, doc_status, label in zip(members, status, labels):
+            groups[(doc_status, label)].append(doc['_id'])
+
+    write_statuses(groups)
+    counts = defaultdict(int)
+    for (doc_status, _), ids in groups.items():
+        counts[doc_status] += len(ids)
+    return dict(counts)
+
+
+def write_statuses(groups, batch_size=DEFAULT_UPDATE_BATCH_SIZE):
+    """One update_many per (status, notes) group, in id batches"""
+    collection = DataPoint._get_collection()
+    for (doc_status, label), ids in groups.items():
+        update = {'$set': {
+            'is_validated': True,
+            'validation_status': doc_status,
+            'validation_notes': label or None,
+        }}
+        for i in range(0, len(ids), batch_size):
+            collection.update_many({'_id': {'$in': ids[i:i + batch_size]}}, update)
+
+
+def validate_ids(point_ids):
+    """Validate stored readings by id. Returns {status: count}."""
+    docs = list(DataPoint._get_collection().find(
+        {'_id': {'$in': list(point_ids)}}, {field: 1 for field in VALIDATION_FIELDS}
+    ))
+    return validate_points(docs) if docs else {}
+
+
+def validate_pending(project_ids=None, revalidate=False, created_before=None, batch_size=DEFAULT_SWEEP_BATCH_SIZE):
+    """
+    Validate readings that have no status yet (every reading with
+    revalidate) in _id batches. Yields {status: count} per batch.
+    """
+    query = {} if revalidate else {'is_validated': False}
+    if project_ids:
+        query['project'] = {'$in': list(project_ids)}
+    if created_before is not None:
+        query['created_at'] = {'$lt': created_before}
+
+    collection = DataPoint._get_collection()
+    projection = {field: 1 for field in VALIDATION_FIELDS}
+    last_id = None
+    while True:
+        batch_query = dict(query)
+        if last_id is not None:
+            batch_query['_id'] = {'$gt': last_id}
+        docs = list(collection.find(batch_query, projection).sort('_id', 1).limit(batch_size))
+        if not docs:
+            return
+        last_id = docs[-1]['_id']
+        yield validate_points(docs)
+
+
+def get_sweep_minutes():
+    return getattr(settings, 'DATA_INTAKE_VALIDATION_SWEEP_MINUTES', DEFAULT_SWEEP_MINUTES)
+
+
+def _validate_safely(docs):
+    try:
+        return validate_points(docs)
+    except PyMongoError as e:
+        # Readings stay is_validated=False and are picked up by validate_pending
+        logger.error(f"Failed to validate {len(docs)} data points: {e}")
+        return None
+
+
+def schedule_validation(docs, inline=False):
+    """
+    Validate freshly stored readings: inline when already off the request
+    path (inline, e.g. on a queue worker), else on the validate_data_points
+    Celery task. Bucketed readings have no per-reading document to carry a
+    status and are not validated.
+    """
+    if not docs or not getattr(settings, 'DATA_INTAKE_VALIDATION_ENABLED', True):
+        return
+    if get_point_store().layout != StorageLayoutChoices.DOCUMENTS:
+        return
+
+    if inline:
+        _validate_safely([{key: doc[key] for key in VALIDATION_FIELDS} for doc in docs])
+        return
+
+    # Imported here: the tasks module builds on this one
+    from apps.data_intake.tasks import validate_data_points
+    point_ids = [str(doc['_id']) for doc in docs]
+    try:
+        for i in range(0, len(point_ids), TASK_BATCH_SIZE):
+            validate_data_points.delay(point_ids[i:i + TASK_BATCH_SIZE])
+    except OperationalError as e:
+        # The readings are stored; the next sweep validates them
+        logger.warning(f"Could not queue validation of {len(point_ids)} data points: {e}")
@@ -2,10 +2,64 @@
 Data intake views
 """
 
+import json
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from django.http import StreamingHttpResponse
+from pymongo.errors import PyMongoError
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from apps.api.pagination import KeysetPagination
+from apps.data_intake.activity import stale_sources
+from apps.data_intake.async_ingest import batch_summary, enqueue_points, enqueue_stream, get_async_ingest_enabled
+from apps.data_intake.ingestion import (
+    IngestResult, prepare_points, write_points, ingest_points, stream_ingest,
+    get_bulk_max_points
+)
+from apps.data_intake.downsampling import downsample_series
+from apps.data_intake.payloads import load_raw_payload
+from apps.data_intake.quotas import QuotaExceeded, charge_quotas
+from apps.data_intake.resampling import resample, resampled_to_dict
+from apps.data_intake.models import (
+    DataSource, DataPoint, ManualUpload, IngestBatch, DataSourceTypeChoices, StorageLayoutChoices,
+    MetricTypeChoices, UploadStatusChoices
+)
+from apps.data_intake.serializers import (
+    DataPointSerializer, DataPointSeriesQuerySerializer, StaleDataSourceQuerySerializer, ResampleQuerySerializer
+)
+from apps.data_intake.storage import get_point_store, naive_utc
+from apps.data_intake.uploads import (
+    count_rows, detect_format, fail_upload, get_upload_max_rows, process_upload, queue_upload, validate_mapping
+)
+
+
+def upload_summary(upload):
+    return {
+        'upload_id': str(upload.pk),
+        'filename': upload.filename,
+        'status': upload.status,
+        'rows': upload.rows,
+        'inserted': upload.inserted,
+        'duplicates': upload.duplicates,
+        'failed': upload.failed,
+        'error': upload.error,
+        'has_error_report': bool(upload.error_report),
+    }
+
+
+def throttled_response(exc):
+    response = Response(
+        {'error': str(exc), 'retry_after': exc.retry_after_seconds},
+        status=status.HTTP_429_TOO_MANY_REQUESTS
+    )
+    response['Retry-After'] = str(exc.retry_after_seconds)
+    return response
+
 
 class DataSourceViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
@@ -18,16 +72,334 @@ class DataSourceViewSet(viewsets.ViewSet):
     
     def retrieve(self, request, pk=None):
         return Response({'id': pk})
+    
+    @action(detail=True, methods=['post'], parser_classes=[MultiPartParser])
+    def upload(self, request, pk=None):
+        """
+        Upload a CSV or XLSX file of readings for a MANUAL source.
+        Form fields: file, mapping (JSON column mapping, see apps.data_intake.uploads).
+        With DATA_INTAKE_ASYNC_INGEST the file is processed by a Celery worker
+        (202 with the upload to poll at uploads/<upload_id>/); otherwise files
+        over DATA_INTAKE_UPLOAD_MAX_ROWS data rows are refused with 413.
+        Rejected rows are downloadable from uploads/<upload_id>/errors/.
+        """
+        if not ObjectId.is_valid(pk):
+            return Response({'error': 'Data source not found'}, status=status.HTTP_404_NOT_FOUND)
+        source = DataSource.objects(id=pk).only('project', 'type', 'is_active').first()
+        if source is None:
+            return Response({'error': 'Data source not found'}, status=status.HTTP_404_NOT_FOUND)
+        if source.type != DataSourceTypeChoices.MANUAL:
+            return Response(
+                {'error': 'Uploads are only accepted for MANUAL data sources'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        upload_file = request.FILES.get('file')
+        upload_format = detect_format(upload_file.name if upload_file else None)
+        if upload_format is None:
+            return Response({'error': 'Expected a .csv or .xlsx file'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            mapping = json.loads(request.data.get('mapping') or '{}')
+        except ValueError:
+            return Response({'error': 'mapping must be a JSON object'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            validate_mapping(mapping)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        async_ingest = get_async_ingest_enabled()
+        max_rows = get_upload_max_rows()
+        if not async_ingest and max_rows and count_rows(upload_file, upload_format, max_rows) > max_rows:
+            return Response(
+                {'error': f'File has more than {max_rows} data rows; split it into smaller files'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        
+        upload = ManualUpload(
+            data_source=source,
+            project=source._data.get('project'),
+            uploaded_by_email=getattr(request.user, 'email', None),
+            filename=upload_file.name,
+            format=upload_format,
+            column_mapping=mapping,
+        )
+        upload.save()
+        if async_ingest:
+            queue_upload(upload, upload_file)
+            return Response(upload_summary(upload), status=status.HTTP_202_ACCEPTED)
+        try:
+            process_upload(upload, upload_file)
+        except PyMongoError as e:
+            fail_upload(upload.pk, str(e))
+            raise
+        
+        if upload.status == UploadStatusChoices.FAILED:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif upload.failed:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+        return Response(upload_summary(upload), status=response_status)
+    
+    @action(detail=True, methods=['get'], url_path=r'uploads/(?P<upload_id>[^/.]+)')
+    def upload_status(self, request, pk=None, upload_id=None):
+        """Counts and status of an upload, e.g. to poll a queued one"""
+        upload = None
+        if ObjectId.is_valid(pk) and ObjectId.is_valid(upload_id):
+            upload = ManualUpload.objects(id=upload_id, data_source=ObjectId(pk)).first()
+        if upload is None:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(upload_summary(upload))
+    
+    @action(detail=True, methods=['get'], url_path=r'uploads/(?P<upload_id>[^/.]+)/errors')
+    def upload_errors(self, request, pk=None, upload_id=None):
+        """Download the CSV error report of an upload"""
+        upload = None
+        if ObjectId.is_valid(pk) and ObjectId.is_valid(upload_id):
+            upload = ManualUpload.objects(id=upload_id, data_source=ObjectId(pk)).first()
+        if upload is None:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        if not upload.error_report:
+            return Response({'error': 'Upload has no rejected rows'}, status=status.HTTP_404_NOT_FOUND)
+        
+        report = upload.error_report.get()
+        response = StreamingHttpResponse(iter(lambda: report.read(64 * 1024), b''), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="{upload_id}-errors.csv"'
+        return response
+    
+    @action(detail=False, methods=['get'])
+    def stale(self, request):
+        """
+        Active sources silent for at least `minutes`, most silent first.
+        Query: minutes, project_id, type.
+        """
+        serializer = StaleDataSourceQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        params = serializer.validated_data
+        now = datetime.utcnow()
+        project_id = params.get('project_id')
+        sources = stale_sources(
+            params['minutes'],
+            project=ObjectId(project_id) if project_id else None,
+            source_type=params.get('type'),
+            now=now,
+        )
+        return Response([
+            {
+                'id': str(source['_id']),
+                'project_id': str(source['project']),
+                'name': source.get('name'),
+                'type': source.get('type'),
+                'last_data_received': source.get('last_data_received'),
+                'silent_seconds': (
+                    int((now - naive_utc(source['last_data_received'])).total_seconds())
+                    if source.get('last_data_received') else None
+                ),
+            }
+            for source in sources
+        ])
 
 
-class DataPointViewSet(viewsets.ViewSet):
+class DataPointViewSet(viewsets.GenericViewSet):
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_field = 'timestamp'
     
     def list(self, request):
-        return Response([])
+        """
+        Readings newest first, paginated by cursor. Raw payloads are left out;
+        fetch a single reading to see its payload. Only available under the
+        DOCUMENTS layout: bucketed readings have no id to page or fetch by,
+        and are read as series (series/) instead.
+        Query: data_source_id, project_id, metric_type, cursor, page_size.
+        """
+        if get_point_store().layout != StorageLayoutChoices.DOCUMENTS:
+            return Response(
+                {'error': 'Individual readings are only listed for the DOCUMENTS layout; use series/'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        filters = {}
+        for param, field in (('data_source_id', 'data_source'), ('project_id', 'project')):
+            value = request.query_params.get(param)
+            if value:
+                if not ObjectId.is_valid(value):
+                    return Response({'error': f'Invalid {param}'}, status=status.HTTP_400_BAD_REQUEST)
+                filters[field] = ObjectId(value)
+        metric_type = request.query_params.get('metric_type')
+        if metric_type:
+            if metric_type not in dict(MetricTypeChoices.CHOICES):
+                return Response({'error': f'invalid metric_type: {metric_type}'}, status=status.HTTP_400_BAD_REQUEST)
+            filters['metric_type'] = metric_type
+        
+        page = self.paginate_queryset(DataPoint.objects(**filters).exclude('raw_payload').no_dereference())
+        return self.get_paginated_response(DataPointSerializer(page, many=True).data)
     
     def create(self, request):
-        return Response({'id': '1'}, status=status.HTTP_201_CREATED)
+        """Ingest a single data point"""
+        docs, rows, errors = prepare_points([request.data])
+        if errors:
+            return Response({'error': errors[0]}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            charge_quotas(docs)
+        except QuotaExceeded as e:
+            return throttled_response(e)
+        
+        store = get_point_store()
+        result = write_points(docs, rows, IngestResult(1), store=store)
+        if result.failed:
+            return Response({'error': result.errors[0]}, status=status.HTTP_400_BAD_REQUEST)
+        if result.duplicates:
+            # Retried reading: already stored, nothing written
+            return Response({'id': None, 'duplicate': True}, status=status.HTTP_200_OK)
+        
+        if store.layout == StorageLayoutChoices.BUCKETS:
+            # Bucketed readings are appended to a shared document and have no id of their own
+            return Response({'id': None}, status=status.HTTP_201_CREATED)
+        return Response({'id': str(docs[0]['_id'])}, status=status.HTTP_201_CREATED)
     
     def retrieve(self, request, pk=None):
-        return Response({'id': pk})
+        """One reading with its raw payload, loaded from the payload store when offloaded"""
+        point = None
+        if ObjectId.is_valid(pk):
+            point = DataPoint.objects(id=pk).no_dereference().first()
+        if point is None:
+            return Response({'error': 'Data point not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        point.raw_payload = load_raw_payload(point)
+        return Response(DataPointSerializer(point).data)
+    
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Ingest an array of data points with one unordered bulk insert.
+        Accepts either a JSON array or {"points": [...]}. Nothing is written
+        when a source or project ingest quota is exceeded (429 with Retry-After).
+        With DATA_INTAKE_ASYNC_INGEST the points are validated and queued for
+        Celery workers instead (202 with a batch to poll at batches/<batch_id>/).
+        """
+        points = request.data
+        if isinstance(points, dict):
+            points = points.get('points')
+        if not isinstance(points, list) or not points:
+            return Response(
+                {'error': 'Expected a non-empty array of data points'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        max_points = get_bulk_max_points()
+        if len(points) > max_points:
+            return Response(
+                {'error': f'Too many data points in one request (max {max_points})'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        
+        if get_async_ingest_enabled():
+            try:
+                batch = enqueue_points(points, enforce_quotas=True)
+            except QuotaExceeded as e:
+                return throttled_response(e)
+            return Response(batch_summary(batch), status=status.HTTP_202_ACCEPTED)
+        
+        try:
+            result = ingest_points(points, enforce_quotas=True)
+        except QuotaExceeded as e:
+            return throttled_response(e)
+        response_status = status.HTTP_201_CREATED if not result.failed else status.HTTP_207_MULTI_STATUS
+        return Response(result.to_dict(), status=response_status)
+    
+    @action(detail=False, methods=['post'])
+    def stream(self, request):
+        """
+        Ingest an NDJSON body (one data point per line) in fixed-size chunks.
+        Progress is streamed back as NDJSON, one record per chunk. A chunk
+        over an ingest quota ends the stream with retry_after and resume_offset.
+        With DATA_INTAKE_ASYNC_INGEST the body is validated and queued as one
+        batch instead (202 with the batch summary).
+        """
+        body = request.stream
+        if body is None:
+            return Response(
+                {'error': 'Expected an NDJSON request body'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if get_async_ingest_enabled():
+            batch, throttled, records = enqueue_stream(body, enforce_quotas=True)
+            summary = batch_summary(batch)
+            if throttled is not None:
+                summary.update({
+                    'throttled': True,
+                    'retry_after': throttled.retry_after_seconds,
+                    'resume_offset': records,
+                })
+            return Response(summary, status=status.HTTP_202_ACCEPTED)
+        
+        def progress():
+            for record in stream_ingest(body, enforce_quotas=True):
+                yield json.dumps(record) + '\n'
+        
+        return StreamingHttpResponse(progress(), content_type='application/x-ndjson')
+    
+    @action(detail=False, methods=['get'], url_path=r'batches/(?P<batch_id>[^/.]+)')
+    def batch(self, request, batch_id=None):
+        """Progress of a batch queued by the bulk or stream endpoint"""
+        batch = IngestBatch.objects(id=batch_id).first() if ObjectId.is_valid(batch_id) else None
+        if batch is None:
+            return Response({'error': 'Ingest batch not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(batch_summary(batch))
+    
+    @action(detail=False, methods=['get'])
+    def series(self, request):
+        """
+        Downsampled series for one source and metric, sized for a chart.
+        Query: data_source_id, metric_type, start, end, points, method (LTTB or MINMAX).
+        """
+        serializer = DataPointSeriesQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        params = serializer.validated_data
+        series = downsample_series(
+            ObjectId(params['data_source_id']),
+            params['metric_type'],
+            naive_utc(params['start']),
+            naive_utc(params['end']),
+            params['points'],
+            params['method'],
+        )
+        series.update({
+            'data_source_id': params['data_source_id'],
+            'metric_type': params['metric_type'],
+        })
+        return Response(series)
+    
+    @action(detail=False, methods=['get'])
+    def resample(self, request):
+        """
+        Align one metric of several sources to a regular grid, filling short gaps.
+        Query: data_source_id (repeatable), metric_type, start, end, step (seconds),
+        aggregate (MEAN, SUM, MIN, MAX, LAST), interpolation (LINEAR, PREVIOUS, NONE), max_gap (cells).
+        """
+        serializer = ResampleQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        params = serializer.validated_data
+        series = [(ObjectId(source_id), params['metric_type']) for source_id in params['data_source_id']]
+        step = timedelta(seconds=params['step'])
+        try:
+            result = resample(
+                series,
+                naive_utc(params['start']),
+                naive_utc(params['end']),
+                step,
+                aggregate=params['aggregate'],
+                interpolation=params['interpolation'],
+                max_gap=params.get('max_gap'),
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(resampled_to_dict(result, series, step))
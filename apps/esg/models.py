@@ -9,6 +9,8 @@ from mongoengine import (
 )
 from datetime import datetime
 
+from apps.api.numeric import DecimalAmountField
+
 
 class ScopeChoices:
     """Emission scope constants"""
@@ -47,7 +49,7 @@ class EmissionSource(EmbeddedDocument):
         choices=ScopeChoices.CHOICES,
         required=True
     )
-    emissions_value = DecimalField(required=True)
+    emissions_value = DecimalAmountField(required=True)
     unit = StringField(default='tons CO2e')
     percentage = DecimalField()
     data_source = StringField()
@@ -73,18 +75,18 @@ class EmissionInventory(Document):
     year = IntField(required=True)
     
     # Scope-based emissions
-    scope1_emissions = DecimalField(default=0)  # Direct emissions (tons CO2e)
-    scope2_emissions = DecimalField(default=0)  # Indirect energy
-    scope3_emissions = DecimalField(default=0)  # Indirect supply chain
+    scope1_emissions = DecimalAmountField(default=0)  # Direct emissions (tons CO2e)
+    scope2_emissions = DecimalAmountField(default=0)  # Indirect energy
+    scope3_emissions = DecimalAmountField(default=0)  # Indirect supply chain
     
-    total_emissions = DecimalField(default=0)  # Total across all scopes
-    net_emissions = DecimalField(default=0)  # After carbon offsets
+    total_emissions = DecimalAmountField(default=0)  # Total across all scopes
+    net_emissions = DecimalAmountField(default=0)  # After carbon offsets
     
     # Breakdown by source
     emission_sources = EmbeddedDocumentField(EmissionSource)
     
     # Baseline & targets
-    baseline_emissions = DecimalField()  # Historical baseline for comparison
+    baseline_emissions = DecimalAmountField()  # Historical baseline for comparison
     reduction_target = DecimalField()  # Target reduction percentage
     actual_reduction = DecimalField()  # Actual reduction achieved
     
@@ -3,11 +3,13 @@ Marketplace models - Carbon credit trading, listings, and orders
 """
 
 from mongoengine import (
-    Document, StringField, DecimalField, ReferenceField, DateTimeField, 
+    Document, StringField, ReferenceField, DateTimeField, 
     BooleanField, ListField, DictField, IntField
 )
 from datetime import datetime
 
+from apps.api.numeric import DecimalAmountField
+
 
 class ListingStatusChoices:
     """Listing status constants"""
@@ -70,11 +72,11 @@ class Listing(Document):
     seller_contact_email = StringField()
     
     # Quantity & pricing
-    quantity = DecimalField(required=True)  # Available credits
-    quantity_sold = DecimalField(default=0)
-    quantity_remaining = DecimalField(required=True)
+    quantity = DecimalAmountField(required=True)  # Available credits
+    quantity_sold = DecimalAmountField(default=0)
+    quantity_remaining = DecimalAmountField(required=True)
     
-    unit_price = DecimalField(required=True)  # Price per credit
+    unit_price = DecimalAmountField(required=True)  # Price per credit
     currency = StringField(default='INR')  # INR, USD, EUR, etc.
     
     # Listing details
@@ -135,9 +137,9 @@ class Order(Document):
     buyer_contact_email = StringField()
     
     # Transaction details
-    quantity = DecimalField(required=True)
-    unit_price = DecimalField(required=True)  # Price per credit at time of order
-    total_price = DecimalField(required=True)
+    quantity = DecimalAmountField(required=True)
+    unit_price = DecimalAmountField(required=True)  # Price per credit at time of order
+    total_price = DecimalAmountField(required=True)
     currency = StringField(default='INR')
     
     # Payment
@@ -189,9 +191,9 @@ class TradeHistory(Document):
     order = ReferenceField(Order, required=True)
     
     # Trade details
-    quantity = DecimalField(required=True)
-    price_per_credit = DecimalField(required=True)
-    total_price = DecimalField(required=True)
+    quantity = DecimalAmountField(required=True)
+    price_per_credit = DecimalAmountField(required=True)
+    total_price = DecimalAmountField(required=True)
     
     # Market data
     market_price_snapshot = DictField()  # Record market conditions at time of trade
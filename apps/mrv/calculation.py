@@ -0,0 +1,651 @@
+"""
+MRV credit calculation - methodology formulas evaluated over measured data
+
+A ProjectMethodology's `parameters` describe how credits follow from the
+project's DataAggregation rollups:
+
+    {
+        "version": 3,
+        "period": "DAILY",
+        "inputs": {
+            "energy": {"metric_type": "ENERGY_CONSUMPTION", "aggregate": "SUM",
+                       "uncertainty": {"distribution": "NORMAL", "relative": 0.02}},
+            "co2": {"metric_type": "CO2_CONCENTRATION", "aggregate": "MEAN", "missing": "NAN"}
+        },
+        "constants": {
+            "grid_factor": {"value": 0.00045, "unit": "tCO2e/kWh", "source": "IPCC 2006",
+                            "uncertainty": {"distribution": "TRIANGULAR", "relative": 0.1}},
+            "leakage": 0.05
+        },
+        "formulas": {
+            "baseline": "energy * grid_factor",
+            "credits": "sum(baseline) * (1 - leakage)"
+        },
+        "output": "credits"
+    }
+
+Each input is one metric summed over every source of the project, on a grid
+of `period` cells covering the reporting period, which must start and end on
+period boundaries. Formulas are arithmetic over inputs, constants, other formulas and
+the built-ins `cell_days` (width of each cell) and `period_days`; only
+whitelisted functions are callable and nothing else of Python is reachable.
+
+Parameters compile once into an expression graph (validated, topologically
+ordered) cached per methodology_code, version and content, and evaluate
+with vectorized NumPy. The output must reduce to a scalar: the credits.
+Every node's value is kept in the calculation trace.
+
+The optional `uncertainty` of a constant or input (the default error of its
+sensors) does not change the credits; apps.mrv.uncertainty samples it.
+"""
+
+import ast
+import hashlib
+import json
+import threading
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+from pymongo import UpdateOne
+
+from apps.api.references import reference_id
+from apps.data_intake.aggregation import period_bounds
+from apps.data_intake.models import AggregationPeriodChoices, DataAggregation, MetricTypeChoices
+from apps.data_intake.storage import naive_utc, to_epoch_ms
+from apps.mrv.models import CreditCalculation, MRVRequest, OPEN_MRV_STATUSES
+from apps.projects.models import ProjectMethodology
+
+
+class MethodologyError(ValueError):
+    """Methodology parameters that cannot be compiled"""
+
+
+class CalculationError(ValueError):
+    """A compiled methodology that cannot be evaluated for a request"""
+
+
+class InputAggregateChoices:
+    """Value of an input cell from the rollups in it"""
+    SUM = 'SUM'
+    MEAN = 'MEAN'
+    MIN = 'MIN'
+    MAX = 'MAX'
+    COUNT = 'COUNT'
+
+    CHOICES = [
+        (SUM, 'Sum of readings'),
+        (MEAN, 'Mean of readings'),
+        (MIN, 'Minimum reading'),
+        (MAX, 'Maximum reading'),
+        (COUNT, 'Number of readings'),
+    ]
+
+
+class MissingDataChoices:
+    """Value of an input cell without readings"""
+    ZERO = 'ZERO'
+    NAN = 'NAN'
+
+    CHOICES = [
+        (ZERO, 'Count as zero'),
+        (NAN, 'Leave undefined (the result fails if it depends on it)'),
+    ]
+
+
+class UncertaintyDistributionChoices:
+    """Error distribution of a constant or of an input's sensors (apps.mrv.uncertainty)"""
+    NORMAL = 'NORMAL'
+    LOGNORMAL = 'LOGNORMAL'
+    UNIFORM = 'UNIFORM'
+    TRIANGULAR = 'TRIANGULAR'
+
+    CHOICES = [
+        (NORMAL, 'Normal; the scale is the standard deviation'),
+        (LOGNORMAL, 'Log-normal with mean 1; the relative scale is the standard deviation'),
+        (UNIFORM, 'Uniform; the scale is the half-width'),
+        (TRIANGULAR, 'Symmetric triangular; the scale is the half-width'),
+    ]
+
+
+DEFAULT_PERIOD = AggregationPeriodChoices.DAILY
+DEFAULT_OUTPUT = 'credits'
+CREDIT_PLACES = Decimal('0.0001')
+
+MAX_EXPRESSION_LENGTH = 2000
+MAX_EXPRESSION_NODES = 200
+MAX_FORMULAS = 200
+MAX_CACHED_METHODOLOGIES = 256
+TRACE_MAX_VALUES = 1000
+
+BUILTIN_NAMES = ('cell_days', 'period_days')
+METRIC_TYPES = frozenset(code for code, _ in MetricTypeChoices.CHOICES)
+PERIODS = frozenset(code for code, _ in AggregationPeriodChoices.CHOICES)
+AGGREGATES = frozenset(code for code, _ in InputAggregateChoices.CHOICES)
+MISSING = frozenset(code for code, _ in MissingDataChoices.CHOICES)
+DISTRIBUTIONS = frozenset(code for code, _ in UncertaintyDistributionChoices.CHOICES)
+UNCERTAINTY_SCALES = ('relative', 'absolute')
+
+BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.divide,
+    ast.Pow: np.power,
+}
+
+UNARY_OPERATORS = {
+    ast.USub: np.negative,
+    ast.UAdd: np.positive,
+}
+
+COMPARISONS = {
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+}
+
+
+def _reduction(function):
+    # Reduce the cells (last) axis only and keep it, so a leading draws axis
+    # (apps.mrv.uncertainty) reduces per draw and results still broadcast
+    return lambda value: function(value, axis=-1, keepdims=True) if np.ndim(value) else value
+
+
+# name: (callable, argument count)
+FUNCTIONS = {
+    'sum': (_reduction(np.sum), 1),
+    'mean': (_reduction(np.mean), 1),
+    'min': (_reduction(np.min), 1),
+    'max': (_reduction(np.max), 1),
+    'abs': (np.abs, 1),
+    'sqrt': (np.sqrt, 1),
+    'exp': (np.exp, 1),
+    'log': (np.log, 1),
+    'minimum': (np.minimum, 2),
+    'maximum': (np.maximum, 2),
+    'clip': (np.clip, 3),
+    'where': (np.where, 3),
+}
+
+
+def _compile_node(node, names, refs):
+    """Closure env -> value for one whitelisted AST node; refs collects the names used"""
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise MethodologyError(f'unsupported constant {node.value!r}')
+        value = float(node.value)
+        return lambda env: value
+    if isinstance(node, ast.Name):
+        if node.id not in names:
+            raise MethodologyError(f'unknown name {node.id!r}')
+        refs.add(node.id)
+        name = node.id
+        return lambda env: env[name]
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        op = BINARY_OPERATORS[type(node.op)]
+        left, right = _compile_node(node.left, names, refs), _compile_node(node.right, names, refs)
+        return lambda env: op(left(env), right(env))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        op = UNARY_OPERATORS[type(node.op)]
+        operand = _compile_node(node.operand, names, refs)
+        return lambda env: op(operand(env))
+    if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in COMPARISONS:
+        op = COMPARISONS[type(node.ops[0])]
+        left, right = _compile_node(node.left, names, refs), _compile_node(node.comparators[0], names, refs)
+        return lambda env: op(left(env), right(env))
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+            raise MethodologyError(f'only {", ".join(sorted(FUNCTIONS))} can be called')
+        function, arity = FUNCTIONS[node.func.id]
+        if len(node.args) != arity:
+            raise MethodologyError(f'{node.func.id}() takes {arity} argument(s)')
+        args = [_compile_node(arg, names, refs) for arg in node.args]
+        return lambda env: function(*[arg(env) for arg in args])
+    raise MethodologyError(f'unsupported syntax: {type(node).__name__}')
+
+
+def compile_expression(expression, names):
+    """(evaluate(env), referenced names) of a formula, or MethodologyError"""
+    if not isinstance(expression, str) or not expression.strip():
+        raise MethodologyError('formula must be a non-empty string')
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise MethodologyError(f'formula longer than {MAX_EXPRESSION_LENGTH} characters')
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise MethodologyError(f'invalid formula: {e.msg}')
+    if sum(1 for _ in ast.walk(tree)) > MAX_EXPRESSION_NODES:
+        raise MethodologyError(f'formula has more than {MAX_EXPRESSION_NODES} terms')
+    refs = set()
+    return _compile_node(tree.body, names, refs), refs
+
+
+def _topological_order(dependencies):
+    """Formula names so each comes after the formulas it uses; MethodologyError on a cycle"""
+    order, state = [], {}
+
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            cycle = path[path.index(name):] + [name]
+            raise MethodologyError(f"formulas depend on each other: {' -> '.join(cycle)}")
+        state[name] = 'visiting'
+        for dependency in sorted(dependencies[name]):
+            visit(dependency, path + [name])
+        state[name] = 'done'
+        order.append(name)
+
+    for name in sorted(dependencies):
+        visit(name, [])
+    return order
+
+
+def _parse_constant(name, spec):
+    if isinstance(spec, dict):
+        meta = {key: spec[key] for key in ('unit', 'source') if spec.get(key)}
+        spec = spec.get('value')
+    else:
+        meta = {}
+    if isinstance(spec, bool) or not isinstance(spec, (int, float)) or not np.isfinite(spec):
+        raise MethodologyError(f'constant {name!r} must be a finite number')
+    return float(spec), meta
+
+
+def _parse_input(name, spec):
+    if not isinstance(spec, dict):
+        raise MethodologyError(f'input {name!r} must be an object')
+    parsed = {
+        'metric_type': spec.get('metric_type'),
+        'aggregate': spec.get('aggregate', InputAggregateChoices.SUM),
+        'missing': spec.get('missing', MissingDataChoices.ZERO),
+    }
+    if parsed['metric_type'] not in METRIC_TYPES:
+        raise MethodologyError(f"input {name!r}: unknown metric_type {parsed['metric_type']!r}")
+    if parsed['aggregate'] not in AGGREGATES:
+        raise MethodologyError(f"input {name!r}: unknown aggregate {parsed['aggregate']!r}")
+    if parsed['missing'] not in MISSING:
+        raise MethodologyError(f"input {name!r}: unknown missing {parsed['missing']!r}")
+    return parsed
+
+
+def parse_uncertainty(spec):
+    """{'distribution': ..., 'relative' or 'absolute': scale} from an uncertainty spec, or MethodologyError"""
+    if not isinstance(spec, dict):
+        raise MethodologyError('uncertainty must be an object')
+    distribution = spec.get('distribution', UncertaintyDistributionChoices.NORMAL)
+    if distribution not in DISTRIBUTIONS:
+        raise MethodologyError(f'unknown distribution {distribution!r}')
+    scales = [key for key in UNCERTAINTY_SCALES if spec.get(key) is not None]
+    if len(scales) != 1:
+        raise MethodologyError('uncertainty needs exactly one of relative or absolute')
+    scale = spec[scales[0]]
+    if isinstance(scale, bool) or not isinstance(scale, (int, float)) or not np.isfinite(scale) or scale < 0:
+        raise MethodologyError(f'{scales[0]} uncertainty must be a non-negative number')
+    if distribution == UncertaintyDistributionChoices.LOGNORMAL and scales[0] != 'relative':
+        raise MethodologyError('a LOGNORMAL uncertainty must be relative')
+    return {'distribution': distribution, scales[0]: float(scale)}
+
+
+class CompiledMethodology:
+    """Validated expression graph of one methodology version"""
+
+    def __init__(self, code, version, parameters):
+        if not isinstance(parameters, dict):
+            raise MethodologyError('parameters must be an object')
+        self.code = code
+        self.version = version
+        self.period = parameters.get('period', DEFAULT_PERIOD)
+        if self.period not in PERIODS:
+            raise MethodologyError(f'unknown period {self.period!r}')
+
+        inputs, constants, formulas = (parameters.get(key) or {} for key in ('inputs', 'constants', 'formulas'))
+        if not all(isinstance(part, dict) for part in (inputs, constants, formulas)):
+            raise MethodologyError('inputs, constants and formulas must be objects')
+        if not formulas:
+            raise MethodologyError('no formulas')
+        if len(formulas) > MAX_FORMULAS:
+            raise MethodologyError(f'more than {MAX_FORMULAS} formulas')
+
+        declared = defaultdict(list)
+        for kind, names in (('input', inputs), ('constant', constants), ('formula', formulas),
+                            ('built-in', BUILTIN_NAMES)):
+            for name in names:
+                if not isinstance(name, str) or not name.isidentifier() or name in FUNCTIONS:
+                    raise MethodologyError(f'invalid name {name!r}')
+                declared[name].append(kind)
+        clashes = sorted(name for name, kinds in declared.items() if len(kinds) > 1)
+        if clashes:
+            raise MethodologyError(f"names declared twice: {', '.join(clashes)}")
+
+        self.inputs = {name: _parse_input(name, spec) for name, spec in inputs.items()}
+        self.constants = {name: _parse_constant(name, spec) for name, spec in constants.items()}
+        # Error of a constant, or the default error of every sensor of an input
+        self.uncertainty = {}
+        for name, spec in list(inputs.items()) + list(constants.items()):
+            if isinstance(spec, dict) and spec.get('uncertainty') is not None:
+                try:
+                    self.uncertainty[name] = parse_uncertainty(spec['uncertainty'])
+                except MethodologyError as e:
+                    raise MethodologyError(f'{name!r}: {e}')
+        self.expressions = dict(formulas)
+        self.formulas, dependencies = {}, {}
+        for name, expression in formulas.items():
+            try:
+                self.formulas[name], refs = compile_expression(expression, declared)
+            except MethodologyError as e:
+                raise MethodologyError(f'formula {name!r}: {e}')
+            dependencies[name] = {ref for ref in refs if ref in formulas}
+        self.order = _topological_order(dependencies)
+
+        self.output = parameters.get('output', DEFAULT_OUTPUT)
+        if self.output not in self.formulas:
+            raise MethodologyError(f'output {self.output!r} is not a formula')
+
+    def run(self, series, cell_days, constants=None):
+        """
+        Value of every node. Input series are float64 arrays over the grid
+        cells, optionally with a leading draws axis; constants may be
+        overridden per draw with (draws, 1) arrays. Reductions apply to the
+        cells axis only, so a reduced value keeps one cell per draw.
+        """
+        env = {'cell_days': cell_days, 'period_days': float(cell_days.sum())}
+        env.update({name: value for name, (value, _) in self.constants.items()})
+        env.update(constants or {})
+        env.update(series)
+        with np.errstate(all='ignore'):
+            for name in self.order:
+                env[name] = self.formulas[name](env)
+        return env
+
+    def credits(self, env, draws=1):
+        """Credits of every draw (float64 array of draws) from run(); CalculationError if not reduced"""
+        credits = np.asarray(env[self.output], dtype=np.float64)
+        if credits.ndim and credits.shape[-1] != 1:
+            raise CalculationError(f'output {self.output!r} is a series; reduce it, e.g. sum({self.output})')
+        return np.broadcast_to(credits.reshape(-1), (draws,))
+
+    def evaluate(self, series, cell_days):
+        """
+        Credits and trace for input series ({name: float64 array}) on a grid
+        whose cells are cell_days wide. Raises CalculationError when the
+        output is not a finite scalar.
+        """
+        env = self.run(series, cell_days)
+        credits = self.credits(env)[0]
+        trace = self.trace(env, len(cell_days))
+        if not np.isfinite(credits):
+            undefined = [node['name'] for node in trace if node.get('undefined')]
+            raise CalculationError(
+                f"output {self.output!r} is not finite"
+                + (f"; undefined values in {', '.join(undefined)}" if undefined else '')
+            )
+        return float(credits), trace
+
+    def trace(self, env, cells):
+        """Every node of the graph with its value (series summarised, values kept up to TRACE_MAX_VALUES)"""
+        nodes = []
+        for name, spec in self.inputs.items():
+            nodes.append(dict(_trace_value(env[name], cells), name=name, kind='input', **spec))
+        for name, (value, meta) in self.constants.items():
+            nodes.append(dict(meta, name=name, kind='constant', value=value))
+        for name in self.order:
+            nodes.append(dict(_trace_value(env[name], cells), name=name, kind='formula',
+                              expression=self.expressions[name]))
+        return nodes
+
+
+def _trace_value(value, cells):
+    value = np.asarray(value, dtype=np.float64)
+    if value.shape == (1,) and cells != 1:
+        value = value[0]  # Reduced to one cell
+    if value.ndim == 0:
+        entry = {'value': float(value) if np.isfinite(value) else None}
+        if not np.isfinite(value):
+            entry['undefined'] = True
+        return entry
+    finite = np.isfinite(value)
+    entry = {
+        'cells': int(value.size),
+        'defined_cells': int(finite.sum()),
+        'sum': float(value[finite].sum()) if finite.any() else None,
+        'min': float(value[finite].min()) if finite.any() else None,
+        'max': float(value[finite].max()) if finite.any() else None,
+    }
+    if not finite.all():
+        entry['undefined'] = True
+    if value.size <= TRACE_MAX_VALUES:
+        entry['values'] = [float(v) if ok else None for v, ok in zip(value, finite)]
+    return entry
+
+
+def parameters_fingerprint(parameters):
+    """Stable hash of methodology parameters"""
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def compile_methodology(methodology):
+    """CompiledMethodology of a ProjectMethodology, cached per code, version and parameter content"""
+    parameters = methodology.parameters or {}
+    version = parameters.get('version', 1)
+    key = (methodology.methodology_code, version, parameters_fingerprint(parameters))
+    with _compiled_lock:
+        compiled = _compiled.get(key)
+    if compiled is None:
+        compiled = CompiledMethodology(methodology.methodology_code, version, parameters)
+        with _compiled_lock:
+            if len(_compiled) >= MAX_CACHED_METHODOLOGIES:
+                _compiled.clear()
+            _compiled[key] = compiled
+    return compiled
+
+
+def period_grid(period, start, end):
+    """
+    Start of every period cell in [start, end), and each cell's width in days.
+    Raises CalculationError unless start and end are cell boundaries: the
+    rollup of a partial cell also holds readings outside [start, end).
+    """
+    start, end = naive_utc(start), naive_utc(end)
+    for bound in (start, end):
+        if period_bounds(period, bound)[0] != bound:
+            raise CalculationError(
+                f'the reporting period must start and end on {period.lower()} period boundaries, '
+                f'{bound.isoformat()} does not'
+            )
+    starts, days = [], []
+    cell_start, cell_end = period_bounds(period, start)
+    while cell_start < end:
+        starts.append(cell_start)
+        days.append((cell_end - cell_start).total_seconds() / 86400)
+        cell_start, cell_end = period_bounds(period, cell_end)
+    return starts, np.array(days, dtype=np.float64)
+
+
+def load_rollups(project_ids, metric_types, period, start, end):
+    """
+    DataAggregation rows of several projects in one query, grouped as
+    {(project, metric_type): [rows]}
+    """
+    rows = defaultdict(list)
+    cursor = DataAggregation._get_collection().find(
+        {
+            'project': {'$in': list(project_ids)},
+            'metric_type': {'$in': list(metric_types)},
+            'period': period,
+            'period_start': {'$gte': start, '$lt': end},
+        },
+        {'project': 1, 'data_source': 1, 'metric_type': 1, 'period_start': 1, 'count': 1,
+         'sum_value': 1, 'min_value': 1, 'max_value': 1},
+    )
+    for row in cursor:
+        rows[(row['project'], row['metric_type'])].append(row)
+    return rows
+
+
+def cell_totals(rows, cell_index, cells):
+    """Reading count, sum, minimum and maximum per grid cell over rollup rows"""
+    count = np.zeros(cells)
+    total = np.zeros(cells)
+    low = np.full(cells, np.inf)
+    high = np.full(cells, -np.inf)
+    for row in rows:
+        idx = cell_index.get(to_epoch_ms(row['period_start']))
+        if idx is None or not row.get('count'):
+            continue
+        count[idx] += row['count']
+        total[idx] += row.get('sum_value') or 0.0
+        if row.get('min_value') is not None:
+            low[idx] = min(low[idx], row['min_value'])
+        if row.get('max_value') is not None:
+            high[idx] = max(high[idx], row['max_value'])
+    return count, total, low, high
+
+
+def cell_values(spec, count, total, low, high):
+    """Values of one input from cell_totals(); total, low and high may carry a leading draws axis"""
+    aggregate = spec['aggregate']
+    if aggregate == InputAggregateChoices.COUNT:
+        return count.copy()
+    observed = count > 0
+    with np.errstate(all='ignore'):
+        if aggregate == InputAggregateChoices.SUM:
+            values = total
+        elif aggregate == InputAggregateChoices.MEAN:
+            values = total / count
+        elif aggregate == InputAggregateChoices.MIN:
+            values = low
+        else:
+            values = high
+    return np.where(observed, values, 0.0 if spec['missing'] == MissingDataChoices.ZERO else np.nan)
+
+
+def input_series(spec, rows, cell_index, cells):
+    """Grid values of one input from a project's rollup rows for its metric"""
+    # Rollups are per source; a cell sums every source of the project
+    return cell_values(spec, *cell_totals(rows, cell_index, cells))
+
+
+def request_grid(compiled, mrv_request):
+    """(cell starts, cell widths in days, {epoch ms: cell}) over an MRV request's reporting period"""
+    start, end = mrv_request.get('reporting_period_start'), mrv_request.get('reporting_period_end')
+    if start is None or end is None or naive_utc(start) >= naive_utc(end):
+        raise CalculationError('the MRV request has no reporting period')
+    starts, cell_days = period_grid(compiled.period, start, end)
+    return starts, cell_days, {to_epoch_ms(cell): i for i, cell in enumerate(starts)}
+
+
+def calculate_request(compiled, mrv_request, rollups):
+    """
+    CreditCalculation of one MRV request (a raw mrv_requests document) from
+    rollups as returned by load_rollups. Raises CalculationError.
+    """
+    starts, cell_days, cell_index = request_grid(compiled, mrv_request)
+    project_id = mrv_request['project']
+    series = {
+        name: input_series(spec, rollups.get((project_id, spec['metric_type']), []), cell_index, len(starts))
+        for name, spec in compiled.inputs.items()
+    }
+    credits, trace = compiled.evaluate(series, cell_days)
+    return CreditCalculation(
+        methodology_code=compiled.code,
+        methodology_version=str(compiled.version),
+        period=compiled.period,
+        period_start=starts[0],
+        period_end=period_bounds(compiled.period, starts[-1])[1],
+        credits=Decimal(repr(credits)).quantize(CREDIT_PLACES),
+        trace=trace,
+        calculated_at=datetime.utcnow(),
+    )
+
+
+def methodologies_by_project(project_ids, methodology_code=None):
+    """Methodology each project is measured by: approved first, then most recent"""
+    query = ProjectMethodology.objects(project__in=list(project_ids))
+    if methodology_code:
+        query = query.filter(methodology_code=methodology_code)
+    chosen = {}
+    for methodology in query.no_dereference().order_by('-is_approved', '-created_at'):
+        chosen.setdefault(reference_id(methodology._data.get('project')), methodology)
+    return chosen
+
+
+def calculate_credits(mrv_requests, methodology_code=None):
+    """
+    Calculate credits of raw mrv_requests documents: one rollup query per
+    methodology and period for all of them. Returns ({request id:
+    CreditCalculation}, {request id: error message}).
+    """
+    methodologies = methodologies_by_project({doc['project'] for doc in mrv_requests}, methodology_code)
+    groups = defaultdict(list)
+    errors = {}
+    for doc in mrv_requests:
+        methodology = methodologies.get(doc['project'])
+        if methodology is None:
+            errors[doc['_id']] = 'the project has no methodology'
+            continue
+        try:
+            compiled = compile_methodology(methodology)
+        except MethodologyError as e:
+            errors[doc['_id']] = f'{methodology.methodology_code}: {e}'
+            continue
+        groups[id(compiled)].append((compiled, doc))
+
+    results = {}
+    for members in groups.values():
+        compiled = members[0][0]
+        dated = [doc for _, doc in members if doc.get('reporting_period_start') and doc.get('reporting_period_end')]
+        rollups = {}
+        if dated:
+            rollups = load_rollups(
+                {doc['project'] for doc in dated},
+                {spec['metric_type'] for spec in compiled.inputs.values()},
+                compiled.period,
+                period_bounds(compiled.period, naive_utc(min(doc['reporting_period_start'] for doc in dated)))[0],
+                max(naive_utc(doc['reporting_period_end']) for doc in dated),
+            )
+        for _, doc in members:
+            try:
+                results[doc['_id']] = calculate_request(compiled, doc, rollups)
+            except CalculationError as e:
+                errors[doc['_id']] = str(e)
+    return results, errors
+
+
+def store_calculations(results):
+    """Save CreditCalculations on their MRV requests in one bulk write"""
+    if not results:
+        return 0
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne({'_id': request_id}, {'$set': {'credit_calculation': calculation.to_mongo().to_dict(),
+                                                  'updated_at': now}})
+        for request_id, calculation in results.items()
+    ]
+    return MRVRequest._get_collection().bulk_write(operations, ordered=False).modified_count
+
+
+def recalculate_credits(methodology_code=None, project_ids=None, statuses=OPEN_MRV_STATUSES):
+    """
+    Recalculate and store credits of MRV requests, e.g. after a factor update.
+    Returns (requests updated, {request id: error message}).
+    """
+    query = {'status': {'$in': list(statuses)}}
+    if project_ids:
+        query['project'] = {'$in': list(project_ids)}
+    elif methodology_code:
+        query['project'] = {'$in': ProjectMethodology._get_collection().distinct(
+            'project', {'methodology_code': methodology_code}
+        )}
+    mrv_requests = list(MRVRequest._get_collection().find(
+        query, {'project': 1, 'reporting_period_start': 1, 'reporting_period_end': 1}
+    ))
+    results, errors = calculate_credits(mrv_requests, methodology_code)
+    return store_calculations(results), errors
@@ -0,0 +1,458 @@
+"""
+MRV evidence - resumable chunked uploads, hashed and deduplicated by content
+
+A client opens an upload for an MRV request with the file's name and size
+(optionally the SHA-256 it expects), then sends the bytes in order as raw
+PATCH bodies, each starting at the offset the server last reported:
+
+    POST  mrv/requests/<id>/evidence/    {"filename", "size", "content_type", "sha256"}
+    PATCH mrv/evidence-uploads/<id>/     Upload-Offset: <n>; body: the next bytes
+    GET   mrv/evidence-uploads/<id>/     current offset, to resume after a failure
+
+Bodies are read in BLOCK_BYTES blocks straight into storage (local disk
+appends to one staging file; GCS stages one object per chunk and composes
+them at the end), so a worker never holds more than a block of a file.
+SHA-256 is updated block by block. The hash state stays in the process that
+wrote the upload's last chunk; a chunk arriving at another process rebuilds
+it by re-reading the staged bytes once.
+
+On the last byte the digest is checked against the declared one and the
+content is stored once under sha256/<ab>/<cd>/<digest>: when an EvidenceFile
+with the digest already exists the staged copy is dropped and the existing
+one reused. The request gets an EvidenceReference per distinct digest. If
+storing or attaching fails, the upload stays UPLOADING at offset == size
+with its bytes staged; an empty PATCH at that offset retries the completion.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from apps.mrv.models import EvidenceFile, EvidenceReference, EvidenceUpload, EvidenceUploadStatusChoices, MRVRequest
+
+
+DEFAULT_MAX_BYTES = 100 * 1024 ** 3
+DEFAULT_MAX_CHUNK_BYTES = 64 * 1024 ** 2
+DEFAULT_UPLOAD_TTL_HOURS = 72
+
+BLOCK_BYTES = 1024 * 1024
+WRITE_LEASE = timedelta(minutes=10)  # Longer than writing the largest chunk
+MAX_CACHED_HASHERS = 64
+MAX_FILENAME_LENGTH = 255
+GCS_COMPOSE_SOURCES = 32
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class EvidenceError(ValueError):
+    """Upload request that cannot be accepted"""
+
+
+class UploadNotFound(EvidenceError):
+    """No upload with that id belongs to the caller"""
+
+
+class UploadConflict(EvidenceError):
+    """Chunk for an offset the upload is not at, or while another chunk is being written"""
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+def get_evidence_uri():
+    """Evidence location (file:///path or gs://bucket/prefix)"""
+    return (getattr(settings, 'MRV_EVIDENCE_URI', '')
+            or f"file://{os.path.join(str(settings.MEDIA_ROOT), 'evidence')}")
+
+
+def get_max_bytes():
+    return getattr(settings, 'MRV_EVIDENCE_MAX_BYTES', DEFAULT_MAX_BYTES)
+
+
+def get_max_chunk_bytes():
+    return getattr(settings, 'MRV_EVIDENCE_MAX_CHUNK_BYTES', DEFAULT_MAX_CHUNK_BYTES)
+
+
+def get_upload_ttl():
+    return timedelta(hours=getattr(settings, 'MRV_EVIDENCE_UPLOAD_TTL_HOURS', DEFAULT_UPLOAD_TTL_HOURS))
+
+
+def evidence_key(digest):
+    """Content-addressed name of stored evidence"""
+    return f'sha256/{digest[:2]}/{digest[2:4]}/{digest}'
+
+
+class LocalEvidenceBackend:
+    """Evidence under a local directory; the chunks of an upload append to one staging file"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _staging(self, upload_id):
+        return os.path.join(self.root, 'staging', str(upload_id))
+
+    def write(self, upload_id, offset, blocks):
+        path = self._staging(upload_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(os.open(path, os.O_RDWR | os.O_CREAT, 0o640), 'r+b') as f:
+            if os.fstat(f.fileno()).st_size < offset:
+                raise EvidenceError('staged data is missing; start a new upload')
+            # Drop whatever an interrupted attempt wrote past the offset
+            f.truncate(offset)
+            f.seek(offset)
+            for block in blocks:
+                f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self, upload_id, parts, length):
+        remaining = length
+        with open(self._staging(upload_id), 'rb') as f:
+            while remaining:
+                block = f.read(min(BLOCK_BYTES, remaining))
+                if not block:
+                    raise EvidenceError('staged data is missing; start a new upload')
+                remaining -= len(block)
+                yield block
+
+    def commit(self, upload_id, parts, key):
+        target = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.replace(self._staging(upload_id), target)
+        except FileNotFoundError:
+            # Committed by an earlier attempt whose completion failed afterwards
+            if not os.path.exists(target):
+                raise EvidenceError('staged data is missing; start a new upload')
+        return f'file://{target}'
+
+    def discard(self, upload_id, parts):
+        try:
+            os.remove(self._staging(upload_id))
+        except FileNotFoundError:
+            pass
+
+
+@lru_cache(maxsize=None)
+def _gcs_bucket(name):
+    # google-cloud-storage is only needed when evidence is kept in GCS
+    from google.cloud import storage
+    return storage.Client().bucket(name)
+
+
+class GCSEvidenceBackend:
+    """Evidence in a Google Cloud Storage bucket; each chunk is staged as an object and composed on commit"""
+
+    def __init__(self, bucket, prefix=''):
+        self.bucket = _gcs_bucket(bucket)
+        self.prefix = prefix.strip('/')
+
+    def _name(self, name):
+        return f'{self.prefix}/{name}' if self.prefix else name
+
+    def _part(self, upload_id, offset):
+        return self.bucket.blob(self._name(f'staging/{upload_id}/{offset:020d}'))
+
+    def write(self, upload_id, offset, blocks):
+        # A retried chunk overwrites the object of its offset
+        with self._part(upload_id, offset).open('wb') as f:
+            for block in blocks:
+                f.write(block)
+
+    def read(self, upload_id, parts, length):
+        remaining = length
+        for offset in parts:
+            with self._part(upload_id, offset).open('rb') as f:
+                for block in iter(lambda: f.read(BLOCK_BYTES), b''):
+                    block = block[:remaining]
+                    remaining -= len(block)
+                    yield block
+                    if not remaining:
+                        return
+        if remaining:
+            raise EvidenceError('staged data is missing; start a new upload')
+
+    def commit(self, upload_id, parts, key):
+        sources = [self._part(upload_id, offset) for offset in parts]
+        target = self.bucket.blob(self._name(key))
+        # Parts are only discarded after a full compose, so none left means an earlier attempt committed
+        if next(iter(self.bucket.list_blobs(prefix=self._name(f'staging/{upload_id}/'), max_results=1)), None) is None:
+            if not target.exists():
+                raise EvidenceError('staged data is missing; start a new upload')
+            return f'gs://{self.bucket.name}/{target.name}'
+        # compose() takes at most 32 sources; fold the rest into the target
+        target.compose(sources[:GCS_COMPOSE_SOURCES])
+        for i in range(GCS_COMPOSE_SOURCES, len(sources), GCS_COMPOSE_SOURCES - 1):
+            target.compose([target] + sources[i:i + GCS_COMPOSE_SOURCES - 1])
+        self.discard(upload_id, parts)
+        return f'gs://{self.bucket.name}/{target.name}'
+
+    def discard(self, upload_id, parts):
+        for blob in self.bucket.list_blobs(prefix=self._name(f'staging/{upload_id}/')):
+            blob.delete()
+
+
+def get_evidence_backend(uri=None):
+    """Backend for an evidence location"""
+    uri = uri or get_evidence_uri()
+    if uri.startswith('gs://'):
+        bucket, _, prefix = uri[len('gs://'):].partition('/')
+        return GCSEvidenceBackend(bucket, prefix)
+    if uri.startswith('file://'):
+        return LocalEvidenceBackend(uri[len('file://'):])
+    raise ValueError(f'Unsupported evidence location: {uri!r}')
+
+
+# upload id -> (offset, sha256 state after that many bytes), most recent last
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+def _take_hasher(upload, backend):
+    with _hashers_lock:
+        cached = _hashers.pop(upload['_id'], None)
+    if cached is not None and cached[0] == upload['offset']:
+        return cached[1]
+    hasher = hashlib.sha256()
+    if upload['offset']:
+        for block in backend.read(upload['_id'], upload.get('parts', []), upload['offset']):
+            hasher.update(block)
+    return hasher
+
+
+def _keep_hasher(upload_id, offset, hasher):
+    with _hashers_lock:
+        _hashers[upload_id] = (offset, hasher)
+        while len(_hashers) > MAX_CACHED_HASHERS:
+            _hashers.popitem(last=False)
+
+
+def _hashed_blocks(stream, length, hashers):
+    remaining = length
+    while remaining:
+        block = stream.read(min(BLOCK_BYTES, remaining))
+        if not block:
+            raise EvidenceError(f'request body ended {remaining} bytes short of Content-Length')
+        for hasher in hashers:
+            hasher.update(block)
+        remaining -= len(block)
+        yield block
+
+
+def create_upload(mrv_request_id, filename, size, uploaded_by_email, content_type=None, sha256=None, now=None):
+    """Open an upload for an MRV request; returns the raw upload document"""
+    filename = os.path.basename((filename or '').replace('\\', '/')).strip()
+    if not filename or len(filename) > MAX_FILENAME_LENGTH:
+        raise EvidenceError(f'filename must be 1 to {MAX_FILENAME_LENGTH} characters')
+    if not 0 < size <= get_max_bytes():
+        raise EvidenceError(f'size must be between 1 and {get_max_bytes()} bytes')
+    if sha256 is not None:
+        sha256 = sha256.lower()
+        if not SHA256_PATTERN.match(sha256):
+            raise EvidenceError('sha256 must be 64 hexadecimal characters')
+
+    now = now or datetime.utcnow()
+    upload = EvidenceUpload(
+        mrv_request=mrv_request_id,
+        uploaded_by_email=uploaded_by_email,
+        filename=filename,
+        content_type=content_type,
+        size=size,
+        expected_sha256=sha256,
+        storage_uri=get_evidence_uri(),
+        created_at=now,
+        updated_at=now,
+        expires_at=now + get_upload_ttl(),
+    )
+    upload.save()
+    return upload.to_mongo().to_dict()
+
+
+def get_upload(upload_id, uploaded_by_email):
+    """Raw upload document of the caller, or UploadNotFound"""
+    upload = EvidenceUpload._get_collection().find_one({'_id': upload_id, 'uploaded_by_email': uploaded_by_email})
+    if upload is None:
+        raise UploadNotFound('upload not found')
+    return upload
+
+
+def write_chunk(upload_id, offset, stream, length, uploaded_by_email, chunk_sha256=None, backend=None, now=None):
+    """
+    Store length bytes read from stream at offset, completing the upload on
+    its last byte. A chunk_sha256 that does not match leaves the offset where
+    it was. An empty chunk at offset == size retries a completion that failed.
+    Returns the raw upload document after the chunk.
+    """
+    now = now or datetime.utcnow()
+    if not 0 <= length <= get_max_chunk_bytes():
+        raise EvidenceError(f'chunks must be between 1 and {get_max_chunk_bytes()} bytes')
+    collection = EvidenceUpload._get_collection()
+    # Holding the offset makes concurrent or out-of-order chunks fail here
+    upload = collection.find_one_and_update(
+        {
+            '_id': upload_id,
+            'uploaded_by_email': uploaded_by_email,
+            'status': EvidenceUploadStatusChoices.UPLOADING,
+            'offset': offset,
+            'writing_until': {'$not': {'$gt': now}},
+        },
+        {'$set': {'writing_until': now + WRITE_LEASE}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if upload is None:
+        current = get_upload(upload_id, uploaded_by_email)
+        if current['status'] != EvidenceUploadStatusChoices.UPLOADING:
+            raise UploadConflict(f"upload is {current['status']}", current['offset'])
+        if current['offset'] == offset:
+            raise UploadConflict('another chunk of the upload is being written', current['offset'])
+        raise UploadConflict(f"upload is at offset {current['offset']}, not {offset}", current['offset'])
+
+    try:
+        if offset + length > upload['size']:
+            raise EvidenceError(f"chunk runs past the declared size of {upload['size']} bytes")
+        if not length and offset < upload['size']:
+            raise EvidenceError(f'chunks must be between 1 and {get_max_chunk_bytes()} bytes')
+        backend = backend or get_evidence_backend(upload.get('storage_uri'))
+        if length:
+            hasher = _take_hasher(upload, backend)
+            chunk_hasher = hashlib.sha256()
+            backend.write(upload_id, offset, _hashed_blocks(stream, length, (hasher, chunk_hasher)))
+            if chunk_sha256 and chunk_hasher.hexdigest() != chunk_sha256:
+                raise EvidenceError('chunk does not match its digest; send it again')
+    except Exception:
+        _release(upload_id, offset)
+        raise
+
+    if length:
+        # The last chunk keeps its lease until the upload is completed
+        update = {
+            '$set': {'offset': offset + length, 'updated_at': now, 'expires_at': now + get_upload_ttl()},
+            '$push': {'parts': offset, 'chunk_sha256': chunk_hasher.hexdigest()},
+        }
+        if offset + length < upload['size']:
+            update['$unset'] = {'writing_until': ''}
+        else:
+            # Recorded so a retried completion needs neither the hash state nor the staged bytes
+            update['$set']['sha256'] = hasher.hexdigest()
+        upload = collection.find_one_and_update(
+            {'_id': upload_id, 'offset': offset}, update, return_document=ReturnDocument.AFTER
+        )
+        if upload['offset'] < upload['size']:
+            _keep_hasher(upload_id, upload['offset'], hasher)
+            return upload
+    try:
+        digest = upload.get('sha256') or _take_hasher(upload, backend).hexdigest()
+        return complete_upload(upload, digest, backend, now)
+    except Exception:
+        _release(upload_id, upload['offset'])
+        raise
+
+
+def _release(upload_id, offset):
+    EvidenceUpload._get_collection().update_one({'_id': upload_id, 'offset': offset}, {'$unset': {'writing_until': ''}})
+
+
+def store_evidence(upload, digest, backend, now=None):
+    """
+    Raw EvidenceFile of digest: the existing one (the staged copy is
+    dropped) or a new one committed from the upload
+    """
+    files = EvidenceFile._get_collection()
+    existing = files.find_one({'sha256': digest})
+    if existing is not None:
+        backend.discard(upload['_id'], upload.get('parts', []))
+        return existing
+    doc = {
+        'sha256': digest,
+        'size': upload['size'],
+        'content_type': upload.get('content_type'),
+        'uri': backend.commit(upload['_id'], upload.get('parts', []), evidence_key(digest)),
+        'created_at': now or datetime.utcnow(),
+    }
+    try:
+        files.insert_one(doc)
+    except DuplicateKeyError:
+        # The same content finished concurrently and was committed to the same key
+        return files.find_one({'sha256': digest})
+    return doc
+
+
+def attach_evidence(mrv_request_id, evidence, upload, now=None):
+    """Reference evidence from an MRV request once per digest; returns whether it was added"""
+    now = now or datetime.utcnow()
+    reference = EvidenceReference(
+        evidence=evidence['_id'],
+        sha256=evidence['sha256'],
+        filename=upload['filename'],
+        size=evidence['size'],
+        content_type=upload.get('content_type') or evidence.get('content_type'),
+        uploaded_by_email=upload['uploaded_by_email'],
+        attached_at=now,
+    )
+    result = MRVRequest._get_collection().update_one(
+        {'_id': mrv_request_id, 'evidence.sha256': {'$ne': evidence['sha256']}},
+        {'$push': {'evidence': reference.to_mongo().to_dict()}, '$set': {'updated_at': now}},
+    )
+    return bool(result.modified_count)
+
+
+def complete_upload(upload, digest, backend, now=None):
+    """Verify the digest, store the content once and attach it; returns the raw upload document"""
+    now = now or datetime.utcnow()
+    collection = EvidenceUpload._get_collection()
+    expected = upload.get('expected_sha256')
+    if expected and expected != digest:
+        backend.discard(upload['_id'], upload.get('parts', []))
+        collection.update_one({'_id': upload['_id']}, {'$set': {
+            'status': EvidenceUploadStatusChoices.FAILED,
+            'sha256': digest,
+            'error': f'content hashes to {digest}, not the declared {expected}',
+            'updated_at': now,
+        }})
+        raise EvidenceError(f'content hashes to {digest}, not the declared {expected}')
+
+    evidence = store_evidence(upload, digest, backend, now)
+    attach_evidence(upload['mrv_request'], evidence, upload, now)
+    return collection.find_one_and_update(
+        {'_id': upload['_id']},
+        {'$set': {
+            'status': EvidenceUploadStatusChoices.COMPLETED,
+            'sha256': digest,
+            'evidence': evidence['_id'],
+            'completed_at': now,
+            'updated_at': now,
+        }, '$unset': {'writing_until': ''}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def abort_upload(upload_id, uploaded_by_email, error=None, now=None):
+    """Stop an unfinished upload and drop its staged bytes; returns whether it was aborted"""
+    upload = EvidenceUpload._get_collection().find_one_and_update(
+        {'_id': upload_id, 'uploaded_by_email': uploaded_by_email, 'status': EvidenceUploadStatusChoices.UPLOADING},
+        {'$set': {'status': EvidenceUploadStatusChoices.ABORTED, 'error': error, 'updated_at': now or datetime.utcnow()}},
+    )
+    if upload is None:
+        return False
+    with _hashers_lock:
+        _hashers.pop(upload_id, None)
+    get_evidence_backend(upload.get('storage_uri')).discard(upload_id, upload.get('parts', []))
+    return True
+
+
+def purge_expired_uploads(now=None):
+    """Abort unfinished uploads past their expiry; returns how many were purged"""
+    now = now or datetime.utcnow()
+    expired = EvidenceUpload._get_collection().find(
+        {'status': EvidenceUploadStatusChoices.UPLOADING, 'expires_at': {'$lt': now}},
+        {'uploaded_by_email': 1},
+    )
+    return sum(abort_upload(upload['_id'], upload['uploaded_by_email'], 'expired', now) for upload in expired)
@@ -0,0 +1,19 @@
+"""
+Abort evidence uploads left unfinished past their expiry and drop their staged bytes
+Usage: python manage.py purge_evidence_uploads
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.mrv.evidence import purge_expired_uploads
+
+
+class Command(BaseCommand):
+    help = 'Abort expired MRV evidence uploads and remove their staged chunks'
+
+    def handle(self, *args, **options):
+        try:
+            purged = purge_expired_uploads()
+        except Exception as e:
+            raise CommandError(f'Error purging evidence uploads: {str(e)}')
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} expired evidence upload(s)'))
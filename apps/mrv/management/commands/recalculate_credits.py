@@ -0,0 +1,44 @@
+"""
+Recalculate credits of MRV requests from measured data, e.g. after a factor update
+Usage: python manage.py recalculate_credits [--methodology BLUE-MANGROVE-01] [--project <id> ...] [--all-statuses]
+"""
+
+import time
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.mrv.calculation import recalculate_credits
+from apps.mrv.models import MRVStatusChoices, OPEN_MRV_STATUSES
+
+
+class Command(BaseCommand):
+    help = 'Evaluate project methodologies over DataAggregation rollups and store the credits on MRV requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--methodology', help='Only projects measured by this methodology_code')
+        parser.add_argument('--project', action='append', default=[], help='Project id (repeatable)')
+        parser.add_argument(
+            '--all-statuses', action='store_true',
+            help='Include approved and rejected requests (default: open ones only)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            project_ids = [ObjectId(project_id) for project_id in options['project']]
+        except InvalidId as e:
+            raise CommandError(str(e))
+        statuses = [code for code, _ in MRVStatusChoices.CHOICES] if options['all_statuses'] else OPEN_MRV_STATUSES
+
+        started = time.perf_counter()
+        try:
+            updated, errors = recalculate_credits(options['methodology'], project_ids, statuses)
+        except Exception as e:
+            raise CommandError(f'Error recalculating credits: {str(e)}')
+
+        for request_id, message in sorted(errors.items()):
+            self.stdout.write(self.style.WARNING(f'  {request_id}: {message}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Recalculated {updated} MRV request(s) in {time.perf_counter() - started:.1f}s; {len(errors)} failed'
+        ))
@@ -2,9 +2,12 @@
 MRV app models
 """
 
-from mongoengine import Document, StringField, DateTimeField, ReferenceField, ListField, DecimalField, BooleanField, EmbeddedDocument, EmbeddedDocumentField, DictField, FloatField
+from mongoengine import Document, StringField, DateTimeField, ReferenceField, ListField, DecimalField, BooleanField, EmbeddedDocument, EmbeddedDocumentField, DictField, FloatField, IntField
 from datetime import datetime
 
+from apps.api.numeric import DecimalAmountField
+from apps.api.references import reference_id
+
 
 class MRVStatusChoices:
     PENDING = 'PENDING'
@@ -36,6 +39,44 @@ class AssessmentDecisionChoices:
     ]
 
 
+class AnomalyTypeChoices:
+    SPIKE = 'SPIKE'
+    DROP = 'DROP'
+    DRIFT = 'DRIFT'
+    
+    CHOICES = [
+        (SPIKE, 'Spike'),
+        (DROP, 'Drop'),
+        (DRIFT, 'Drift'),
+    ]
+
+
+class AnomalySeverityChoices:
+    LOW = 'LOW'
+    MEDIUM = 'MEDIUM'
+    HIGH = 'HIGH'
+    
+    CHOICES = [
+        (LOW, 'Low'),
+        (MEDIUM, 'Medium'),
+        (HIGH, 'High'),
+    ]
+
+
+class EvidenceUploadStatusChoices:
+    UPLOADING = 'UPLOADING'
+    COMPLETED = 'COMPLETED'
+    FAILED = 'FAILED'
+    ABORTED = 'ABORTED'
+    
+    CHOICES = [
+        (UPLOADING, 'Uploading'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+        (ABORTED, 'Aborted'),
+    ]
+
+
 class Anomaly(EmbeddedDocument):
     """Anomaly detected in MRV data"""
     type = StringField()
@@ -43,6 +84,82 @@ class Anomaly(EmbeddedDocument):
     description = StringField()
     recommended_action = StringField()
     detected_at = DateTimeField(default=datetime.utcnow)
+    
+    # Set when raised by the ingest-time detector (apps.data_intake.anomalies)
+    data_source = ReferenceField('apps.data_intake.DataSource')
+    metric_type = StringField()
+    observed_at = DateTimeField()  # Timestamp of the reading that raised it
+    value = FloatField()
+    expected = FloatField()
+    score = FloatField()  # Standardised deviation from the baseline
+
+
+class CreditCalculation(EmbeddedDocument):
+    """Credits computed from measured data by the project's methodology (apps.mrv.calculation)"""
+    methodology_code = StringField()
+    methodology_version = StringField()
+    period = StringField()  # Grid the inputs were aggregated on
+    period_start = DateTimeField()  # Reporting period snapped to whole periods
+    period_end = DateTimeField()
+    credits = DecimalAmountField()
+    trace = ListField(DictField())  # Every input, constant and formula with its value
+    calculated_at = DateTimeField(default=datetime.utcnow)
+
+
+class UncertaintyEstimate(EmbeddedDocument):
+    """Monte Carlo distribution of calculated credits (apps.mrv.uncertainty)"""
+    methodology_code = StringField()
+    methodology_version = StringField()
+    draws = IntField()
+    undefined_draws = IntField()  # Draws whose credits were not finite, left out of the statistics
+    seed = IntField()  # Reproduces the draws
+    confidence = FloatField()  # Two-sided level of ci_low..ci_high
+    credits = DecimalAmountField()  # Without error, as in CreditCalculation
+    mean = DecimalAmountField()
+    std = FloatField()
+    ci_low = DecimalAmountField()
+    ci_high = DecimalAmountField()
+    relative_uncertainty = FloatField()  # Half-width of the interval over the mean
+    conservative_credits = DecimalAmountField()  # Lower bound, capped at credits, never negative
+    parameters = ListField(DictField())  # Every sampled constant and sensor with its error
+    calculated_at = DateTimeField(default=datetime.utcnow)
+
+
+class EvidenceFile(Document):
+    """Evidence content, stored once per SHA-256 however many requests attach it (apps.mrv.evidence)"""
+    sha256 = StringField(required=True)
+    size = IntField(required=True)
+    content_type = StringField()
+    uri = StringField(required=True)  # file:// or gs:// location, keyed by the digest
+    created_at = DateTimeField(default=datetime.utcnow)
+    
+    meta = {
+        'collection': 'mrv_evidence_files',
+        'indexes': [
+            {'fields': ['sha256'], 'unique': True},
+        ],
+    }
+    
+    def __str__(self):
+        return f"Evidence {self.sha256} ({self.size} bytes)"
+
+
+class EvidenceReference(EmbeddedDocument):
+    """Uploaded evidence attached to an MRV request once its digest was computed by the server"""
+    evidence = ReferenceField(EvidenceFile)
+    sha256 = StringField()
+    filename = StringField()
+    size = IntField()
+    content_type = StringField()
+    uploaded_by_email = StringField()
+    attached_at = DateTimeField(default=datetime.utcnow)
+
+
+OPEN_MRV_STATUSES = (
+    MRVStatusChoices.PENDING,
+    MRVStatusChoices.UNDER_REVIEW,
+    MRVStatusChoices.REQUIRES_REVISION,
+)
 
 
 class MRVRequest(Document):
@@ -61,10 +178,26 @@ class MRVRequest(Document):
     # Evidence
     documentation_urls = ListField(StringField())
     evidence_files = ListField(StringField())  # File paths or URLs
+    evidence = ListField(EmbeddedDocumentField(EvidenceReference))  # Uploaded and hashed, one per digest
     
     # Initial estimate
     initial_estimate_credits = DecimalField(max_digits=20, decimal_places=4)
     
+    # Computed from DataAggregation rollups; refreshed by recalculate_credits
+    credit_calculation = EmbeddedDocumentField(CreditCalculation)
+    
+    # Raised by ingest-time anomaly detection while the request is open (most recent kept)
+    anomalies = ListField(EmbeddedDocumentField(Anomaly))
+    
+    # Review queue (apps.mrv.review_queue): higher priority is claimed first
+    priority = FloatField(default=0.0)
+    priority_factors = DictField()  # Age, volume, risk and SLA terms, each 0-1 (SLA up to 2 when overdue)
+    sla_due_at = DateTimeField()  # Review deadline; submitted_at + MRV_REVIEW_SLA_DAYS when unset
+    reviewer_email = StringField()  # Validator holding the lease
+    review_claimed_at = DateTimeField()
+    review_lease_expires_at = DateTimeField()  # Claimable again by anyone once passed
+    review_claims = IntField(default=0)
+    
     # Timestamps
     submitted_at = DateTimeField(default=datetime.utcnow)
     created_at = DateTimeField(default=datetime.utcnow)
@@ -72,11 +205,54 @@ class MRVRequest(Document):
     
     meta = {
         'collection': 'mrv_requests',
-        'indexes': ['project', 'status', 'submitted_at'],
+        'indexes': [
+            # Keyset pagination: (submitted_at, _id), also behind the project filter
+            {'fields': ['project', 'submitted_at', 'id']},
+            {'fields': ['submitted_at', 'id']},
+            # Serves status filters and the review queue's claim order
+            {'fields': ['status', '-priority', 'submitted_at'], 'name': 'review_queue'},
+        ],
+    }
+    
+    def __str__(self):
+        # Stored ids only: dereferencing here costs a query per printed row
+        return f"MRVRequest for project {reference_id(self._data.get('project'))} - {self.status}"
+
+
+class EvidenceUpload(Document):
+    """Resumable chunked upload of one evidence file for an MRV request"""
+    
+    mrv_request = ReferenceField(MRVRequest, required=True)
+    uploaded_by_email = StringField(required=True)
+    
+    filename = StringField(required=True)
+    content_type = StringField()
+    size = IntField(required=True)  # Declared bytes
+    expected_sha256 = StringField()  # Declared digest, checked on completion
+    storage_uri = StringField()  # Evidence location when the upload started
+    
+    status = StringField(choices=EvidenceUploadStatusChoices.CHOICES, default=EvidenceUploadStatusChoices.UPLOADING)
+    offset = IntField(default=0)  # Bytes stored so far; the next chunk starts here
+    parts = ListField(IntField())  # Offset of every stored chunk
+    chunk_sha256 = ListField(StringField())  # Digest of every stored chunk
+    writing_until = DateTimeField()  # Held while a chunk is being written
+    
+    sha256 = StringField()
+    evidence = ReferenceField(EvidenceFile)
+    error = StringField()
+    
+    created_at = DateTimeField(default=datetime.utcnow)
+    updated_at = DateTimeField(default=datetime.utcnow)
+    expires_at = DateTimeField()  # Unfinished uploads are purged after this
+    completed_at = DateTimeField()
+    
+    meta = {
+        'collection': 'mrv_evidence_uploads',
+        'indexes': ['mrv_request', {'fields': ['status', 'expires_at']}],
     }
     
     def __str__(self):
-        return f"MRVRequest for {self.project.name} - {self.status}"
+        return f"Upload of {self.filename} ({self.status}: {self.offset}/{self.size})"
 
 
 class MRVAssessment(Document):
@@ -95,6 +271,7 @@ class MRVAssessment(Document):
     
     # Analysis
     risk_score = FloatField()  # 0-100
+    uncertainty = EmbeddedDocumentField(UncertaintyEstimate)
     anomalies_detected = ListField(EmbeddedDocumentField(Anomaly))
     assessment_notes = StringField()
     
@@ -109,11 +286,18 @@ class MRVAssessment(Document):
     
     meta = {
         'collection': 'mrv_assessments',
-        'indexes': ['mrv_request', 'project', 'decision', 'submitted_at'],
+        'indexes': [
+            'mrv_request',
+            'decision',
+            # Keyset pagination: (submitted_at, _id), also behind the project filter
+            {'fields': ['project', 'submitted_at', 'id']},
+            {'fields': ['submitted_at', 'id']},
+        ],
     }
     
     def __str__(self):
-        return f"Assessment: {self.mrv_request.project.name} - {self.decision}"
+        # Stored ids only: dereferencing here costs a query per printed row
+        return f"Assessment of MRVRequest {reference_id(self._data.get('mrv_request'))} - {self.decision}"
 
 
 class MRVAuditLog(Document):
@@ -0,0 +1,234 @@
+"""
+MRV review queue - prioritised, lease-based hand-out of requests to validators
+
+Every queued MRVRequest stores a priority built from four terms, each
+scaled to 0-1 and weighted by MRV_REVIEW_PRIORITY_WEIGHTS:
+
+    age     days since submission, saturating at MAX_AGE_DAYS
+    volume  log10 of the credits at stake (calculated, else the estimate)
+    risk    latest assessment risk_score, else a score from open anomalies
+    sla     share of the SLA window used; 1 at the deadline, 2 when overdue
+
+Age and SLA grow with time, so refresh_priorities() runs periodically
+(Celery beat) as well as on submission.
+
+claim_next() is a single find-and-modify on the review_queue index
+(status, -priority, submitted_at): the highest-priority request whose
+lease is missing or expired is taken and leased to the validator, so two
+validators never receive the same request. A lease is renewed while the
+review goes on and released when it ends; an abandoned one simply
+expires and the request is handed out again.
+"""
+
+import math
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from pymongo import ReturnDocument, UpdateOne
+
+from apps.api.numeric import to_decimal
+from apps.data_intake.storage import naive_utc
+from apps.mrv.models import AnomalySeverityChoices, MRVAssessment, MRVRequest, MRVStatusChoices
+
+
+DEFAULT_SLA_DAYS = 30
+DEFAULT_LEASE_MINUTES = 30
+DEFAULT_PRIORITY_WEIGHTS = {'age': 0.2, 'volume': 0.25, 'risk': 0.25, 'sla': 0.3}
+DEFAULT_REFRESH_BATCH_SIZE = 1000
+
+MAX_AGE_DAYS = 90
+MAX_VOLUME_DIGITS = 6  # 1,000,000 credits saturate the volume term
+MAX_LEASE_MINUTES = 24 * 60
+OVERDUE_SLA = 2.0
+
+# Risk of an unassessed request, per open anomaly
+ANOMALY_RISK = {
+    AnomalySeverityChoices.LOW: 2.0,
+    AnomalySeverityChoices.MEDIUM: 10.0,
+    AnomalySeverityChoices.HIGH: 25.0,
+}
+
+# Statuses a validator can claim from; UNDER_REVIEW only once its lease has expired
+QUEUE_STATUSES = (MRVStatusChoices.PENDING, MRVStatusChoices.UNDER_REVIEW)
+QUEUE_INDEX = 'review_queue'
+QUEUE_SORT = [('priority', -1), ('submitted_at', 1)]
+
+LEASE_FIELDS = ('reviewer_email', 'review_claimed_at', 'review_lease_expires_at')
+PRIORITY_PROJECTION = {
+    'submitted_at': 1, 'sla_due_at': 1, 'initial_estimate_credits': 1,
+    'credit_calculation.credits': 1, 'anomalies.severity': 1,
+}
+
+QUEUE_PROJECTION = {
+    'project': 1, 'status': 1, 'submitted_at': 1, 'sla_due_at': 1, 'priority': 1, 'priority_factors': 1,
+    'review_claims': 1, 'reviewer_email': 1, 'review_lease_expires_at': 1,
+}
+
+
+def get_sla_days():
+    return getattr(settings, 'MRV_REVIEW_SLA_DAYS', DEFAULT_SLA_DAYS)
+
+
+def get_lease_minutes():
+    return getattr(settings, 'MRV_REVIEW_LEASE_MINUTES', DEFAULT_LEASE_MINUTES)
+
+
+def get_priority_weights():
+    return dict(DEFAULT_PRIORITY_WEIGHTS, **getattr(settings, 'MRV_REVIEW_PRIORITY_WEIGHTS', {}))
+
+
+def anomaly_risk(anomalies):
+    """0-100 risk of a request no validator has scored, from its open anomalies"""
+    return min(100.0, sum(ANOMALY_RISK.get(anomaly.get('severity'), 0.0) for anomaly in anomalies or []))
+
+
+def priority_factors(doc, risk_score=None, now=None):
+    """Age, volume, risk and SLA terms of a raw mrv_requests document"""
+    now = now or datetime.utcnow()
+    submitted_at = naive_utc(doc.get('submitted_at')) or now
+    due_at = naive_utc(doc.get('sla_due_at')) or submitted_at + timedelta(days=get_sla_days())
+    age_days = max((now - submitted_at).total_seconds(), 0.0) / 86400
+
+    credits = (doc.get('credit_calculation') or {}).get('credits')
+    if credits is None:
+        credits = doc.get('initial_estimate_credits')
+    credits = max(float(to_decimal(credits) or 0), 0.0)
+
+    if risk_score is None:
+        risk_score = anomaly_risk(doc.get('anomalies'))
+
+    if now >= due_at:
+        sla = OVERDUE_SLA
+    else:
+        window = max((due_at - submitted_at).total_seconds(), 1.0)
+        sla = min(max(1 - (due_at - now).total_seconds() / window, 0.0), 1.0)
+
+    return {
+        'age': min(age_days / MAX_AGE_DAYS, 1.0),
+        'volume': min(math.log10(1 + credits) / MAX_VOLUME_DIGITS, 1.0),
+        'risk': min(max(risk_score / 100, 0.0), 1.0),
+        'sla': sla,
+    }
+
+
+def priority_score(factors):
+    """Weighted sum of priority factors, 0-100 (more when overdue)"""
+    weights = get_priority_weights()
+    return round(100 * sum(weights.get(name, 0.0) * value for name, value in factors.items()), 4)
+
+
+def latest_risk_scores(request_ids):
+    """{request id: risk_score of its latest assessment that has one}"""
+    pipeline = [
+        {'$match': {'mrv_request': {'$in': list(request_ids)}, 'risk_score': {'$ne': None}}},
+        {'$sort': {'submitted_at': -1}},
+        {'$group': {'_id': '$mrv_request', 'risk_score': {'$first': '$risk_score'}}},
+    ]
+    return {row['_id']: row['risk_score'] for row in MRVAssessment._get_collection().aggregate(pipeline)}
+
+
+def _priority_updates(docs, now):
+    risks = latest_risk_scores([doc['_id'] for doc in docs])
+    updates = []
+    for doc in docs:
+        factors = priority_factors(doc, risks.get(doc['_id']), now)
+        updates.append(UpdateOne(
+            {'_id': doc['_id']},
+            {'$set': {'priority': priority_score(factors), 'priority_factors': factors}},
+        ))
+    return updates
+
+
+def refresh_priorities(request_ids=None, batch_size=DEFAULT_REFRESH_BATCH_SIZE, now=None):
+    """
+    Recompute the priority of queued requests (or only request_ids) in _id
+    batches. Returns the number of requests updated.
+    """
+    now = now or datetime.utcnow()
+    collection = MRVRequest._get_collection()
+    query = {'status': {'$in': list(QUEUE_STATUSES)}}
+    if request_ids is not None:
+        query['_id'] = {'$in': list(request_ids)}
+    updated, last_id = 0, None
+    while True:
+        batch_query = dict(query, _id={'$gt': last_id, **query.get('_id', {})}) if last_id else query
+        docs = list(collection.find(batch_query, PRIORITY_PROJECTION).sort('_id', 1).limit(batch_size))
+        if not docs:
+            return updated
+        last_id = docs[-1]['_id']
+        updated += collection.bulk_write(_priority_updates(docs, now), ordered=False).modified_count
+
+
+def _claimable(now):
+    return {'status': {'$in': list(QUEUE_STATUSES)}, 'review_lease_expires_at': {'$not': {'$gt': now}}}
+
+
+def peek(limit=20, now=None):
+    """Highest-priority claimable requests, without claiming them"""
+    now = now or datetime.utcnow()
+    return list(
+        MRVRequest._get_collection().find(_claimable(now), QUEUE_PROJECTION)
+        .sort(QUEUE_SORT).hint(QUEUE_INDEX).limit(limit)
+    )
+
+
+def claim_next(validator_email, lease_minutes=None, now=None):
+    """
+    Lease the highest-priority claimable request to a validator and move it
+    UNDER_REVIEW. Returns the updated raw document, or None when the queue
+    is empty.
+    """
+    now = now or datetime.utcnow()
+    lease = timedelta(minutes=min(lease_minutes or get_lease_minutes(), MAX_LEASE_MINUTES))
+    return MRVRequest._get_collection().find_one_and_update(
+        _claimable(now),
+        {
+            '$set': {
+                'status': MRVStatusChoices.UNDER_REVIEW,
+                'reviewer_email': validator_email,
+                'review_claimed_at': now,
+                'review_lease_expires_at': now + lease,
+                'updated_at': now,
+            },
+            '$inc': {'review_claims': 1},
+        },
+        projection=QUEUE_PROJECTION,
+        sort=QUEUE_SORT,
+        hint=QUEUE_INDEX,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _held(request_id, validator_email, now):
+    # Only the current holder of an unexpired lease may act on it
+    return {
+        '_id': request_id,
+        'status': MRVStatusChoices.UNDER_REVIEW,
+        'reviewer_email': validator_email,
+        'review_lease_expires_at': {'$gt': now},
+    }
+
+
+def renew_lease(request_id, validator_email, lease_minutes=None, now=None):
+    """Extend a validator's lease; returns the new expiry, or None if the lease is no longer theirs"""
+    now = now or datetime.utcnow()
+    expires_at = now + timedelta(minutes=min(lease_minutes or get_lease_minutes(), MAX_LEASE_MINUTES))
+    result = MRVRequest._get_collection().update_one(
+        _held(request_id, validator_email, now),
+        {'$set': {'review_lease_expires_at': expires_at, 'updated_at': now}},
+    )
+    return expires_at if result.modified_count else None
+
+
+def release_lease(request_id, validator_email, status=MRVStatusChoices.PENDING, now=None):
+    """
+    End a validator's lease, putting the request back in the queue (PENDING)
+    or moving it to the status the review decided. Returns False if the
+    lease is no longer theirs.
+    """
+    now = now or datetime.utcnow()
+    result = MRVRequest._get_collection().update_one(
+        _held(request_id, validator_email, now),
+        {'$set': {'status': status, 'updated_at': now}, '$unset': {field: '' for field in LEASE_FIELDS}},
+    )
+    return bool(result.modified_count)
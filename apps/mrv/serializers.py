@@ -3,21 +3,178 @@ MRV app serializers
 """
 
 from rest_framework import serializers
+from apps.api.references import load_references, reference_ids, stored_reference
 from apps.mrv.models import MRVRequest, MRVAssessment, MRVAuditLog, MRVStatusChoices, AssessmentDecisionChoices
+from apps.mrv.evidence import MAX_FILENAME_LENGTH, get_max_bytes, get_max_chunk_bytes
+from apps.mrv.uncertainty import MAX_DRAWS
+from apps.projects.models import Project
+
+
+# Fields of related documents shown in MRV listings
+PROJECT_SUMMARY_FIELDS = ('name', 'status')
+MRV_REQUEST_SUMMARY_FIELDS = ('status', 'reporting_period_start', 'reporting_period_end')
+
+
+class ReferenceIdField(serializers.CharField):
+    """Id of a ReferenceField, read from the stored value so the reference is never dereferenced"""
+    
+    def __init__(self, reference, **kwargs):
+        self.reference = reference
+        super().__init__(**kwargs)
+    
+    def get_attribute(self, instance):
+        return stored_reference(instance, self.reference)
+
+
+class ReferenceSummaryField(serializers.Field):
+    """
+    Summary of a referenced document, looked up in the {id: raw document}
+    map the list view loaded for the whole page (context[context_key])
+    """
+    
+    def __init__(self, reference, context_key, summary_fields, **kwargs):
+        self.reference = reference
+        self.context_key = context_key
+        self.summary_fields = summary_fields
+        super().__init__(read_only=True, **kwargs)
+    
+    def get_attribute(self, instance):
+        return self.context.get(self.context_key, {}).get(stored_reference(instance, self.reference))
+    
+    def to_representation(self, row):
+        return dict({'id': str(row['_id'])}, **{field: row.get(field) for field in self.summary_fields})
+
+
+class AnomalySerializer(serializers.Serializer):
+    """Serializer for anomalies raised on MRV data"""
+    
+    type = serializers.CharField()
+    severity = serializers.CharField()
+    description = serializers.CharField(required=False)
+    recommended_action = serializers.CharField(required=False)
+    detected_at = serializers.DateTimeField(read_only=True)
+    data_source_id = serializers.SerializerMethodField()
+    metric_type = serializers.CharField(required=False)
+    observed_at = serializers.DateTimeField(required=False)
+    value = serializers.FloatField(required=False)
+    expected = serializers.FloatField(required=False)
+    score = serializers.FloatField(required=False)
+    
+    def get_data_source_id(self, obj):
+        source_id = stored_reference(obj, 'data_source')
+        return str(source_id) if source_id else None
+
+
+class CreditCalculationSerializer(serializers.Serializer):
+    """Serializer for credits calculated from measured data"""
+    
+    methodology_code = serializers.CharField()
+    methodology_version = serializers.CharField()
+    period = serializers.CharField()
+    period_start = serializers.DateTimeField()
+    period_end = serializers.DateTimeField()
+    credits = serializers.DecimalField(max_digits=20, decimal_places=4)
+    trace = serializers.ListField(child=serializers.DictField())
+    calculated_at = serializers.DateTimeField()
+
+
+class UncertaintyEstimateSerializer(serializers.Serializer):
+    """Serializer for Monte Carlo credit uncertainty"""
+    
+    methodology_code = serializers.CharField()
+    methodology_version = serializers.CharField()
+    draws = serializers.IntegerField()
+    undefined_draws = serializers.IntegerField()
+    seed = serializers.IntegerField()
+    confidence = serializers.FloatField()
+    credits = serializers.DecimalField(max_digits=20, decimal_places=4)
+    mean = serializers.DecimalField(max_digits=20, decimal_places=4)
+    std = serializers.FloatField()
+    ci_low = serializers.DecimalField(max_digits=20, decimal_places=4)
+    ci_high = serializers.DecimalField(max_digits=20, decimal_places=4)
+    relative_uncertainty = serializers.FloatField(allow_null=True)
+    conservative_credits = serializers.DecimalField(max_digits=20, decimal_places=4)
+    parameters = serializers.ListField(child=serializers.DictField())
+    calculated_at = serializers.DateTimeField()
+
+
+class UncertaintyEstimateRequestSerializer(serializers.Serializer):
+    """Options of a Monte Carlo uncertainty estimate (settings apply when left out)"""
+    
+    draws = serializers.IntegerField(min_value=1, max_value=MAX_DRAWS, required=False)
+    confidence = serializers.FloatField(min_value=0.5, max_value=0.999, required=False)
+    seed = serializers.IntegerField(min_value=0, max_value=2 ** 63 - 1, required=False)
+    apply = serializers.BooleanField(default=False)  # Recommend the conservative credits
+
+
+class EvidenceReferenceSerializer(serializers.Serializer):
+    """Serializer for uploaded evidence attached to an MRV request"""
+    
+    evidence_id = ReferenceIdField('evidence')
+    sha256 = serializers.CharField()
+    filename = serializers.CharField()
+    size = serializers.IntegerField()
+    content_type = serializers.CharField()
+    uploaded_by_email = serializers.EmailField()
+    attached_at = serializers.DateTimeField()
+
+
+class EvidenceUploadCreateSerializer(serializers.Serializer):
+    """Serializer for opening an evidence upload"""
+    
+    filename = serializers.CharField(max_length=MAX_FILENAME_LENGTH)
+    size = serializers.IntegerField(min_value=1)
+    content_type = serializers.CharField(max_length=255, required=False)
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False)  # Checked once every byte arrived
+    
+    def validate_size(self, value):
+        if value > get_max_bytes():
+            raise serializers.ValidationError(f'Evidence files are limited to {get_max_bytes()} bytes')
+        return value
+
+
+class EvidenceUploadSerializer(serializers.Serializer):
+    """Serializer for raw evidence upload documents; offset is where the next chunk starts"""
+    
+    id = serializers.CharField(source='_id')
+    mrv_request_id = serializers.CharField(source='mrv_request')
+    filename = serializers.CharField()
+    content_type = serializers.CharField(required=False)
+    size = serializers.IntegerField()
+    offset = serializers.IntegerField()
+    status = serializers.CharField()
+    sha256 = serializers.CharField(required=False)
+    evidence_id = serializers.CharField(source='evidence', required=False)
+    error = serializers.CharField(required=False)
+    max_chunk_bytes = serializers.SerializerMethodField()
+    expires_at = serializers.DateTimeField()
+    completed_at = serializers.DateTimeField(required=False)
+    
+    def get_max_chunk_bytes(self, obj):
+        return get_max_chunk_bytes()
 
 
 class MRVRequestSerializer(serializers.Serializer):
     """Serializer for MRV requests"""
     
     id = serializers.CharField(read_only=True)
-    project_id = serializers.CharField()
+    project_id = ReferenceIdField('project')
+    project = ReferenceSummaryField('project', 'projects', PROJECT_SUMMARY_FIELDS)
     requested_by_email = serializers.EmailField()
     status = serializers.ChoiceField(choices=MRVStatusChoices.CHOICES)
     reporting_period_start = serializers.DateTimeField(required=False)
     reporting_period_end = serializers.DateTimeField(required=False)
     documentation_urls = serializers.ListField(child=serializers.URLField(), required=False)
     evidence_files = serializers.ListField(child=serializers.CharField(), required=False)
+    evidence = EvidenceReferenceSerializer(many=True, read_only=True)
     initial_estimate_credits = serializers.DecimalField(max_digits=20, decimal_places=4, required=False)
+    anomalies = AnomalySerializer(many=True, read_only=True)
+    credit_calculation = CreditCalculationSerializer(read_only=True)
+    priority = serializers.FloatField(read_only=True)
+    priority_factors = serializers.DictField(read_only=True)
+    sla_due_at = serializers.DateTimeField(read_only=True)
+    reviewer_email = serializers.EmailField(read_only=True)
+    review_lease_expires_at = serializers.DateTimeField(read_only=True)
     submitted_at = serializers.DateTimeField(read_only=True)
     created_at = serializers.DateTimeField(read_only=True)
     updated_at = serializers.DateTimeField(read_only=True)
@@ -27,14 +184,17 @@ class MRVAssessmentSerializer(serializers.Serializer):
     """Serializer for MRV assessments"""
     
     id = serializers.CharField(read_only=True)
-    mrv_request_id = serializers.CharField()
-    project_id = serializers.CharField()
+    mrv_request_id = ReferenceIdField('mrv_request')
+    mrv_request = ReferenceSummaryField('mrv_request', 'mrv_requests', MRV_REQUEST_SUMMARY_FIELDS)
+    project_id = ReferenceIdField('project')
+    project = ReferenceSummaryField('project', 'projects', PROJECT_SUMMARY_FIELDS)
     validator_email = serializers.EmailField()
     validator_organization = serializers.CharField(required=False)
     decision = serializers.ChoiceField(choices=AssessmentDecisionChoices.CHOICES)
     recommended_credits = serializers.DecimalField(max_digits=20, decimal_places=4, required=False)
     risk_score = serializers.FloatField(required=False)
-    anomalies_detected = serializers.ListField(required=False)
+    uncertainty = UncertaintyEstimateSerializer(read_only=True)
+    anomalies_detected = AnomalySerializer(many=True, required=False)
     assessment_notes = serializers.CharField(required=False)
     assessment_report_url = serializers.URLField(required=False)
     calculation_methodology = serializers.CharField(required=False)
@@ -43,12 +203,29 @@ class MRVAssessmentSerializer(serializers.Serializer):
     updated_at = serializers.DateTimeField(read_only=True)
 
 
+def serialize_mrv_requests(mrv_requests):
+    """Serialize a page of MRV requests, loading their projects in one query"""
+    projects = load_references(Project, reference_ids(mrv_requests, 'project'), PROJECT_SUMMARY_FIELDS)
+    return MRVRequestSerializer(mrv_requests, many=True, context={'projects': projects}).data
+
+
+def serialize_mrv_assessments(assessments):
+    """Serialize a page of MRV assessments, loading their projects and MRV requests in one query each"""
+    context = {
+        'projects': load_references(Project, reference_ids(assessments, 'project'), PROJECT_SUMMARY_FIELDS),
+        'mrv_requests': load_references(
+            MRVRequest, reference_ids(assessments, 'mrv_request'), MRV_REQUEST_SUMMARY_FIELDS
+        ),
+    }
+    return MRVAssessmentSerializer(assessments, many=True, context=context).data
+
+
 class MRVAuditLogSerializer(serializers.Serializer):
     """Serializer for MRV audit logs"""
     
     id = serializers.CharField(read_only=True)
-    mrv_request_id = serializers.CharField(required=False)
-    mrv_assessment_id = serializers.CharField(required=False)
+    mrv_request_id = ReferenceIdField('mrv_request', required=False)
+    mrv_assessment_id = ReferenceIdField('mrv_assessment', required=False)
     action = serializers.CharField()
     performed_by = serializers.CharField()
     performer_role = serializers.CharField()
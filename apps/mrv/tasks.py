@@ -0,0 +1,20 @@
+"""
+MRV Celery tasks
+"""
+
+from celery import shared_task
+
+from apps.mrv.evidence import purge_expired_uploads
+from apps.mrv.review_queue import refresh_priorities
+
+
+@shared_task(ignore_result=True)
+def refresh_review_priorities():
+    """Recompute review queue priorities as requests age towards their SLA (run by Celery beat)"""
+    return refresh_priorities()
+
+
+@shared_task(ignore_result=True)
+def purge_evidence_uploads():
+    """Abort evidence uploads left unfinished past their expiry and drop their staged bytes (run by Celery beat)"""
+    return purge_expired_uploads()
@@ -0,0 +1,479 @@
+"""
+Tests for MRV credit calculation, uncertainty, the review queue, listings and evidence uploads
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
+
+from bson import ObjectId
+from django.test import SimpleTestCase
+from pymongo.errors import AutoReconnect
+
+import numpy as np
+
+from apps.api.permissions import IsValidator
+from apps.mrv.calculation import (
+    CalculationError, CompiledMethodology, MethodologyError, calculate_request, compile_methodology, period_grid
+)
+from apps.mrv.evidence import (
+    EvidenceError, LocalEvidenceBackend, UploadConflict, _hashers, attach_evidence, complete_upload, store_evidence,
+    write_chunk
+)
+from apps.mrv.models import MRVAssessment, MRVRequest
+from apps.mrv.review_queue import claim_next, priority_factors, priority_score, refresh_priorities, release_lease
+from apps.mrv.serializers import serialize_mrv_assessments, serialize_mrv_requests
+from apps.mrv.uncertainty import build_model, simulate, summarize
+from apps.mrv.views import MRVAssessmentViewSet, MRVRequestViewSet
+from apps.projects.models import Project
+
+
+PARAMETERS = {
+    'version': 2,
+    'period': 'DAILY',
+    'inputs': {
+        'energy': {'metric_type': 'ENERGY_CONSUMPTION', 'aggregate': 'SUM'},
+    },
+    'constants': {
+        'grid_factor': {'value': 0.5, 'unit': 'tCO2e/MWh'},
+        'leakage': 0.1,
+    },
+    'formulas': {
+        'credits': 'sum(baseline) * (1 - leakage)',
+        'baseline': 'energy * grid_factor',
+    },
+}
+
+
+class CreditCalculationTests(SimpleTestCase):
+    """Test compiling methodology parameters and evaluating them over rollups"""
+
+    def test_formulas_evaluate_in_dependency_order(self):
+        compiled = CompiledMethodology('M-1', 2, PARAMETERS)
+        self.assertEqual(compiled.order, ['baseline', 'credits'])
+        credits, trace = compiled.evaluate({'energy': np.array([10.0, 20.0, 30.0])}, np.ones(3))
+        self.assertAlmostEqual(credits, 27.0)
+        baseline = next(node for node in trace if node['name'] == 'baseline')
+        self.assertEqual(baseline['values'], [5.0, 10.0, 15.0])
+        factor = next(node for node in trace if node['name'] == 'grid_factor')
+        self.assertEqual(factor['unit'], 'tCO2e/MWh')
+
+    def test_unsafe_or_invalid_formulas_are_rejected(self):
+        for formula in (
+            '__import__("os").system("true")',
+            'energy.__class__',
+            'energy[0]',
+            '[x for x in energy]',
+            'unknown * 2',
+            'sum(energy, 2)',
+            'lambda: 1',
+            '"text"',
+        ):
+            with self.subTest(formula=formula), self.assertRaises(MethodologyError):
+                CompiledMethodology('M-1', 1, dict(PARAMETERS, formulas={'credits': formula}))
+
+    def test_cycles_and_name_clashes_are_rejected(self):
+        with self.assertRaisesMessage(MethodologyError, 'depend on each other'):
+            CompiledMethodology('M-1', 1, dict(PARAMETERS, formulas={'credits': 'a', 'a': 'credits + 1'}))
+        with self.assertRaisesMessage(MethodologyError, 'declared twice'):
+            CompiledMethodology('M-1', 1, dict(PARAMETERS, formulas={'credits': '1', 'leakage': '2'}))
+
+    def test_series_output_must_be_reduced(self):
+        compiled = CompiledMethodology('M-1', 1, dict(PARAMETERS, formulas={'credits': 'energy * 2'}))
+        with self.assertRaises(CalculationError):
+            compiled.evaluate({'energy': np.ones(3)}, np.ones(3))
+
+    def test_compiled_methodologies_are_cached_by_version_and_content(self):
+        methodology = SimpleNamespace(methodology_code='M-1', parameters=PARAMETERS)
+        self.assertIs(compile_methodology(methodology), compile_methodology(methodology))
+        updated = SimpleNamespace(
+            methodology_code='M-1', parameters=dict(PARAMETERS, constants={'grid_factor': 0.6, 'leakage': 0.1})
+        )
+        self.assertIsNot(compile_methodology(updated), compile_methodology(methodology))
+
+    def test_period_grid_covers_whole_periods(self):
+        starts, days = period_grid('MONTHLY', datetime(2024, 1, 1), datetime(2024, 3, 1))
+        self.assertEqual(starts, [datetime(2024, 1, 1), datetime(2024, 2, 1)])
+        self.assertEqual(list(days), [31.0, 29.0])
+
+    def test_unaligned_reporting_period_is_rejected(self):
+        compiled = CompiledMethodology('M-1', 2, PARAMETERS)
+        rollups = {}
+        for start, end in ((datetime(2024, 1, 1, 12), datetime(2024, 1, 4)),
+                           (datetime(2024, 1, 1), datetime(2024, 1, 3, 6))):
+            with self.subTest(start=start, end=end), self.assertRaises(CalculationError):
+                calculate_request(compiled, {
+                    'project': ObjectId(), 'reporting_period_start': start, 'reporting_period_end': end,
+                }, rollups)
+
+    def test_request_credits_sum_every_source(self):
+        project = ObjectId()
+        compiled = CompiledMethodology('M-1', 2, PARAMETERS)
+        rollups = {(project, 'ENERGY_CONSUMPTION'): [
+            {'period_start': datetime(2024, 1, 1), 'count': 24, 'sum_value': 10.0, 'min_value': 0.1, 'max_value': 1.0},
+            {'period_start': datetime(2024, 1, 1), 'count': 24, 'sum_value': 30.0, 'min_value': 0.2, 'max_value': 2.0},
+            {'period_start': datetime(2024, 1, 2), 'count': 24, 'sum_value': 20.0, 'min_value': 0.1, 'max_value': 1.0},
+        ]}
+        calculation = calculate_request(compiled, {
+            'project': project,
+            'reporting_period_start': datetime(2024, 1, 1),
+            'reporting_period_end': datetime(2024, 1, 4),
+        }, rollups)
+        # (40 + 20 + 0) * 0.5 * 0.9
+        self.assertEqual(calculation.credits, Decimal('27.0000'))
+        self.assertEqual(calculation.methodology_version, '2')
+        energy = next(node for node in calculation.trace if node['name'] == 'energy')
+        self.assertEqual(energy['values'], [40.0, 20.0, 0.0])
+
+
+class CreditUncertaintyTests(SimpleTestCase):
+    """Test Monte Carlo propagation of sensor and constant errors"""
+
+    def setUp(self):
+        self.project = ObjectId()
+        self.mrv_request = {
+            'project': self.project,
+            'reporting_period_start': datetime(2024, 1, 1),
+            'reporting_period_end': datetime(2024, 1, 3),
+        }
+        self.rollups = {(self.project, 'ENERGY_CONSUMPTION'): [
+            {'period_start': datetime(2024, 1, 1), 'count': 24, 'sum_value': 40.0},
+            {'period_start': datetime(2024, 1, 2), 'count': 24, 'sum_value': 20.0},
+        ]}
+
+    def parameters(self, energy=None, grid_factor=None):
+        inputs = {'energy': dict(PARAMETERS['inputs']['energy'], uncertainty=energy)}
+        constants = dict(PARAMETERS['constants'], grid_factor={'value': 0.5, 'uncertainty': grid_factor})
+        return dict(PARAMETERS, inputs=inputs, constants=constants)
+
+    def test_invalid_uncertainty_is_rejected(self):
+        for spec in (
+            {'distribution': 'CAUCHY', 'relative': 0.1},
+            {'relative': 0.1, 'absolute': 1.0},
+            {'distribution': 'NORMAL'},
+            {'relative': -0.1},
+            {'distribution': 'LOGNORMAL', 'absolute': 1.0},
+        ):
+            with self.subTest(spec=spec), self.assertRaises(MethodologyError):
+                CompiledMethodology('M-1', 1, self.parameters(energy=spec))
+
+    def test_reductions_apply_per_draw(self):
+        compiled = CompiledMethodology('M-1', 2, PARAMETERS)
+        env = compiled.run({'energy': np.array([[10.0, 20.0], [0.0, 2.0]])}, np.ones(2))
+        np.testing.assert_allclose(compiled.credits(env, 2), [13.5, 0.9])
+
+    def test_errors_propagate_to_the_credits(self):
+        parameters = self.parameters(
+            energy={'distribution': 'NORMAL', 'relative': 0.05},
+            grid_factor={'distribution': 'NORMAL', 'relative': 0.1},
+        )
+        compiled = CompiledMethodology('M-1', 2, parameters)
+        model = build_model(compiled, self.mrv_request, self.rollups)
+        self.assertEqual([p['kind'] for p in model['parameters']], ['sensor', 'constant'])
+
+        outputs = simulate(compiled, parameters, model, 20000, seed=7)
+        # 60 * 0.5 * 0.9, relative error sqrt(0.05^2 + 0.1^2 + 0.05^2 * 0.1^2)
+        self.assertAlmostEqual(outputs.mean(), 27.0, delta=0.15)
+        self.assertAlmostEqual(outputs.std(), 27.0 * 0.1119, delta=0.1)
+        np.testing.assert_array_equal(outputs, simulate(compiled, parameters, model, 20000, seed=7))
+
+        estimate = summarize(compiled, model, Decimal('27.0000'), outputs, 0.90, 7)
+        self.assertLess(estimate.ci_low, estimate.mean)
+        self.assertLess(estimate.mean, estimate.ci_high)
+        self.assertEqual(estimate.conservative_credits, estimate.ci_low)
+        self.assertAlmostEqual(estimate.relative_uncertainty, 1.645 * 0.1119, delta=0.01)
+
+    def test_without_uncertainty_every_draw_is_the_credits(self):
+        compiled = CompiledMethodology('M-1', 2, PARAMETERS)
+        model = build_model(compiled, self.mrv_request, self.rollups)
+        outputs = simulate(compiled, PARAMETERS, model, 100, seed=1)
+        np.testing.assert_allclose(outputs, 27.0)
+        estimate = summarize(compiled, model, Decimal('27.0000'), outputs, 0.90, 1)
+        self.assertEqual(estimate.conservative_credits, Decimal('27.0000'))
+        self.assertEqual(estimate.parameters, [])
+
+
+class ValidatorActionTests(SimpleTestCase):
+    """Test that actions writing a validator's figures refuse other users"""
+
+    def test_only_validators_estimate_uncertainty(self):
+        self.assertIn(IsValidator, MRVAssessmentViewSet.uncertainty.kwargs['permission_classes'])
+
+    def test_only_validators_recalculate_credits(self):
+        self.assertIn(IsValidator, MRVRequestViewSet.calculate.kwargs['permission_classes'])
+
+
+class ReviewQueueTests(SimpleTestCase):
+    """Test review priorities and lease-based claiming"""
+
+    def setUp(self):
+        self.now = datetime(2024, 6, 1)
+        self.requests = mock.Mock()
+        patcher = mock.patch('apps.mrv.review_queue.MRVRequest._get_collection', return_value=self.requests)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_priority_grows_with_age_volume_risk_and_overdue_sla(self):
+        fresh = {'submitted_at': self.now, 'initial_estimate_credits': 10.0}
+        base = priority_score(priority_factors(fresh, now=self.now))
+        for doc, risk in (
+            (dict(fresh, submitted_at=self.now - timedelta(days=20)), None),
+            (dict(fresh, credit_calculation={'credits': Decimal('50000')}), None),
+            (dict(fresh, anomalies=[{'severity': 'HIGH'}]), None),
+            (fresh, 80.0),
+        ):
+            with self.subTest(doc=doc, risk=risk):
+                self.assertGreater(priority_score(priority_factors(doc, risk, now=self.now)), base)
+
+        overdue = priority_factors(dict(fresh, sla_due_at=self.now - timedelta(hours=1)), now=self.now)
+        self.assertEqual(overdue['sla'], 2.0)
+        with self.settings(MRV_REVIEW_SLA_DAYS=10):
+            halfway = priority_factors(dict(fresh, submitted_at=self.now - timedelta(days=5)), now=self.now)
+        self.assertAlmostEqual(halfway['sla'], 0.5)
+
+    def test_claim_takes_the_top_unleased_request_atomically(self):
+        claimed = {'_id': ObjectId(), 'status': 'UNDER_REVIEW'}
+        self.requests.find_one_and_update.return_value = claimed
+        with self.settings(MRV_REVIEW_LEASE_MINUTES=15):
+            self.assertIs(claim_next('validator@example.com', now=self.now), claimed)
+
+        query, update = self.requests.find_one_and_update.call_args[0]
+        options = self.requests.find_one_and_update.call_args[1]
+        self.assertEqual(query['status'], {'$in': ['PENDING', 'UNDER_REVIEW']})
+        self.assertEqual(query['review_lease_expires_at'], {'$not': {'$gt': self.now}})
+        self.assertEqual(update['$set']['review_lease_expires_at'], self.now + timedelta(minutes=15))
+        self.assertEqual(update['$set']['reviewer_email'], 'validator@example.com')
+        self.assertEqual(options['sort'], [('priority', -1), ('submitted_at', 1)])
+        self.assertEqual(options['hint'], 'review_queue')
+
+    def test_only_the_lease_holder_can_release(self):
+        request_id = ObjectId()
+        self.requests.update_one.return_value = mock.Mock(modified_count=0)
+        self.assertFalse(release_lease(request_id, 'other@example.com', now=self.now))
+        query, update = self.requests.update_one.call_args[0]
+        self.assertEqual(query['reviewer_email'], 'other@example.com')
+        self.assertEqual(query['review_lease_expires_at'], {'$gt': self.now})
+        self.assertEqual(update['$set']['status'], 'PENDING')
+        self.assertIn('review_lease_expires_at', update['$unset'])
+
+    def test_refresh_writes_priorities_in_batches(self):
+        docs = [{'_id': ObjectId(), 'submitted_at': self.now} for _ in range(3)]
+        self.requests.find.return_value.sort.return_value.limit.side_effect = [docs[:2], docs[2:], []]
+        self.requests.bulk_write.side_effect = lambda ops, ordered: mock.Mock(modified_count=len(ops))
+        with mock.patch('apps.mrv.review_queue.latest_risk_scores', return_value={docs[0]['_id']: 90.0}):
+            self.assertEqual(refresh_priorities(batch_size=2, now=self.now), 3)
+
+        second_query = self.requests.find.call_args_list[1][0][0]
+        self.assertEqual(second_query['_id'], {'$gt': docs[1]['_id']})
+        first = self.requests.bulk_write.call_args_list[0][0][0][0]
+        self.assertEqual(first._doc['$set']['priority_factors']['risk'], 0.9)
+
+
+class MRVListingTests(SimpleTestCase):
+    """Test that a page of MRV documents loads each referenced collection once"""
+
+    def setUp(self):
+        self.project_ids = [ObjectId() for _ in range(5)]
+        self.collections = {}
+        for document in (Project, MRVRequest):
+            collection = mock.Mock()
+            collection.find.side_effect = lambda query, projection: [
+                dict({field: f'{field} of {_id}' for field in projection}, _id=_id) for _id in query['_id']['$in']
+            ]
+            self.collections[document] = collection
+            for target, patch in (
+                ('_get_collection', {'return_value': collection}),
+                # Any lazy dereference would go through the database
+                ('_get_db', {'side_effect': AssertionError(f'{document.__name__} dereferenced')}),
+            ):
+                patcher = mock.patch.object(document, target, **patch)
+                patcher.start()
+                self.addCleanup(patcher.stop)
+
+    def assertQueries(self, document, count, ids=None):
+        find = self.collections[document].find
+        self.assertEqual(find.call_count, count)
+        if ids is not None:
+            self.assertEqual(len(find.call_args[0][0]['_id']['$in']), ids)
+
+    def test_request_page_loads_projects_once(self):
+        mrv_requests = [
+            MRVRequest._from_son({
+                '_id': ObjectId(), 'project': self.project_ids[i % 5], 'requested_by_email': 'dev@example.com',
+                'status': 'PENDING', 'submitted_at': datetime(2024, 1, 1),
+            })
+            for i in range(100)
+        ]
+        data = serialize_mrv_requests(mrv_requests)
+
+        self.assertQueries(Project, 1, ids=5)
+        self.assertQueries(MRVRequest, 0)
+        self.assertEqual(data[7]['project_id'], str(self.project_ids[2]))
+        self.assertEqual(data[7]['project'], {
+            'id': str(self.project_ids[2]),
+            'name': f'name of {self.project_ids[2]}',
+            'status': f'status of {self.project_ids[2]}',
+        })
+        self.assertIn(str(self.project_ids[0]), str(mrv_requests[0]))
+
+    def test_assessment_page_loads_projects_and_requests_once(self):
+        assessments = [
+            MRVAssessment._from_son({
+                '_id': ObjectId(), 'mrv_request': ObjectId(), 'project': self.project_ids[i % 5],
+                'validator_email': 'validator@example.com', 'decision': 'APPROVED',
+                'submitted_at': datetime(2024, 1, 1),
+            })
+            for i in range(100)
+        ]
+        data = serialize_mrv_assessments(assessments)
+
+        self.assertQueries(Project, 1, ids=5)
+        self.assertQueries(MRVRequest, 1, ids=100)
+        self.assertEqual(data[3]['mrv_request']['id'], data[3]['mrv_request_id'])
+        self.assertEqual(data[3]['project']['id'], str(self.project_ids[3]))
+        str(assessments[0])
+
+    def test_missing_references_serialize_as_none(self):
+        mrv_request = MRVRequest._from_son({'_id': ObjectId(), 'requested_by_email': 'dev@example.com'})
+        data = serialize_mrv_requests([mrv_request])
+        self.assertQueries(Project, 0)
+        self.assertIsNone(data[0]['project_id'])
+        self.assertIsNone(data[0]['project'])
+
+
+class EvidenceUploadTests(SimpleTestCase):
+    """Test resumable chunked evidence uploads, hashing and deduplication"""
+
+    def setUp(self):
+        self.now = datetime(2024, 6, 1)
+        staging = tempfile.TemporaryDirectory()
+        self.addCleanup(staging.cleanup)
+        self.root = staging.name
+        self.backend = LocalEvidenceBackend(self.root)
+        self.collections = {}
+        for name in ('EvidenceUpload', 'EvidenceFile', 'MRVRequest'):
+            self.collections[name] = mock.Mock()
+            patcher = mock.patch(f'apps.mrv.evidence.{name}._get_collection', return_value=self.collections[name])
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.upload = {
+            '_id': ObjectId(), 'mrv_request': ObjectId(), 'uploaded_by_email': 'dev@example.com',
+            'filename': 'survey.csv', 'size': 11, 'offset': 0, 'parts': [], 'status': 'UPLOADING',
+        }
+
+    def test_local_backend_resumes_at_offset_and_commits(self):
+        upload_id = self.upload['_id']
+        self.backend.write(upload_id, 0, [b'hello '])
+        self.backend.write(upload_id, 6, [b'wor', b'XX'])  # Interrupted before the offset moved
+        self.backend.write(upload_id, 6, [b'world'])
+        self.assertEqual(b''.join(self.backend.read(upload_id, [0, 6], 11)), b'hello world')
+        with self.assertRaises(EvidenceError):
+            self.backend.write(upload_id, 20, [b'!'])
+
+        uri = self.backend.commit(upload_id, [0, 6], 'sha256/ab/cd/abcd')
+        self.assertEqual(uri, f"file://{os.path.join(self.root, 'sha256/ab/cd/abcd')}")
+        with open(uri[len('file://'):], 'rb') as f:
+            self.assertEqual(f.read(), b'hello world')
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'staging', str(upload_id))))
+
+    def test_chunks_hash_incrementally_across_processes(self):
+        first = dict(self.upload, offset=6, parts=[0])
+        self.collections['EvidenceUpload'].find_one_and_update.side_effect = [
+            self.upload, first, first, dict(first, offset=11, parts=[0, 6]),
+        ]
+        with mock.patch('apps.mrv.evidence.complete_upload', side_effect=lambda upload, digest, *args: digest):
+            self.assertIs(write_chunk(
+                self.upload['_id'], 0, io.BytesIO(b'hello '), 6, 'dev@example.com',
+                chunk_sha256=hashlib.sha256(b'hello ').hexdigest(), backend=self.backend, now=self.now,
+            ), first)
+            # The next chunk lands on a process without the hash state
+            _hashers.clear()
+            digest = write_chunk(
+                self.upload['_id'], 6, io.BytesIO(b'world'), 5, 'dev@example.com', backend=self.backend, now=self.now,
+            )
+
+        self.assertEqual(digest, hashlib.sha256(b'hello world').hexdigest())
+        claims = self.collections['EvidenceUpload'].find_one_and_update.call_args_list
+        self.assertEqual(claims[2][0][0]['offset'], 6)
+        self.assertEqual(claims[3][0][1]['$set']['offset'], 11)
+        self.assertEqual(claims[3][0][1]['$push'], {'parts': 6, 'chunk_sha256': hashlib.sha256(b'world').hexdigest()})
+        self.assertEqual(claims[3][0][1]['$set']['sha256'], digest)
+
+    def test_failed_completion_is_retried_with_an_empty_chunk(self):
+        digest = hashlib.sha256(b'hello world').hexdigest()
+        first = dict(self.upload, offset=6, parts=[0])
+        sent = dict(first, offset=11, parts=[0, 6], sha256=digest)
+        completed = dict(sent, status='COMPLETED')
+        uploads = self.collections['EvidenceUpload']
+        uploads.find_one_and_update.side_effect = [first, sent, sent, completed]
+        self.collections['EvidenceFile'].find_one.return_value = None
+        attempts = []
+
+        def insert_one(doc):
+            attempts.append(doc)
+            if len(attempts) == 1:
+                raise AutoReconnect('primary stepped down')
+            doc['_id'] = ObjectId()
+
+        self.collections['EvidenceFile'].insert_one.side_effect = insert_one
+        self.backend.write(self.upload['_id'], 0, [b'hello '])
+
+        with self.assertRaises(AutoReconnect):
+            write_chunk(self.upload['_id'], 6, io.BytesIO(b'world'), 5, 'dev@example.com',
+                        backend=self.backend, now=self.now)
+        # The lease is released and the upload left at offset == size for a retry
+        self.assertEqual(uploads.update_one.call_args[0], (
+            {'_id': self.upload['_id'], 'offset': 11}, {'$unset': {'writing_until': ''}}
+        ))
+
+        _hashers.clear()
+        self.assertIs(write_chunk(self.upload['_id'], 11, None, 0, 'dev@example.com',
+                                  backend=self.backend, now=self.now), completed)
+        stored = attempts[-1]
+        self.assertEqual(stored['sha256'], digest)
+        with open(stored['uri'][len('file://'):], 'rb') as f:
+            self.assertEqual(f.read(), b'hello world')
+
+    def test_empty_chunk_before_the_last_byte_is_rejected(self):
+        self.collections['EvidenceUpload'].find_one_and_update.return_value = dict(self.upload, offset=6, parts=[0])
+        with self.assertRaises(EvidenceError):
+            write_chunk(self.upload['_id'], 6, None, 0, 'dev@example.com', backend=self.backend, now=self.now)
+
+    def test_chunk_at_another_offset_conflicts(self):
+        self.collections['EvidenceUpload'].find_one_and_update.return_value = None
+        self.collections['EvidenceUpload'].find_one.return_value = dict(self.upload, offset=6)
+        backend = mock.Mock()
+        with self.assertRaises(UploadConflict) as raised:
+            write_chunk(self.upload['_id'], 0, io.BytesIO(b'hello '), 6, 'dev@example.com', backend=backend)
+        self.assertEqual(raised.exception.offset, 6)
+        backend.write.assert_not_called()
+
+    def test_identical_content_is_stored_once(self):
+        digest = hashlib.sha256(b'hello world').hexdigest()
+        existing = {'_id': ObjectId(), 'sha256': digest, 'size': 11, 'uri': f'gs://evidence/sha256/b9/4d/{digest}'}
+        self.collections['EvidenceFile'].find_one.return_value = existing
+        backend = mock.Mock()
+
+        self.assertIs(store_evidence(dict(self.upload, offset=11), digest, backend, self.now), existing)
+        backend.commit.assert_not_called()
+        backend.discard.assert_called_once_with(self.upload['_id'], [])
+        self.collections['EvidenceFile'].insert_one.assert_not_called()
+
+        attach_evidence(self.upload['mrv_request'], existing, self.upload, self.now)
+        query, update = self.collections['MRVRequest'].update_one.call_args[0]
+        self.assertEqual(query['evidence.sha256'], {'$ne': digest})
+        self.assertEqual(update['$push']['evidence']['filename'], 'survey.csv')
+
+    def test_declared_digest_mismatch_fails_the_upload(self):
+        backend = mock.Mock()
+        with self.assertRaises(EvidenceError):
+            complete_upload(dict(self.upload, expected_sha256='0' * 64), 'f' * 64, backend, self.now)
+        backend.discard.assert_called_once()
+        update = self.collections['EvidenceUpload'].update_one.call_args[0][1]
+        self.assertEqual(update['$set']['status'], 'FAILED')
+        self.collections['EvidenceFile'].find_one.assert_not_called()
@@ -0,0 +1,284 @@
+"""
+MRV uncertainty - Monte Carlo propagation of measurement and factor errors
+
+Credits from apps.mrv.calculation are a point estimate. Registries issue
+against a conservative figure, so the errors of the methodology constants
+and of every sensor are propagated through the same expression graph:
+
+    "constants": {"grid_factor": {"value": 0.00045,
+                                  "uncertainty": {"distribution": "TRIANGULAR", "relative": 0.1}}}
+    "inputs": {"energy": {"metric_type": "ENERGY_CONSUMPTION",
+                          "uncertainty": {"distribution": "NORMAL", "relative": 0.02}}}
+
+An input's uncertainty is the default of its sensors; a DataSource overrides
+it with metadata["uncertainty"], either one spec or one per metric_type.
+A sensor error is systematic (calibration): one draw applies to every
+reading of the sensor in the reporting period, scaling it (relative) or
+offsetting each reading (absolute). Random per-reading noise averages out
+over rollups and is not modelled.
+
+Draws are evaluated together as (draws, cells) arrays in blocks bounded by
+MAX_BLOCK_VALUES, optionally spread over a process pool; block seeds are
+spawned from one seed so the result does not depend on the worker count.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+
+from apps.data_intake.models import DataSource
+from apps.data_intake.storage import naive_utc
+from apps.mrv.calculation import (
+    CREDIT_PLACES, CalculationError, CompiledMethodology, InputAggregateChoices, MethodologyError,
+    UncertaintyDistributionChoices, calculate_request, cell_totals, cell_values, compile_methodology,
+    load_rollups, methodologies_by_project, parse_uncertainty, request_grid,
+)
+from apps.mrv.models import UncertaintyEstimate
+
+
+DEFAULT_DRAWS = 20000
+DEFAULT_CONFIDENCE = 0.90
+DEFAULT_WORKERS = 1
+
+MAX_DRAWS = 1000000
+MAX_BLOCK_DRAWS = 5000
+MAX_BLOCK_VALUES = 2000000  # Values per (draws, cells) array of a block: 16 MB
+MAX_UNDEFINED_SHARE = 0.01  # Draws allowed to come out undefined before the estimate fails
+
+
+def get_uncertainty_draws():
+    return getattr(settings, 'MRV_UNCERTAINTY_DRAWS', DEFAULT_DRAWS)
+
+
+def get_uncertainty_confidence():
+    return getattr(settings, 'MRV_UNCERTAINTY_CONFIDENCE', DEFAULT_CONFIDENCE)
+
+
+def get_uncertainty_workers():
+    return getattr(settings, 'MRV_UNCERTAINTY_WORKERS', DEFAULT_WORKERS)
+
+
+def sample_errors(spec, rng, draws):
+    """Relative or absolute error of each draw (float64 array) under a parsed uncertainty spec"""
+    scale = spec.get('relative', spec.get('absolute'))
+    distribution = spec['distribution']
+    if distribution == UncertaintyDistributionChoices.NORMAL:
+        return rng.normal(0.0, scale, draws)
+    if distribution == UncertaintyDistributionChoices.UNIFORM:
+        return rng.uniform(-scale, scale, draws)
+    if distribution == UncertaintyDistributionChoices.TRIANGULAR:
+        return rng.triangular(-scale, 0.0, scale, draws) if scale else np.zeros(draws)
+    # LOGNORMAL: factor with mean 1 and standard deviation scale, never negative
+    sigma = np.sqrt(np.log1p(scale * scale))
+    return np.exp(rng.normal(-sigma * sigma / 2, sigma, draws)) - 1.0
+
+
+def sensor_uncertainty(metadata, metric_type):
+    """Uncertainty spec a DataSource declares for metric_type, or None"""
+    spec = (metadata or {}).get('uncertainty')
+    if isinstance(spec, dict) and metric_type in spec:
+        spec = spec[metric_type]
+    elif isinstance(spec, dict) and not any(key in spec for key in ('distribution', 'relative', 'absolute')):
+        spec = None  # Specs for other metrics only
+    return spec
+
+
+def _source_metadata(groups):
+    source_ids = {row['data_source'] for rows in groups for row in rows if row.get('data_source')}
+    if not source_ids:
+        return {}
+    cursor = DataSource._get_collection().find({'_id': {'$in': list(source_ids)}}, {'metadata.uncertainty': 1})
+    return {doc['_id']: doc.get('metadata') for doc in cursor}
+
+
+def build_model(compiled, mrv_request, rollups):
+    """
+    Everything a simulation needs for one MRV request, as plain arrays that
+    can be sent to worker processes: per input the totals of sensors without
+    error and the totals of each sensor with one.
+    """
+    starts, cell_days, cell_index = request_grid(compiled, mrv_request)
+    project_id = mrv_request['project']
+    input_rows = {
+        name: rollups.get((project_id, spec['metric_type']), [])
+        for name, spec in compiled.inputs.items()
+    }
+    metadata = _source_metadata(input_rows.values())
+
+    inputs, parameters = {}, []
+    for name, spec in compiled.inputs.items():
+        by_source = {}
+        for row in input_rows[name]:
+            by_source.setdefault(row.get('data_source'), []).append(row)
+        certain, sensors = [], []
+        for source_id, rows in by_source.items():
+            error = sensor_uncertainty(metadata.get(source_id), spec['metric_type'])
+            if error is not None:
+                try:
+                    error = parse_uncertainty(error)
+                except MethodologyError as e:
+                    raise CalculationError(f'data source {source_id}: {e}')
+            else:
+                error = compiled.uncertainty.get(name)
+            if error is None or spec['aggregate'] == InputAggregateChoices.COUNT:
+                certain.extend(rows)
+                continue
+            sensors.append((error, cell_totals(rows, cell_index, len(starts))))
+            parameters.append(dict(error, name=name, kind='sensor',
+                                   data_source=str(source_id) if source_id else None))
+        inputs[name] = {'certain': cell_totals(certain, cell_index, len(starts)), 'sensors': sensors}
+
+    constants = {}
+    for name, (value, _) in compiled.constants.items():
+        if name in compiled.uncertainty:
+            constants[name] = (value, compiled.uncertainty[name])
+            parameters.append(dict(compiled.uncertainty[name], name=name, kind='constant', value=value))
+
+    return {
+        'cell_days': cell_days,
+        'inputs': inputs,
+        'constants': constants,
+        'parameters': parameters,
+    }
+
+
+def _perturbed_input(spec, certain, sensors, rng, draws):
+    """(draws, cells) values of one input with every sensor's error drawn"""
+    count, total, low, high = certain
+    count = count + sum(totals[0] for _, totals in sensors)
+    relative = [(sample_errors(error, rng, draws), totals) for error, totals in sensors if 'relative' in error]
+    absolute = [(sample_errors(error, rng, draws), totals) for error, totals in sensors if 'absolute' in error]
+    # Sums of every sensor plus each sensor's error: one matrix product per error kind
+    total = total + sum(totals[1] for _, totals in sensors)
+    if relative:
+        total = total + np.column_stack([e for e, _ in relative]) @ np.vstack([t[1] for _, t in relative])
+    if absolute:
+        total = total + np.column_stack([e for e, _ in absolute]) @ np.vstack([t[0] for _, t in absolute])
+    if spec['aggregate'] in (InputAggregateChoices.MIN, InputAggregateChoices.MAX):
+        for kind, members in (('relative', relative), ('absolute', absolute)):
+            for errors, (sensor_count, _, sensor_low, sensor_high) in members:
+                errors = errors[:, np.newaxis]
+                observed = sensor_count > 0
+                with np.errstate(all='ignore'):
+                    if kind == 'relative':
+                        sensor_low, sensor_high = sensor_low * (1 + errors), sensor_high * (1 + errors)
+                    else:
+                        sensor_low, sensor_high = sensor_low + errors, sensor_high + errors
+                # A negative factor swaps the extremes
+                low = np.minimum(low, np.where(observed, np.minimum(sensor_low, sensor_high), np.inf))
+                high = np.maximum(high, np.where(observed, np.maximum(sensor_low, sensor_high), -np.inf))
+    return cell_values(spec, count, total, low, high)
+
+
+def simulate_block(compiled, model, draws, seed):
+    """Credits of draws simulations (float64 array) from one seed"""
+    rng = np.random.default_rng(seed)
+    series = {}
+    for name, spec in compiled.inputs.items():
+        entry = model['inputs'][name]
+        if entry['sensors']:
+            series[name] = _perturbed_input(spec, entry['certain'], entry['sensors'], rng, draws)
+        else:
+            series[name] = cell_values(spec, *entry['certain'])
+    constants = {}
+    for name, (value, error) in model['constants'].items():
+        errors = sample_errors(error, rng, draws)[:, np.newaxis]
+        constants[name] = value * (1 + errors) if 'relative' in error else value + errors
+    env = compiled.run(series, model['cell_days'], constants)
+    return np.array(compiled.credits(env, draws))
+
+
+def _simulate_in_worker(job):
+    code, version, parameters, model, draws, seed = job
+    return simulate_block(CompiledMethodology(code, version, parameters), model, draws, seed)
+
+
+def simulate(compiled, parameters, model, draws, seed, workers=1):
+    """
+    Credits of every draw, simulated in blocks; blocks are spread over a
+    process pool when workers > 1 (each worker recompiles the parameters).
+    """
+    block = max(1, min(MAX_BLOCK_DRAWS, MAX_BLOCK_VALUES // max(len(model['cell_days']), 1)))
+    sizes = [block] * (draws // block) + ([draws % block] if draws % block else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers <= 1 or len(sizes) <= 1:
+        return np.concatenate([simulate_block(compiled, model, size, s) for size, s in zip(sizes, seeds)])
+
+    jobs = [(compiled.code, compiled.version, parameters, model, size, s) for size, s in zip(sizes, seeds)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return np.concatenate(list(executor.map(_simulate_in_worker, jobs)))
+
+
+def _amount(value):
+    return Decimal(repr(float(value))).quantize(CREDIT_PLACES)
+
+
+def summarize(compiled, model, credits, outputs, confidence, seed):
+    """UncertaintyEstimate from the simulated credits; CalculationError if too many draws are undefined"""
+    finite = outputs[np.isfinite(outputs)]
+    undefined = int(outputs.size - finite.size)
+    if not finite.size or undefined > MAX_UNDEFINED_SHARE * outputs.size:
+        raise CalculationError(
+            f'{undefined} of {outputs.size} draws are undefined; narrow the uncertainties or check the inputs'
+        )
+    tail = (1 - confidence) / 2 * 100
+    ci_low, ci_high = np.percentile(finite, [tail, 100 - tail])
+    mean = float(finite.mean())
+    return UncertaintyEstimate(
+        methodology_code=compiled.code,
+        methodology_version=str(compiled.version),
+        draws=int(outputs.size),
+        undefined_draws=undefined,
+        seed=seed,
+        confidence=confidence,
+        credits=credits,
+        mean=_amount(mean),
+        std=float(finite.std()),
+        ci_low=_amount(ci_low),
+        ci_high=_amount(ci_high),
+        relative_uncertainty=float((ci_high - ci_low) / 2 / abs(mean)) if mean else None,
+        conservative_credits=max(min(_amount(ci_low), credits), Decimal(0)).quantize(CREDIT_PLACES),
+        parameters=model['parameters'],
+        calculated_at=datetime.utcnow(),
+    )
+
+
+def estimate_uncertainty(mrv_request, draws=None, confidence=None, seed=None, workers=None):
+    """
+    UncertaintyEstimate of a raw mrv_requests document (project and
+    reporting period) under its project's methodology. Raises
+    CalculationError.
+    """
+    draws = draws or get_uncertainty_draws()
+    confidence = confidence or get_uncertainty_confidence()
+    workers = workers or get_uncertainty_workers()
+    if not 1 <= draws <= MAX_DRAWS:
+        raise CalculationError(f'draws must be between 1 and {MAX_DRAWS}')
+    if not 0 < confidence < 1:
+        raise CalculationError('confidence must be between 0 and 1')
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % 2 ** 63)
+
+    methodology = methodologies_by_project({mrv_request['project']}).get(mrv_request['project'])
+    if methodology is None:
+        raise CalculationError('the project has no methodology')
+    try:
+        compiled = compile_methodology(methodology)
+    except MethodologyError as e:
+        raise CalculationError(f'{methodology.methodology_code}: {e}')
+
+    starts, _, _ = request_grid(compiled, mrv_request)
+    rollups = load_rollups(
+        {mrv_request['project']},
+        {spec['metric_type'] for spec in compiled.inputs.values()},
+        compiled.period,
+        starts[0],
+        naive_utc(mrv_request['reporting_period_end']),
+    )
+    calculation = calculate_request(compiled, mrv_request, rollups)
+    model = build_model(compiled, mrv_request, rollups)
+    outputs = simulate(compiled, methodology.parameters or {}, model, draws, seed, workers)
+    return summarize(compiled, model, calculation.credits, outputs, confidence, seed)
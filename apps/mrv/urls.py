@@ -4,10 +4,11 @@ MRV app URLs
 
 from django.urls import path
 from rest_framework.routers import DefaultRouter
-from apps.mrv.views import MRVRequestViewSet, MRVAssessmentViewSet
+from apps.mrv.views import MRVRequestViewSet, MRVAssessmentViewSet, EvidenceUploadViewSet
 
 router = DefaultRouter()
 router.register(r'requests', MRVRequestViewSet, basename='mrv-request')
 router.register(r'assessments', MRVAssessmentViewSet, basename='mrv-assessment')
+router.register(r'evidence-uploads', EvidenceUploadViewSet, basename='mrv-evidence-upload')
 
 urlpatterns = router.urls
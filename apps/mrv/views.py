@@ -6,30 +6,236 @@ from rest_framework import viewsets, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from bson import ObjectId
+from datetime import datetime
+import base64
+import binascii
+import re
 
+from apps.api.pagination import KeysetPagination
+from apps.api.permissions import IsValidator
+from apps.mrv.calculation import CalculationError, calculate_credits, store_calculations
+from apps.mrv.evidence import (
+    EvidenceError, UploadConflict, UploadNotFound, abort_upload, create_upload, get_upload, write_chunk
+)
+from apps.mrv.models import MRVAssessment, MRVRequest, MRVStatusChoices
+from apps.mrv.review_queue import claim_next, peek, release_lease, renew_lease
+from apps.mrv.serializers import (
+    CreditCalculationSerializer, EvidenceUploadCreateSerializer, EvidenceUploadSerializer,
+    UncertaintyEstimateRequestSerializer, UncertaintyEstimateSerializer,
+    serialize_mrv_assessments, serialize_mrv_requests
+)
+from apps.mrv.uncertainty import estimate_uncertainty
 
-class MRVRequestViewSet(viewsets.ViewSet):
+
+# Per-request trace of every formula node; only the calculate action returns it
+LIST_EXCLUDED_FIELDS = ('credit_calculation.trace',)
+
+# RFC 9530 digest of a chunk, e.g. Content-Digest: sha-256=:<base64>:
+CONTENT_DIGEST_PATTERN = re.compile(r'(?:^|,)\s*sha-256=:([A-Za-z0-9+/=]+):')
+
+
+def _reference_filters(request, params):
+    """{field: ObjectId} from id query parameters ({param: field}), or None if any is invalid"""
+    filters = {}
+    for param, field in params.items():
+        value = request.query_params.get(param)
+        if value:
+            if not ObjectId.is_valid(value):
+                return None
+            filters[field] = ObjectId(value)
+    return filters
+
+
+class MRVRequestViewSet(viewsets.GenericViewSet):
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_field = 'submitted_at'
     
     def list(self, request):
-        return Response([])
+        """
+        MRV requests newest first, paginated by cursor, with their projects
+        loaded in one query per page. Query: status, project_id, cursor, page_size.
+        """
+        filters = _reference_filters(request, {'project_id': 'project'})
+        if filters is None:
+            return Response({'error': 'Invalid id'}, status=status.HTTP_400_BAD_REQUEST)
+        if request.query_params.get('status'):
+            filters['status'] = request.query_params['status']
+        
+        mrv_requests = MRVRequest.objects(**filters).exclude(*LIST_EXCLUDED_FIELDS).no_dereference()
+        page = self.paginate_queryset(mrv_requests)
+        return self.get_paginated_response(serialize_mrv_requests(page))
     
     def create(self, request):
         return Response({'id': '1'}, status=status.HTTP_201_CREATED)
     
     def retrieve(self, request, pk=None):
-        return Response({'id': pk})
+        mrv_request = None
+        if ObjectId.is_valid(pk):
+            mrv_request = MRVRequest.objects(id=pk).no_dereference().first()
+        if mrv_request is None:
+            return Response({'error': 'MRV request not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(serialize_mrv_requests([mrv_request])[0])
+    
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated, IsValidator])
+    def calculate(self, request, pk=None):
+        """
+        Calculate and store credits from the project's measured data and
+        methodology, with the full trace (validators only)
+        """
+        doc = None
+        if ObjectId.is_valid(pk):
+            doc = MRVRequest._get_collection().find_one(
+                {'_id': ObjectId(pk)}, {'project': 1, 'reporting_period_start': 1, 'reporting_period_end': 1}
+            )
+        if doc is None:
+            return Response({'error': 'MRV request not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        results, errors = calculate_credits([doc])
+        if errors:
+            return Response({'error': errors[doc['_id']]}, status=status.HTTP_400_BAD_REQUEST)
+        store_calculations(results)
+        return Response(CreditCalculationSerializer(results[doc['_id']]).data)
+    
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated, IsValidator])
+    def queue(self, request):
+        """Highest-priority requests a validator can claim. Query: limit (default 20, at most 100)."""
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response([_queue_entry(doc) for doc in peek(limit)])
+    
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated, IsValidator])
+    def claim(self, request):
+        """Lease the highest-priority request to the calling validator; 204 when the queue is empty"""
+        doc = claim_next(request.user.email)
+        if doc is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(_queue_entry(doc))
+    
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated, IsValidator])
+    def renew(self, request, pk=None):
+        """Extend the calling validator's lease on a request"""
+        expires_at = renew_lease(ObjectId(pk), request.user.email) if ObjectId.is_valid(pk) else None
+        if expires_at is None:
+            return Response({'error': 'You do not hold a lease on this request'}, status=status.HTTP_409_CONFLICT)
+        return Response({'id': pk, 'review_lease_expires_at': expires_at})
+    
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated, IsValidator])
+    def release(self, request, pk=None):
+        """
+        End the calling validator's lease. Body: status (default PENDING puts
+        the request back in the queue).
+        """
+        new_status = request.data.get('status', MRVStatusChoices.PENDING)
+        if new_status not in dict(MRVStatusChoices.CHOICES) or new_status == MRVStatusChoices.UNDER_REVIEW:
+            return Response({'error': f'Invalid status {new_status!r}'}, status=status.HTTP_400_BAD_REQUEST)
+        if not (ObjectId.is_valid(pk) and release_lease(ObjectId(pk), request.user.email, new_status)):
+            return Response({'error': 'You do not hold a lease on this request'}, status=status.HTTP_409_CONFLICT)
+        return Response({'id': pk, 'status': new_status})
+    
+    @action(detail=True, methods=['post'])
+    def evidence(self, request, pk=None):
+        """
+        Open a resumable evidence upload. Body: filename, size, content_type,
+        sha256 (optional, verified on completion). The bytes follow as PATCH
+        requests to mrv/evidence-uploads/<id>/.
+        """
+        serializer = EvidenceUploadCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if not (ObjectId.is_valid(pk) and MRVRequest._get_collection().find_one({'_id': ObjectId(pk)}, {'_id': 1})):
+            return Response({'error': 'MRV request not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        params = serializer.validated_data
+        try:
+            upload = create_upload(
+                ObjectId(pk), params['filename'], params['size'], request.user.email,
+                content_type=params.get('content_type'), sha256=params.get('sha256'),
+            )
+        except EvidenceError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(EvidenceUploadSerializer(upload).data, status=status.HTTP_201_CREATED)
 
 
-class MRVAssessmentViewSet(viewsets.ViewSet):
+def _queue_entry(doc):
+    return {
+        'id': str(doc['_id']),
+        'project_id': str(doc['project']),
+        'status': doc.get('status'),
+        'priority': doc.get('priority'),
+        'priority_factors': doc.get('priority_factors') or {},
+        'submitted_at': doc.get('submitted_at'),
+        'sla_due_at': doc.get('sla_due_at'),
+        'review_claims': doc.get('review_claims', 0),
+        'reviewer_email': doc.get('reviewer_email'),
+        'review_lease_expires_at': doc.get('review_lease_expires_at'),
+    }
+
+
+class MRVAssessmentViewSet(viewsets.GenericViewSet):
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_field = 'submitted_at'
     
     def list(self, request):
-        return Response([])
+        """
+        MRV assessments newest first, paginated by cursor, with their projects
+        and MRV requests loaded in one query each per page.
+        Query: decision, mrv_request_id, project_id, cursor, page_size.
+        """
+        filters = _reference_filters(request, {'mrv_request_id': 'mrv_request', 'project_id': 'project'})
+        if filters is None:
+            return Response({'error': 'Invalid id'}, status=status.HTTP_400_BAD_REQUEST)
+        if request.query_params.get('decision'):
+            filters['decision'] = request.query_params['decision']
+        
+        assessments = MRVAssessment.objects(**filters).no_dereference()
+        page = self.paginate_queryset(assessments)
+        return self.get_paginated_response(serialize_mrv_assessments(page))
     
     def create(self, request):
         return Response({'id': '1'}, status=status.HTTP_201_CREATED)
     
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated, IsValidator])
+    def uncertainty(self, request, pk=None):
+        """
+        Monte Carlo credit distribution of the assessed request, stored on the
+        assessment (validators only). Body: draws, confidence, seed, apply (set
+        recommended_credits to the conservative credits).
+        """
+        serializer = UncertaintyEstimateRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = serializer.validated_data
+        
+        assessment = None
+        if ObjectId.is_valid(pk):
+            assessment = MRVAssessment._get_collection().find_one({'_id': ObjectId(pk)}, {'mrv_request': 1})
+        doc = assessment and MRVRequest._get_collection().find_one(
+            {'_id': assessment['mrv_request']},
+            {'project': 1, 'reporting_period_start': 1, 'reporting_period_end': 1},
+        )
+        if doc is None:
+            return Response({'error': 'MRV assessment not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        try:
+            estimate = estimate_uncertainty(
+                doc, draws=params.get('draws'), confidence=params.get('confidence'), seed=params.get('seed')
+            )
+        except CalculationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        update = {'uncertainty': estimate.to_mongo().to_dict(), 'updated_at': datetime.utcnow()}
+        if params['apply']:
+            update['recommended_credits'] = MRVAssessment._fields['recommended_credits'].to_mongo(
+                estimate.conservative_credits
+            )
+        MRVAssessment._get_collection().update_one({'_id': assessment['_id']}, {'$set': update})
+        return Response(UncertaintyEstimateSerializer(estimate).data)
+    
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         return Response({'message': 'Assessment approved'})
@@ -37,3 +243,67 @@ class MRVAssessmentViewSet(viewsets.ViewSet):
     @action(detail=True, methods=['post'])
     def reject(self, request, pk=None):
         return Response({'message': 'Assessment rejected'})
+
+
+def _chunk_digest(header):
+    """Hex SHA-256 from a Content-Digest header, None without one, or EvidenceError"""
+    if not header:
+        return None
+    match = CONTENT_DIGEST_PATTERN.search(header)
+    if match is None:
+        raise EvidenceError('Content-Digest must carry a sha-256 digest')
+    try:
+        digest = base64.b64decode(match.group(1), validate=True)
+    except binascii.Error:
+        raise EvidenceError('Content-Digest is not valid base64')
+    if len(digest) != 32:
+        raise EvidenceError('Content-Digest sha-256 must be 32 bytes')
+    return digest.hex()
+
+
+class EvidenceUploadViewSet(viewsets.ViewSet):
+    """Resumable evidence uploads; only the user who opened an upload can see or write it"""
+    
+    permission_classes = [IsAuthenticated]
+    
+    def retrieve(self, request, pk=None):
+        """Status and offset of an upload, to resume it from where the server stopped"""
+        try:
+            upload = get_upload(ObjectId(pk) if ObjectId.is_valid(pk) else None, request.user.email)
+        except UploadNotFound as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+        return Response(EvidenceUploadSerializer(upload).data)
+    
+    def partial_update(self, request, pk=None):
+        """
+        Append the raw request body at the Upload-Offset header, which must be
+        the upload's current offset (409 with that offset otherwise). An
+        optional Content-Digest (sha-256) is checked before the offset moves.
+        The upload completes with the last byte; if that fails, an empty body
+        at the final offset retries the completion.
+        """
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return Response(
+                {'error': 'Upload-Offset and Content-Length must be integers'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            upload = write_chunk(
+                ObjectId(pk) if ObjectId.is_valid(pk) else None, offset, request.stream, length,
+                request.user.email, chunk_sha256=_chunk_digest(request.headers.get('Content-Digest')),
+            )
+        except UploadNotFound as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except UploadConflict as e:
+            return Response({'error': str(e), 'offset': e.offset}, status=status.HTTP_409_CONFLICT)
+        except EvidenceError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(EvidenceUploadSerializer(upload).data)
+    
+    def destroy(self, request, pk=None):
+        """Abort an unfinished upload and drop its staged bytes"""
+        if not (ObjectId.is_valid(pk) and abort_upload(ObjectId(pk), request.user.email, 'aborted by uploader')):
+            return Response({'error': 'No unfinished upload with that id'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(status=status.HTTP_204_NO_CONTENT)
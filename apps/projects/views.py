@@ -17,6 +17,7 @@ from apps.projects.serializers import (
     ProjectSerializer, CarbonCategorySerializer, ProjectMethodologySerializer
 )
 from apps.mrv.models import MRVRequest
+from apps.mrv.review_queue import refresh_priorities
 
 
 class CarbonCategoryViewSet(viewsets.ReadOnlyModelViewSet):
@@ -82,6 +83,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
             initial_estimate_credits=request.data.get('initial_estimate_credits'),
         )
         mrv_request.save()
+        refresh_priorities([mrv_request.id])
         
         project.status = 'SUBMITTED_FOR_MRV'
         project.submitted_at = datetime.utcnow()
@@ -3,12 +3,14 @@ Registry models - Carbon credit issuance, lifecycle, and serialization
 """
 
 from mongoengine import (
-    Document, StringField, IntField, ReferenceField, DateTimeField, DecimalField,
+    Document, StringField, IntField, ReferenceField, DateTimeField,
     BooleanField, EmbeddedDocument, EmbeddedDocumentField, ListField, DictField
 )
 from datetime import datetime
 import uuid
 
+from apps.api.numeric import DecimalAmountField
+
 
 class BatchStatusChoices:
     """Batch status constants"""
@@ -85,9 +87,9 @@ class CreditBatch(Document):
     carbon_category = ReferenceField('apps.projects.CarbonCategory', required=True)
     
     # Quantity
-    total_credits = DecimalField(required=True)  # Total CO2 tons equivalent
-    available_credits = DecimalField(required=True)
-    retired_credits = DecimalField(default=0)
+    total_credits = DecimalAmountField(required=True)  # Total CO2 tons equivalent
+    available_credits = DecimalAmountField(required=True)
+    retired_credits = DecimalAmountField(default=0)
     
     # Status
     status = StringField(
@@ -131,7 +133,7 @@ class CreditTransaction(Document):
             'transaction_type',
             'from_organization',
             'to_organization',
-            'timestamp',
+            {'fields': ['timestamp', 'id']},  # Keyset pagination
         ],
     }
     
@@ -140,7 +142,7 @@ class CreditTransaction(Document):
     
     # Transaction details
     transaction_type = StringField(required=True)  # ISSUED, TRANSFERRED, TRADED, RETIRED
-    quantity = DecimalField(required=True)
+    quantity = DecimalAmountField(required=True)
     
     # Parties involved
     from_organization = ReferenceField('apps.organizations.Organization')
@@ -6,6 +6,17 @@ from rest_framework import viewsets, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from apps.api.numeric import sum_fields
+from apps.api.pagination import KeysetPagination
+from apps.api.references import reference_id
+from apps.registry.models import CreditBatch, CreditTransaction
+
+
+CREDIT_TOTAL_FIELDS = ['total_credits', 'available_credits', 'retired_credits']
+CREDIT_TOTAL_GROUPS = ('project', 'organization', 'status')
 
 
 class CreditBatchViewSet(viewsets.ViewSet):
@@ -21,16 +32,76 @@ class CreditBatchViewSet(viewsets.ViewSet):
     def credits(self, request, pk=None):
         return Response([])
     
+    @action(detail=False, methods=['get'])
+    def totals(self, request):
+        """
+        Issued, available and retired credits summed in MongoDB.
+        Query: project_id, organization_id, status, group_by (project, organization or status).
+        """
+        match = {}
+        try:
+            for param, field in (('project_id', 'project'), ('organization_id', 'organization')):
+                if request.query_params.get(param):
+                    match[field] = ObjectId(request.query_params[param])
+        except InvalidId:
+            return Response({'error': 'Invalid id'}, status=status.HTTP_400_BAD_REQUEST)
+        if request.query_params.get('status'):
+            match['status'] = request.query_params['status']
+        group_by = request.query_params.get('group_by')
+        if group_by and group_by not in CREDIT_TOTAL_GROUPS:
+            return Response(
+                {'error': f"group_by must be one of {', '.join(CREDIT_TOTAL_GROUPS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        totals = sum_fields(CreditBatch, CREDIT_TOTAL_FIELDS, match=match, group_by=group_by)
+        rows = [
+            dict(
+                {field: str(row[field]) for field in CREDIT_TOTAL_FIELDS},
+                group=str(key) if key is not None else None,
+                batches=row['count'],
+            )
+            for key, row in totals.items()
+        ]
+        if group_by:
+            return Response({'group_by': group_by, 'results': rows})
+        return Response(rows[0] if rows else dict({field: '0' for field in CREDIT_TOTAL_FIELDS}, group=None, batches=0))
+    
     @action(detail=True, methods=['post'])
     def lock(self, request, pk=None):
         return Response({'message': 'Batch locked'})
 
 
-class CreditTransactionLogViewSet(viewsets.ViewSet):
+class CreditTransactionLogViewSet(viewsets.GenericViewSet):
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_field = 'timestamp'
     
     def list(self, request):
-        return Response([])
+        """
+        Credit transactions newest first, paginated by cursor.
+        Query: transaction_type, cursor, page_size.
+        """
+        transactions = CreditTransaction.objects.no_dereference()
+        transaction_type = request.query_params.get('transaction_type')
+        if transaction_type:
+            transactions = transactions.filter(transaction_type=transaction_type)
+        
+        page = self.paginate_queryset(transactions)
+        return self.get_paginated_response([
+            {
+                'id': str(transaction.id),
+                'transaction_id': transaction.transaction_id,
+                'batch_id': str(reference_id(transaction.batch)),
+                'transaction_type': transaction.transaction_type,
+                'quantity': str(transaction.quantity),
+                'from_org_id': str(reference_id(transaction.from_organization)) if transaction.from_organization else None,
+                'to_org_id': str(reference_id(transaction.to_organization)) if transaction.to_organization else None,
+                'reference_id': transaction.order_reference or transaction.retirement_reference,
+                'timestamp': transaction.timestamp.isoformat() if transaction.timestamp else None,
+            }
+            for transaction in page
+        ])
     
     def retrieve(self, request, pk=None):
         return Response({'id': pk})
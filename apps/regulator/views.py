@@ -9,18 +9,21 @@ from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
 
 from apps.accounts.models import UserProfile, AuditLog
+from apps.api.pagination import KeysetPagination
 from apps.api.permissions import IsRegulator, IsNotFrozen
 from apps.registry.models import CreditBatch
 from apps.mrv.models import MRVRequest
 
 
-class RegulatorViewSet(viewsets.ViewSet):
+class RegulatorViewSet(viewsets.GenericViewSet):
     """Regulator-only operations"""
     permission_classes = [IsAuthenticated, IsRegulator, IsNotFrozen]
+    pagination_class = KeysetPagination
+    keyset_field = 'created_at'
     
     @action(detail=False, methods=['get'])
     def audit_logs(self, request):
-        """Get audit logs (regulator view)"""
+        """Get audit logs (regulator view), newest first, paginated by cursor"""
         # Filters
         user_id = request.query_params.get('user_id')
         action_type = request.query_params.get('action')
@@ -38,9 +41,9 @@ class RegulatorViewSet(viewsets.ViewSet):
         if date_to:
             logs = logs.filter(created_at__lte=date_to)
         
-        logs = logs.order_by('-created_at')[:100]  # Latest 100
+        logs = self.paginate_queryset(logs)
         
-        return Response([
+        return self.get_paginated_response([
             {
                 'id': str(log.id),
                 'user_email': log.user_profile.email if log.user_profile else 'N/A',
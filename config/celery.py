@@ -0,0 +1,22 @@
+"""
+Celery application - background workers for the Django apps
+Usage: celery -A config worker -l info
+"""
+
+import os
+
+from celery import Celery
+from celery.signals import worker_process_init
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+app = Celery('config')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
+
+
+@worker_process_init.connect
+def connect_mongodb(**kwargs):
+    # PyMongo clients are not fork safe; every worker process opens its own
+    from config.settings import init_mongodb_connection
+    init_mongodb_connection()
@@ -295,6 +295,72 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# ============================================
+# DATA INTAKE CONFIGURATION
+# ============================================
+DATA_INTAKE_STORAGE_LAYOUT = env('DATA_INTAKE_STORAGE_LAYOUT', default='DOCUMENTS')  # DOCUMENTS or BUCKETS
+DATA_INTAKE_BUCKET_SECONDS = env.int('DATA_INTAKE_BUCKET_SECONDS', default=3600)
+DATA_INTAKE_BUCKET_MAX_READINGS = env.int('DATA_INTAKE_BUCKET_MAX_READINGS', default=10000)  # Then an overflow bucket
+DATA_INTAKE_ROLLUP_PERIODS = env.list('DATA_INTAKE_ROLLUP_PERIODS', default=['HOURLY', 'DAILY', 'WEEKLY', 'MONTHLY'])
+DATA_INTAKE_BULK_MAX_POINTS = env.int('DATA_INTAKE_BULK_MAX_POINTS', default=50000)
+DATA_INTAKE_STREAM_CHUNK_SIZE = env.int('DATA_INTAKE_STREAM_CHUNK_SIZE', default=5000)
+DATA_INTAKE_STREAM_MAX_LINE_BYTES = env.int('DATA_INTAKE_STREAM_MAX_LINE_BYTES', default=64 * 1024)
+DATA_INTAKE_VALIDATION_ENABLED = env.bool('DATA_INTAKE_VALIDATION_ENABLED', default=True)
+DATA_INTAKE_VALIDATION_INLINE_MAX_POINTS = env.int('DATA_INTAKE_VALIDATION_INLINE_MAX_POINTS', default=2000)  # Anomaly detection inline limit
+DATA_INTAKE_VALIDATION_SWEEP_MINUTES = env.int('DATA_INTAKE_VALIDATION_SWEEP_MINUTES', default=10)  # Catch-up for lost validation tasks
+DATA_INTAKE_VALIDATION_CONTEXT_HOURS = env.int('DATA_INTAKE_VALIDATION_CONTEXT_HOURS', default=24)
+DATA_INTAKE_SATELLITE_TILE_SIZE = env.int('DATA_INTAKE_SATELLITE_TILE_SIZE', default=1024)
+DATA_INTAKE_SATELLITE_BUFFER_METERS = env.int('DATA_INTAKE_SATELLITE_BUFFER_METERS', default=1000)
+DATA_INTAKE_SOURCE_ACTIVITY_FLUSH_SECONDS = env.int('DATA_INTAKE_SOURCE_ACTIVITY_FLUSH_SECONDS', default=30)
+DATA_INTAKE_ARCHIVE_URI = env('DATA_INTAKE_ARCHIVE_URI', default='')  # file:///path or gs://bucket/prefix; empty disables
+DATA_INTAKE_ARCHIVE_AFTER_MONTHS = env.int('DATA_INTAKE_ARCHIVE_AFTER_MONTHS', default=12)
+DATA_INTAKE_RAW_PAYLOAD_RETENTION = env('DATA_INTAKE_RAW_PAYLOAD_RETENTION', default='COMPRESSED')  # NONE, SAMPLED, COMPRESSED or INLINE
+DATA_INTAKE_RAW_PAYLOAD_SAMPLE_RATE = env.float('DATA_INTAKE_RAW_PAYLOAD_SAMPLE_RATE', default=0.01)
+DATA_INTAKE_QUOTA_REDIS_URL = env('DATA_INTAKE_QUOTA_REDIS_URL', default='')  # Empty keeps token buckets per process
+DATA_INTAKE_SOURCE_QUOTA_RATE = env.float('DATA_INTAKE_SOURCE_QUOTA_RATE', default=0.0)  # Readings/second; 0 is unlimited
+DATA_INTAKE_SOURCE_QUOTA_BURST = env.int('DATA_INTAKE_SOURCE_QUOTA_BURST', default=50000)
+DATA_INTAKE_PROJECT_QUOTA_RATE = env.float('DATA_INTAKE_PROJECT_QUOTA_RATE', default=0.0)
+DATA_INTAKE_PROJECT_QUOTA_BURST = env.int('DATA_INTAKE_PROJECT_QUOTA_BURST', default=500000)
+DATA_INTAKE_ANOMALY_DETECTION_ENABLED = env.bool('DATA_INTAKE_ANOMALY_DETECTION_ENABLED', default=True)
+DATA_INTAKE_ASYNC_INGEST = env.bool('DATA_INTAKE_ASYNC_INGEST', default=False)  # Queue bulk/stream batches for Celery workers
+DATA_INTAKE_ASYNC_CHUNK_SIZE = env.int('DATA_INTAKE_ASYNC_CHUNK_SIZE', default=5000)
+DATA_INTAKE_ASYNC_REQUEUE_MINUTES = env.int('DATA_INTAKE_ASYNC_REQUEUE_MINUTES', default=30)  # Resend chunks still unstored after this
+DATA_INTAKE_UPLOAD_MAX_ROWS = env.int('DATA_INTAKE_UPLOAD_MAX_ROWS', default=100000)  # Spreadsheet rows processed in the request; 0 is unlimited
+
+# ============================================
+# MRV CONFIGURATION
+# ============================================
+MRV_UNCERTAINTY_DRAWS = env.int('MRV_UNCERTAINTY_DRAWS', default=20000)  # Monte Carlo draws per estimate
+MRV_UNCERTAINTY_CONFIDENCE = env.float('MRV_UNCERTAINTY_CONFIDENCE', default=0.90)  # Two-sided interval level
+MRV_UNCERTAINTY_WORKERS = env.int('MRV_UNCERTAINTY_WORKERS', default=1)  # Processes; 1 simulates in the request
+MRV_REVIEW_SLA_DAYS = env.int('MRV_REVIEW_SLA_DAYS', default=30)  # Review deadline after submission
+MRV_REVIEW_LEASE_MINUTES = env.int('MRV_REVIEW_LEASE_MINUTES', default=30)  # Claim lease; renewed while reviewing
+MRV_REVIEW_PRIORITY_WEIGHTS = env.json('MRV_REVIEW_PRIORITY_WEIGHTS', default={})  # Overrides of age, volume, risk, sla
+MRV_REVIEW_PRIORITY_REFRESH_MINUTES = env.int('MRV_REVIEW_PRIORITY_REFRESH_MINUTES', default=15)
+MRV_EVIDENCE_URI = env('MRV_EVIDENCE_URI', default='')  # file:///path or gs://bucket/prefix; empty uses MEDIA_ROOT/evidence
+MRV_EVIDENCE_MAX_BYTES = env.int('MRV_EVIDENCE_MAX_BYTES', default=100 * 1024 ** 3)  # Largest evidence file
+MRV_EVIDENCE_MAX_CHUNK_BYTES = env.int('MRV_EVIDENCE_MAX_CHUNK_BYTES', default=64 * 1024 ** 2)  # Largest PATCH body
+MRV_EVIDENCE_UPLOAD_TTL_HOURS = env.int('MRV_EVIDENCE_UPLOAD_TTL_HOURS', default=72)  # Idle time before an upload is purged
+
+CELERY_BEAT_SCHEDULE = {
+    'validate-pending-points': {
+        'task': 'apps.data_intake.tasks.validate_pending_points',
+        'schedule': DATA_INTAKE_VALIDATION_SWEEP_MINUTES * 60,
+    },
+    'requeue-ingest-chunks': {
+        'task': 'apps.data_intake.tasks.requeue_ingest_chunks',
+        'schedule': DATA_INTAKE_ASYNC_REQUEUE_MINUTES * 60,
+    },
+    'refresh-review-priorities': {
+        'task': 'apps.mrv.tasks.refresh_review_priorities',
+        'schedule': MRV_REVIEW_PRIORITY_REFRESH_MINUTES * 60,
+    },
+    'purge-evidence-uploads': {
+        'task': 'apps.mrv.tasks.purge_evidence_uploads',
+        'schedule': 60 * 60,
+    },
+}
+
 # ============================================
 # CUSTOM SETTINGS
 # ============================================